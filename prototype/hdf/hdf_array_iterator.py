@@ -6,14 +6,35 @@
 @author Swarbhanu Chatterjee
 @brief HDFArrayIterator. Used in replay. Accepts a certain number of hdf files. Extracts the arrays out of them. Uses the ArrayIterator to
 resize the arrays into blocks that are of the right size so that they do not have to be read into memory.
+
+Range statistics (min/max/count) of the blocks of each dataset can be kept in a chunk index, stored in a sidecar file
+next to the hdf file (see ChunkIndex). With the index, chunk ranges are not recomputed on replay and chunks can be
+skipped without reading them when a value range filter is given. Chunks can also be read ahead in greenlets while the
+consumer processes (e.g. publishes) the current one.
 '''
 
+from collections import deque
 from operator import mul
+import itertools
+import json
+import os
+
+from gevent.pool import Pool
+
 from pyon.core.exception import NotFound, BadRequest
 from pyon.public import log
-import itertools
 
-def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bounds = None):
+def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bounds = None,
+                  value_range=None, chunk_index=False, read_ahead=0):
+    """
+    Generator of dicts with the current slice, value range and values of the next chunk of each variable.
+
+    @param value_range dict of variable name to (min, max): chunks where a listed variable has no values within its
+            range are skipped without being read. The listed variables are always kept in the persistent chunk index,
+            so only the first filtered replay of a file reads them in full
+    @param chunk_index if True, use and update the persistent chunk index of each file for all variables
+    @param read_ahead number of chunks to read ahead while the caller processes the current one
+    """
 
 
     import h5py, numpy
@@ -52,7 +73,8 @@ def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bou
 
             open_files.append(file)
 
-        gen = _acquire_hdf_data(open_hdf_files=open_files, var_names=var_names, concatenate_size=concatenate_size, bounds=bounds)
+        gen = _acquire_hdf_data(open_hdf_files=open_files, var_names=var_names, concatenate_size=concatenate_size, bounds=bounds,
+                                value_range=value_range, chunk_index=chunk_index, read_ahead=read_ahead)
 
         # run the generator yielding to the caller
         for item in gen:
@@ -64,7 +86,8 @@ def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bou
             file.close()
 
 
-def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size = None, bounds = None):
+def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size = None, bounds = None,
+                       value_range=None, chunk_index=False, read_ahead=0):
 
 
     import h5py, numpy
@@ -100,6 +123,7 @@ def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size =
 
     ### Declare a variable to hold array iterators:
     dataset_lists_by_name ={}
+    indexes_by_name = {}
 
     for file in open_hdf_files:
 
@@ -132,6 +156,9 @@ def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size =
         if not dict_of_h5py_datasets:
             continue
 
+        # Computing the index reads a dataset in full, so it is persisted for the value range filter as well
+        index = ChunkIndex(file.filename) if (chunk_index or value_range) else None
+
         #-------------------------------------------------------------------------------------------------------
         # Iterate over the supplied variable names
         #-------------------------------------------------------------------------------------------------------
@@ -154,16 +181,30 @@ def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size =
                 dset_list.append(dataset)
                 dataset_lists_by_name[vname] = dset_list
 
+                # Without chunk_index, only the variables filtered by value range are indexed
+                indexed = chunk_index or (value_range and vname in value_range)
+                indexes_by_name.setdefault(vname, []).append(index if indexed else None)
+
 
     array_iterators_by_name = {}
+    virtual_dsets_by_name = {}
 
     if len(dataset_lists_by_name.keys()) == 0:
         raise NotFound('No dataset for the variables provided were found in the hdf files.')
 
     for vname, dset_list in dataset_lists_by_name.iteritems():
 
+        block_lists = None
+        indexes = indexes_by_name[vname]
+        if indexes[0] is not None:
+            # Index blocks of the records in one chunk, so that ranges of aligned chunks come from the index
+            agg_size = reduce(mul, dset_list[0].shape[1:], 1)
+            block_records = max(1, concatenate_size // max(1, agg_size))
+            block_lists = [index.get_blocks(dset, block_records) for index, dset in zip(indexes, dset_list)]
+
         # Create the dataset list object that behaves like a dataset
-        virtual_dset = VirtualDataset(dset_list)
+        virtual_dset = VirtualDataset(dset_list, block_lists)
+        virtual_dsets_by_name[vname] = virtual_dset
 
         if bounds:
 
@@ -176,26 +217,164 @@ def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size =
 
         array_iterators_by_name[vname] = iarray
 
-    log.warn(array_iterators_by_name)
+    for index in set(itertools.chain(*indexes_by_name.values())):
+        if index is not None:
+            index.save()
+
+    log.debug(array_iterators_by_name)
 
     names = array_iterators_by_name.keys()
     iarrays = array_iterators_by_name.values() # Get the list of array iterators
+    virtual_dsets = [virtual_dsets_by_name[name] for name in names]
+
+    log.debug('Len iarrays: %d' % len(iarrays))
 
+    # The slices of the chunks of all variables at each step, without reading them
+    steps = itertools.izip_longest(*[iarray.iter_slices() for iarray in iarrays])
+    if value_range:
+        steps = _filter_steps(steps, names, virtual_dsets, value_range)
 
-    log.warn('Len iarrays: %d' % len(iarrays))
-    for ichunks in itertools.izip_longest(*iarrays):
+    for slices, ichunks in _read_steps(steps, virtual_dsets, read_ahead):
 
-        log.warn('Len ichunks: %d' % len(ichunks))
+        for name, slice_, chunk, virtual_dset in itertools.izip(names, slices, ichunks, virtual_dsets):
+            if chunk is None:
+                continue
 
-        for name, chunk, iarray in itertools.izip(names, ichunks, iarrays):
+            stats = virtual_dset.get_stats(slice_)
+            if stats and stats[3]:
+                chunk_range = (stats[0], stats[1])
+            else:
+                chunk_range = (numpy.nanmin(chunk), numpy.nanmax(chunk))
 
-            out_dict[name] = {'current_slice' : iarray.curr_slice,
-                            'range' : (numpy.nanmin(chunk), numpy.nanmax(chunk)),
+            out_dict[name] = {'current_slice' : slice_,
+                            'range' : chunk_range,
                             'values' : chunk}
 
         yield out_dict
 
 
+def _filter_steps(steps, names, virtual_dsets, value_range):
+    """
+    Drops the steps where the chunk of a variable in value_range holds no value within the range,
+    according to the chunk index.
+    """
+    filters = [(i, value_range[name]) for i, name in enumerate(names) if name in value_range]
+    for slices in steps:
+        for i, (range_min, range_max) in filters:
+            if slices[i] is None:
+                continue
+            stats = virtual_dsets[i].get_stats(slices[i])
+            if stats and (not stats[2] or stats[1] < range_min or stats[0] > range_max):
+                break
+        else:
+            yield slices
+
+
+def _read_step(virtual_dsets, slices):
+    return [virtual_dset[slice_] if slice_ is not None else None for virtual_dset, slice_ in zip(virtual_dsets, slices)]
+
+def _read_steps(steps, virtual_dsets, read_ahead=0):
+    """
+    Generator of (slices, chunks) for the given steps. With read_ahead, up to that many following
+    steps are read in greenlets while the caller processes the current one.
+    """
+    if not read_ahead:
+        for slices in steps:
+            yield slices, _read_step(virtual_dsets, slices)
+        return
+
+    pool = Pool(read_ahead)
+    pending = deque()
+    try:
+        for slices in steps:
+            pending.append((slices, pool.spawn(_read_step, virtual_dsets, slices)))
+            if len(pending) > read_ahead:
+                slices, reader = pending.popleft()
+                yield slices, reader.get()
+        while pending:
+            slices, reader = pending.popleft()
+            yield slices, reader.get()
+    finally:
+        pool.kill(block=False)
+
+
+def compute_chunk_stats(dataset, block_records):
+    """
+    Returns the [start, stop, min, max, count] of each block of block_records records of the dataset, with count the
+    number of non NaN values, or None if the dataset is not numeric.
+    """
+    import numpy
+
+    if dataset.dtype.kind not in 'biuf' or not dataset.shape:
+        return None
+
+    blocks = []
+    records = dataset.shape[0]
+    for start in xrange(0, records, block_records):
+        stop = min(start + block_records, records)
+        values = dataset[start:stop]
+        count = int(values.size - numpy.count_nonzero(numpy.isnan(values))) if dataset.dtype.kind == 'f' else int(values.size)
+        if count:
+            blocks.append([start, stop, float(numpy.nanmin(values)), float(numpy.nanmax(values)), count])
+        else:
+            blocks.append([start, stop, None, None, 0])
+    return blocks
+
+
+class ChunkIndex(object):
+    """
+    Block statistics of the datasets of one hdf file, kept in a sidecar file (file name + SUFFIX)
+    that is discarded when the hdf file changes (modification time and size).
+    """
+
+    SUFFIX = '.chunkidx'
+
+    def __init__(self, hdf_filename, persist=True):
+        self.filename = hdf_filename + self.SUFFIX
+        self.persist = persist
+        self._entries = {}
+        self._dirty = False
+
+        try:
+            stat = os.stat(hdf_filename)
+            self._file_version = [stat.st_mtime, stat.st_size]
+        except OSError:
+            self._file_version = None
+            self.persist = False
+
+        if self.persist and os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r') as f:
+                    index = json.load(f)
+                if index.get('file_version') == self._file_version:
+                    self._entries = index['datasets']
+            except (IOError, ValueError, KeyError):
+                log.warn('Ignoring invalid chunk index: %s', self.filename)
+
+    def get_blocks(self, dataset, block_records):
+        """
+        Returns the block statistics of the dataset (see compute_chunk_stats), computing them if not indexed yet.
+        """
+        key = '%s:%s' % (dataset.name, block_records)
+        if key not in self._entries:
+            self._entries[key] = compute_chunk_stats(dataset, block_records)
+            self._dirty = True
+        return self._entries[key]
+
+    def save(self):
+        if not (self.persist and self._dirty):
+            return
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as f:
+                json.dump({'file_version': self._file_version, 'datasets': self._entries}, f)
+            os.rename(tmp_filename, self.filename)
+            self._dirty = False
+        except (IOError, OSError):
+            # Archives may be read only - the index is then rebuilt on the next replay
+            log.warn('Unable to save chunk index: %s', self.filename)
+
+
 
 def check_bounds(bounds, virtual_dset):
     """
@@ -212,11 +391,16 @@ def check_bounds(bounds, virtual_dset):
 class VirtualDataset(object):
 
 
-    def __init__(self, var_list):
+    def __init__(self, var_list, block_lists=None):
+        """
+        @param var_list list of datasets, concatenated along the first dimension
+        @param block_lists optional block statistics of each dataset, see compute_chunk_stats
+        """
 
         import h5py, numpy
 
         self._vars = []
+        self._block_lists = block_lists if block_lists and None not in block_lists else None
 
         self._records = 0
 
@@ -297,6 +481,34 @@ class VirtualDataset(object):
         return aggregate
 
 
+    def get_stats(self, index):
+        """
+        Returns (min, max, count, exact) over the index blocks overlapping the records of index, or None without
+        block statistics. Unless exact (index covers whole blocks and records), min and max are bounds only.
+        """
+        if self._block_lists is None:
+            return None
+
+        records = index[0]
+        get_start, get_stop = records.start or 0, records.stop
+        exact = records.step in (None, 1) and all(slc.start in (None, 0) and slc.stop in (None, dim) and slc.step in (None, 1)
+                                                  for slc, dim in zip(index[1:], self._agg_shape))
+
+        vmin, vmax, count = None, None, 0
+        for start, blocks in zip(self._starts, self._block_lists):
+            for block_start, block_stop, block_min, block_max, block_count in blocks:
+                block_start, block_stop = start + block_start, start + block_stop
+                if block_stop <= get_start or block_start >= get_stop:
+                    continue
+                if block_start < get_start or block_stop > get_stop:
+                    exact = False
+                if block_count:
+                    vmin = block_min if vmin is None else min(vmin, block_min)
+                    vmax = block_max if vmax is None else max(vmax, block_max)
+                    count += block_count
+
+        return vmin, vmax, count, exact
+
     @property
     def __array_interface__(self):
         raise RuntimeError('Shit - I need array_interface!')
@@ -408,6 +620,13 @@ class ArrayIterator(object):
         zip(self.start, self.stop, self.step))
 
     def __iter__(self):
+        for slice_ in self.iter_slices():
+            yield self.var[slice_]
+
+    def iter_slices(self):
+        """
+        Generator of the slices of the blocks of this iterator, without reading them.
+        """
         # Skip arrays with degenerate dimensions
         if [dim for dim in self.shape if dim <= 0]:
             log.warn("StopIteration called because of degernate dimensions")
@@ -441,7 +660,7 @@ class ArrayIterator(object):
             # yield a block
             slice_ = tuple(slice(*t) for t in zip(start, stop, step))
             self.curr_slice = slice_
-            yield self.var[slice_]
+            yield slice_
 
             # If this is a scalar variable, bail out
             if ndims == 0:
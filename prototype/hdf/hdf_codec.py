@@ -8,9 +8,8 @@
 @author Swarbhanu Chatterjee
 @brief prototype codec for the science data object
 
-To run the encoder and decoder, please ensure that numpy and h5py are installed. Also make sure that the temporary
-folder, /tmp/, is available for use. Any hdf files that need to be temporarily written to the /tmp/ folder will
-be automatically cleaned at the end of the execution.
+To run the encoder and decoder, please ensure that numpy and h5py are installed. Encoding and decoding work on
+in-memory hdf file images (h5py core driver without backing store); nothing is written to disk.
 
 Please follow these sequence of steps to run the demo example.
 
@@ -33,15 +32,20 @@ and...
 4. Create a decoder object: $decoder = HDFDecoder(hdf_string)
 5. Read the array out of the decoder: $decoder.read_hdf_dataset('/myGroup/measurements/pressure')
 
+Compression and chunking can be set for the encoder and per dataset, e.g. HDFEncoder(compression='lzf') or
+encoder.add_hdf_dataset(name, array, compression='gzip-6', chunks=(100,)). Compression is one of None/'none',
+'lzf', 'gzip' or 'gzip-N' with N the gzip level 0-9.
+
 '''
 
 
 import uuid
 import hashlib
-import os
 from pyon.util.log import log
 from pyon.core.exception import IonException
-from pyon.util.file_sys import FS, FileSystem
+
+# Compression of encoded datasets unless given for the encoder or dataset
+DEFAULT_COMPRESSION = 'gzip-4'
 
 class ScienceObjectTransportException(IonException):
     """
@@ -105,42 +109,74 @@ class HDFDecoderException(ScienceObjectTransportException):
     def __str__(self):
         return str(self.get_status_code()) + " - " + "DecoderError: " + str(self.get_error_message())
 
+def parse_compression(compression):
+    """
+    Returns the h5py (compression, compression_opts) arguments for a compression setting:
+    None or 'none', 'lzf', 'gzip' (level 4) or 'gzip-N' with N the gzip level 0-9.
+
+    @param compression The compression setting
+    @retval (compression, compression_opts)
+    """
+    if not compression or compression == 'none':
+        return None, None
+    if compression == 'lzf':
+        return 'lzf', None
+    if compression == 'gzip':
+        return 'gzip', 4
+    if compression.startswith('gzip-'):
+        try:
+            level = int(compression[5:])
+        except ValueError:
+            level = -1
+        if 0 <= level <= 9:
+            return 'gzip', level
+    raise HDFEncoderException("Unknown compression '%s'" % compression)
+
+def open_hdf_image(hdf_string, name=None):
+    """
+    Opens an in-memory hdf file image read-only, without writing it to disk.
+
+    @param hdf_string The binary string representation of an hdf file
+    @param name The name of the in-memory file
+    @retval h5pyfile
+    """
+    # Using inline imports to put off making hdf/numpy required dependencies
+    import h5py
+
+    fapl = h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+    fapl.set_fapl_core(backing_store=False)
+    fapl.set_file_image(hdf_string)
+    fid = h5py.h5f.open(name or random_name(), h5py.h5f.ACC_RDONLY, fapl=fapl)
+    return h5py.File(fid)
+
+
 class HDFEncoder(object):
     """
     Implementation of the HDFEncoder object. This class is used to accept an numpy array and user specified datagroup
     tree and return a binary string. This binary string is a binary representation of an hdf file holding the data.
-    There are no side effects. The hdf file written to disk (or to virtual memory) during the entire process is cleaned
-    up on exit.
+    There are no side effects. The hdf file is built in memory only and its image returned as the string.
     """
-    def __init__(self, name = None):
+    def __init__(self, name = None, compression=DEFAULT_COMPRESSION, chunks=None):
         """
-        @param name The name of the dataset
+        @param name The name of the (in-memory) hdf file
+        @param compression Default compression of the datasets, see parse_compression
+        @param chunks Default chunk shape of the datasets (None for h5py automatic chunking)
         """
-        # generate a random name for the filename if it has not been provided.
-        self.filename = FileSystem.get_url(fs=FS.TEMP, filename=name or random_name(), ext='encoder.hdf5')
+        # generate a random name for the file if it has not been provided.
+        self.filename = name or random_name()
+        self.compression = compression
+        self.chunks = chunks
+
+        # Validates the default compression early
+        parse_compression(compression)
 
         # Using inline imports to put off making hdf/numpy required dependencies
         import h5py
 
-        # open an hdf file on disk - in /tmp to write data to since we can't yet do in memory
-        log.debug("Creating h5py file object for the encoder at %s" % self.filename)
-        if os.path.isfile(self.filename):
-            # if file exists, then append to it
-            self.h5pyfile = h5py.File(self.filename, mode = 'r+', driver='core')
-        else:
-            # if file does not already exist, write a new one
-            self.h5pyfile = h5py.File(self.filename, mode = 'w', driver='core')
+        log.debug("Creating in-memory h5py file object for the encoder: %s" % self.filename)
+        self.h5pyfile = h5py.File(self.filename, mode = 'w', driver='core', backing_store=False)
         assert self.h5pyfile, 'No h5py file object created.'
 
-        ### Remove exception handeling for now...
-#        except IOError:
-#            log.exception("Error opening file for the HDFEncoder! ")
-#            raise HDFEncoderException("Error while trying to open file. ")
-#        except AssertionError as err:
-#            log.exception(err.message)
-#            raise HDFEncoderException(err.message)
-
-
     def assert_valid_name(self, name):
         """
         Checks valid user input regarding name.
@@ -191,20 +227,12 @@ class HDFEncoder(object):
         # ------------
         # (lowest_subgroup: '', dataset: '')
         #
-        # Using inline imports to put off making hdf/numpy required dependencies
-
-        #try:
         name = self.assert_valid_name(name)
         tree_list, dataset = self.create_pathname(name)
-        #except AssertionError as err:
-        #    log.debug("The group/subgroup/dataset could not be created because of invalid name.")
-        #    raise HDFEncoderException(err.message)
 
-        # if list is empty, hang the array in a group called data directly underneath '/',
+        # if list is empty, hang the array directly underneath '/',
         # otherwise, keep popping group names from the list of names and create them using h5py
-        #try:
-        lowest_subgroup = self.h5pyfile.get('/')
-        group = lowest_subgroup
+        group = self.h5pyfile.get('/')
 
         for group_name in tree_list:
             g = group.get(group_name) # if the group doesnt already exist in the file
@@ -213,23 +241,19 @@ class HDFEncoder(object):
             else:
                 group = g
         lowest_subgroup = group
-        #except Exception as exc:
-        #    log.debug('Error while creating group/subgroup/dataset using h5py.')
-        #    raise HDFEncoderException(exc.message)
 
         return lowest_subgroup, dataset
 
-
-
-    def add_hdf_dataset(self, name, nparray):
+    def add_hdf_dataset(self, name, nparray, compression=None, chunks=None):
         """
-        Add a numpy array to the hdf file that is temporarily used to store the data.
+        Add a numpy array to the in-memory hdf file.
         This method uses the provided string in name to build a datagroup path in the hdf file
 
         @param name The name contains the datagroup tree and the dataset name. Ex: '/mygroup/measurements/temperature'
         @param nparray
+        @param compression Compression of this dataset, see parse_compression (default: the encoder compression)
+        @param chunks Chunk shape of this dataset (default: the encoder chunks)
         @retval success Boolean to indicate successful adding of dataset to the
-        @todo later make the path more flexible to create groups as needed...
         """
         # Return Value
         # ------------
@@ -239,48 +263,38 @@ class HDFEncoder(object):
         # Using inline imports to put off making hdf/numpy required dependencies
         import numpy
 
-
-        #try:
         assert isinstance(nparray, numpy.ndarray), '2nd argument of method add_hdf_dataset() is not a numpy array!'
         # check that that the input arguments are of the type they are supposed to be
         assert isinstance(name, basestring), '1st argument of method add_hdf_dataset() is not a string!'
-        #except AssertionError as err:
-        #    log.debug('Name and array assertion failed in add_hdf_dataset method.')
-        #    raise HDFEncoderException(err.message)
         lowest_subgroup, name_of_dataset = self.create_group_tree(name)
 
-        #try:
         assert lowest_subgroup, 'No datagroup.'
         assert name_of_dataset, 'No dataset name. provided.'
 
         assert lowest_subgroup.get(name_of_dataset) is None, 'The dataset %s already exists in the file.' % name_of_dataset
 
+        compression, compression_opts = parse_compression(compression or self.compression)
+
         # create a dataset and hang it under the just created group...
         shape = nparray.shape
         dataset = lowest_subgroup.create_dataset(name_of_dataset,
             shape,
             nparray.dtype.str,
-            compression='gzip',
-            compression_opts=4,
+            chunks=chunks or self.chunks,
+            compression=compression,
+            compression_opts=compression_opts,
             maxshape=([None for rank in range(len(shape))])
             )
 
         assert dataset, 'Unable to create dataset.'
         # write the array in the dataset
         dataset.write_direct(nparray)
-        #except AssertionError as err:
-        #    log.debug(err.message)
-        #    raise HDFEncoderException(err.message)
-        #except Exception as exc:
-        #    log.debug('Error writing dataset to HDFFile during encoding.')
-        #    raise HDFEncoderException(exc.message)
 
         return True
 
     def encoder_close(self):
         """
-        /wrap the hdf_to_string() method so that first the open h5py file object is closed and the the hdf_to_string()
-        method is called so that the latter can convert the temporary hdf file to a binary string.
+        Returns the binary string of the hdf file (see hdf_to_string) and closes the in-memory file.
 
         @retval hdf_string
         """
@@ -288,17 +302,14 @@ class HDFEncoder(object):
         # ------------
         # hdf_string: ''
         #
-        #try:
-        self.h5pyfile.close()
-        #except IOError:
-        #    log.debug('Error closing hdf file.')
-        #    raise HDFEncoderException("Error closing file.")
-        return self.hdf_to_string()
+        try:
+            return self.hdf_to_string()
+        finally:
+            self.h5pyfile.close()
 
     def hdf_to_string(self):
         """
-        Convert the temporary hdf file holding the data into a binary string. Cleanup by deleting the hdf file and
-        return the binary string.
+        Return the image of the in-memory hdf file holding the data as a binary string.
 
         @retval hdf_string
         """
@@ -307,134 +318,112 @@ class HDFEncoder(object):
         # hdf_string: ''
         #
         try:
-            # open the hdf5 file using python 'open()'
-            f = open(self.filename, mode='rb')
-            # read the binary string representation of the file
-            hdf_string = f.read()
-            f.close()
-        except IOError:
-            log.exception("Error opening binary file for reading out hdfstring in HDFEncoder. ")
-            raise HDFEncoderException("Error while trying to open file. ")
-        finally:
-            FileSystem.unlink(self.filename)
-        return hdf_string
+            self.h5pyfile.flush()
+            return self.h5pyfile.id.get_file_image()
+        except (IOError, ValueError):
+            log.exception("Error reading out hdfstring in HDFEncoder. ")
+            raise HDFEncoderException("Error while trying to read file image. ")
 
 
 class HDFDecoder(object):
     """
-    Implementation of the HDFDecoder object. This class is used to accept a binary string and return a numpy array.
-    The binary string is the binary representation of an hdf file, which contains data. The numpy array that is returned
-    is the data. There are no side effects. The binary string needs to written into disk or virtual memory temporarily
-    for the data to be extracted. But the temporary file is deleted during cleanup at the end before the array is
-    returned.
+    Implementation of the HDFDecoder object. This class is used to accept a binary string and return numpy arrays.
+    The binary string is the binary representation of an hdf file, which contains data. The string is opened as an
+    in-memory hdf file on first use and stays open until close(); datasets are only read when requested, so
+    get_hdf_dataset and iter_hdf_datasets give lazy access to parts of large granules.
     """
 
     def __init__(self, hdf_string):
         """
         @param hdf_string
         """
-        #try:
         assert isinstance(hdf_string, basestring), 'The input for instantiating the HDFDecoder object is not a string'
-        #except AssertionError as err:
-        #    raise HDFDecoderException(err.message)
-
-        #self.filename = FileSystem.get_url(fs=FS.TEMP, filename=hashlib.sha1(hdf_string).hexdigest(), ext='_decoder.hdf5')
-
-        f = FileSystem.mktemp(ext='.hdf5')
-
-        # save an hdf string to disk - in /tmp to so we can open it as an hdf file and read data from it
-        f.write(hdf_string)
-        f.close()
 
+        self._hdf_string = hdf_string
+        self._h5pyfile = None
         self._list_of_datasets = []
 
-        self.filename = f.name
-        #except IOError:
-        #    log.debug("Error opening binary file for writing hdfstring in HDFDecoder. ")
-        #    raise HDFDecoderException("Error while trying to open file. ")
-
     def __del__(self):
-        # This is dangerous - I don't like implementing del!!!
+        self.close()
 
-        # Clean up files!
-        FileSystem.unlink(self.filename)
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    def list_datasets(self):
-
-        if not self._list_of_datasets:
-            import h5py
-            h5pyfile = h5py.File(self.filename, mode = 'r', driver='core')
-
-            h5pyfile.visit(self._list_of_datasets.append)
+    @property
+    def h5pyfile(self):
+        if self._h5pyfile is None:
+            try:
+                self._h5pyfile = open_hdf_image(self._hdf_string)
+            except (IOError, ValueError):
+                log.exception("Error opening hdf string in HDFDecoder. ")
+                raise HDFDecoderException("Error while trying to open file image. ")
+        return self._h5pyfile
 
+    def close(self):
+        """
+        Closes the in-memory hdf file. Datasets returned by get_hdf_dataset are no longer readable.
+        """
+        h5pyfile, self._h5pyfile = getattr(self, '_h5pyfile', None), None
+        if h5pyfile is not None:
             h5pyfile.close()
 
-        return self._list_of_datasets
-
+    def list_datasets(self):
 
+        if not self._list_of_datasets:
+            self.h5pyfile.visit(self._list_of_datasets.append)
 
+        return self._list_of_datasets
 
     def get_hdf_groups(self):
-        #try:
-        import h5py
-        h5pyfile = h5py.File(self.filename, mode = 'r', driver='core')
-        #except IOError:
-        #    log.debug("Error opening file for the HDFDecoder")
-        #   raise HDFDecoderException("Error while trying to open file.")
-
-        root_group = h5pyfile[h5pyfile.name]
+        root_group = self.h5pyfile[self.h5pyfile.name]
         list_of_groups = []
         root_group.visit(list_of_groups.append)
 
-        h5pyfile.close()
-
         return list_of_groups
 
-    def read_hdf_dataset(self, name):
-        """
-        read the hdf dataset at this location in to an array
-
-        @param name This should be of the form: '/group/subgroup/subsubgroup/dataset'
-        @retval nparray Numpy array that holds data
-        """
-        # Return Value
-        # ------------
-        # nparray: numpy.ndarray
-        #
-
-        # Using inline imports to put off making hdf/numpy required dependencies
-        import h5py
-        import numpy
-
-        #try:
+    def _get_path(self, name):
         # assert that the input field is a string
         assert isinstance(name, basestring),\
         'HDFDecoder read error: The name provided for the group tree and dataset is not a string!'
-        #except AssertionError as err:
-        #    raise HDFDecoderException(err.message)
 
         # if a data group name is not provided, use the default data group name, 'data'
         if name.find('/')==-1:
             name = 'data/' + name
+        return '/' + name
 
-        # open hdf file using h5py
-        #try:
-        h5pyfile = h5py.File(self.filename, mode = 'r', driver='core')
-        #except IOError:
-        #    log.debug("Error opening file for the HDFDecoder! ")
-        #   raise HDFDecoderException("Error while trying to open file. ")
-
-        # read array from the hdf file
-        nparray = numpy.array(h5pyfile['/' + name])
-
-        # hdf close
-        h5pyfile.close()
+    def get_hdf_dataset(self, name):
+        """
+        Returns the hdf dataset at this location without reading it. The returned h5py dataset reads
+        (slices of) the data on access, while the decoder is open.
 
-        # Do not remove the file here!
+        @param name This should be of the form: '/group/subgroup/subsubgroup/dataset'
+        @retval dataset h5py dataset
+        """
+        return self.h5pyfile[self._get_path(name)]
 
-        return nparray
+    def iter_hdf_datasets(self):
+        """
+        Iterates over (name, h5py dataset) of all datasets in the file, without reading them.
+        """
+        import h5py
 
-    #@todo Do resource clean up on the file - in a close method or some other way?
+        names = []
+        self.h5pyfile.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        for name in names:
+            yield name, self.h5pyfile[name]
 
+    def read_hdf_dataset(self, name):
+        """
+        read the hdf dataset at this location in to an array
 
+        @param name This should be of the form: '/group/subgroup/subsubgroup/dataset'
+        @retval nparray Numpy array that holds data
+        """
+        # Return Value
+        # ------------
+        # nparray: numpy.ndarray
+        #
+        return self.get_hdf_dataset(name)[...]
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+'''
+@file prototype/hdf/test/test_hdf_array_iterator.py
+@brief Test of the hdf array iterator chunk index, range filter and read ahead
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from prototype.hdf.hdf_array_iterator import acquire_data, ChunkIndex, compute_chunk_stats
+
+try:
+    import numpy
+    import h5py
+    _have_h5py = True
+except ImportError:
+    _have_h5py = False
+
+
+@attr('UNIT')
+@unittest.skipIf(not _have_h5py, 'No h5py')
+class HDFArrayIteratorTest(PyonTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        # Two files of 20 records each, temperature rising from 0 to 39
+        self.hdf_files = []
+        for i in xrange(2):
+            filename = os.path.join(self.tmpdir, 'data%s.hdf5' % i)
+            with h5py.File(filename, 'w') as f:
+                f.create_dataset('/fields/temperature', data=numpy.arange(i * 20, (i + 1) * 20, dtype='float64'))
+            self.hdf_files.append(filename)
+
+    def _acquire(self, **kwargs):
+        return [(item['temperature']['current_slice'][0], item['temperature']['range'], item['temperature']['values'].copy())
+                for item in acquire_data(hdf_files=self.hdf_files, var_names=['temperature'], concatenate_size=10, **kwargs)]
+
+    def test_compute_chunk_stats(self):
+        with h5py.File(self.hdf_files[0], 'r') as f:
+            dataset = f['/fields/temperature']
+            self.assertEquals(compute_chunk_stats(dataset, 8), [[0, 8, 0.0, 7.0, 8], [8, 16, 8.0, 15.0, 8], [16, 20, 16.0, 19.0, 4]])
+
+    def test_chunk_index(self):
+        chunks = self._acquire()
+        self.assertEquals([c[1] for c in chunks], [(0, 9), (10, 19), (20, 29), (30, 39)])
+        self.assertFalse(os.path.exists(self.hdf_files[0] + ChunkIndex.SUFFIX))
+
+        indexed = self._acquire(chunk_index=True)
+        self.assertTrue(os.path.exists(self.hdf_files[0] + ChunkIndex.SUFFIX))
+        self.assertEquals([c[1] for c in indexed], [c[1] for c in chunks])
+        for (slc, rng, values), (islc, irng, ivalues) in zip(chunks, indexed):
+            self.assertTrue((values == ivalues).all())
+
+        # Replay uses the stored statistics
+        with h5py.File(self.hdf_files[1], 'r') as f:
+            index = ChunkIndex(self.hdf_files[1])
+            self.assertEquals(index.get_blocks(f['/fields/temperature'], 10), [[0, 10, 20.0, 29.0, 10], [10, 20, 30.0, 39.0, 10]])
+            self.assertFalse(index._dirty)
+
+    def test_value_range_read_ahead(self):
+        chunks = self._acquire(value_range={'temperature': (12, 25)})
+        self.assertEquals([c[0] for c in chunks], [slice(10, 20, 1), slice(20, 30, 1)])
+
+        # The filter keeps its statistics in the index, later filtered replays do not recompute them
+        self.assertTrue(os.path.exists(self.hdf_files[0] + ChunkIndex.SUFFIX))
+        with h5py.File(self.hdf_files[0], 'r') as f:
+            index = ChunkIndex(self.hdf_files[0])
+            index.get_blocks(f['/fields/temperature'], 10)
+            self.assertFalse(index._dirty)
+
+        chunks = self._acquire(value_range={'temperature': (100, 200)})
+        self.assertEquals(chunks, [])
+
+        chunks = self._acquire()
+        ahead = self._acquire(read_ahead=2)
+        self.assertEquals([c[0] for c in ahead], [c[0] for c in chunks])
+        for (slc, rng, values), (aslc, arng, avalues) in zip(chunks, ahead):
+            self.assertTrue((values == avalues).all())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+@file prototype/hdf/test/test_hdf_codec.py
+@brief Test and benchmark of the in-memory hdf codec
+'''
+
+import sys
+import time
+import unittest
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from prototype.hdf.hdf_codec import HDFEncoder, HDFDecoder, HDFEncoderException, parse_compression
+
+try:
+    import numpy
+    import h5py
+    _have_h5py = True
+except ImportError:
+    _have_h5py = False
+
+# Field paths of a CTD granule
+CTD_FIELDS = ['/fields/temperature', '/fields/conductivity', '/fields/pressure',
+              '/coordinates/latitude', '/coordinates/longitude', '/coordinates/time']
+
+
+@attr('UNIT')
+@unittest.skipIf(not _have_h5py, 'No h5py')
+class HDFCodecTest(PyonTestCase):
+
+    def test_parse_compression(self):
+        self.assertEquals(parse_compression(None), (None, None))
+        self.assertEquals(parse_compression('none'), (None, None))
+        self.assertEquals(parse_compression('lzf'), ('lzf', None))
+        self.assertEquals(parse_compression('gzip'), ('gzip', 4))
+        self.assertEquals(parse_compression('gzip-9'), ('gzip', 9))
+        self.assertRaises(HDFEncoderException, parse_compression, 'gzip-10')
+        self.assertRaises(HDFEncoderException, parse_compression, 'zip')
+
+    def test_encode_decode(self):
+        temperature = numpy.arange(100, dtype='float32')
+        pressure = numpy.ones((10, 5))
+
+        encoder = HDFEncoder(compression='none')
+        encoder.add_hdf_dataset('/fields/temperature', temperature)
+        encoder.add_hdf_dataset('/fields/pressure', pressure, compression='gzip-6', chunks=(5, 5))
+        encoder.add_hdf_dataset('/fields/time', temperature, compression='lzf')
+        hdf_string = encoder.encoder_close()
+
+        with HDFDecoder(hdf_string) as decoder:
+            self.assertTrue((decoder.read_hdf_dataset('fields/temperature') == temperature).all())
+            self.assertTrue((decoder.read_hdf_dataset('fields/pressure') == pressure).all())
+            self.assertEquals(decoder.get_hdf_dataset('fields/pressure').compression, 'gzip')
+            self.assertEquals(decoder.get_hdf_dataset('fields/pressure').chunks, (5, 5))
+            self.assertIsNone(decoder.get_hdf_dataset('fields/temperature').compression)
+            self.assertEquals(decoder.get_hdf_dataset('fields/time').compression, 'lzf')
+
+            # Lazy datasets read slices
+            self.assertTrue((decoder.get_hdf_dataset('fields/temperature')[10:20] == temperature[10:20]).all())
+            self.assertEquals(sorted(name for name, dataset in decoder.iter_hdf_datasets()),
+                              ['fields/pressure', 'fields/temperature', 'fields/time'])
+            self.assertIn('fields', decoder.list_datasets())
+
+            self.assertRaises(KeyError, decoder.read_hdf_dataset, 'fields/salinity')
+
+
+@attr('PFM')
+@unittest.skipIf(not _have_h5py, 'No h5py')
+class HDFCodecSpeedTest(PyonTestCase):
+
+    def test_codec_speed(self):
+        count = 200
+        print >> sys.stderr, ""
+        for records in (10, 1000, 100000):
+            values = numpy.random.random(records)
+            for compression in ('none', 'lzf', 'gzip-1', 'gzip-4'):
+                t1 = time.time()
+                for i in xrange(count):
+                    encoder = HDFEncoder(compression=compression)
+                    for field in CTD_FIELDS:
+                        encoder.add_hdf_dataset(field, values)
+                    hdf_string = encoder.encoder_close()
+                t2 = time.time()
+                for i in xrange(count):
+                    decoder = HDFDecoder(hdf_string)
+                    for field in CTD_FIELDS:
+                        decoder.read_hdf_dataset(field)
+                    decoder.close()
+                t3 = time.time()
+
+                print >> sys.stderr, "%6s records, %6s: %8d bytes, encode %.3f ms, decode %.3f ms" % (
+                    records, compression, len(hdf_string), (t2 - t1) * 1000 / count, (t3 - t2) * 1000 / count)
@@ -33,6 +33,7 @@ from pyon.ion.event import EventPublisher, EventSubscriber
 from pyon.container.snapshot import ContainerSnapshot
 from pyon.core import bootstrap
 from pyon.core.bootstrap import IonObject
+from pyon.net.channel import set_lock_diagnostics, LOCK_DIAG_OFF, LOCK_DIAG_CHEAP, LOCK_DIAG_FULL
 
 from interface.objects import ContainerManagementRequest, ChangeLogLevel, ReportStatistics, ClearStatistics, \
     ResetPolicyCache, TriggerGarbageCollection, TriggerContainerSnapshot, PrepareSystemShutdown
@@ -103,6 +104,22 @@ class LogLevelHandler(EventHandler):
         config.set_level(action.logger, action.level, action.recursive)
 
 
+class LockDiagnosticsHandler(EventHandler):
+    """ changes the channel lock diagnostics level, by a ChangeLogLevel action for the pseudo logger LOGGER:
+        TRACE/DEBUG enable full diagnostics (stack capture), INFO/WARN cheap, ERROR/CRITICAL off, NOTSET resets to config
+    """
+    LOGGER = 'pyon.net.channel.lock'
+    LEVELS = dict(TRACE=LOCK_DIAG_FULL, DEBUG=LOCK_DIAG_FULL, INFO=LOCK_DIAG_CHEAP, WARN=LOCK_DIAG_CHEAP,
+                  WARNING=LOCK_DIAG_CHEAP, ERROR=LOCK_DIAG_OFF, CRITICAL=LOCK_DIAG_OFF, NOTSET=None)
+    def can_handle_request(self, action):
+        return isinstance(action, ChangeLogLevel) and action.logger == self.LOGGER
+    def handle_request(self, action):
+        level = str(action.level).upper()
+        if level not in self.LEVELS:
+            raise ValueError("Unknown log level for lock diagnostics: %s" % action.level)
+        set_lock_diagnostics(self.LEVELS[level])
+
+
 class StatisticsHandler(EventHandler):
     def can_handle_request(self, action):
         return isinstance(action, ReportStatistics) or isinstance(action, ClearStatistics)
@@ -175,7 +192,7 @@ class PrepareSystemShutdownHandler(EventHandler):
 
 SEND_RESULT_IF_NOT_SELECTED = False  # terrible idea... but might want for debug or audit?
 
-DEFAULT_HANDLERS = [ LogLevelHandler(), StatisticsHandler(), PolicyCacheHandler(), GarbageCollectionHandler(),
+DEFAULT_HANDLERS = [ LogLevelHandler(), LockDiagnosticsHandler(), StatisticsHandler(), PolicyCacheHandler(), GarbageCollectionHandler(),
                      ContainerSnapshotHandler(), PrepareSystemShutdownHandler() ]
 
 
@@ -20,6 +20,7 @@ from pyon.ion.endpoint import ProcessRPCServer
 from pyon.ion.conversation import ConversationRPCServer
 from pyon.ion.stream import StreamPublisher, StreamSubscriber
 from pyon.ion.process import IonProcessThreadManager, IonProcessError
+from pyon.ion.state import STATE_MODE_FULL, STATE_MODE_DELTA, DELTA_KEYS
 from pyon.net.messaging import IDPool
 from pyon.ion.service import BaseService
 from pyon.util.containers import DotDict, for_name, named_any, dict_merge, get_safe, is_valid_identifier
@@ -402,7 +403,9 @@ class ProcManager(object):
                                    service=process_instance,
                                    listeners=[rsvc1, rsvc2],
                                    proc_name=process_instance._proc_name,
-                                   cleanup_method=cleanup)
+                                   cleanup_method=cleanup,
+                                   max_concurrency=get_safe(config, "process.max_concurrency", 1),
+                                   concurrent_ops=get_safe(config, "process.concurrent_ops"))
         proc.proc._glname = "ION Proc %s" % process_instance._proc_name
         self.proc_sup.ensure_ready(proc, "_spawn_service_process for %s" % ",".join((listen_name, process_instance.id)))
 
@@ -678,22 +681,38 @@ class ProcManager(object):
         if hasattr(process_instance, "_flush_state"):
             def _flush_state():
                 with process_instance._state_lock:
-                    state_obj = process_instance.container.state_repository.put_state(process_instance.id, process_instance._proc_state,
-                                                                                      state_obj=process_instance._proc_state_obj)
-                    state_obj.state = None   # Make sure memory footprint is low for larger states
-                    process_instance._proc_state_obj = state_obj
-                    process_instance._proc_state_changed = False
+                    if process_instance._proc_state_mode == STATE_MODE_DELTA:
+                        revs = process_instance._proc_state_revs
+                        changes, deleted = process_instance._get_state_changes(persisted_keys=[k for k in revs if k != DELTA_KEYS])
+                        # Reset before the write, so that changes made while writing are kept dirty
+                        process_instance._reset_state_changes()
+                        try:
+                            process_instance.container.state_repository.put_state_delta(process_instance.id, changes,
+                                                                                        deleted=deleted, revs=revs)
+                        except Exception:
+                            process_instance._get_dirty_keys().update(changes.keys() + deleted)
+                            process_instance._proc_state_changed = True
+                            raise
+                    else:
+                        state_obj = process_instance.container.state_repository.put_state(process_instance.id, process_instance._proc_state,
+                                                                                          state_obj=process_instance._proc_state_obj)
+                        state_obj.state = None   # Make sure memory footprint is low for larger states
+                        process_instance._proc_state_obj = state_obj
+                        process_instance._reset_state_changes()
 
             def _load_state():
                 if not hasattr(process_instance, "_proc_state"):
                     process_instance._proc_state = {}
                 try:
                     with process_instance._state_lock:
-                        new_state, state_obj = process_instance.container.state_repository.get_state(process_instance.id)
+                        revs = {}
+                        new_state, state_obj = process_instance.container.state_repository.get_state(process_instance.id, revs=revs)
                         process_instance._proc_state.clear()
                         process_instance._proc_state.update(new_state)
+                        state_obj.state = None
                         process_instance._proc_state_obj = state_obj
-                        process_instance._proc_state_changed = False
+                        process_instance._proc_state_revs = revs
+                        process_instance._reset_state_changes()
                 except NotFound as nf:
                     log.debug("No persisted state available for process %s", process_instance.id)
                 except Exception as ex:
@@ -703,7 +722,11 @@ class ProcManager(object):
             process_instance._state_lock = RLock()
             process_instance._proc_state = {}
             process_instance._proc_state_obj = None
-            process_instance._proc_state_changed = False
+            process_instance._proc_state_revs = {}
+            process_instance._proc_state_mode = get_safe(config, "process.state.update_mode", STATE_MODE_FULL)
+            process_instance._proc_state_flush_changes = get_safe(config, "process.state.flush_changes", 0)
+            process_instance._proc_state_flush_interval = get_safe(config, "process.state.flush_interval", 0)
+            process_instance._reset_state_changes()
 
             # PROCESS RESTART: Need to check whether this process had persisted state.
             # Note: This could happen anytime during a system run, not just on RESTART boot
@@ -756,6 +779,13 @@ class ProcManager(object):
         # Give the process notice to quit doing stuff.
         process_instance.quit()
 
+        # Flush state changes deferred by the process' state flush policy
+        if getattr(process_instance, "_proc_state_changed", False) and hasattr(process_instance, "_flush_state"):
+            try:
+                process_instance._flush_state()
+            except Exception:
+                log.warn("Process %s flush state on quit failed", process_instance.id, exc_info=True)
+
         # Terminate IonProcessThread (may not have one, i.e. simple process)
         # @TODO: move this into process' on_quit()
         if getattr(process_instance, '_process', None) is not None and process_instance._process:
@@ -77,3 +77,17 @@ class AdminMessageTest(PyonTestCase):
         action = IonObject(OT.TriggerGarbageCollection)
         handler.handle_request(action)
         #
+
+    def test_lock_diagnostics_handler(self):
+        from pyon.net import channel
+        self.addCleanup(channel.set_lock_diagnostics, None)
+        handler = pyon.container.management.LockDiagnosticsHandler()
+        self.assertFalse(handler.can_handle_request(IonObject(OT.ChangeLogLevel, logger='pyon.container', level='DEBUG')))
+
+        action = IonObject(OT.ChangeLogLevel, logger=handler.LOGGER, level='DEBUG')
+        self.assertTrue(handler.can_handle_request(action))
+        handler.handle_request(action)
+        self.assertEqual(channel.get_lock_diagnostics(), channel.LOCK_DIAG_FULL)
+
+        handler.handle_request(IonObject(OT.ChangeLogLevel, logger=handler.LOGGER, level='ERROR'))
+        self.assertEqual(channel.get_lock_diagnostics(), channel.LOCK_DIAG_OFF)
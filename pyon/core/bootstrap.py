@@ -176,12 +176,13 @@ def bootstrap_pyon(logging_config_override=None, pyon_cfg=None):
     _obj_registry = IonObjectRegistry()
 
     # SERVICES. Service definitions
-    # TODO: change the following to read service definitions from directory and import selectively
+    # Import service modules on first reference if a service manifest exists, otherwise all now
     from pyon.ion.service import IonServiceRegistry
     global _service_registry
     _service_registry = IonServiceRegistry()
-    _service_registry.load_service_mods('interface/services')
-    _service_registry.build_service_map()
+    if not CFG.get_safe('container.service_registry.lazy', True) or not _service_registry.load_service_manifest():
+        _service_registry.load_service_mods('interface/services')
+        _service_registry.build_service_map()
 
     # RESOURCES. Load and initialize definitions
     from pyon.ion import resource
@@ -4,7 +4,13 @@ from __builtin__ import classmethod
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
+import copy
+import cPickle as pickle
 import os
+import time
+from collections import OrderedDict
+
+from pyon.core.bootstrap import CFG
 from pyon.core.governance.governance_interceptor import BaseInternalGovernanceInterceptor
 from pyon.core.governance.governance_dispatcher import GovernanceDispatcher
 from pyon.util.log import log
@@ -13,7 +19,7 @@ from parsing.base_parser import ANTLRScribbleParser
 from core.transition import TransitionFactory
 from core.local_type import LocalType
 from core.fsm import FSM, ExceptionFSM
-from core.conversation_context import ConversationContext
+from core.compiled_fsm import CompiledFSM, ConversationState
 
 class ConversationProvider(object):
     @classmethod
@@ -25,11 +31,19 @@ class ConversationMonitorInterceptor(BaseInternalGovernanceInterceptor):
     def __init__(self):
         self.spec_path = os.path.normpath("%s/../specs/" %__file__)
         self._initialize_conversation_for_monitoring()
-        #map principal to conversation_context
-        self.conversation_context = {}
+        #map (conv_id, principal) to ConversationState, least recently used first
+        self.conversation_context = OrderedDict()
         self.parsed_conversation_protocols = {}
+        # map (role_spec, op) to the CompiledFSM, or the FSM template if the protocol cannot be compiled
+        self.compiled_conversation_protocols = {}
         self.parser = ANTLRScribbleParser()
 
+        monitor_cfg = CFG.get_safe('container.governance.conversation_monitor', None) or {}
+        self.max_conversations = monitor_cfg.get('max_conversations', 1000)
+        self.conversation_timeout = monitor_cfg.get('conversation_timeout', 600)
+        # Directory to persist compiled protocols in, so that specs are not parsed again on restart
+        self.protocol_cache_path = monitor_cfg.get('protocol_cache_path', None)
+
     def _initialize_conversation_for_monitoring(self):
         #self.conversations_for_monitoring = {'bank':{'buy_bonds':'bank/local/BuyBonds_Bank.srt',
         #                                             'new_account':'bank/local/NewAccount_Bank.srt'},
@@ -107,14 +121,80 @@ class ConversationMonitorInterceptor(BaseInternalGovernanceInterceptor):
     '''
 
     def _initialize_conversation_context(self, cid, role_spec, self_principal, target_principal, op):
-
-        #Cache the parsing of static protocol specifications
-        if not self.parsed_conversation_protocols.has_key(self_principal):
-            self.parsed_conversation_protocols[self_principal] = self.parser.parse(os.path.join(self.spec_path,role_spec))
-
-        builder = self.parser.walk(self.parsed_conversation_protocols[self_principal])
-        mapping = ConversationProvider.get_protocol_mapping(op)
-        return ConversationContext(builder, cid, [self_principal, target_principal], mapping)
+        protocol = self._get_compiled_protocol(role_spec, op)
+        if isinstance(protocol, CompiledFSM):
+            return ConversationState(protocol, cid)
+        return ConversationState(None, cid, fsm=copy.deepcopy(protocol))
+
+    def _get_compiled_protocol(self, role_spec, op):
+        """
+        Returns the CompiledFSM of the protocol specification with generics instantiated for op,
+        or the FSM to copy per conversation if the protocol cannot be compiled.
+        Protocols are parsed and built once, and compiled ones are persisted if protocol_cache_path is set.
+        """
+        key = (role_spec, op)
+        protocol = self.compiled_conversation_protocols.get(key, None)
+        if protocol is not None:
+            return protocol
+
+        spec_file = os.path.join(self.spec_path, role_spec)
+        cache_file = None
+        if self.protocol_cache_path:
+            cache_file = os.path.join(self.protocol_cache_path, "%s_%s.fsm" % (role_spec.replace('/', '_'), op))
+            protocol = self._load_compiled_protocol(cache_file, spec_file)
+
+        if protocol is None:
+            #Cache the parsing of static protocol specifications
+            if not self.parsed_conversation_protocols.has_key(role_spec):
+                self.parsed_conversation_protocols[role_spec] = self.parser.parse(spec_file)
+
+            builder = self.parser.walk(self.parsed_conversation_protocols[role_spec])
+            fsm = builder.main_fsm.fsm
+            fsm.reset()
+            fsm.instantiate_generics(ConversationProvider.get_protocol_mapping(op))
+
+            protocol = CompiledFSM.compile(fsm)
+            if protocol is None:
+                protocol = fsm
+            elif cache_file:
+                self._save_compiled_protocol(cache_file, protocol)
+
+        self.compiled_conversation_protocols[key] = protocol
+        return protocol
+
+    def _load_compiled_protocol(self, cache_file, spec_file):
+        try:
+            if os.path.getmtime(cache_file) < os.path.getmtime(spec_file):
+                return None
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, IOError):
+            return None
+        except Exception:
+            log.warn("Ignoring invalid compiled protocol: %s", cache_file)
+            return None
+
+    def _save_compiled_protocol(self, cache_file, protocol):
+        try:
+            with open(cache_file, 'wb') as f:
+                pickle.dump(protocol, f, pickle.HIGHEST_PROTOCOL)
+        except (OSError, IOError):
+            log.warn("Could not save compiled protocol: %s", cache_file)
+
+    def _add_conversation_context(self, conversation_key, conversation_context):
+        """
+        Adds the state of a new conversation, first evicting expired conversations and then the least
+        recently used ones beyond max_conversations.
+        """
+        expiry = time.time() - self.conversation_timeout
+        while self.conversation_context:
+            oldest_key = next(iter(self.conversation_context))
+            if self.conversation_context[oldest_key].last_update >= expiry and len(self.conversation_context) < self.max_conversations:
+                break
+            log.debug("Evicting monitored conversation %s", oldest_key)
+            del self.conversation_context[oldest_key]
+
+        self.conversation_context[conversation_key] = conversation_context
 
 
     def _get_control_conv_msg(self, invocation):
@@ -140,11 +220,14 @@ class ConversationMonitorInterceptor(BaseInternalGovernanceInterceptor):
                 conversation_context = self._initialize_conversation_context(cid, role_spec,
                                                                         self_principal, target_principal,
                                                                         operation)
-                if conversation_context: self.conversation_context[conversation_key] = conversation_context
+                if conversation_context: self._add_conversation_context(conversation_key, conversation_context)
 
         # CHECK
         if (conversation_key in self.conversation_context):
-            conversation_context = self.conversation_context[conversation_key]
+            # Most recently used conversations go last
+            conversation_context = self.conversation_context.pop(conversation_key)
+            conversation_context.last_update = time.time()
+            self.conversation_context[conversation_key] = conversation_context
 
             #target_role = conversation_context.get_role_by_principal(target_principal)
             target_role = target_principal
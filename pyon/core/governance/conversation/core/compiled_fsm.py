@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+import time
+
+from pyon.core.governance.conversation.core.fsm import FSM, ExceptionFSM
+
+
+class CompiledFSM(object):
+    """
+    Immutable transition table of a protocol FSM: (state, trigger) -> next state, where the trigger
+    is the transition string with local type, operation and role (see TransitionFactory).
+    Empty transitions are resolved at compile time. Shared by all conversations of a protocol and picklable.
+    """
+
+    def __init__(self, transitions, initial_state, end_states, final_state=-1):
+        self.transitions = transitions
+        self.initial_state = initial_state
+        self.end_states = frozenset(end_states)
+        self.final_state = final_state
+
+    @classmethod
+    def compile(cls, fsm):
+        """
+        Returns the CompiledFSM of an FSM, or None if the FSM uses constructs that need a full FSM
+        at runtime (parallel branches, interrupts, any/default transitions or assertion checks).
+        """
+        if (fsm.memory or fsm.interrupt_transition is not None or fsm.state_transitions_any or
+                fsm.default_transition is not None or fsm.check_assertions):
+            return None
+
+        empty_transitions = {}
+        transitions_by_state = {}
+        states = set([fsm.initial_state])
+        for (input_symbol, state), (_, _, next_state) in fsm.state_transitions.iteritems():
+            if input_symbol == FSM.EMPTY_TRANSITION:
+                empty_transitions[state] = next_state
+            else:
+                transitions_by_state.setdefault(state, {})[input_symbol] = next_state
+            states.add(state)
+            states.add(next_state)
+
+        def resolve(state):
+            # The state where transitions are looked up, following empty transitions as FSM.get_transition
+            seen = set()
+            while state in empty_transitions and state not in seen:
+                seen.add(state)
+                state = empty_transitions[state]
+            return state
+
+        def reaches_end(state):
+            # As FSM.test_for_end_state
+            seen = set()
+            while state not in fsm.end_states and state in empty_transitions and state not in seen:
+                seen.add(state)
+                state = empty_transitions[state]
+            return state in fsm.end_states
+
+        transitions = {}
+        for state in states:
+            for input_symbol, next_state in transitions_by_state.get(resolve(state), {}).iteritems():
+                transitions[(state, input_symbol)] = next_state
+
+        end_states = [state for state in states if reaches_end(state)]
+        return cls(transitions, fsm.initial_state, end_states, fsm.final_state)
+
+    def next_state(self, state, trigger):
+        try:
+            return self.transitions[(state, trigger)]
+        except KeyError:
+            raise ExceptionFSM('Transition is undefined: (%s, %s).' % (str(trigger), str(state)))
+
+    def is_end_state(self, state):
+        return state in self.end_states
+
+
+class ConversationState(object):
+    """
+    The state of one monitored conversation: the current state in a shared CompiledFSM and the
+    triggers processed so far. Provides the parts of the FSM and ConversationContext interfaces used
+    by the conversation monitor. Protocols that cannot be compiled keep a private FSM instead.
+    """
+    __slots__ = ('protocol', 'fsm', 'conv_id', 'current_state', 'history', 'last_update')
+
+    def __init__(self, protocol, conv_id, fsm=None):
+        self.protocol = protocol
+        self.fsm = fsm
+        self.conv_id = conv_id
+        self.current_state = protocol.initial_state if protocol is not None else None
+        self.history = []
+        self.last_update = time.time()
+
+    def get_fsm(self):
+        return self.fsm if self.fsm is not None else self
+
+    def get_conversation_id(self):
+        return self.conv_id
+
+    def process(self, input_transition, payload=None):
+        if self.current_state == self.protocol.final_state:
+            raise ExceptionFSM('What are you sending?The communication has finished.')
+        self.current_state = self.protocol.next_state(self.current_state, input_transition)
+        self.history.append(input_transition)
+
+    def test_for_end_state(self, state):
+        return self.protocol.is_end_state(state)
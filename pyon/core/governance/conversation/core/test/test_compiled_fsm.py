@@ -0,0 +1,50 @@
+import cPickle as pickle
+from pyon.core.governance.conversation.core.fsm import FSM, ExceptionFSM
+from pyon.core.governance.conversation.core.compiled_fsm import CompiledFSM, ConversationState
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+
+@attr('UNIT')
+class TestCompiledFSM(PyonTestCase):
+    def get_test_fsm(self):
+        # 1 -request-> 2 -EMPTY-> 3, choice at 3 between accept and reject
+        fsm = FSM(1)
+        fsm.add_transition('send_request_provider', 1, 2)
+        fsm.add_transition(FSM.EMPTY_TRANSITION, 2, 3)
+        fsm.add_transition('resv_accept_provider', 3, 4)
+        fsm.add_transition('resv_reject_provider', 3, 5)
+        return fsm
+
+    def test_compile(self):
+        fsm = self.get_test_fsm()
+        compiled = CompiledFSM.compile(fsm)
+
+        self.assertEqual(compiled.next_state(1, 'send_request_provider'), 2)
+        # Empty transitions are resolved
+        self.assertEqual(compiled.next_state(2, 'resv_accept_provider'), 4)
+        self.assertRaises(ExceptionFSM, compiled.next_state, 1, 'resv_accept_provider')
+        for state in (1, 2, 3, 4, 5):
+            self.assertEqual(compiled.is_end_state(state), fsm.test_for_end_state(state))
+
+        compiled = pickle.loads(pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(compiled.next_state(2, 'resv_reject_provider'), 5)
+
+        # Parallel branches need the full FSM
+        fsm.add_fsm_to_memory(3, FSM('3_1'))
+        self.assertIsNone(CompiledFSM.compile(fsm))
+
+    def test_conversation_state(self):
+        compiled = CompiledFSM.compile(self.get_test_fsm())
+        conv = ConversationState(compiled, 'conv1')
+        self.assertIs(conv.get_fsm(), conv)
+        self.assertEqual(conv.get_conversation_id(), 'conv1')
+
+        conv.process('send_request_provider')
+        self.assertFalse(conv.test_for_end_state(conv.current_state))
+        conv.process('resv_accept_provider')
+        self.assertTrue(conv.test_for_end_state(conv.current_state))
+        self.assertEqual(conv.history, ['send_request_provider', 'resv_accept_provider'])
+        self.assertRaises(ExceptionFSM, conv.process, 'send_request_provider')
+
+        fsm = self.get_test_fsm()
+        self.assertIs(ConversationState(None, 'conv2', fsm=fsm).get_fsm(), fsm)
@@ -3,6 +3,7 @@ import os, inspect
 from pyon.core.governance.conversation.core.transition import TransitionFactory
 from pyon.core.governance.conversation.core.local_type import LocalType
 from pyon.core.governance.conversation.core.fsm import ExceptionFSM, ExceptionFailAssertion
+from pyon.core.governance.conversation.core.compiled_fsm import CompiledFSM, ConversationState
 from pyon.core.governance.conversation.parsing.base_parser import ANTLRScribbleParser
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.log import log
@@ -164,3 +165,22 @@ class TestFSM(IonIntegrationTestCase):
     def test_interrupt_when_interrupt_occur(self):
         self.base('Interrupt.spr', (Interrupt_events()[0:2]+Interrupt_events()[4:6]))
         self.assertEqual(1, 1)
+
+    def test_compiled(self):
+        myparser = ANTLRScribbleParser()
+        for lt_filename, events in [('PurchasingAtBuyer.spr', purchasingAtBuyer_events()),
+                                    ('LocateChoiceAtBuyer.spr', locateChoiceAtBuyer_events()[2:6])]:
+            fsm = myparser.walk(myparser.parse(self.path + lt_filename)).main_fsm.fsm
+            compiled = CompiledFSM.compile(fsm)
+            self.assertIsNotNone(compiled)
+
+            conv = ConversationState(compiled, 'conv1')
+            for event in events:
+                fsm.process(event)
+                conv.process(event)
+                self.assertEqual(conv.test_for_end_state(conv.current_state), fsm.test_for_end_state(fsm.current_state))
+
+        # Wrong messages are rejected as by the FSM
+        fsm = myparser.walk(myparser.parse(self.path + 'LocateChoiceAtBuyer.spr')).main_fsm.fsm
+        conv = ConversationState(CompiledFSM.compile(fsm), 'conv1')
+        self.assertRaises(ExceptionFSM, conv.process, locateChoiceAtBuyer_events()[1])
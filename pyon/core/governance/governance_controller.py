@@ -31,6 +31,8 @@ class GovernanceController(object):
         self.enabled = False
         self.interceptor_by_name_dict = dict()
         self.interceptor_order = []
+        # Bound interceptor methods per direction, keyed by the interceptor order they were built for
+        self._interceptor_pipelines = dict()
         self.policy_decision_point_manager = None
         self.governance_dispatcher = None
 
@@ -91,6 +93,7 @@ class GovernanceController(object):
 
         if 'interceptor_order' in config:
             self.interceptor_order = config['interceptor_order']
+        self._interceptor_pipelines.clear()
 
         if 'governance_interceptors' in config:
             gov_ints = config['governance_interceptors']
@@ -175,7 +178,7 @@ class GovernanceController(object):
         @param invocation:
         @return:
         """
-        self.process_message(invocation, self.interceptor_order,'incoming' )
+        self._process_pipeline(invocation, 'incoming')
         return self.governance_dispatcher.handle_incoming_message(invocation)
 
     def process_outgoing_message(self,invocation):
@@ -184,7 +187,7 @@ class GovernanceController(object):
         @param invocation:
         @return:
         """
-        self.process_message(invocation, reversed(self.interceptor_order),'outgoing')
+        self._process_pipeline(invocation, 'outgoing')
         return self.governance_dispatcher.handle_outgoing_message(invocation)
 
     def process_message(self,invocation,interceptor_list, method):
@@ -197,17 +200,37 @@ class GovernanceController(object):
         @param method:
         @return:
         """
-        for int_name in interceptor_list:
-            class_inst = self.interceptor_by_name_dict[int_name]
-            getattr(class_inst, method)(invocation)
+        funcs = [getattr(self.interceptor_by_name_dict[int_name], method) for int_name in interceptor_list]
+        return self._run_interceptors(invocation, funcs)
+
+    def _process_pipeline(self, invocation, method):
+        return self._run_interceptors(invocation, self._get_interceptor_pipeline(method))
+
+    def _run_interceptors(self, invocation, funcs):
+        for func in funcs:
+            func(invocation)
+            annotations = invocation.message_annotations
 
             #Stop processing message if an issue with the message was found by an interceptor.
-            if ( invocation.message_annotations.has_key(GovernanceDispatcher.CONVERSATION__STATUS_ANNOTATION) and invocation.message_annotations[GovernanceDispatcher.CONVERSATION__STATUS_ANNOTATION] == GovernanceDispatcher.STATUS_REJECT) or\
-               ( invocation.message_annotations.has_key(GovernanceDispatcher.POLICY__STATUS_ANNOTATION) and invocation.message_annotations[GovernanceDispatcher.POLICY__STATUS_ANNOTATION] == GovernanceDispatcher.STATUS_REJECT) :
+            if annotations and (annotations.get(GovernanceDispatcher.CONVERSATION__STATUS_ANNOTATION, None) == GovernanceDispatcher.STATUS_REJECT or
+                                annotations.get(GovernanceDispatcher.POLICY__STATUS_ANNOTATION, None) == GovernanceDispatcher.STATUS_REJECT):
                 break
 
         return invocation
 
+    def _get_interceptor_pipeline(self, method):
+        """
+        Returns the bound methods of the governance interceptors in interceptor_order for the given
+        method (reversed order for outgoing), compiled once per interceptor order.
+        """
+        order = tuple(self.interceptor_order)
+        pipeline = self._interceptor_pipelines.get(method, None)
+        if pipeline is None or pipeline[0] != order:
+            int_names = order if method == 'incoming' else tuple(reversed(order))
+            funcs = [getattr(self.interceptor_by_name_dict[int_name], method) for int_name in int_names]
+            pipeline = self._interceptor_pipelines[method] = (order, funcs)
+        return pipeline[1]
+
 
 
     # Manage all of the policies in the container
@@ -225,6 +248,8 @@ class GovernanceController(object):
 
         log.info("Policy event callback received: %s" % policy_event)
 
+        self._clear_policy_decision_cache()
+
         if policy_event.type_ == OT.ResourcePolicyEvent:
             self.resource_policy_event_callback(policy_event, *args, **kwargs)
         elif policy_event.type_ == OT.RelatedResourcePolicyEvent:
@@ -299,6 +324,10 @@ class GovernanceController(object):
         self.policy_decision_point_manager.clear_policy_cache()
         self.unregister_all_process_policy_preconditions()
 
+    def _clear_policy_decision_cache(self):
+        if self.policy_decision_point_manager is not None:
+            self.policy_decision_point_manager.clear_decision_cache()
+
     def _get_policy_snapshot(self):
         policy_snap = {}
         policy_snap["snap_ts"] = get_ion_ts()
@@ -418,6 +447,8 @@ class GovernanceController(object):
                 self.system_actor_id = system_actor._id
                 self.system_actor_user_header = get_system_actor_header()
 
+        self._clear_policy_decision_cache()
+
         if process_instance._proc_type == SERVICE_PROCESS_TYPE:
             # look to load any existing policies for this service
 
@@ -5,9 +5,12 @@ __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
 
+from collections import OrderedDict
 from os import path
 from StringIO import StringIO
 
+from ooi.timer import Accumulator
+
 from ndg.xacml.parsers.etree.factory import ReaderFactory
 
 
@@ -23,7 +26,7 @@ from ndg.xacml.core.context.action import Action
 from ndg.xacml.core.context.environment import Environment
 from ndg.xacml.core.context.pdp import PDP
 from ndg.xacml.core.context.result import Decision
-from pyon.core.bootstrap import IonObject
+from pyon.core.bootstrap import IonObject, CFG
 from pyon.core.exception import NotFound
 from pyon.core.governance import ION_MANAGER
 from pyon.core.registry import is_ion_object, message_classes, get_class_decorator_value
@@ -31,6 +34,8 @@ from pyon.core.governance.governance_dispatcher import GovernanceDispatcher
 
 from pyon.util.log import log
 
+stats = Accumulator(persist=True)
+
 COMMON_SERVICE_POLICY_RULES = 'common_service_policy_rules'
 
 
@@ -43,6 +48,9 @@ RECEIVER_TYPE = XACML_1_0_PREFIX + 'resource:receiver-type'
 ACTION_VERB = XACML_1_0_PREFIX + 'action:action-verb'
 ACTION_PARAMETERS = XACML_1_0_PREFIX + 'action:param-dict'
 
+# Policies referring to these (message content dependent) are never served from the decision cache
+NON_CACHEABLE_POLICY_TOKENS = ('param-dict', 'evaluate-code', 'evaluate-function')
+
 DICT_TYPE_URI = AttributeValue.IDENTIFIER_PREFIX + 'dict'
 OBJECT_TYPE_URI = AttributeValue.IDENTIFIER_PREFIX + 'object'
 
@@ -60,7 +68,16 @@ class PolicyDecisionPointManager(object):
         self.resource_policy_decision_point = dict()
         self.service_policy_decision_point = dict()
 
+        # Bounded LRU of decisions by normalized request attributes, only for PDPs not looking at message content
+        self._decision_cache = OrderedDict()
+        self._decision_cache_size = CFG.get_safe('interceptor.interceptors.governance.config.decision_cache_size', 1000)
+        self._cacheable_pdps = set()        # ids of PDPs whose decisions can be cached
+        self._decision_cache_hits = 0
+        self._decision_cache_misses = 0
+        self._decision_cache_evictions = 0
+
         self.empty_pdp = PDP.fromPolicySource(path.join(THIS_DIR, XACML_EMPTY_POLICY_FILENAME), ReaderFactory)
+        self._cacheable_pdps.add(id(self.empty_pdp))
         self.load_common_service_policy_rules('')
 
         self.governance_controller = governance_controller
@@ -175,11 +192,26 @@ class PolicyDecisionPointManager(object):
     def list_service_policies(self):
         return self.service_policy_decision_point.keys()
 
+    def _create_pdp(self, policy_text):
+        """
+        Compiles a PDP from the policy text and records whether its decisions can be cached.
+        """
+        pdp = PDP.fromPolicySource(StringIO(policy_text), ReaderFactory)
+        if not any(token in policy_text for token in NON_CACHEABLE_POLICY_TOKENS):
+            self._cacheable_pdps.add(id(pdp))
+        return pdp
+
+    def _remove_pdp(self, pdp):
+        self._cacheable_pdps.discard(id(pdp))
+        self.clear_decision_cache()
+
     def load_common_service_policy_rules(self, rules_text):
 
+        if hasattr(self, 'load_common_service_pdp'):
+            self._remove_pdp(self.load_common_service_pdp)
+
         self.common_service_rules = rules_text
-        input_source = StringIO(self.create_policy_from_rules(COMMON_SERVICE_POLICY_RULES, rules_text))
-        self.load_common_service_pdp = PDP.fromPolicySource(input_source, ReaderFactory)
+        self.load_common_service_pdp = self._create_pdp(self.create_policy_from_rules(COMMON_SERVICE_POLICY_RULES, rules_text))
 
     def load_service_policy_rules(self, service_name, rules_text):
 
@@ -192,8 +224,8 @@ class PolicyDecisionPointManager(object):
         service_rule_set = self.common_service_rules + rules_text
 
         #Simply create a new PDP object for the service
-        input_source = StringIO(self.create_policy_from_rules(service_name, service_rule_set))
-        self.service_policy_decision_point[service_name] = PDP.fromPolicySource(input_source, ReaderFactory)
+        self.service_policy_decision_point[service_name] = self._create_pdp(self.create_policy_from_rules(service_name, service_rule_set))
+        self.clear_decision_cache()
 
     def load_resource_policy_rules(self, resource_key, rules_text):
 
@@ -206,24 +238,36 @@ class PolicyDecisionPointManager(object):
         self.clear_resource_policy(resource_key)
 
         #Simply create a new PDP object for the service
-        input_source = StringIO(self.create_resource_policy_from_rules(resource_key, rules_text))
-        self.resource_policy_decision_point[resource_key] = PDP.fromPolicySource(input_source, ReaderFactory)
+        self.resource_policy_decision_point[resource_key] = self._create_pdp(self.create_resource_policy_from_rules(resource_key, rules_text))
+        self.clear_decision_cache()
 
     #Remove any policy indexed by the resource_key
     def clear_resource_policy(self, resource_key):
         if self.resource_policy_decision_point.has_key(resource_key):
-            del self.resource_policy_decision_point[resource_key]
+            self._remove_pdp(self.resource_policy_decision_point.pop(resource_key))
 
     #Remove any policy indexed by the service_name
     def clear_service_policy(self, service_name):
         if self.service_policy_decision_point.has_key(service_name):
-            del self.service_policy_decision_point[service_name]
+            self._remove_pdp(self.service_policy_decision_point.pop(service_name))
 
     #Remove all policies
     def clear_policy_cache(self):
+        for pdp in self.resource_policy_decision_point.values() + self.service_policy_decision_point.values():
+            self._cacheable_pdps.discard(id(pdp))
         self.resource_policy_decision_point.clear()
         self.service_policy_decision_point.clear()
         self.load_common_service_policy_rules('')
+        self.clear_decision_cache()
+
+    #Remove all cached policy decisions - must be called whenever any policy changes
+    def clear_decision_cache(self):
+        self._decision_cache.clear()
+
+    def get_decision_cache_stats(self):
+        return dict(size=len(self._decision_cache), max_size=self._decision_cache_size,
+                    hits=self._decision_cache_hits, misses=self._decision_cache_misses,
+                    evictions=self._decision_cache_evictions)
 
 
     def create_attribute(self, attrib_class, attrib_id, val):
@@ -266,8 +310,11 @@ class PolicyDecisionPointManager(object):
         if attribute is not None:
             subject.attributes.append(attribute)
 
-    def _create_request_from_message(self, invocation, receiver, receiver_type='service'):
-
+    def _get_request_attributes(self, invocation, receiver, receiver_type='service'):
+        """
+        Returns the normalized attributes a policy decision is based on (apart from the message content),
+        as a tuple (receiver_type, receiver, sender, actor_id, roles, op, message_format) usable as cache key.
+        """
         sender, sender_type = invocation.get_message_sender()
         op = invocation.get_header_value('op', 'Unknown')
         ion_actor_id = invocation.get_header_value('ion-actor-id', 'anonymous')
@@ -276,11 +323,6 @@ class PolicyDecisionPointManager(object):
 
         log.debug("Checking XACML Request: receiver_type: %s, sender: %s, receiver:%s, op:%s,  ion_actor_id:%s, ion_actor_roles:%s", receiver_type, sender, receiver, op, ion_actor_id, actor_roles)
 
-        request = Request()
-        subject = Subject()
-        subject.attributes.append(self.create_string_attribute(SENDER_ID, sender))
-        subject.attributes.append(self.create_string_attribute(Identifiers.Subject.SUBJECT_ID, ion_actor_id))
-
         #Get the Org name associated with the endpoint process
         endpoint_process = invocation.get_arg_value('process', None)
         if endpoint_process is not None and hasattr(endpoint_process,'org_governance_name'):
@@ -290,22 +332,36 @@ class PolicyDecisionPointManager(object):
 
         #If this process is not associated wiht the root Org, then iterate over the roles associated with the user only for
         #the Org that this process is associated with otherwise include all roles and create attributes for each
+        roles = set()
         if org_governance_name == self.governance_controller.system_root_org_name:
             log.debug("Including roles for all Orgs")
             #If the process Org name is the same for the System Root Org, then include all of them to be safe
             for org in actor_roles:
-                self.create_org_role_attribute(actor_roles[org],subject)
+                roles.update(actor_roles[org])
         else:
             if actor_roles.has_key(org_governance_name):
                 log.debug("Org Roles (%s): %s" , org_governance_name, ' '.join(actor_roles[org_governance_name]))
-                self.create_org_role_attribute(actor_roles[org_governance_name],subject)
+                roles.update(actor_roles[org_governance_name])
 
             #Handle the special case for the ION system actor
             if actor_roles.has_key(self.governance_controller.system_root_org_name):
                 if ION_MANAGER in actor_roles[self.governance_controller.system_root_org_name]:
                     log.debug("Including ION_MANAGER role")
-                    self.create_org_role_attribute([ION_MANAGER],subject)
+                    roles.add(ION_MANAGER)
+
+        return receiver_type, receiver, sender, ion_actor_id, frozenset(roles), op, message_format
+
+    def _create_request_from_message(self, invocation, receiver, receiver_type='service', request_attributes=None):
 
+        if request_attributes is None:
+            request_attributes = self._get_request_attributes(invocation, receiver, receiver_type)
+        receiver_type, receiver, sender, ion_actor_id, roles, op, message_format = request_attributes
+
+        request = Request()
+        subject = Subject()
+        subject.attributes.append(self.create_string_attribute(SENDER_ID, sender))
+        subject.attributes.append(self.create_string_attribute(Identifiers.Subject.SUBJECT_ID, ion_actor_id))
+        self.create_org_role_attribute(sorted(roles), subject)
 
         request.subjects.append(subject)
 
@@ -333,6 +389,7 @@ class PolicyDecisionPointManager(object):
         #Create generic attributes for each of the primitive message parameter types to be available in XACML rules
 
         parameter_dict = {'message': invocation.message, 'headers': invocation.headers, 'annotations': invocation.message_annotations }
+        endpoint_process = invocation.get_arg_value('process', None)
         if endpoint_process is not None:
             parameter_dict['process'] = endpoint_process
 
@@ -372,46 +429,88 @@ class PolicyDecisionPointManager(object):
         if not receiver:
             raise NotFound('No receiver for this message')
 
-        requestCtx = self._create_request_from_message(invocation, receiver, receiver_type)
-
         pdp = self.get_service_pdp(receiver)
 
         if pdp is None:
             return Decision.NOT_APPLICABLE
 
-        return self._evaluate_pdp(invocation, pdp, requestCtx)
+        return self._check_request_policies(invocation, pdp, receiver, receiver_type)
 
     def check_resource_request_policies(self, invocation, resource_id):
 
         if not resource_id:
             raise NotFound('The resource_id is not set')
 
-        requestCtx = self._create_request_from_message(invocation, resource_id, 'resource')
-
         pdp = self.get_resource_pdp(resource_id)
 
         if pdp is None:
             return Decision.NOT_APPLICABLE
 
-        return self._evaluate_pdp(invocation, pdp, requestCtx)
+        return self._check_request_policies(invocation, pdp, resource_id, 'resource')
+
+    def _check_request_policies(self, invocation, pdp, receiver, receiver_type):
+        """
+        Returns the decision of the PDP for the message, from the decision cache if possible.
 
-    def _evaluate_pdp(self, invocation, pdp, requestCtx):
+        Decisions are cached by the normalized request attributes for PDPs that do not evaluate the
+        message content, and only if no earlier policy check has already denied the message.
+        """
+        request_attributes = self._get_request_attributes(invocation, receiver, receiver_type)
 
+        cacheable = self._decision_cache_size > 0 and id(pdp) in self._cacheable_pdps and \
+                    not invocation.message_annotations.has_key(GovernanceDispatcher.POLICY__STATUS_REASON_ANNOTATION)
+        if cacheable:
+            cache_key = (id(pdp), request_attributes)
+            try:
+                decision = self._decision_cache.pop(cache_key)
+            except KeyError:
+                pass
+            except TypeError:
+                # Unhashable attribute values
+                cacheable = False
+            else:
+                self._decision_cache[cache_key] = decision     # Most recently used
+                self._decision_cache_hits += 1
+                stats.add_value('governance.decision_cache.hit', 1)
+                return decision
+
+        requestCtx = self._create_request_from_message(invocation, receiver, receiver_type, request_attributes)
+        decision, complete = self._evaluate_pdp(invocation, pdp, requestCtx, with_status=True)
+
+        if cacheable:
+            self._decision_cache_misses += 1
+            stats.add_value('governance.decision_cache.miss', 1)
+            if complete:
+                if len(self._decision_cache) >= self._decision_cache_size:
+                    self._decision_cache.popitem(last=False)
+                    self._decision_cache_evictions += 1
+                    stats.add_value('governance.decision_cache.eviction', 1)
+                self._decision_cache[cache_key] = decision
+
+        return decision
+
+    def _evaluate_pdp(self, invocation, pdp, requestCtx, with_status=False):
+        """
+        Returns the decision of the PDP for the request. With with_status, returns a tuple of the decision
+        and a flag whether it is the result of a completed evaluation (i.e. not of an error).
+        """
         try:
             response = pdp.evaluate(requestCtx)
         except Exception, e:
             log.error("Error evaluating policies: %s" % e.message)
-            return Decision.NOT_APPLICABLE
+            return (Decision.NOT_APPLICABLE, False) if with_status else Decision.NOT_APPLICABLE
 
         if response is None:
             log.debug('response from PDP contains nothing, so not authorized')
-            return Decision.DENY
+            decision = Decision.DENY
 
-        if invocation.message_annotations.has_key(GovernanceDispatcher.POLICY__STATUS_REASON_ANNOTATION):
-            return Decision.DENY
+        elif invocation.message_annotations.has_key(GovernanceDispatcher.POLICY__STATUS_REASON_ANNOTATION):
+            decision = Decision.DENY
 
-        for result in response.results:
-            if result.decision == Decision.DENY:
-                break
+        else:
+            for result in response.results:
+                if result.decision == Decision.DENY:
+                    break
+            decision = result.decision
 
-        return result.decision
+        return (decision, True) if with_status else decision
@@ -334,3 +334,62 @@ class PolicyDecisionUnitTest(PyonTestCase):
         pdpm.load_resource_policy_rules(resource_id, self.permit_ION_MANAGER_rule)
         response = pdpm.check_agent_request_policies(invocation)
         self.assertEqual(response.value, "Permit")
+
+    def test_decision_cache(self):
+        gc = Mock()
+        gc.system_root_org_name = 'sys_org_name'
+        service_key = 'service_key'
+        pdpm = PolicyDecisionPointManager(gc)
+        pdpm.load_service_policy_rules(service_key, self.permit_ION_MANAGER_rule)
+
+        invocation = Mock()
+        invocation.message_annotations = {}
+        invocation.message = {'argument1': 0}
+        invocation.headers = {'op': 'op', 'ion-actor-id': 'ion-actor-id', 'ion-actor-roles': {'sys_org_name': ['ION_MANAGER']}}
+        invocation.get_message_receiver.return_value = service_key
+        invocation.get_message_sender.return_value = ['Unknown', 'Unknown']
+        invocation.get_header_value.side_effect = lambda key, default: invocation.headers.get(key, default)
+        process = Mock()
+        process.org_governance_name = 'sys_org_name'
+        invocation.get_arg_value.side_effect = lambda key, default=None: {'process': process}.get(key, default)
+
+        pdp = pdpm.get_service_pdp(service_key)
+        pdp_evaluate = pdp.evaluate
+        pdp.evaluate = Mock(side_effect=pdp_evaluate)
+
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "Permit")
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "Permit")
+        self.assertEqual(pdp.evaluate.call_count, 1)
+        self.assertEqual(pdpm.get_decision_cache_stats()['hits'], 1)
+        self.assertEqual(pdpm.get_decision_cache_stats()['misses'], 1)
+
+        # Different roles make a different decision
+        invocation.headers['ion-actor-roles'] = {'sys_org_name': ['MEMBER']}
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "NotApplicable")
+        self.assertEqual(pdp.evaluate.call_count, 2)
+        self.assertEqual(pdpm.get_decision_cache_stats()['size'], 2)
+
+        # Cache is bounded
+        pdpm._decision_cache_size = 2
+        invocation.headers['op'] = 'other_op'
+        pdpm.check_service_request_policies(invocation)
+        self.assertEqual(pdpm.get_decision_cache_stats()['size'], 2)
+        self.assertEqual(pdpm.get_decision_cache_stats()['evictions'], 1)
+
+        # Any policy change invalidates the cache
+        pdpm.load_service_policy_rules(service_key, self.deny_ION_MANAGER_rule)
+        self.assertEqual(pdpm.get_decision_cache_stats()['size'], 0)
+        invocation.headers['op'] = 'op'
+        invocation.headers['ion-actor-roles'] = {'sys_org_name': ['ION_MANAGER']}
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "Deny")
+
+        pdpm.clear_policy_cache()
+        self.assertEqual(pdpm.get_decision_cache_stats()['size'], 0)
+
+        # Policies evaluating the message content are never cached
+        pdpm.load_service_policy_rules(service_key, self.deny_message_parameter_rule)
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "Deny")
+        invocation.message = {'argument1': 5}
+        invocation.message_annotations = {}
+        self.assertEqual(pdpm.check_service_request_policies(invocation).value, "Permit")
+        self.assertEqual(pdpm.get_decision_cache_stats()['size'], 0)
@@ -1,6 +1,9 @@
 from pyon.core.interceptor.interceptor import Interceptor
 from pyon.core.bootstrap import get_obj_registry
-from pyon.core.object import IonObjectDeserializer, IonObjectSerializer, IonObjectBlameDeserializer, IonObjectBlameSerializer
+from pyon.core.exception import BadRequest
+from pyon.core.object import IonObjectDeserializer, IonObjectSerializer, IonObjectBlameDeserializer, IonObjectBlameSerializer, \
+    IonObjectValidatingDeserializer
+from pyon.core.registry import is_ion_object
 from pyon.util.log import log
 
 
@@ -42,3 +45,47 @@ class BlameCodecInterceptor(CodecInterceptor):
         Interceptor.__init__(self)
         self._io_serializer = IonObjectBlameSerializer()
         self._io_deserializer = IonObjectBlameDeserializer(obj_registry=get_obj_registry())
+
+
+class CodecValidateInterceptor(CodecInterceptor):
+    """
+    Transforms IonObject <-> dict and validates incoming IonObjects in the same pass.
+    Drop-in replacement for the codec + validate interceptor pair in a stack.
+    """
+    enabled = True
+
+    def __init__(self):
+        CodecInterceptor.__init__(self)
+        self._io_deserializer = IonObjectValidatingDeserializer(obj_registry=get_obj_registry())
+
+    def configure(self, config):
+        if config and "enabled" in config:
+            self.enabled = config["enabled"]
+        log.debug("CodecValidateInterceptor validation enabled: %s" % str(self.enabled))
+
+    def incoming(self, invocation):
+        log.debug("CodecValidateInterceptor.incoming: %s", invocation)
+
+        payload = invocation.message
+        log.debug("Payload, pre-transform: %s", payload)
+
+        # If payload is IonObject in dict form, validate it as an object in the same pass
+        type_ = None
+        if self.enabled and "format" in invocation.headers and is_ion_object(invocation.headers["format"]):
+            type_ = invocation.headers["format"]
+
+        errors = []
+        payload = self._io_deserializer.deserialize(payload, errors=errors, validate=self.enabled, type_=type_)
+        invocation.message = payload
+        log.debug("Payload, post-transform: %s", payload)
+
+        # Same failure policy as the ValidateInterceptor
+        if errors:
+            msg = errors[0].message
+            if invocation.headers.get("raise-exception", False):
+                log.warn('message failed validation: %s\nheaders %s\npayload %s', msg, invocation.headers, payload)
+                raise BadRequest(msg)
+            else:
+                log.warn('message failed validation, but allowing it anyway: %s\nheaders %s\npayload %s', msg, invocation.headers, payload)
+
+        return invocation
@@ -16,12 +16,41 @@ class EncodeTypes(object):
     SET = 's'
     LIST = 'l'
     NPARRAY = 'a'
+    NPARRAY_BUF = 'b'
     COMPLEX = 'c'
     DTYPE = 'd'
     SLICE = 'i'
     NPVAL = 'n'
 
 
+def encode_ndarray_buffer(obj):
+    """
+    Encodes a numpy array as its raw data buffer plus dtype (which includes byte order) and shape.
+
+    The buffer travels as a single msgpack raw value, so no per-element Python objects are created on
+    either side. Arrays holding Python objects or structured dtypes cannot be represented this way;
+    for those this returns None and the caller should fall back to the element-wise encoding.
+    """
+    if obj.dtype.hasobject or obj.dtype.fields is not None:
+        return None
+
+    return {'t':EncodeTypes.NPARRAY_BUF, 'o':obj.tostring(), 'd':obj.dtype.str, 's':obj.shape}
+
+
+def decode_ndarray_buffer(obj):
+    """
+    Decodes an array encoded by encode_ndarray_buffer.
+
+    The returned array is writable. Its data is a single copy of the received buffer, made into a
+    bytearray, rather than a read-only view onto the message.
+    """
+    dt = np.dtype(obj['d'])
+    if not obj['o']:
+        return np.empty(obj['s'], dtype=dt)
+
+    return np.frombuffer(bytearray(obj['o']), dtype=dt).reshape(obj['s'])
+
+
 
 
 def decode_ion(obj):
@@ -36,6 +65,9 @@ def decode_ion(obj):
     if obj['t'] == EncodeTypes.LIST:
         return list(obj['o'])
 
+    elif obj['t'] == EncodeTypes.NPARRAY_BUF:
+        return decode_ndarray_buffer(obj)
+
     elif obj['t'] == EncodeTypes.NPARRAY:
         return np.array(obj['o'], dtype=np.dtype(obj['d']))
 
@@ -58,6 +90,14 @@ def decode_ion(obj):
     return obj
 
 
+def encode_ndarray_list(obj):
+    """
+    Encodes a numpy array element-wise as nested lists. Works for any dtype, but builds a Python
+    object per element; only used where encode_ndarray_buffer can't represent the array.
+    """
+    return {'t':EncodeTypes.NPARRAY, 'o':obj.tolist(), 'd':obj.dtype.str}
+
+
 def encode_ion(obj):
     """
     MsgPack object hook to encode any ion object as part of the message pack walk rather than implementing it again in
@@ -71,7 +111,7 @@ def encode_ion(obj):
         return {'t':EncodeTypes.SET, 'o':tuple(obj)}
 
     if isinstance(obj, np.ndarray):
-        return {'t':EncodeTypes.NPARRAY, 'o':obj.tolist(), 'd':obj.dtype.str}
+        return encode_ndarray_buffer(obj) or encode_ndarray_list(obj)
 
     if isinstance(obj, complex):
         return {'t':EncodeTypes.COMPLEX, 'o':tuple(obj.real, obj.imag)}
@@ -97,6 +97,13 @@ class Interceptor(object):
     def configure(self, config):
         pass
 
+    def is_noop(self, path):
+        """
+        Returns True if this interceptor, as configured, leaves invocations on the given path
+        (Invocation.PATH_IN or PATH_OUT) unchanged, so that compiled pipelines can skip it.
+        """
+        return False
+
     def outgoing(self, invocation):
         pass
 
@@ -109,3 +116,45 @@ def process_interceptors(interceptors, invocation):
         func = getattr(interceptor, invocation.path)
         invocation = func(invocation)
     return invocation
+
+
+def _pass_invocation(invocation):
+    return invocation
+
+def compile_interceptors(interceptors, path):
+    """
+    Returns a callable running an invocation through the given interceptors on path, equivalent
+    to process_interceptors. Interceptor methods are bound once and no-op interceptors are left out.
+    """
+    funcs = tuple(getattr(interceptor, path) for interceptor in interceptors if not interceptor.is_noop(path))
+    if not funcs:
+        return _pass_invocation
+    elif len(funcs) == 1:
+        return funcs[0]
+
+    def pipeline(invocation):
+        for func in funcs:
+            invocation = func(invocation)
+        return invocation
+    return pipeline
+
+
+class InterceptorStacks(dict):
+    """
+    The interceptor stacks of a node by name (e.g. message_incoming), each a list of interceptors.
+    Keeps the compiled pipeline for each stack, see get_pipeline.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._pipelines = {}
+
+    def get_pipeline(self, stack_name):
+        pipeline = self._pipelines.get(stack_name, None)
+        if pipeline is None:
+            path = stack_name.rsplit('_', 1)[-1]
+            pipeline = self._pipelines[stack_name] = compile_interceptors(self.get(stack_name, []), path)
+        return pipeline
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._pipelines.pop(key, None)
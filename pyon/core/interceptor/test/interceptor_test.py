@@ -6,10 +6,13 @@
 @file pyon/core/interceptor/test/interceptor_test.py
 @description test lib for interceptor
 '''
+import sys
+import time
 import unittest
 from pyon.core.interceptor.encode import EncodeInterceptor
 from pyon.core.interceptor.validate import ValidateInterceptor
-from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import CodecValidateInterceptor
+from pyon.core.interceptor.interceptor import Invocation, Interceptor, InterceptorStacks, compile_interceptors, process_interceptors
 from pyon.core.exception import BadRequest
 from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
@@ -365,4 +368,140 @@ class InterceptorTest(PyonTestCase):
         deco_value = decorator_obj.get_class_decorator_value('Unknown')
         self.assertEqual(deco_value,None)
 
+    def test_codec_validate(self):
+        codec_validate = CodecValidateInterceptor()
+        codec_validate.configure({"enabled": True})
 
+        decorator_obj = IonObject('Deco_Example', {"list1": [1], "list2": ["One element"], "dict1": {"key1": 1}, "dict2": {"key1": 1}, "an_important_value": "good value", "us_phone_number": "555-555-5555"})
+
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': decorator_obj})
+        invoke = codec_validate.outgoing(invoke)
+        self.assertIsInstance(invoke.message['obj'], dict)
+
+        invoke.headers["raise-exception"] = True
+        received = codec_validate.incoming(invoke)
+        self.assertEqual(received.message['obj'], decorator_obj)
+
+        # Should fail because required field not set
+        decorator_obj.an_important_value = None
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': decorator_obj})
+        invoke = codec_validate.outgoing(invoke)
+        invoke.headers["raise-exception"] = True
+        with self.assertRaises(BadRequest):
+            codec_validate.incoming(invoke)
+
+        # Without raise-exception the message goes through, decoded
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': decorator_obj})
+        invoke = codec_validate.outgoing(invoke)
+        received = codec_validate.incoming(invoke)
+        self.assertEqual(received.message['obj'], decorator_obj)
+
+        # IonObject in dict form, typed by the format header
+        invoke = Invocation(path=Invocation.PATH_OUT, message=decorator_obj)
+        invoke = codec_validate.outgoing(invoke)
+        invoke.message.pop('type_')
+        invoke.headers["format"] = 'Deco_Example'
+        invoke.headers["raise-exception"] = True
+        with self.assertRaises(BadRequest):
+            codec_validate.incoming(invoke)
+
+        # Disabled validation only decodes
+        codec_validate.configure({"enabled": False})
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': decorator_obj})
+        invoke = codec_validate.outgoing(invoke)
+        invoke.headers["raise-exception"] = True
+        received = codec_validate.incoming(invoke)
+        self.assertEqual(received.message['obj'], decorator_obj)
+
+
+class CountingInterceptor(Interceptor):
+    def __init__(self, name, noop=False):
+        self.name = name
+        self.noop = noop
+
+    def is_noop(self, path):
+        return self.noop
+
+    def outgoing(self, invocation):
+        invocation.headers.setdefault('seen', []).append(self.name)
+        return invocation
+
+    def incoming(self, invocation):
+        return self.outgoing(invocation)
+
+
+@attr('UNIT')
+class InterceptorPipelineTest(PyonTestCase):
+    def test_compile_interceptors(self):
+        invoke = Invocation()
+        self.assertIs(compile_interceptors([], Invocation.PATH_IN)(invoke), invoke)
+        self.assertIs(compile_interceptors([CountingInterceptor('a', noop=True)], Invocation.PATH_IN)(invoke), invoke)
+        self.assertNotIn('seen', invoke.headers)
+
+        stack = [CountingInterceptor('a'), CountingInterceptor('b', noop=True), CountingInterceptor('c')]
+        invoke = compile_interceptors(stack, Invocation.PATH_OUT)(Invocation())
+        self.assertEquals(invoke.headers['seen'], ['a', 'c'])
+
+        # Same result as the uncompiled stack, which calls every interceptor
+        invoke = process_interceptors(stack, Invocation(path=Invocation.PATH_OUT))
+        self.assertEquals(invoke.headers['seen'], ['a', 'b', 'c'])
+
+        validate = ValidateInterceptor()
+        validate.configure({"enabled": True})
+        self.assertTrue(validate.is_noop(Invocation.PATH_OUT))
+        self.assertFalse(validate.is_noop(Invocation.PATH_IN))
+        validate.configure({"enabled": False})
+        self.assertTrue(validate.is_noop(Invocation.PATH_IN))
+
+    def test_interceptor_stacks(self):
+        stacks = InterceptorStacks(message_incoming=[CountingInterceptor('a')])
+        pipeline = stacks.get_pipeline('message_incoming')
+        self.assertIs(stacks.get_pipeline('message_incoming'), pipeline)
+        self.assertEquals(pipeline(Invocation()).headers['seen'], ['a'])
+
+        # Unknown stacks pass invocations through
+        invoke = Invocation()
+        self.assertIs(stacks.get_pipeline('process_outgoing')(invoke), invoke)
+
+        # Replacing a stack recompiles its pipeline
+        stacks['message_incoming'] = [CountingInterceptor('b'), CountingInterceptor('c')]
+        self.assertEquals(stacks.get_pipeline('message_incoming')(Invocation()).headers['seen'], ['b', 'c'])
+
+
+@attr('PFM')
+class InterceptorPipelineSpeedTest(PyonTestCase):
+    def test_pipeline_speed(self):
+        """ Round trips a message through the configured node interceptor stacks """
+        from pyon.core.bootstrap import CFG
+        from pyon.net.messaging import BaseNode
+
+        node = BaseNode()
+        node.setup_interceptors(CFG.interceptor)
+        stacks = node.interceptors
+        count = 10000
+
+        obj = IonObject('Deco_Example', list1=[1, 2], dict1={'key1': 1}, an_important_value='value')
+
+        def process_stack(stack_name, invocation):
+            return process_interceptors(stacks.get(stack_name, []), invocation)
+
+        def compiled_stack(stack_name, invocation):
+            return stacks.get_pipeline(stack_name)(invocation)
+
+        def round_trip(run):
+            invocation = Invocation(path=Invocation.PATH_OUT, message={'obj': obj}, headers={'op': 'test_op'})
+            invocation = run('message_outgoing', run('process_outgoing', invocation))
+            invocation = Invocation(path=Invocation.PATH_IN, message=invocation.message, headers=dict(invocation.headers))
+            return run('process_incoming', run('message_incoming', invocation))
+
+        self.assertEquals(round_trip(compiled_stack).message, round_trip(process_stack).message)
+
+        print >> sys.stderr, ""
+        print >> sys.stderr, "Stacks: %s" % dict((name, [type(i).__name__ for i in stack]) for name, stack in stacks.iteritems())
+
+        for label, run in (("process_interceptors", process_stack), ("compiled pipeline", compiled_stack)):
+            t1 = time.time()
+            for i in xrange(count):
+                round_trip(run)
+            t2 = time.time()
+            print >> sys.stderr, "%s: %.2f usec/round trip" % (label, (t2 - t1) * 1000000 / count)
@@ -8,7 +8,9 @@
 
 
 from nose.tools import *
+from nose.plugins.attrib import attr
 import unittest
+import sys
 
 import collections
 import time
@@ -17,7 +19,7 @@ import random
 from msgpack import packb, unpackb
 import hashlib
 
-from pyon.core.interceptor.encode import encode_ion, decode_ion
+from pyon.core.interceptor.encode import encode_ion, decode_ion, encode_ndarray_list, EncodeTypes
 
 """
 def decode_numpy( obj):
@@ -158,6 +160,93 @@ class NumpyMsgPackTestCase(unittest.TestCase, PackRunBase ):
         PackRunBase.__init__(self,*args, **kwargs)
 
 
+class NumpyBufferEncodingTestCase(unittest.TestCase):
+
+    def test_uses_buffer_encoding(self):
+        array = numpy.arange(12, dtype='float32').reshape(3, 4)
+        encoded = encode_ion(array)
+
+        self.assertEquals(encoded['t'], EncodeTypes.NPARRAY_BUF)
+        self.assertEquals(encoded['o'], array.tostring())
+
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+        self.assertEquals(new_array.shape, (3, 4))
+        self.assertEquals(new_array.dtype, array.dtype)
+        self.assertTrue((array == new_array).all())
+
+        # decoded arrays can be modified in place
+        self.assertTrue(new_array.flags.writeable)
+        new_array[0, 0] = 42
+        self.assertEquals(new_array[0, 0], 42)
+
+    def test_byte_order_preserved(self):
+        array = numpy.arange(10, dtype='>i4')
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+
+        self.assertEquals(new_array.dtype.str, '>i4')
+        self.assertTrue((array == new_array).all())
+
+    def test_non_contiguous_and_empty(self):
+        array = numpy.arange(20, dtype='int16').reshape(4, 5)[:, ::2]
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+        self.assertTrue((array == new_array).all())
+
+        array = numpy.zeros((0, 3), dtype='float64')
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+        self.assertEquals(new_array.shape, (0, 3))
+
+    def test_object_array_falls_back(self):
+        array = numpy.array([{1:'a'}, {2:'b'}], dtype='object')
+        self.assertEquals(encode_ion(array)['t'], EncodeTypes.NPARRAY)
+
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+        self.assertTrue((array == new_array).all())
+
+    def test_decodes_list_encoding(self):
+        # messages encoded by older containers still decode
+        array = numpy.arange(6, dtype='uint8').reshape(2, 3)
+        msg = packb(encode_ndarray_list(array))
+        new_array = unpackb(msg, object_hook=decode_ion)
+
+        self.assertEquals(new_array.dtype, array.dtype)
+        self.assertTrue((array == new_array).all())
+
+
+@attr('PFM')
+class NumpyEncodingSpeedTestCase(unittest.TestCase):
+    """
+    Compares the element-wise (list) and raw buffer ndarray encodings.
+    """
+    sizes = (1000, 10000, 100000, 1000000, 10000000)
+
+    def _time_it(self, array, encoder):
+        tic = time.time()
+        msg = packb(array, default=encoder)
+        enc_time = time.time() - tic
+
+        tic = time.time()
+        unpackb(msg, object_hook=decode_ion)
+        dec_time = time.time() - tic
+
+        return len(msg), enc_time, dec_time
+
+    def test_encoding_speed(self):
+        def list_encoder(obj):
+            if isinstance(obj, numpy.ndarray):
+                return encode_ndarray_list(obj)
+            return encode_ion(obj)
+
+        print >>sys.stderr, ""
+        print >>sys.stderr, "%10s %8s | %12s %10s %10s | %12s %10s %10s" % ("elements", "dtype", "list bytes", "enc s", "dec s", "buf bytes", "enc s", "dec s")
+        for dtype in ('float64', 'int32'):
+            for size in self.sizes:
+                array = numpy.random.uniform(-1000, 1000, size).astype(dtype)
+
+                old = self._time_it(array, list_encoder)
+                new = self._time_it(array, encode_ion)
+
+                print >>sys.stderr, "%10d %8s | %12d %10.4f %10.4f | %12d %10.4f %10.4f" % ((size, dtype) + old + new)
+
 
 if __name__ == '__main__':
 
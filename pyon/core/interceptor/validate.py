@@ -1,4 +1,4 @@
-from pyon.core.interceptor.interceptor import Interceptor
+from pyon.core.interceptor.interceptor import Interceptor, Invocation
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest
 from pyon.core.object import IonObjectBase, walk
@@ -17,6 +17,9 @@ class ValidateInterceptor(Interceptor):
             self.enabled = config["enabled"]
         log.debug("ValidateInterceptor enabled: %s" % str(self.enabled))
 
+    def is_noop(self, path):
+        return path == Invocation.PATH_OUT or not self.enabled
+
     def outgoing(self, invocation):
         # Set validate flag in header if IonObject(s) found in message
         log.debug("ValidateInterceptor.outgoing: %s", invocation)
@@ -20,7 +20,7 @@ from collections import OrderedDict
 
 from pyon.core.path import list_files_recursive
 from pyon.core.interfaces.interface_util import get_object_definition_from_datastore, get_service_definition_from_datastore
-from pyon.ion.service import BaseService
+from pyon.ion.service import BaseService, SERVICE_MANIFEST_FILE
 from pyon.core.bootstrap import CFG, set_config
 from pyon.util import yaml_ordered_dict; yaml_ordered_dict.apply_yaml_patch()
 from pyon.ion.directory_standalone import DirectoryStandalone
@@ -369,6 +369,9 @@ class ServiceObjectGenerator:
         # completed service client definitions, maps service name -> full module path to find module
         client_defs = {}
 
+        # service manifest for lazy loading, maps service name -> module, base class, dependencies
+        service_index = {}
+
         yaml_file_re = re.compile('(obj)/(.*)[.](yml)')
         # Generate the new definitions, for now giving each
         # yaml file its own python service
@@ -479,6 +482,10 @@ class ServiceObjectGenerator:
                 # update list of client paths for the client to this service
                 client_defs[service_name] = client_path
 
+                service_index[service_name] = {'module': client_path[0],
+                                               'base': 'Base%s' % self.service_name_from_file_name(interface_name),
+                                               'dependencies': list(dependencies or [])}
+
         print " About to generate", len(raw_services), "service interfaces"
 
         # topological sort of services to make sure we do things in order
@@ -548,6 +555,12 @@ class ServiceObjectGenerator:
                                                             client_imports="\n".join([templates['dep_client_imports'].substitute(clientmodule=x[0], clientclass=x[1]) for x in client_defs.itervalues()])))
             '''
 
+        if not opts.dryrun:
+            # always write the manifest, it indexes all services including unchanged ones
+            print " Writing service manifest to", SERVICE_MANIFEST_FILE
+            with open(SERVICE_MANIFEST_FILE, 'w') as f:
+                f.write(yaml.dump(service_index, default_flow_style=False))
+
         self.generate_validation_report()
         exitcode = 0
 
@@ -348,6 +348,140 @@ class IonObjectBase(object):
 class IonMessageObjectBase(IonObjectBase):
     pass
 
+class CompiledValidator(object):
+    """
+    Validator for a single IonObject type, precomputed from the class schema.
+
+    Handles the common cases (matching types, None, numeric and OrderedDict coercion and the
+    field decorators) without interpreting the schema each time, and falls back to
+    IonObjectBase._validate for anything else. Unlike _validate, child IonObjects are not
+    validated; callers are expected to validate bottom-up.
+    """
+
+    def __init__(self, clzz):
+        schema = clzz._schema
+        self.allowed_fields = frozenset(schema) | built_in_attrs
+        self.required_fields = tuple(key for key, schema_val in schema.iteritems()
+                                     if 'Required' in (schema_val.get('decorators') or {}))
+        self.field_checks = dict((key, (schema_val['type'], _compile_field_checks(schema_val)))
+                                 for key, schema_val in schema.iteritems())
+
+    def validate(self, obj):
+        fields = obj.__dict__
+
+        extra_fields = fields.viewkeys() - self.allowed_fields
+        if extra_fields:
+            raise AttributeError('Fields found that are not in the schema: %r' % (list(extra_fields)))
+
+        for key in self.required_fields:
+            if fields.get(key, None) is None:
+                raise AttributeError('Required value "%s" not set' % key)
+
+        for key, field_val in fields.items():
+            if key not in self.field_checks:
+                continue
+            schema_type, checks = self.field_checks[key]
+
+            if type(field_val).__name__ != schema_type:
+                if field_val is None or schema_type == 'NoneType':
+                    continue
+                if isinstance(field_val, int) and schema_type == 'float':
+                    field_val = fields[key] = float(field_val)
+                elif isinstance(field_val, int) and schema_type == 'long':
+                    field_val = fields[key] = long(field_val)
+                elif type(field_val) == dict and schema_type == 'OrderedDict':
+                    field_val = fields[key] = OrderedDict(field_val)
+                else:
+                    # Inheritance, enums and the other special cases are left to the full check
+                    obj._validate()
+                    return
+
+            for check in checks:
+                check(obj, key, field_val)
+
+
+def _compile_field_checks(schema_val):
+    """
+    Returns the decorator checks for a schema field as a tuple of callables (obj, key, value).
+    The checks assume the value already has the schema type.
+    """
+    schema_type = schema_val['type']
+    decorators = schema_val.get('decorators') or {}
+    checks = []
+
+    if schema_type == 'str' and 'ValuePattern' in decorators:
+        checks.append(_pattern_check(decorators['ValuePattern']))
+    if schema_type in ('int', 'float', 'long') and 'ValueRange' in decorators:
+        checks.append(_range_check(decorators['ValueRange']))
+    if 'ContentType' in decorators:
+        checks.append(_content_check(schema_type, decorators['ContentType']))
+    if schema_type in ('list', 'dict', 'OrderedDict') and 'ContentCount' in decorators:
+        checks.append(_count_check(decorators['ContentCount']))
+
+    return tuple(checks)
+
+
+def _pattern_check(pattern):
+    match = re.compile(pattern).match
+    def check(obj, key, value):
+        if not match(value):
+            raise AttributeError('Invalid value pattern %s for field "%s.%s", should match regular expression %s' %
+                (value, type(obj).__name__, key, pattern))
+    return check
+
+
+def _range_check(value_range):
+    if ',' in value_range:
+        min_val = eval(value_range.split(',')[0].strip())
+        max_val = eval(value_range.split(',')[1].strip())
+    else:
+        min_val = max_val = eval(value_range.split(',')[0].strip())
+    def check(obj, key, value):
+        if value < min_val or value > max_val:
+            raise AttributeError('Invalid value %s for field "%s.%s", should be between %d and %d' %
+                (str(value), type(obj).__name__, key, min_val, max_val))
+    return check
+
+
+def _content_check(schema_type, content_types):
+    if schema_type == 'list':
+        return lambda obj, key, value: obj.check_collection_content(key, value, content_types)
+    elif schema_type in ('dict', 'OrderedDict'):
+        return lambda obj, key, value: obj.check_collection_content(key, value.values(), content_types)
+    return lambda obj, key, value: obj.check_content(key, value, content_types)
+
+
+def _count_check(length):
+    if ',' in length:
+        min_len = int(length.split(',')[0].strip())
+        max_len = int(length.split(',')[1].strip())
+    else:
+        min_len = max_len = int(length.split(',')[0].strip())
+    def check(obj, key, value):
+        if len(value) < min_len or len(value) > max_len:
+            raise AttributeError('Invalid value length for collection field "%s.%s", should be between %d and %d' %
+                (type(obj).__name__, key, min_len, max_len))
+    return check
+
+
+_compiled_validators = {}
+
+def get_compiled_validator(clzz):
+    """
+    Returns the CompiledValidator for an IonObject class, building it on first use.
+    """
+    validator = _compiled_validators.get(clzz, None)
+    if validator is None:
+        validator = _compiled_validators[clzz] = CompiledValidator(clzz)
+    return validator
+
+def clear_compiled_validators():
+    """
+    Drops all CompiledValidators. Called whenever the object definitions are (re)loaded.
+    """
+    _compiled_validators.clear()
+
+
 def walk(o, cb, modify_key_value = 'value'):
     """
     Utility method to do recursive walking of a possible iterable (inc dicts) and do inline transformations.
@@ -462,43 +596,125 @@ class IonObjectDeserializer(IonObjectSerializationBase):
     def _transform(self, obj):
         # Note: This check to detect an IonObject is a bit risky (only type_)
         if isinstance(obj, dict) and "type_" in obj:
-            objc    = obj.copy()
-            type    = objc['type_'].encode('ascii')
+            type    = obj['type_'].encode('ascii')
+
+            # CouchDB adds _attachments and puts metadata in it
+            # in pyon metadata is in the document
+            # so we discard _attachments while transforming between the two
+            fields = dict((k, v) for k, v in obj.iteritems() if k not in ("type_", "_attachments", "_conflicts"))
+            if "_conflict" in fields:
+                log.warn("CouchDB conflict detected for ID=%s (ignored): %s", obj.get('_id', None), fields["_conflict"])
+
+            # the object initializes with all its defaults intact, fields are set as by setattr
+            return self._obj_registry.new_from_dict(type, fields)
+
+        return obj
+
+
+class IonObjectValidatingDeserializer(IonObjectDeserializer):
+    """
+    Deserializer that validates each IonObject as soon as it has been built, so decoding and
+    validation take a single traversal of the message.
+
+    Children are decoded (and validated) before their parent, using the per-type validators
+    from get_compiled_validator. Dicts and lists are updated in place rather than rebuilt, so
+    only use this on freshly decoded payloads that nobody else holds a reference to.
+    """
+
+    def deserialize(self, obj, errors=None, validate=True, type_=None):
+        """
+        Decodes obj, validating IonObjects along the way if validate is set.
 
-            # don't supply a dict - we want the object to initialize with all its defaults intact,
-            # which preserves things like IonEnumObject and invokes the setattr behavior we want there.
-            ion_obj = self._obj_registry.new(type)
-            for k, v in objc.iteritems():
+        If type_ is given and obj is a dict without a type_ key, obj holds the fields of an
+        IonObject of that type (as sent with a "format" header). It is decoded in place and
+        validated as that type, but stays a dict.
 
-                # CouchDB adds _attachments and puts metadata in it
-                # in pyon metadata is in the document
-                # so we discard _attachments while transforming between the two
-                if k not in ("type_", "_attachments", "_conflicts"):
-                    setattr(ion_obj, k, v)
-                if k == "_conflict":
-                    log.warn("CouchDB conflict detected for ID=%S (ignored): %s", obj.get('_id', None), v)
+        If errors is a list, validation failures (AttributeError) are appended to it and
+        decoding continues; otherwise the first failure is raised.
+        """
+        if type_ and isinstance(obj, dict) and "type_" not in obj:
+            self._decode_typed_dict(obj, type_, errors, validate)
+            return obj
+        return self._decode(obj, errors, validate)
 
-            return ion_obj
+    def _decode(self, obj, errors, validate):
+        if isinstance(obj, dict):
+            # Note: This check to detect an IonObject is a bit risky (only type_)
+            if "type_" in obj:
+                return self._decode_ion_obj(obj, errors, validate)
+
+            for k, v in obj.iteritems():
+                newv = self._decode(v, errors, validate)
+                if newv is not v:
+                    obj[k] = newv
+            return obj
+        elif isinstance(obj, list):
+            for i, v in enumerate(obj):
+                newv = self._decode(v, errors, validate)
+                if newv is not v:
+                    obj[i] = newv
+            return obj
+        elif isinstance(obj, (tuple, set)):
+            return [self._decode(v, errors, validate) for v in obj]
 
         return obj
 
+    def _decode_ion_obj(self, obj, errors, validate):
+        fields = dict((k, self._decode(v, errors, validate)) for k, v in obj.iteritems()
+                      if k not in ("type_", "_attachments", "_conflicts"))
+        if "_conflict" in fields:
+            log.warn("CouchDB conflict detected for ID=%s (ignored): %s", obj.get('_id', None), fields["_conflict"])
+        ion_obj = self._obj_registry.new_from_dict(obj['type_'].encode('ascii'), fields)
+
+        if validate:
+            self._validate_ion_obj(ion_obj, errors)
+
+        return ion_obj
+
+    def _decode_typed_dict(self, obj, type_, errors, validate):
+        """
+        Decodes the values of a dict holding the fields of an IonObject of type type_ in place.
+        Returns a shadow IonObject sharing the decoded values, after validating it if requested.
+        Nested dicts in complex typed fields are handled the same way.
+        """
+        from pyon.core.registry import model_classes
+
+        ion_obj = self._obj_registry.new(type_)
+        schema = ion_obj._schema
+        fields = ion_obj.__dict__
+        for k, v in obj.iteritems():
+            if isinstance(v, dict) and "type_" not in v and k in schema and schema[k]['type'] in model_classes:
+                fields[k] = self._decode_typed_dict(v, schema[k]['type'], errors, validate)
+            else:
+                newv = self._decode(v, errors, validate)
+                if newv is not v:
+                    obj[k] = newv
+                fields[k] = newv
+
+        if validate:
+            self._validate_ion_obj(ion_obj, errors)
+
+        return ion_obj
+
+    def _validate_ion_obj(self, ion_obj, errors):
+        if not isinstance(ion_obj, IonObjectBase):
+            return
+        try:
+            get_compiled_validator(type(ion_obj)).validate(ion_obj)
+        except AttributeError as ex:
+            if errors is None:
+                raise
+            errors.append(ex)
+
 
 class IonObjectBlameDeserializer(IonObjectDeserializer):
 
     def _transform(self, obj):
 
         def handle_ion_obj(in_obj):
-            objc    = in_obj.copy()
-            type    = objc['type_'].encode('ascii')
-
-            # don't supply a dict - we want the object to initialize with all its defaults intact,
-            # which preserves things like IonEnumObject and invokes the setattr behavior we want there.
-            ion_obj = self._obj_registry.new(type)
-            for k, v in objc.iteritems():
-                if k != "type_":
-                    setattr(ion_obj, k, v)
-
-            return ion_obj
+            type    = in_obj['type_'].encode('ascii')
+            fields = dict((k, v) for k, v in in_obj.iteritems() if k != "type_")
+            return self._obj_registry.new_from_dict(type, fields)
 
         # Note: This check to detect an IonObject is a bit risky (only type_)
         if isinstance(obj, dict):
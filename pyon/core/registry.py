@@ -3,19 +3,129 @@
 __author__ = 'Adam Smith, Tom Lennan'
 __license__ = 'Apache 2.0'
 
+import functools
 import inspect
+from collections import defaultdict, OrderedDict
 from copy import deepcopy
 
 from pyon.core.exception import NotFound
 
 import interface.objects
-import interface.messages
 
-from pyon.core.object import walk
+from pyon.core.object import IonObjectBase, walk, clear_compiled_validators
+
+
+class LazyClassDict(dict):
+    """
+    Dict of classes that is populated by a loader function on first access.
+    Used to defer importing large generated modules until a class is needed.
+    """
+    def __init__(self, loader):
+        dict.__init__(self)
+        self._loader = loader
+
+    def _load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            loader(self)
+
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def __getitem__(self, key):
+        self._load()
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._load()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._load()
+        dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        self._load()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+    def get(self, key, default=None):
+        self._load()
+        return dict.get(self, key, default)
+
+    def has_key(self, key):
+        return key in self
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self._load()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self._load()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._load()
+        return dict.iteritems(self)
+
+
+def _load_message_classes(classes):
+    import interface.messages
+    for name, clzz in vars(interface.messages).iteritems():
+        if inspect.isclass(clzz):
+            dict.__setitem__(classes, name, clzz)
+
 
 enum_classes = {}
 model_classes = {}
-message_classes = {}
+message_classes = LazyClassDict(_load_message_classes)
+
+# Type hierarchy index, built from model_classes by build_type_index().
+# Maps type name to frozenset of type names, both including the type itself.
+_subtypes = {}
+_supertypes = {}
+
+def build_type_index():
+    """
+    Precomputes the transitive subtype and supertype sets of all model classes.
+    Called whenever the object definitions are (re)loaded into model_classes.
+    """
+    global _subtypes, _supertypes
+
+    names_by_class = defaultdict(list)
+    for name, clzz in model_classes.iteritems():
+        names_by_class[clzz].append(name)
+
+    supertypes = {}
+    subtypes = defaultdict(set)
+    for name, clzz in model_classes.iteritems():
+        supertypes[name] = frozenset(base_name for base in clzz.__mro__ for base_name in names_by_class.get(base, ()))
+        for base_name in supertypes[name]:
+            subtypes[base_name].add(name)
+
+    _supertypes = supertypes
+    _subtypes = dict((name, frozenset(subtypes[name])) for name in model_classes)
+
 
 def getextends(type):
     """
@@ -23,24 +133,20 @@ def getextends(type):
     @param type (str) Object type
     @retval List of object types that are extended by given type
     """
-    ret = []
-    base_clzz = model_classes[type]
-    for name in model_classes:
-        clzz = model_classes[name]
-        bases = inspect.getmro(clzz)
-        if base_clzz in bases:
-            ret.append(name)
-    return ret
+    return list(_subtypes[type])
 
 
-def issubtype(obj_type, base_type):
-    obj_cls = model_classes.get(obj_type, None)
-    base_cls = model_classes.get(base_type, None)
+def get_supertypes(type):
+    """
+    Returns the object types that the given type inherits from, including itself.
+    @param type (str) Object type
+    @retval frozenset of object types
+    """
+    return _supertypes[type]
 
-    if obj_cls and base_cls:
-        return base_cls in obj_cls.__mro__
 
-    return False
+def issubtype(obj_type, base_type):
+    return base_type in _supertypes.get(obj_type, ())
 
 
 def isenum(clzz_name):
@@ -116,6 +222,87 @@ def get_class_decorator_value(class_obj, decorator):
 
     return None
 
+# -----------------------------------------------------------------------------
+# Object instantiation support
+
+# Types of field values that are copied per instance; all others are immutable and shared
+_mutable_types = (list, dict, IonObjectBase)
+
+_setattr_patched = set()        # Classes with the validating __setattr__ applied
+
+def _validating_setattr(self, name, value):
+    from pyon.core.object import built_in_attrs
+    if name not in self._schema and name not in built_in_attrs:
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+    def unicode_to_utf8(value):
+        if isinstance(value, unicode):
+            value = str(value.encode('utf8'))
+        return value
+    def recursive_encoding(value):
+        value = walk(value, unicode_to_utf8, 'key_value')
+        return value
+    self.__dict__[name] = recursive_encoding(value)
+
+
+_templates = {}     # Class -> (shared defaults dict, tuple of (field, default factory)), or None
+
+def _get_template(clzz):
+    """
+    Returns the defaults template for a class, built once from a default instance.
+    Immutable defaults are shared by all instances; mutable defaults (lists, dicts, objects)
+    get a factory producing a fresh copy. Returns None for classes that are not IonObjects.
+    """
+    try:
+        return _templates[clzz]
+    except KeyError:
+        pass
+
+    template = None
+    if issubclass(clzz, IonObjectBase):
+        try:
+            ref = clzz()
+            shared, copied = {}, []
+            for key, value in ref.__dict__.iteritems():
+                if not isinstance(value, _mutable_types):
+                    shared[key] = value
+                elif not value and type(value) in (list, dict, OrderedDict):
+                    copied.append((key, type(value)))
+                else:
+                    copied.append((key, functools.partial(deepcopy, value)))
+            template = shared, tuple(copied)
+        except Exception:
+            template = None
+    _templates[clzz] = template
+    return template
+
+def _new_from_template(clzz, fields):
+    """
+    Returns a new instance of clzz with defaults and the given fields (dict or None) set
+    directly into the instance dict. Falls back to the constructor for other classes.
+    """
+    template = _get_template(clzz)
+    if template is None:
+        obj = clzz()
+        if fields:
+            for key, value in fields.iteritems():
+                setattr(obj, key, value)
+        return obj
+
+    shared, copied = template
+    obj_dict = dict(shared)
+    if fields:
+        for key, factory in copied:
+            if key not in fields:
+                obj_dict[key] = factory()
+        obj_dict.update(fields)
+    else:
+        for key, factory in copied:
+            obj_dict[key] = factory()
+    obj = clzz.__new__(clzz)
+    obj.__dict__ = obj_dict
+    return obj
+
+
 class IonObjectRegistry(object):
     """
     A simple key-value store that stores by name and by definition hash for versioning.
@@ -125,15 +312,17 @@ class IonObjectRegistry(object):
     validate_setattr = False
 
     def __init__(self):
-        classes = inspect.getmembers(interface.objects, inspect.isclass)
-        for name, clzz in classes:
+        for name, clzz in vars(interface.objects).iteritems():
+            if not inspect.isclass(clzz):
+                continue
             if clzz.__bases__[0].__name__ == "IonEnum":
                 enum_classes[name] = clzz
             else:
                 model_classes[name] = clzz
-        classes = inspect.getmembers(interface.messages, inspect.isclass)
-        for name, clzz in classes:
-            message_classes[name] = clzz
+        # Message classes are loaded on first lookup (see message_classes)
+
+        build_type_index()
+        clear_compiled_validators()
 
         from pyon.core.bootstrap import CFG
         self.validate_setattr = CFG.get_safe('validate.setattr', False)
@@ -144,49 +333,58 @@ class IonObjectRegistry(object):
         #log.debug("name: %s" % _def)
         #log.debug("_dict: %s" % str(_dict))
         #log.debug("kwargs: %s" % str(kwargs))
-        if _def in model_classes:
-            clzz = model_classes[_def]
-        elif _def in message_classes:
-            clzz = message_classes[_def]
-        elif _def in enum_classes:
-            clzz = enum_classes[_def]
-        else:
-            raise NotFound("No matching class found for name %s" % _def)
+        clzz = self._get_class(_def)
 
         # Conditionally override the __setattr__ method to
         # include additional client side validation
-        if self.validate_setattr:
-            def validating_setattr(self, name, value):
-                from pyon.core.object import built_in_attrs
-                if name not in self._schema and name not in built_in_attrs:
-                    raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
-                def unicode_to_utf8(value):
-                    if isinstance(value, unicode):
-                        value = str(value.encode('utf8'))
-                    return value
-                def recursive_encoding(value):
-                    value = walk(value, unicode_to_utf8, 'key_value')
-                    return value
-                self.__dict__[name] = recursive_encoding(value)
-
-            setattrmethod = validating_setattr
-            setattr(clzz, "__setattr__", setattrmethod)
+        if self.validate_setattr and clzz not in _setattr_patched:
+            setattr(clzz, "__setattr__", _validating_setattr)
+            _setattr_patched.add(clzz)
 
         if _dict:
             # Traverse input parameters looking for dict values being passed in as
             # the init values of complex types.  Instantiate new object and substitute
-            # into the argument dict.
-            tmpdict = deepcopy(_dict)
-            for key in tmpdict:
-                if isinstance(tmpdict[key], dict) and clzz._schema[key]["type"] in model_classes:
-                    obj_param = self.new(clzz._schema[key]["type"], tmpdict[key])
-                    tmpdict[key] = obj_param
+            # into the argument dict. Other mutable values are copied, immutable ones shared.
+            tmpdict = {}
+            for key, value in _dict.iteritems():
+                if isinstance(value, dict) and clzz._schema[key]["type"] in model_classes:
+                    value = self.new(clzz._schema[key]["type"], value)
+                elif isinstance(value, _mutable_types):
+                    value = deepcopy(value)
+                tmpdict[key] = value
 
             # Apply dict values, then override with kwargs
             keywordargs = tmpdict
             keywordargs.update(kwargs)
             obj = clzz(**keywordargs)
+        elif not kwargs and not self.validate_setattr:
+            obj = _new_from_template(clzz, None)
         else:
             obj = clzz(**kwargs)
 
         return obj
+
+    def new_from_dict(self, _def, fields):
+        """
+        Returns a new object of given type with its defaults, and the given fields set directly
+        (as by setattr, without the type's __init__ logic). This is the decode path for serialized
+        objects: fields are not copied, and mutable defaults are only created for fields not given.
+        """
+        clzz = self._get_class(_def)
+        if self.validate_setattr:
+            obj = self.new(_def)
+            for key, value in fields.iteritems():
+                setattr(obj, key, value)
+            return obj
+
+        return _new_from_template(clzz, fields)
+
+    def _get_class(self, _def):
+        if _def in model_classes:
+            return model_classes[_def]
+        elif _def in message_classes:
+            return message_classes[_def]
+        elif _def in enum_classes:
+            return enum_classes[_def]
+        else:
+            raise NotFound("No matching class found for name %s" % _def)
@@ -3,8 +3,15 @@
 __author__ = 'Adam R. Smith'
 __license__ = 'Apache 2.0'
 
-from pyon.core.registry import IonObjectRegistry
+import inspect
+import sys
+import time
+
+from pyon.core import registry
+
+from pyon.core.registry import IonObjectRegistry, getextends, get_supertypes, issubtype, model_classes, message_classes, LazyClassDict
 from pyon.core.bootstrap import IonObject
+from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer, IonObjectValidatingDeserializer, get_compiled_validator
 from pyon.util.int_test import IonIntegrationTestCase
 from nose.plugins.attrib import attr
 
@@ -140,6 +147,83 @@ class ObjectTest(IonIntegrationTestCase):
         # Should work
         obj._validate
 
+    def test_compiled_validator(self):
+        validator = get_compiled_validator(IonObject('Deco_Example').__class__)
+        self.assertIs(validator, get_compiled_validator(IonObject('Deco_Example').__class__))
+
+        obj = IonObject('Deco_Example', {"list1": [1], "list2": ["One element"], "dict1": {"key1": 1}, "dict2": {"key1": 1}, "us_phone_number": "555-555-5555"})
+        # Should fail because required value not provided
+        self.assertRaises(AttributeError, validator.validate, obj)
+
+        obj.an_important_value = "good value"
+        validator.validate(obj)
+
+        obj.us_phone_number = "5555555555"
+        self.assertRaises(AttributeError, validator.validate, obj)
+        obj.us_phone_number = "555-555-5555"
+
+        obj.list2 = []
+        self.assertRaises(AttributeError, validator.validate, obj)
+        obj.list2 = ["One element"]
+
+        obj.unsigned_short_int = -1
+        self.assertRaises(AttributeError, validator.validate, obj)
+        obj.unsigned_short_int = 256
+
+        obj.dict1 = {"key1": "Should be a numeric type"}
+        self.assertRaises(AttributeError, validator.validate, obj)
+        obj.dict1 = {"key1": 1}
+
+        validator.validate(obj)
+
+        # Type mismatches go through the full _validate
+        sample = self.registry.new('SampleObject')
+        sample.name = 3
+        self.assertRaises(AttributeError, get_compiled_validator(sample.__class__).validate, sample)
+
+    def test_validating_deserializer(self):
+        obj = IonObject('Deco_Example', {"list1": [{"phone_number": "858.822.5141", "phone_type": "work", "type_": "Phone", "sms": False}], "list2": ["One element"], "dict1": {"key1": 1}, "dict2": {"key1": 1}, "an_important_value": "good value", "us_phone_number": "555-555-5555"})
+        serialized = IonObjectSerializer().serialize({'payload': [obj]})
+        deserializer = IonObjectValidatingDeserializer(obj_registry=self.registry)
+
+        res = deserializer.deserialize(serialized)
+        self.assertEqual(res['payload'][0], obj)
+        self.assertEqual(res['payload'][0].list1[0].phone_number, "858.822.5141")
+
+        obj.us_phone_number = "5555555555"
+        serialized = IonObjectSerializer().serialize({'payload': [obj]})
+        self.assertRaises(AttributeError, deserializer.deserialize, serialized)
+
+        # Errors collected instead of raised, decoding completes
+        serialized = IonObjectSerializer().serialize({'payload': [obj]})
+        errors = []
+        res = deserializer.deserialize(serialized, errors=errors)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(res['payload'][0].us_phone_number, "5555555555")
+
+        # No validation at all
+        serialized = IonObjectSerializer().serialize({'payload': [obj]})
+        res = deserializer.deserialize(serialized, validate=False)
+        self.assertEqual(res['payload'][0], obj)
+
+        # Payload in dict form with a given type is validated as that type, and stays a dict
+        fields = IonObjectSerializer().serialize(obj).copy()
+        del fields['type_']
+        errors = []
+        res = deserializer.deserialize(fields, errors=errors, type_='Deco_Example')
+        self.assertIsInstance(res, dict)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(res['list1'][0].phone_number, "858.822.5141")
+
+        fields['us_phone_number'] = "555-555-5555"
+        deserializer.deserialize(fields, type_='Deco_Example')
+
+    def test_compiled_validators_cleared_on_reload(self):
+        clzz = IonObject('Deco_Example').__class__
+        validator = get_compiled_validator(clzz)
+        IonObjectRegistry()
+        self.assertIsNot(validator, get_compiled_validator(clzz))
+
     def test_recursive_encoding(self):
         obj = self.registry.new('SampleObject')
         a_dict = {'1':u"♣ Temporal Domain ♥",
@@ -184,7 +268,185 @@ class ObjectTest(IonIntegrationTestCase):
 
 
 
+    def test_type_index(self):
+        self.assertIn('Resource', getextends('Resource'))
+        self.assertIn('UserInfo', getextends('Resource'))
+        self.assertNotIn('Resource', getextends('UserInfo'))
+        self.assertRaises(KeyError, getextends, 'NotAType')
+
+        self.assertIsInstance(get_supertypes('UserInfo'), frozenset)
+        self.assertIn('Resource', get_supertypes('UserInfo'))
+        self.assertIn('UserInfo', get_supertypes('UserInfo'))
+
+        self.assertTrue(issubtype('UserInfo', 'Resource'))
+        self.assertTrue(issubtype('Resource', 'Resource'))
+        self.assertFalse(issubtype('Resource', 'UserInfo'))
+        self.assertFalse(issubtype('NotAType', 'Resource'))
+
+        # Callers may modify the returned list
+        ext = getextends('Resource')
+        ext.append('Foo')
+        self.assertNotIn('Foo', getextends('Resource'))
+
+        # Same answers as the MRO scan
+        for base_type in ('IonObjectBase', 'Resource', 'TaskableResource'):
+            expected = [name for name, clzz in model_classes.iteritems() if model_classes[base_type] in inspect.getmro(clzz)]
+            self.assertEqual(sorted(getextends(base_type)), sorted(expected))
+
+    def test_type_index_rebuilt(self):
+        model_classes['NotAType'] = model_classes['UserInfo']
+        try:
+            IonObjectRegistry()
+            self.assertIn('NotAType', getextends('Resource'))
+            self.assertTrue(issubtype('NotAType', 'UserInfo'))
+        finally:
+            del model_classes['NotAType']
+            IonObjectRegistry()
+
+        self.assertNotIn('NotAType', getextends('Resource'))
+
+    def test_new_defaults(self):
+        # Template construction gives the same defaults as the generated constructor
+        for name, clzz in model_classes.iteritems():
+            if issubclass(clzz, IonObjectBase):
+                self.assertEqual(self.registry.new(name).__dict__, clzz().__dict__, msg=name)
+
+        # Mutable defaults are not shared between instances
+        obj1, obj2 = self.registry.new('Deco_Example'), self.registry.new('Deco_Example')
+        obj1.list1.append(1)
+        obj1.dict1['key'] = 1
+        self.assertEqual(obj2.list1, [])
+        self.assertEqual(obj2.dict1, {})
+
+        # Values from a dict are copied if mutable
+        list1 = [1]
+        obj = self.registry.new('Deco_Example', {'list1': list1, 'an_important_value': 'value'})
+        self.assertEqual(obj.list1, [1])
+        self.assertIsNot(obj.list1, list1)
+
+    def test_new_from_dict(self):
+        list1 = [1]
+        obj = self.registry.new_from_dict('Deco_Example', {'list1': list1, '_id': 'id1'})
+        self.assertIs(obj.list1, list1)
+        self.assertEqual(obj._id, 'id1')
+        self.assertEqual(obj.dict1, {})
+        self.assertEqual(obj.type_, 'Deco_Example')
+
+        ref = IonObject('Deco_Example')
+        ref.list1 = list1
+        ref._id = 'id1'
+        self.assertEqual(obj, ref)
+
+    def test_new_validate_setattr(self):
+        self.registry.validate_setattr = True
+        try:
+            obj = self.registry.new_from_dict('SampleObject', {'name': u'name'})
+            self.assertEqual(type(obj.name), str)
+            self.assertRaises(AttributeError, setattr, obj, 'not_a_field', 1)
+        finally:
+            self.registry.validate_setattr = False
+            clzz = model_classes['SampleObject']
+            if '__setattr__' in clzz.__dict__:
+                del clzz.__setattr__
+            registry._setattr_patched.discard(clzz)
+
+    def test_lazy_class_dict(self):
+        loads = []
+        def loader(classes):
+            loads.append(1)
+            dict.__setitem__(classes, 'SampleObject', model_classes['SampleObject'])
+
+        classes = LazyClassDict(loader)
+        self.assertFalse(classes.loaded)
+        self.assertIn('SampleObject', classes)
+        self.assertTrue(classes.loaded)
+        self.assertEqual(classes.keys(), ['SampleObject'])
+        self.assertEqual(len(loads), 1)
+
+        self.assertIsNone(LazyClassDict(loader).get('NotAType'))
+        self.assertEqual(len(loads), 2)
+
+        # Message classes are loaded on first use
+        self.assertTrue(issubclass(message_classes['resource_registry_read_in'], IonObjectBase))
+
     def test_bootstrap(self):
         """ Use the factory and singleton from bootstrap.py/public.py """
         obj = IonObject('SampleObject')
         self.assertEqual(obj.name, '')
+
+
+@attr('PFM')
+class TypeIndexSpeedTest(IonIntegrationTestCase):
+    def setUp(self):
+        self.registry = IonObjectRegistry()
+
+    def test_getextends_speed(self):
+        def old_getextends(type):
+            ret = []
+            base_clzz = model_classes[type]
+            for name in model_classes:
+                clzz = model_classes[name]
+                bases = inspect.getmro(clzz)
+                if base_clzz in bases:
+                    ret.append(name)
+            return ret
+
+        print >>sys.stderr, ""
+        print >>sys.stderr, "Object model size: %s types" % len(model_classes)
+
+        for label, func, count in (("MRO scan", old_getextends, 100), ("index", getextends, 100000)):
+            start_time = time.time()
+            for i in xrange(count):
+                func('Resource')
+            elapsed = time.time() - start_time
+            print >>sys.stderr, "getextends %s: %.2f usec/call" % (label, elapsed * 1000000 / count)
+
+        start_time = time.time()
+        for i in xrange(100000):
+            issubtype('UserInfo', 'Resource')
+        elapsed = time.time() - start_time
+        print >>sys.stderr, "issubtype index: %.2f usec/call" % (elapsed * 1000000 / 100000)
+
+
+@attr('PFM')
+class ObjectInstantiationSpeedTest(IonIntegrationTestCase):
+    def setUp(self):
+        self.registry = IonObjectRegistry()
+
+    def test_new_speed(self):
+        """ Instantiating and decoding 100K mixed objects """
+        objs = [IonObject('SampleObject', name='sample'),
+                IonObject('UserInfo', name='user', contact=IonObject('ContactInformation', email='a@b.c')),
+                IonObject('Deco_Example', list1=[1, 2], dict1={'key1': 1}, an_important_value='value'),
+                IonObject('Phone', phone_number='555-555-5555')]
+        serialized = [IonObjectSerializer().serialize(obj) for obj in objs]
+        count = 100000
+
+        def old_new(type_):
+            clzz = model_classes[type_]
+            return clzz()
+
+        def old_decode(doc):
+            ion_obj = old_new(doc['type_'])
+            for k, v in doc.iteritems():
+                if k != 'type_':
+                    if isinstance(v, dict) and 'type_' in v:
+                        v = old_decode(v)
+                    setattr(ion_obj, k, v)
+            return ion_obj
+
+        deserializer = IonObjectDeserializer(obj_registry=self.registry)
+
+        print >>sys.stderr, ""
+        for label, func, inputs in (("new, constructor", old_new, [o.type_ for o in objs]),
+                                    ("new, template", self.registry.new, [o.type_ for o in objs]),
+                                    ("decode, setattr", old_decode, serialized),
+                                    ("decode, from dict", deserializer.deserialize, serialized)):
+            start_time = time.time()
+            for i in xrange(count):
+                func(inputs[i % len(inputs)])
+            elapsed = time.time() - start_time
+            print >>sys.stderr, "%s: %.2f usec/object" % (label, elapsed * 1000000 / count)
+
+        for obj, doc in zip(objs, serialized):
+            self.assertEqual(deserializer.deserialize(doc), obj)
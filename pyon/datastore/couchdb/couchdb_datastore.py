@@ -6,8 +6,10 @@ __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
 from uuid import uuid4
+import base64
 import gevent
 import hashlib
+import json
 
 import couchdb
 from couchdb.client import ViewResults, Row
@@ -34,6 +36,9 @@ stats = Accumulator(persist=True)
 #END_MARKER = "\x7f\x7f\x7f\x7f"
 END_MARKER = "ZZZZZZ"
 
+# Number of view rows fetched per request when streaming or paging through query results
+DEFAULT_PAGE_SIZE = 1000
+
 
 def sha1hex(doc):
     """
@@ -52,6 +57,33 @@ def sha1hex(doc):
     return hashlib.sha1(doc_string).hexdigest().upper()
 
 
+def encode_page_token(row):
+    """
+    Returns an opaque continuation token for the view row following the given (last returned) row.
+    The token is a URL safe string and can be handed to RPC clients.
+    """
+    return base64.urlsafe_b64encode(json.dumps([row['key'], row['id']]))
+
+def decode_page_token(page_token):
+    """
+    Returns the view options (startkey, startkey_docid, skip) that continue a query after the row
+    a page token was created for. Continuing from a key is O(log n) in CouchDB, unlike large skips.
+    """
+    try:
+        startkey, startkey_docid = json.loads(base64.urlsafe_b64decode(str(page_token)))
+    except (TypeError, ValueError):
+        raise BadRequest("Invalid page token: %s" % page_token)
+    return dict(startkey=startkey, startkey_docid=startkey_docid, skip=1)
+
+def get_next_page_token(rows, page_size):
+    """
+    Returns the page token continuing after the given page of rows, or None if it was the last page.
+    """
+    if page_size and len(rows) >= page_size:
+        return encode_page_token(rows[-1])
+    return None
+
+
 class CouchDB_DataStore(DataStore):
     """
     Data store implementation utilizing CouchDB to persist documents.
@@ -668,8 +700,28 @@ class CouchDB_DataStore(DataStore):
         limit = int(all_args.get('limit', 0)) if all_args.get('limit', None) is not None else 0
         if limit > 0:
             view_args['limit'] = limit
+        if all_args.get('page_token', None):
+            # Continuation replaces the start of the key range and any skip
+            view_args.update(decode_page_token(all_args['page_token']))
         return view_args
 
+    def _split_page_filter(self, filter):
+        """
+        @brief Returns a copy of the given find filter with page_size converted into a view limit,
+        and the page size (or None if not paging).
+        """
+        filter = dict(filter) if filter is not None else {}
+        page_size = filter.pop('page_size', None)
+        if page_size:
+            filter['limit'] = int(page_size)
+        return filter, page_size
+
+    def _get_view_range(self, view, key, endkey, view_args):
+        """
+        @brief Returns the rows of view for the key range, starting at a page token continuation if present
+        """
+        return view[view_args.get('startkey', key):endkey]
+
     def _is_in_association(self, obj_id, datastore_name=""):
         if not obj_id:
             raise BadRequest("Must provide object id")
@@ -938,8 +990,16 @@ class CouchDB_DataStore(DataStore):
     def find_resources_ext(self, restype="", lcstate="", name="",
                            keyword=None, nested_type=None,
                            attr_name=None, attr_value=None, alt_id=None, alt_id_ns=None,
-                           limit=None, skip=None, descending=None, id_only=True):
-        filter_kwargs = self._get_view_args(dict(limit=limit, skip=skip, descending=descending))
+                           limit=None, skip=None, descending=None, id_only=True,
+                           page_size=None, page_token=None):
+        """
+        @brief Finds resources by one of the resource views. If page_size is given, returns a page of
+        at most page_size results plus a page token for the next page (or None) as third tuple element.
+        Pass the token back as page_token to continue the query; this does not need O(n) skips.
+        """
+        filter_kwargs = self._get_view_args(dict(limit=limit, skip=skip, descending=descending, page_token=page_token))
+        if page_size:
+            filter_kwargs['page_size'] = page_size
         if name:
             if lcstate:
                 raise BadRequest("find by name does not support lcstate")
@@ -961,16 +1021,20 @@ class CouchDB_DataStore(DataStore):
         elif not restype and not lcstate and not name:
             return self.find_res_by_type(None, None, id_only, filter=filter_kwargs)
 
-    def _prepare_find_return(self, rows, res_assocs=None, id_only=True, **kwargs):
+    def _prepare_find_return(self, rows, res_assocs=None, id_only=True, page_size=None, **kwargs):
         if id_only:
             res_ids = [row.id for row in rows]
-            return (res_ids, res_assocs)
+            res = (res_ids, res_assocs)
         else:
             res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows]
             if [True for doc in res_docs if doc is None]:
                 res_ids = [row.id for row in rows]
                 log.error("Datastore returned None docs despite include_docs==True.\nids=%s\ndocs=%s\nassocs=%s", res_ids, res_docs, res_assocs)
-            return (res_docs, res_assocs)
+            res = (res_docs, res_assocs)
+        if page_size:
+            rows = rows.rows if hasattr(rows, 'rows') else list(rows)
+            res += (get_next_page_token(rows, page_size),)
+        return res
 
     def find_res_by_type(self, restype, lcstate=None, id_only=False, filter=None):
         log.debug("find_res_by_type(restype=%s, lcstate=%s)", restype, lcstate)
@@ -978,20 +1042,20 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
         if lcstate:
             raise BadRequest('lcstate not supported anymore in find_res_by_type')
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_type"), include_docs=(not id_only), **filter)
         if restype:
             key = [restype]
             endkey = self._get_endkey(key)
-            rows = view[key:endkey]   # Range query
+            rows = self._get_view_range(view, key, endkey, filter)   # Range query
         else:
             # Returns ALL documents, only limited by filter
             rows = view
 
         res_assocs = [dict(type=row['key'][0], name=row['key'][1], id=row.id) for row in rows]
         log.debug("find_res_by_type() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_lcstate(self, lcstate, restype=None, id_only=False, filter=None):
         log.debug("find_res_by_lcstate(lcstate=%s, restype=%s)", lcstate, restype)
@@ -1000,35 +1064,35 @@ class CouchDB_DataStore(DataStore):
         if '_' in lcstate:
             log.warn("Search for compound lcstate restricted to maturity: %s", lcstate)
             lcstate,_ = lcstate.split("_", 1)
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_lcstate"), include_docs=(not id_only), **filter)
         key = [1, lcstate] if lcstate in CommonResourceLifeCycleSM.AVAILABILITY else [0, lcstate]
         if restype:
             key.append(restype)
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]   # Range query
+        rows = self._get_view_range(view, key, endkey, filter)   # Range query
 
         res_assocs = [dict(lcstate=row['key'][1], type=row['key'][2], name=row['key'][3], id=row.id) for row in rows]
         log.debug("find_res_by_lcstate() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_name(self, name, restype=None, id_only=False, filter=None):
         log.debug("find_res_by_name(name=%s, restype=%s)", name, restype)
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_name"), include_docs=(not id_only), **filter)
         key = [name]
         if restype:
             key.append(restype)
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]   # Range query
+        rows = self._get_view_range(view, key, endkey, filter)   # Range query
 
         res_assocs = [dict(name=row['key'][0], type=row['key'][1], id=row.id) for row in rows]
         log.debug("find_res_by_name() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_keyword(self, keyword, restype=None, id_only=False, filter=None):
         log.debug("find_res_by_keyword(keyword=%s, restype=%s)", keyword, restype)
@@ -1036,18 +1100,18 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest('Argument keyword illegal')
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_keyword"), include_docs=(not id_only), **filter)
         key = [keyword]
         if restype:
             key.append(restype)
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]
+        rows = self._get_view_range(view, key, endkey, filter)
 
         res_assocs = [dict(keyword=row['key'][0], type=row['key'][1], id=row.id) for row in rows]
         log.debug("find_res_by_keyword() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_nested_type(self, nested_type, restype=None, id_only=False, filter=None):
         log.debug("find_res_by_nested_type(nested_type=%s, restype=%s)", nested_type, restype)
@@ -1055,18 +1119,18 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest('Argument nested_type illegal')
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_nestedtype"), include_docs=(not id_only), **filter)
         key = [nested_type]
         if restype:
             key.append(restype)
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]
+        rows = self._get_view_range(view, key, endkey, filter)
 
         res_assocs = [dict(nested_type=row['key'][0], type=row['key'][1], id=row.id) for row in rows]
         log.debug("find_res_by_nested_type() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_attribute(self, restype, attr_name, attr_value=None, id_only=False, filter=None):
         log.debug("find_res_by_attribute(restype=%s, attr_name=%s, attr_value=%s)", restype, attr_name, attr_value)
@@ -1074,18 +1138,18 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest('Argument attr_name illegal')
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_attribute"), include_docs=(not id_only), **filter)
         key = [restype, attr_name]
         if attr_value:
             key.append(attr_value)
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]
+        rows = self._get_view_range(view, key, endkey, filter)
 
         res_assocs = [dict(type=row['key'][0], attr_name=row['key'][1], attr_value=row['key'][2], id=row.id) for row in rows]
         log.debug("find_res_by_attribute() found %s objects", len(res_assocs))
-        return self._prepare_find_return(rows, res_assocs, id_only=id_only)
+        return self._prepare_find_return(rows, res_assocs, id_only=id_only, page_size=page_size)
 
     def find_res_by_alternative_id(self, alt_id=None, alt_id_ns=None, id_only=False, filter=None):
         log.debug("find_res_by_alternative_id(restype=%s, alt_id_ns=%s)", alt_id, alt_id_ns)
@@ -1095,7 +1159,7 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest('Argument alt_id_ns illegal')
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        filter = filter if filter is not None else {}
+        filter, page_size = self._split_page_filter(filter)
         ds, datastore_name = self._get_datastore()
         view = ds.view(self._get_viewname("resource", "by_altid"), include_docs=(not id_only), **filter)
         key = []
@@ -1105,7 +1169,7 @@ class CouchDB_DataStore(DataStore):
                 key.append(alt_id_ns)
 
         endkey = self._get_endkey(key)
-        rows = view[key:endkey]
+        rows = self._get_view_range(view, key, endkey, filter)
 
         if alt_id_ns and not alt_id:
             res_assocs = [dict(alt_id=row['key'][0], alt_id_ns=row['key'][1], id=row.id) for row in rows if row['key'][1] == alt_id_ns]
@@ -1114,13 +1178,17 @@ class CouchDB_DataStore(DataStore):
         log.debug("find_res_by_alternative_id() found %s objects", len(res_assocs))
         if id_only:
             res_ids = [row['id'] for row in res_assocs]
-            return (res_ids, res_assocs)
+            res = (res_ids, res_assocs)
         else:
             if alt_id_ns and not alt_id:
                 res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows if row['key'][1] == alt_id_ns]
             else:
                 res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows]
-            return (res_docs, res_assocs)
+            res = (res_docs, res_assocs)
+        if page_size:
+            # The token refers to the last view row, not the last matching one
+            res += (get_next_page_token(list(rows), page_size),)
+        return res
 
     def find_res_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
                      id_only=True, **kwargs):
@@ -1144,37 +1212,108 @@ class CouchDB_DataStore(DataStore):
             view_args['keys'] = keys
         view = ds.view(view_doc, **view_args)
         if key is not None:
-            rows = view[key]
             log.debug("find_by_view(%s): key=%s", view_doc, key)
+            if 'startkey_docid' in view_args:
+                rows = view[view_args['startkey']:key]
+            else:
+                rows = view[key]
         elif keys:
             rows = view
             log.debug("find_by_view(%s): keys=%s", view_doc, keys)
         elif start_key and end_key:
-            startkey = start_key or []
-            endkey = list(end_key) or []
-            endkey.append(END_MARKER)
+            startkey, endkey = self._get_view_bounds(start_key, end_key, view_args)
             log.debug("find_by_view(%s): start_key=%s to end_key=%s", view_doc, startkey, endkey)
-            if view_args.get('descending', False):
-                rows = view[endkey:startkey]
-            else:
-                rows = view[startkey:endkey]
+            rows = view[view_args.get('startkey', startkey):endkey]
         else:
             rows = view
 
-        if id_only:
-            if convert_doc:
-                res_rows = [(row['id'], row['key'], self._persistence_dict_to_ion_object(row['value'])) for row in rows]
-            else:
-                res_rows = [(row['id'], row['key'], row['value']) for row in rows]
-        else:
-            if convert_doc:
-                res_rows = [(row['id'], row['key'], self._persistence_dict_to_ion_object(row['doc'])) for row in rows]
-            else:
-                res_rows = [(row['id'], row['key'], row['doc']) for row in rows]
+        res_rows = [self._get_view_result(row, id_only, convert_doc) for row in rows]
 
         log.debug("find_by_view() found %s objects", len(res_rows))
         return res_rows
 
+    def find_by_view_page(self, design_name, view_name, key=None, start_key=None, end_key=None,
+                          id_only=True, convert_doc=True, page_size=DEFAULT_PAGE_SIZE, page_token=None, **kwargs):
+        """
+        @brief Returns one page of results of find_by_view, continuing at the given page token.
+        @retval Tuple of (list of (object _id, index key, Document/object or None), next page token or None)
+        """
+        if not page_size or page_size < 0:
+            raise BadRequest("page_size must be a positive number")
+        kwargs['limit'] = page_size
+        kwargs['page_token'] = page_token
+        rows = self.find_by_view(design_name, view_name, key=key, start_key=start_key, end_key=end_key,
+                                 id_only=id_only, convert_doc=convert_doc, **kwargs)
+        return rows, get_next_page_token([dict(id=row[0], key=row[1]) for row in rows], page_size)
+
+    def find_by_view_iter(self, design_name, view_name, key=None, start_key=None, end_key=None,
+                          id_only=True, convert_doc=True, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        @brief Generator version of find_by_view, streaming the results in pages of page_size view rows.
+        Only one page is held in memory at any time. A limit applies to the total number of results.
+        @retval Generates triples: (object _id, index key, Document/object or None)
+        """
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        ds, datastore_name = self._get_datastore()
+
+        view_args = self._get_view_args(kwargs)
+        view_args['include_docs'] = (not id_only)
+        view_doc = design_name if design_name == "_all_docs" else self._get_viewname(design_name, view_name)
+        if key is not None:
+            startkey, endkey = key, key
+        elif start_key and end_key:
+            startkey, endkey = self._get_view_bounds(start_key, end_key, view_args)
+        else:
+            startkey, endkey = None, None
+        log.debug("find_by_view_iter(%s): start_key=%s to end_key=%s", view_doc, startkey, endkey)
+
+        for row in self._iter_view_rows(ds, view_doc, view_args, startkey, endkey, page_size):
+            yield self._get_view_result(row, id_only, convert_doc)
+
+    def _get_view_bounds(self, start_key, end_key, view_args):
+        startkey = start_key or []
+        endkey = list(end_key) or []
+        endkey.append(END_MARKER)
+        if view_args.get('descending', False):
+            return endkey, startkey
+        return startkey, endkey
+
+    def _get_view_result(self, row, id_only, convert_doc):
+        value = row['value'] if id_only else row['doc']
+        if convert_doc:
+            value = self._persistence_dict_to_ion_object(value)
+        return row['id'], row['key'], value
+
+    def _iter_view_rows(self, ds, view_doc, view_args, startkey=None, endkey=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        @brief Generates the rows of a view key range, querying page_size rows at a time.
+        Each page continues after the last row of the previous page by startkey and startkey_docid.
+        """
+        if not page_size or page_size < 0:
+            raise BadRequest("page_size must be a positive number")
+        view_args = dict(view_args)
+        if 'keys' in view_args:
+            raise BadRequest("Cannot page through a multi-key query")
+        max_rows = view_args.pop('limit', None)
+        if startkey is not None and 'startkey' not in view_args:
+            view_args['startkey'] = startkey
+        if endkey is not None:
+            view_args['endkey'] = endkey
+
+        num_rows = 0
+        while True:
+            limit = page_size if max_rows is None else min(page_size, max_rows - num_rows)
+            if limit <= 0:
+                return
+            rows = ds.view(view_doc, limit=limit, **view_args).rows
+            for row in rows:
+                yield row
+            num_rows += len(rows)
+            if len(rows) < limit:
+                return
+            view_args.update(decode_page_token(encode_page_token(rows[-1])))
+
     def _get_endkey(self, startkey):
         if startkey is None or type(startkey) is not list:
             raise BadRequest("Cannot create endkey for type %s" % type(startkey))
@@ -1210,6 +1349,14 @@ class CouchDB_DataStore(DataStore):
 
         return result
 
+    def query_view_iter(self, view_name='', opts={}, datastore_name='', page_size=DEFAULT_PAGE_SIZE):
+        """
+        Generator version of query_view, streaming the parsed result rows in pages of page_size rows.
+        """
+        ds, datastore_name = self._get_datastore(datastore_name)
+        for row in self._iter_view_rows(ds, view_name, opts, page_size=page_size):
+            yield self._parse_results(row)
+
     def custom_query(self, map_fun, reduce_fun=None, datastore_name='', **options):
         '''
         custom_query sets up a temporary view in couchdb, the map_fun is a string consisting
@@ -5,7 +5,8 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
-from pyon.core.bootstrap import get_sys_name
+from pyon.core.bootstrap import get_sys_name, CFG
+from pyon.core.exception import BadRequest
 from pyon.util.containers import DotDict
 from pyon.util.log import log
 from pyon.util.arg_check import validate_true
@@ -34,6 +35,10 @@ class DataStore(object):
         DS_STATE: DS_PROFILE.STATE,
     }
 
+    # Datastore server types, selected by config server.type
+    DS_SERVER_COUCHDB = "couchdb"
+    DS_SERVER_INMEMORY = "inmemory"
+
 
 class DatastoreManager(object):
     """
@@ -101,9 +106,17 @@ class DatastoreManager(object):
     def get_datastore_instance(cls, ds_name, profile=DataStore.DS_PROFILE.BASIC):
         scoped_name = DatastoreManager.get_scoped_name(ds_name)
 
+        server_type = CFG.get_safe('server.type', DataStore.DS_SERVER_COUCHDB)
+
         # Use inline import to prevent circular import dependency
-        from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
-        new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile)
+        if server_type == DataStore.DS_SERVER_COUCHDB:
+            from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+            new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile)
+        elif server_type == DataStore.DS_SERVER_INMEMORY:
+            from pyon.datastore.inmemory.inmemory_datastore import InMemory_DataStore
+            new_ds = InMemory_DataStore(datastore_name=scoped_name, profile=profile)
+        else:
+            raise BadRequest("Unknown datastore server type: %s" % server_type)
 
         return new_ds
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from couchdb.http import ResourceNotFound
+
+from pyon.core.bootstrap import get_obj_registry, CFG
+from pyon.core.exception import BadRequest
+from pyon.core.object import IonObjectSerializer, IonObjectDeserializer
+from pyon.datastore.datastore import DataStore
+from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+from pyon.datastore.inmemory.inmemory_server import InMemoryServer, InMemoryViewResults
+from pyon.util.log import log
+
+
+# The in-process server shared by all in-memory datastore instances
+_inmemory_server = None
+
+def get_inmemory_server():
+    """
+    Returns the in-process server singleton, restoring it from the configured snapshot file if present.
+    """
+    global _inmemory_server
+    if _inmemory_server is None:
+        snapshot_path = CFG.get_safe('server.inmemory.snapshot_path', None)
+        _inmemory_server = InMemoryServer(snapshot_path=snapshot_path)
+    return _inmemory_server
+
+
+class InMemory_DataStore(CouchDB_DataStore):
+    """
+    Data store implementation keeping all documents in process memory.
+    Provides the CouchDB_DataStore API and semantics (revisions, conflicts, attachments, views),
+    with the views of couchdb_config maintained as in-memory indexes updated on every write.
+    """
+
+    def __init__(self, host=None, port=None, datastore_name='prototype', options="", profile=DataStore.DS_PROFILE.BASIC, server=None):
+        log.debug('__init__(datastore_name=%s)', datastore_name)
+        self.host = host
+        self.port = port
+        # The scoped name of the datastore
+        self.datastore_name = datastore_name
+        self.server = server or get_inmemory_server()
+
+        # Datastore specialization (views)
+        self.profile = profile
+
+        # serializers
+        self._io_serializer = IonObjectSerializer()
+        self._io_deserializer = IonObjectDeserializer(obj_registry=get_obj_registry())
+
+    def close(self):
+        log.trace("Closing in-memory datastore %s", self.datastore_name)
+        try:
+            self.server.save_snapshot()
+        except Exception:
+            log.exception("Error saving in-memory datastore snapshot")
+
+    def _get_datastore(self, datastore_name=None):
+        # No caching of database instances: a deleted and recreated database is a new instance
+        datastore_name = datastore_name or self.datastore_name
+        try:
+            return self.server[datastore_name], datastore_name
+        except ResourceNotFound:
+            raise BadRequest("Datastore '%s' does not exist" % datastore_name)
+        except ValueError:
+            raise BadRequest("Datastore name '%s' invalid" % datastore_name)
+
+    def _parse_results(self, doc):
+        if isinstance(doc, InMemoryViewResults):
+            try:
+                return self._parse_results(doc.rows)
+            except ResourceNotFound:
+                raise BadRequest('The desired resource does not exist.')
+
+        return CouchDB_DataStore._parse_results(self, doc)
@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+
+"""In-process document database emulating the parts of the CouchDB client API used by pyon"""
+
+__license__ = 'Apache 2.0'
+
+from bisect import bisect_left, bisect_right, insort
+from uuid import uuid4
+import cPickle as pickle
+import os
+import re
+import StringIO
+import sys
+
+from couchdb.client import Row, Document
+from couchdb.http import PreconditionFailed, ResourceConflict, ResourceNotFound
+
+from pyon.datastore.inmemory.inmemory_views import get_inmemory_view
+from pyon.util.log import log
+
+
+VALID_DB_NAME = re.compile(r'^[a-z][a-z0-9_$()+/-]*$')
+
+DESIGN_PREFIX = "_design/"
+
+
+def collation_key(value):
+    """
+    Returns a sort key for a JSON value that orders like CouchDB views:
+    null < false < true < numbers < strings < arrays < objects.
+    Strings are compared case-insensitively first, lower case before upper case, approximating
+    the ICU collation of CouchDB.
+    """
+    if value is None:
+        return (0,)
+    elif value is False:
+        return (1, 0)
+    elif value is True:
+        return (1, 1)
+    elif isinstance(value, (int, long, float)):
+        return (2, value)
+    elif isinstance(value, basestring):
+        return (3, value.lower(), value.swapcase())
+    elif isinstance(value, (list, tuple)):
+        return (4, tuple(collation_key(v) for v in value))
+    elif isinstance(value, dict):
+        return (5, tuple((collation_key(k), collation_key(v)) for k, v in sorted(value.iteritems())))
+    return (6, value)
+
+
+def copy_doc(value):
+    """
+    Fast deep copy for JSON style documents (dicts, lists and primitives).
+    """
+    if isinstance(value, dict):
+        return dict((k, copy_doc(v)) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        return [copy_doc(v) for v in value]
+    return value
+
+
+class ViewIndex(object):
+    """
+    Materialized view over a database: the rows emitted by a map function for every document.
+    Rows are kept sorted by (key collation, doc id) for range queries, with an additional hash
+    index by key for exact key and multi key lookups.
+    """
+
+    def __init__(self, map_fun):
+        self.map_fun = map_fun
+        self._sorted = []       # Sorted (collation key, doc id, emit index)
+        self._ckeys = []        # Collation keys parallel to _sorted, for bisect
+        self._by_key = {}       # Collation key -> sorted list of (doc id, emit index)
+        self._by_doc = {}       # Doc id -> list of (collation key, key, value) as emitted
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def add(self, doc_id, doc):
+        try:
+            emitted = [(collation_key(key), key, value) for key, value in self.map_fun(doc)]
+        except Exception:
+            # A failing map function skips the document, like in CouchDB
+            log.debug("View map function failed for doc %s", doc_id, exc_info=True)
+            return
+        if not emitted:
+            return
+
+        self._by_doc[doc_id] = emitted
+        for idx, (ckey, key, value) in enumerate(emitted):
+            entry = (ckey, doc_id, idx)
+            pos = bisect_left(self._sorted, entry)
+            self._sorted.insert(pos, entry)
+            self._ckeys.insert(pos, ckey)
+            insort(self._by_key.setdefault(ckey, []), (doc_id, idx))
+
+    def remove(self, doc_id):
+        emitted = self._by_doc.pop(doc_id, None)
+        if not emitted:
+            return
+
+        for idx, (ckey, key, value) in enumerate(emitted):
+            pos = bisect_left(self._sorted, (ckey, doc_id, idx))
+            del self._sorted[pos]
+            del self._ckeys[pos]
+            key_rows = self._by_key[ckey]
+            key_rows.remove((doc_id, idx))
+            if not key_rows:
+                del self._by_key[ckey]
+
+    def _get_row(self, doc_id, idx):
+        ckey, key, value = self._by_doc[doc_id][idx]
+        return doc_id, key, value
+
+    def query(self, key=None, keys=None, startkey=None, endkey=None, inclusive_end=True, descending=False,
+              startkey_docid=None, **kwargs):
+        """
+        Returns the rows as (doc id, key, value) tuples for the given CouchDB view query options.
+        Paging options (skip, limit) are applied by the caller. A startkey_docid continues a range
+        query within the rows of startkey.
+        """
+        if keys is not None:
+            rows = []
+            for k in keys:
+                rows.extend(self._get_row(doc_id, idx) for doc_id, idx in self._by_key.get(collation_key(k), ()))
+            return rows
+
+        if key is not None:
+            rows = [self._get_row(doc_id, idx) for doc_id, idx in self._by_key.get(collation_key(key), ())]
+            if descending:
+                rows.reverse()
+            return rows
+
+        if descending:
+            # Descending queries start at the high end
+            if startkey is None:
+                hi = len(self._ckeys)
+            elif startkey_docid is not None:
+                hi = bisect_right(self._sorted, (collation_key(startkey), startkey_docid, sys.maxint))
+            else:
+                hi = bisect_right(self._ckeys, collation_key(startkey))
+            if endkey is None:
+                lo = 0
+            elif inclusive_end:
+                lo = bisect_left(self._ckeys, collation_key(endkey))
+            else:
+                lo = bisect_right(self._ckeys, collation_key(endkey))
+            positions = xrange(hi - 1, lo - 1, -1)
+        else:
+            if startkey is None:
+                lo = 0
+            elif startkey_docid is not None:
+                lo = bisect_left(self._sorted, (collation_key(startkey), startkey_docid))
+            else:
+                lo = bisect_left(self._ckeys, collation_key(startkey))
+            if endkey is None:
+                hi = len(self._ckeys)
+            elif inclusive_end:
+                hi = bisect_right(self._ckeys, collation_key(endkey))
+            else:
+                hi = bisect_left(self._ckeys, collation_key(endkey))
+            positions = xrange(lo, hi)
+
+        sorted_rows = self._sorted
+        return [self._get_row(sorted_rows[pos][1], sorted_rows[pos][2]) for pos in positions]
+
+
+class InMemoryViewResults(object):
+    """
+    Lazily evaluated view query, supporting the slicing syntax of couchdb.client.ViewResults:
+    view[key] for an exact key and view[startkey:endkey] for a key range.
+    """
+
+    def __init__(self, database, name, options):
+        self.database = database
+        self.name = name
+        self.options = options
+        self._rows = None
+
+    def __getitem__(self, key):
+        options = self.options.copy()
+        if type(key) is slice:
+            if key.start is not None:
+                options['startkey'] = key.start
+            if key.stop is not None:
+                options['endkey'] = key.stop
+        else:
+            options['key'] = key
+        return InMemoryViewResults(self.database, self.name, options)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self.database._query_view(self.name, self.options)
+        return self._rows
+
+    @property
+    def total_rows(self):
+        return self.database._view_length(self.name)
+
+
+class InMemoryDatabase(object):
+    """
+    A single in-memory database with CouchDB document semantics: revisions and conflict
+    detection, attachments, bulk updates and views defined through design documents.
+    """
+
+    # Number of old revision bodies kept per document
+    max_revisions = 20
+
+    def __init__(self, name):
+        self.name = name
+        self._docs = {}             # Doc id -> current doc
+        self._history = {}          # Doc id -> list of (rev, doc), oldest first
+        self._rev_seqs = {}         # Doc id -> last revision sequence number, kept for deleted docs
+        self._attachments = {}      # Doc id -> {attachment name: (content, content type)}
+        self._views = {}            # (design, view name) -> ViewIndex
+        self._update_seq = 0
+
+    # -------------------------------------------------------------------------
+    # Document API
+
+    def __iter__(self):
+        return iter(list(self._docs))
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def __getitem__(self, doc_id):
+        doc = self.get(doc_id)
+        if doc is None:
+            raise ResourceNotFound(('not_found', 'missing'))
+        return doc
+
+    def __setitem__(self, doc_id, content):
+        content['_id'] = doc_id
+        self.save(content)
+
+    def __delitem__(self, doc_id):
+        if doc_id not in self._docs:
+            raise ResourceNotFound(('not_found', 'missing'))
+        self._delete(doc_id)
+
+    def info(self):
+        return dict(db_name=self.name, doc_count=len(self._docs), doc_del_count=len(self._rev_seqs) - len(self._docs),
+                    update_seq=self._update_seq, disk_size=0)
+
+    def get(self, doc_id, default=None, rev=None, **options):
+        if rev:
+            for hist_rev, hist_doc in self._history.get(doc_id, ()):
+                if hist_rev == rev:
+                    return Document(copy_doc(hist_doc))
+            return default
+
+        doc = self._docs.get(doc_id, None)
+        if doc is None:
+            return default
+        return Document(copy_doc(doc))
+
+    def revisions(self, doc_id, **options):
+        for rev, doc in reversed(self._history.get(doc_id, [])):
+            yield Document(copy_doc(doc))
+
+    def save(self, doc, **options):
+        if '_id' not in doc:
+            doc['_id'] = uuid4().hex
+        if doc.get('_deleted', False):
+            self.delete(doc)
+            return doc['_id'], doc['_rev']
+
+        doc_id = doc['_id']
+        self._check_rev(doc_id, doc.get('_rev', None))
+        doc['_rev'] = self._store(doc_id, doc)
+        return doc_id, doc['_rev']
+
+    def update(self, documents, **options):
+        results = []
+        for doc in documents:
+            try:
+                doc_id, rev = self.save(doc)
+                results.append((True, doc_id, rev))
+            except (ResourceConflict, ResourceNotFound) as ex:
+                results.append((False, doc.get('_id', None), ex))
+        return results
+
+    def delete(self, doc):
+        doc_id = doc['_id']
+        if doc_id not in self._docs:
+            raise ResourceNotFound(('not_found', 'missing'))
+        self._check_rev(doc_id, doc.get('_rev', None))
+        doc['_rev'] = self._delete(doc_id)
+
+    # -------------------------------------------------------------------------
+    # Attachment API
+
+    def put_attachment(self, doc, content, filename=None, content_type=None):
+        if hasattr(content, 'read'):
+            content = content.read()
+        filename = filename or getattr(content, 'name', None)
+        doc_id = doc['_id']
+        if doc_id not in self._docs:
+            raise ResourceNotFound(('not_found', 'missing'))
+        self._check_rev(doc_id, doc.get('_rev', None))
+
+        new_doc = copy_doc(self._docs[doc_id])
+        attachments = new_doc.setdefault('_attachments', {})
+        attachments[filename] = dict(content_type=content_type or 'application/octet-stream', length=len(content), stub=True)
+        self._attachments.setdefault(doc_id, {})[filename] = (content, content_type)
+        doc['_rev'] = self._store(doc_id, new_doc)
+
+    def get_attachment(self, id_or_doc, filename, default=None):
+        doc_id = id_or_doc['_id'] if isinstance(id_or_doc, dict) else id_or_doc
+        content, content_type = self._attachments.get(doc_id, {}).get(filename, (None, None))
+        if content is None:
+            return default
+        return StringIO.StringIO(content)
+
+    def delete_attachment(self, doc, filename):
+        doc_id = doc['_id']
+        if doc_id not in self._docs:
+            raise ResourceNotFound(('not_found', 'missing'))
+        self._check_rev(doc_id, doc.get('_rev', None))
+
+        new_doc = copy_doc(self._docs[doc_id])
+        new_doc.get('_attachments', {}).pop(filename, None)
+        if not new_doc.get('_attachments', True):
+            del new_doc['_attachments']
+        self._attachments.get(doc_id, {}).pop(filename, None)
+        doc['_rev'] = self._store(doc_id, new_doc)
+
+    # -------------------------------------------------------------------------
+    # View API
+
+    def view(self, name, wrapper=None, **options):
+        return InMemoryViewResults(self, name, options)
+
+    def _get_view_index(self, name):
+        if name.startswith(DESIGN_PREFIX):
+            parts = name[len(DESIGN_PREFIX):].split('/')
+            if len(parts) == 3 and parts[1] == '_view' and (parts[0], parts[2]) in self._views:
+                return self._views[(parts[0], parts[2])]
+        raise ResourceNotFound(('not_found', 'missing_named_view %s' % name))
+
+    def _view_length(self, name):
+        if name == "_all_docs":
+            return len(self._docs)
+        return len(self._get_view_index(name))
+
+    def _query_view(self, name, options):
+        include_docs = options.get('include_docs', False)
+        if name == "_all_docs":
+            rows = self._query_all_docs(options)
+        else:
+            rows = self._get_view_index(name).query(**options)
+
+        skip = options.get('skip', 0)
+        limit = options.get('limit', None)
+        if skip or limit is not None:
+            rows = rows[skip:skip + limit] if limit is not None else rows[skip:]
+
+        res_rows = []
+        for doc_id, key, value in rows:
+            if doc_id is None:
+                res_rows.append(Row(key=key, error='not_found'))
+                continue
+            row = Row(id=doc_id, key=copy_doc(key), value=copy_doc(value))
+            if include_docs:
+                doc = self._docs.get(doc_id, None)
+                row['doc'] = copy_doc(doc) if doc is not None else None
+            res_rows.append(row)
+        return res_rows
+
+    def _query_all_docs(self, options):
+        if options.get('keys', None) is not None:
+            return [(doc_id, doc_id, dict(rev=self._docs[doc_id]['_rev'])) if doc_id in self._docs else (None, doc_id, None)
+                    for doc_id in options['keys']]
+
+        doc_ids = sorted(self._docs)
+        if options.get('key', None) is not None:
+            doc_ids = [options['key']] if options['key'] in self._docs else []
+        else:
+            descending = options.get('descending', False)
+            startkey, endkey = options.get('startkey', None), options.get('endkey', None)
+            if descending:
+                doc_ids.reverse()
+            if startkey is not None:
+                doc_ids = [d for d in doc_ids if (d <= startkey if descending else d >= startkey)]
+            if endkey is not None:
+                if options.get('inclusive_end', True):
+                    doc_ids = [d for d in doc_ids if (d >= endkey if descending else d <= endkey)]
+                else:
+                    doc_ids = [d for d in doc_ids if (d > endkey if descending else d < endkey)]
+        return [(doc_id, doc_id, dict(rev=self._docs[doc_id]['_rev'])) for doc_id in doc_ids]
+
+    # -------------------------------------------------------------------------
+    # Internals
+
+    def _check_rev(self, doc_id, rev):
+        cur_doc = self._docs.get(doc_id, None)
+        cur_rev = cur_doc['_rev'] if cur_doc is not None else None
+        if rev != cur_rev:
+            raise ResourceConflict(('conflict', 'Document update conflict.'))
+
+    def _store(self, doc_id, doc):
+        """Stores a copy of doc as the new current revision and updates all indexes"""
+        seq = self._rev_seqs.get(doc_id, 0) + 1
+        rev = "%d-%s" % (seq, uuid4().hex)
+
+        new_doc = copy_doc(doc)
+        new_doc['_id'] = doc_id
+        new_doc['_rev'] = rev
+
+        # Like CouchDB, attachments not referenced by the new revision are dropped
+        if doc_id in self._attachments:
+            att_names = new_doc.get('_attachments', {})
+            for name in self._attachments[doc_id].keys():
+                if name not in att_names:
+                    del self._attachments[doc_id][name]
+
+        self._unindex(doc_id)
+        self._docs[doc_id] = new_doc
+        self._rev_seqs[doc_id] = seq
+        history = self._history.setdefault(doc_id, [])
+        history.append((rev, new_doc))
+        if len(history) > self.max_revisions:
+            del history[0]
+        self._update_seq += 1
+        self._index(doc_id, new_doc)
+        return rev
+
+    def _delete(self, doc_id):
+        seq = self._rev_seqs.get(doc_id, 0) + 1
+        self._unindex(doc_id)
+        del self._docs[doc_id]
+        self._history.pop(doc_id, None)
+        self._attachments.pop(doc_id, None)
+        self._rev_seqs[doc_id] = seq
+        self._update_seq += 1
+        return "%d-%s" % (seq, uuid4().hex)
+
+    def _index(self, doc_id, doc):
+        if doc_id.startswith(DESIGN_PREFIX):
+            self._define_design_views(doc_id[len(DESIGN_PREFIX):], doc.get('views', {}))
+            return
+        for index in self._views.itervalues():
+            index.add(doc_id, doc)
+
+    def _unindex(self, doc_id):
+        if doc_id.startswith(DESIGN_PREFIX):
+            design = doc_id[len(DESIGN_PREFIX):]
+            for view_key in [vk for vk in self._views if vk[0] == design]:
+                del self._views[view_key]
+            return
+        for index in self._views.itervalues():
+            index.remove(doc_id)
+
+    def _define_design_views(self, design, viewdefs):
+        for view_name in viewdefs:
+            map_fun = get_inmemory_view(design, view_name)
+            if map_fun is None:
+                log.warn("View %s/%s not available in memory for database %s", design, view_name, self.name)
+                continue
+            index = ViewIndex(map_fun)
+            for doc_id, doc in self._docs.iteritems():
+                if not doc_id.startswith(DESIGN_PREFIX):
+                    index.add(doc_id, doc)
+            self._views[(design, view_name)] = index
+
+    def _get_state(self):
+        return dict(docs=self._docs, history=self._history, rev_seqs=self._rev_seqs,
+                    attachments=self._attachments, update_seq=self._update_seq)
+
+    def _set_state(self, state):
+        self._docs = state['docs']
+        self._history = state['history']
+        self._rev_seqs = state['rev_seqs']
+        self._attachments = state['attachments']
+        self._update_seq = state['update_seq']
+        self._views = {}
+        for doc_id, doc in self._docs.iteritems():
+            if doc_id.startswith(DESIGN_PREFIX):
+                self._define_design_views(doc_id[len(DESIGN_PREFIX):], doc.get('views', {}))
+
+
+class InMemoryServer(object):
+    """
+    Container of in-memory databases, emulating couchdb.client.Server.
+    Optionally persists all databases to a snapshot file and restores them on creation.
+    """
+
+    def __init__(self, snapshot_path=None):
+        self._databases = {}
+        self.snapshot_path = snapshot_path
+        self._snapshot_seq = None
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot()
+
+    def __iter__(self):
+        return iter(list(self._databases))
+
+    def __len__(self):
+        return len(self._databases)
+
+    def __contains__(self, name):
+        return name in self._databases
+
+    def __getitem__(self, name):
+        self._validate_dbname(name)
+        if name not in self._databases:
+            raise ResourceNotFound(('not_found', 'no_db_file'))
+        return self._databases[name]
+
+    def __delitem__(self, name):
+        self.delete(name)
+
+    def create(self, name):
+        self._validate_dbname(name)
+        if name in self._databases:
+            raise PreconditionFailed(('file_exists', 'The database could not be created, the file already exists.'))
+        self._databases[name] = InMemoryDatabase(name)
+        return self._databases[name]
+
+    def delete(self, name):
+        self._validate_dbname(name)
+        if name not in self._databases:
+            raise ResourceNotFound(('not_found', 'missing'))
+        del self._databases[name]
+
+    def _validate_dbname(self, name):
+        if not name or not VALID_DB_NAME.match(name):
+            raise ValueError('Invalid database name')
+
+    def _get_update_seq(self):
+        return sorted((name, db._update_seq) for name, db in self._databases.iteritems())
+
+    def save_snapshot(self, path=None):
+        """
+        Writes all databases to the snapshot file, if anything changed since the last snapshot.
+        """
+        path = path or self.snapshot_path
+        if not path:
+            return
+        update_seq = self._get_update_seq()
+        if update_seq == self._snapshot_seq:
+            return
+
+        state = dict((name, db._get_state()) for name, db in self._databases.iteritems())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+        self._snapshot_seq = update_seq
+        log.info("Saved in-memory datastore snapshot to %s (%s databases)", path, len(state))
+
+    def load_snapshot(self, path=None):
+        path = path or self.snapshot_path
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        self._databases = {}
+        for name, db_state in state.iteritems():
+            db = InMemoryDatabase(name)
+            db._set_state(db_state)
+            self._databases[name] = db
+        self._snapshot_seq = self._get_update_seq()
+        log.info("Loaded in-memory datastore snapshot from %s (%s databases)", path, len(state))
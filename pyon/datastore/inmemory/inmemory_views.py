@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""Python equivalents of the CouchDB view map functions, used by the in-memory datastore"""
+
+__license__ = 'Apache 2.0'
+
+# Each map function receives a document (dict) and yields (key, value) tuples, exactly as the
+# JavaScript map function with the same design and view name in couchdb_config.COUCHDB_VIEWS emits.
+# Views without an entry here (e.g. the 'datasets' reduce views) are not available in memory.
+
+
+def _js_truthy(value):
+    """Emulates JavaScript truthiness for JSON values (empty lists and dicts are true)"""
+    return value is not None and value is not False and value != 0 and value != ""
+
+def _js_string(value, length=200):
+    if not isinstance(value, basestring):
+        value = str(value)
+    return value[:length]
+
+
+# -------------------------------------------------------------------------
+# Views for ION Resource objects
+
+def _resource_by_type(doc):
+    if doc.get('type_') and doc.get('lcstate') is not None and doc['lcstate'] != 'RETIRED' and doc.get('name') is not None:
+        yield [doc['type_'], _js_string(doc['name'])], None
+
+def _resource_by_lcstate(doc):
+    if doc.get('type_') and doc.get('lcstate') is not None and doc.get('availability') is not None and doc.get('name') is not None:
+        name = _js_string(doc['name'])
+        yield [0, doc['lcstate'], doc['type_'], name], None
+        yield [1, doc['availability'], doc['type_'], name], None
+
+def _resource_by_name(doc):
+    if doc.get('type_') and doc.get('lcstate') is not None and doc['lcstate'] != 'RETIRED' and doc.get('name') is not None:
+        yield [doc['name'], doc['type_']], None
+
+def _resource_by_altid(doc):
+    if doc.get('type_') and _js_truthy(doc.get('alt_ids')) and doc.get('lcstate') != 'RETIRED':
+        for altid in doc['alt_ids']:
+            parts = altid.split(":")
+            if len(parts) == 2:
+                yield [parts[1], parts[0]], None
+            else:
+                yield [altid, "_"], None
+    elif doc.get('type_') and _js_truthy(doc.get('uirefid')) and doc.get('lcstate') != 'RETIRED':
+        yield [doc['uirefid'], "UIREFID"], None
+
+def _resource_by_keyword(doc):
+    if doc.get('type_') and doc.get('lcstate') != 'RETIRED' and doc.get('keywords') is not None:
+        for keyword in doc['keywords']:
+            yield [keyword, doc['type_']], None
+
+def _resource_by_nestedtype(doc):
+    if doc.get('type_') and doc.get('lcstate') != 'RETIRED':
+        for attr, attval in doc.iteritems():
+            if isinstance(attval, dict) and attval.get('type_'):
+                yield [attval['type_'], doc['type_']], None
+
+def _resource_by_attribute(doc):
+    if doc.get('type_') and doc.get('lcstate') != 'RETIRED':
+        if doc['type_'] == "UserInfo" and isinstance(doc.get('contact'), dict) and doc['contact'].get('email') is not None:
+            yield [doc['type_'], "contact.email", doc['contact']['email']], None
+        elif doc['type_'] == "DataProduct" and doc.get('ooi_product_name'):
+            yield [doc['type_'], "ooi_product_name", doc['ooi_product_name']], None
+        elif doc['type_'] == "NotificationRequest" and doc.get('origin'):
+            yield [doc['type_'], "origin", doc['origin']], None
+
+
+# -------------------------------------------------------------------------
+# Pure ION object related views
+
+def _object_by_type(doc):
+    if doc.get('type_') is not None:
+        yield [doc['type_']], None
+
+
+# -------------------------------------------------------------------------
+# Attachment objects
+
+def _attachment_by_resource(doc):
+    if doc.get('type_') == "Attachment":
+        yield [doc.get('object_id'), doc.get('ts_created'), doc.get('keywords')], None
+
+
+# -------------------------------------------------------------------------
+# Association (triple) related views
+
+def _is_association(doc):
+    return doc.get('type_') == "Association" and not _js_truthy(doc.get('retired'))
+
+def _association_by_sub(doc):
+    if _is_association(doc):
+        yield [doc['s'], doc['p'], doc['ot'], doc['o']], doc
+
+def _association_by_obj(doc):
+    if _is_association(doc):
+        yield [doc['o'], doc['p'], doc['st'], doc['s']], doc
+
+def _association_by_match(doc):
+    if _is_association(doc):
+        yield [doc['s'], doc['o'], doc['p']], doc
+
+def _association_by_idpred(doc):
+    if _is_association(doc):
+        yield [doc['s'], doc['p']], doc
+        yield [doc['o'], doc['p']], doc
+
+def _association_by_id(doc):
+    if _is_association(doc):
+        yield doc['s'], doc
+        yield doc['o'], doc
+
+def _association_by_pred(doc):
+    if _is_association(doc):
+        yield [doc['p'], doc['s'], doc['o']], doc
+
+def _association_by_bulk(doc):
+    if _is_association(doc):
+        yield doc['s'], doc['o']
+
+def _association_by_subject_bulk(doc):
+    if _is_association(doc):
+        yield doc['o'], doc['s']
+
+
+# -------------------------------------------------------------------------
+# Directory related objects
+
+def _directory_by_path(doc):
+    if doc.get('type_') == "DirEntry":
+        levels = doc['parent'].split('/')[1:]
+        if doc['parent'] == "/":
+            levels = levels[1:]
+        levels.append(doc['key'])
+        yield [doc['org'], levels], doc
+
+def _directory_by_key(doc):
+    if doc.get('type_') == "DirEntry":
+        yield [doc['org'], doc['key'], doc['parent']], doc
+
+def _directory_by_parent(doc):
+    if doc.get('type_') == "DirEntry":
+        yield [doc['org'], doc['parent'], doc['key']], doc
+
+def _directory_by_attribute(doc):
+    if doc.get('type_') == "DirEntry":
+        for attr, attval in (doc.get('attributes') or {}).iteritems():
+            if isinstance(attval, basestring) and len(attval) > 0:
+                attval = attval[:200]
+            elif isinstance(attval, (list, tuple)) and len(attval) > 0:
+                attval = _js_string(",".join(str(v) for v in attval))
+            yield [doc['org'], attr, attval, doc['parent']], doc
+
+
+# -------------------------------------------------------------------------
+# Event related objects
+
+def _event_by_time(doc):
+    if doc.get('origin'):
+        yield [doc.get('ts_created')], None
+
+def _event_by_type(doc):
+    if doc.get('origin'):
+        yield [doc.get('type_'), doc.get('ts_created')], None
+
+def _event_by_origin(doc):
+    if doc.get('origin'):
+        yield [doc['origin'], doc.get('ts_created')], None
+
+def _event_by_origintype(doc):
+    if doc.get('origin'):
+        yield [doc['origin'], doc.get('type_'), doc.get('ts_created')], None
+
+
+# -------------------------------------------------------------------------
+# Science data manifest and file system catalog
+
+def _manifest_by_dataset(doc):
+    try:
+        ts_create = float(doc.get('ts_create'))
+    except (TypeError, ValueError):
+        ts_create = None
+    yield [doc.get('dataset_id'), ts_create], doc['_id']
+
+def _catalog_file_by_name(doc):
+    yield [u"%s%s" % (doc.get('name'), doc.get('extension')), doc.get('owner_id'), doc.get('group_id'),
+           doc.get('permissions'), doc.get('modified_date'), doc.get('created_date')], doc['_id']
+
+def _catalog_file_by_created_date(doc):
+    yield doc.get('created_date'), doc['_id']
+
+def _catalog_file_by_modified_date(doc):
+    yield doc.get('modified_date'), doc['_id']
+
+def _catalog_file_by_owner(doc):
+    yield [doc.get('owner_id'), doc.get('group_id'), doc.get('name')], doc['_id']
+
+
+INMEMORY_VIEWS = {
+    'resource': {
+        'by_type': _resource_by_type,
+        'by_lcstate': _resource_by_lcstate,
+        'by_name': _resource_by_name,
+        'by_altid': _resource_by_altid,
+        'by_keyword': _resource_by_keyword,
+        'by_nestedtype': _resource_by_nestedtype,
+        'by_attribute': _resource_by_attribute,
+    },
+    'object': {
+        'by_type': _object_by_type,
+    },
+    'attachment': {
+        'by_resource': _attachment_by_resource,
+    },
+    'association': {
+        'by_sub': _association_by_sub,
+        'by_obj': _association_by_obj,
+        'by_match': _association_by_match,
+        'by_idpred': _association_by_idpred,
+        'by_id': _association_by_id,
+        'by_pred': _association_by_pred,
+        'by_bulk': _association_by_bulk,
+        'by_subject_bulk': _association_by_subject_bulk,
+    },
+    'directory': {
+        'by_path': _directory_by_path,
+        'by_key': _directory_by_key,
+        'by_parent': _directory_by_parent,
+        'by_attribute': _directory_by_attribute,
+    },
+    'event': {
+        'by_time': _event_by_time,
+        'by_type': _event_by_type,
+        'by_origin': _event_by_origin,
+        'by_origintype': _event_by_origintype,
+    },
+    'manifest': {
+        'by_dataset': _manifest_by_dataset,
+    },
+    'catalog': {
+        'file_by_name': _catalog_file_by_name,
+        'file_by_created_date': _catalog_file_by_created_date,
+        'file_by_modified_date': _catalog_file_by_modified_date,
+        'file_by_owner': _catalog_file_by_owner,
+    },
+}
+
+
+def get_inmemory_view(design, view_name):
+    """
+    Returns the map function for the given design and view name, or None if not available in memory.
+    """
+    return INMEMORY_VIEWS.get(design, {}).get(view_name, None)
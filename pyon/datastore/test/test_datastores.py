@@ -7,6 +7,8 @@ from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest, NotFound
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+from pyon.datastore.inmemory.inmemory_datastore import InMemory_DataStore
+from pyon.datastore.inmemory.inmemory_server import InMemoryServer
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.ion.identifier import create_unique_resource_id
 from pyon.ion.resource import RT, PRED, LCS, AS, lcstate
@@ -23,8 +25,11 @@ BASED_ON = "XBASED_ON"
 @attr('UNIT', group='datastore')
 class Test_DataStores(IonIntegrationTestCase):
 
+    def _get_test_datastore(self):
+        return CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+
     def test_datastore_database(self):
-        ds = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+        ds = self._get_test_datastore()
 
         # CouchDB does not like upper case characters for database names
         with self.assertRaises(BadRequest):
@@ -58,7 +63,7 @@ class Test_DataStores(IonIntegrationTestCase):
             ds.delete_doc("badid", "BadDataStoreNamePerCouchDB")
 
     def test_datastore_basic(self):
-        data_store = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+        data_store = self._get_test_datastore()
 
         self.data_store = data_store
         self.resources = {}
@@ -288,7 +293,7 @@ class Test_DataStores(IonIntegrationTestCase):
         self.assertNotIn('ion_test_ds', data_store.list_datastores())
 
     def test_datastore_attach(self):
-        data_store = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+        data_store = self._get_test_datastore()
 
         self.data_store = data_store
         self.resources = {}
@@ -438,7 +443,7 @@ class Test_DataStores(IonIntegrationTestCase):
             data_store.delete_attachment(doc="incorrect_id", attachment_name='no_such_file')
 
     def test_datastore_views(self):
-        data_store = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+        data_store = self._get_test_datastore()
 
         self.data_store = data_store
         self.resources = {}
@@ -736,5 +741,20 @@ class Test_DataStores(IonIntegrationTestCase):
         return res_obj_res[0]
 
 
+@attr('UNIT', group='datastore')
+class Test_InMemoryDataStores(Test_DataStores):
+    """
+    Runs the datastore tests against the in-memory datastore, with a private server per test.
+    """
+
+    def _get_test_datastore(self):
+        if not hasattr(self, '_inmemory_server'):
+            self._inmemory_server = InMemoryServer()
+        ds = InMemory_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES, server=self._inmemory_server)
+        if not ds.datastore_exists('ion_test_ds'):
+            ds.create_datastore()
+        return ds
+
+
 if __name__ == "__main__":
     unittest.main()
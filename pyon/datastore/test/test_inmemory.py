@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+import base64
+import json
+import os
+import tempfile
+
+from couchdb.http import ResourceConflict, ResourceNotFound
+from mock import patch
+from nose.plugins.attrib import attr
+
+from pyon.datastore.datastore import DatastoreManager, DataStore
+from pyon.datastore.inmemory.inmemory_datastore import InMemory_DataStore
+from pyon.datastore.inmemory.inmemory_server import InMemoryServer, ViewIndex, collation_key
+from pyon.datastore.couchdb.couchdb_datastore import END_MARKER, decode_page_token
+from pyon.core.exception import BadRequest
+from pyon.util.unit_test import PyonTestCase
+
+
+@attr('UNIT', group='datastore')
+class TestInMemoryServer(PyonTestCase):
+
+    def test_collation(self):
+        values = [None, False, True, 1, 2.5, "a", "A", "b", "B", "ZZZ", [], ["a"], ["a", 1], ["b"], {}]
+        shuffled = list(reversed(values))
+        self.assertEquals(sorted(shuffled, key=collation_key), values)
+
+        # Prefix range queries with END_MARKER include lower case continuations
+        self.assertLess(collation_key(["id1", "hasModel"]), collation_key(["id1", END_MARKER]))
+
+    def test_view_index(self):
+        def map_fun(doc):
+            if doc.get('type_') == "Association":
+                yield [doc['s'], doc['p']], doc['o']
+                yield [doc['o'], doc['p']], doc['s']
+
+        index = ViewIndex(map_fun)
+        index.add("a1", dict(type_="Association", s="s1", p="hasA", o="o1"))
+        index.add("a2", dict(type_="Association", s="s1", p="hasB", o="o2"))
+        index.add("a3", dict(type_="Association", s="s2", p="hasA", o="o1"))
+        index.add("x1", dict(type_="Other"))
+        self.assertEquals(len(index), 6)
+
+        rows = index.query(startkey=["s1"], endkey=["s1", END_MARKER])
+        self.assertEquals([r[0] for r in rows], ["a1", "a2"])
+
+        rows = index.query(key=["o1", "hasA"])
+        self.assertEquals([r[0] for r in rows], ["a1", "a3"])
+
+        rows = index.query(keys=[["s2", "hasA"], ["s1", "hasB"]])
+        self.assertEquals([r[0] for r in rows], ["a3", "a2"])
+
+        rows = index.query(startkey=["s1", END_MARKER], endkey=["s1"], descending=True)
+        self.assertEquals([r[0] for r in rows], ["a2", "a1"])
+
+        rows = index.query(startkey=["s1", "hasA"], endkey=["s1", "hasB"], inclusive_end=False)
+        self.assertEquals([r[0] for r in rows], ["a1"])
+
+        # Continuation within the rows of one key
+        rows = index.query(startkey=["o1", "hasA"], startkey_docid="a3", endkey=["o1", END_MARKER])
+        self.assertEquals([r[0] for r in rows], ["a3"])
+        rows = index.query(startkey=["o1", "hasA"], startkey_docid="a1", endkey=["o1"], descending=True)
+        self.assertEquals([r[0] for r in rows], ["a1"])
+
+        index.remove("a1")
+        index.remove("x1")
+        self.assertEquals(len(index), 4)
+        self.assertEquals(index.query(key=["o1", "hasA"]), [("a3", ["o1", "hasA"], "s2")])
+
+    def test_database(self):
+        server = InMemoryServer()
+        self.assertRaises(ValueError, server.create, "BadName")
+        db = server.create("test_db")
+        self.assertIn("test_db", list(server))
+
+        doc = dict(type_="Association", s="s1", p="hasA", o="o1", ot="T", st="T")
+        doc_id, rev1 = db.save(doc)
+        self.assertEquals(doc['_rev'], rev1)
+
+        # Conflict on stale or missing revision
+        self.assertRaises(ResourceConflict, db.save, dict(_id=doc_id))
+        doc2 = db.get(doc_id)
+        doc2['p'] = "hasB"
+        db.save(doc2)
+        self.assertRaises(ResourceConflict, db.save, doc)
+        self.assertEquals(len(list(db.revisions(doc_id))), 2)
+        self.assertEquals(db.get(doc_id, rev=rev1)['p'], "hasA")
+
+        # Views are defined through design docs and maintained on write
+        db["_design/association"] = dict(views=dict(by_sub=dict(map="..."), no_such_view=dict(map="...")))
+        rows = db.view("_design/association/_view/by_sub")[["s1"]:["s1", END_MARKER]]
+        self.assertEquals(len(rows), 1)
+        self.assertEquals(rows.rows[0].value['p'], "hasB")
+        self.assertRaises(ResourceNotFound, len, db.view("_design/association/_view/no_such_view"))
+
+        del db[doc_id]
+        self.assertEquals(len(db.view("_design/association/_view/by_sub")), 0)
+        self.assertEquals(db.get(doc_id), None)
+        self.assertRaises(ResourceNotFound, db.__delitem__, doc_id)
+
+        rows = db.view("_all_docs", keys=[doc_id, "_design/association"], include_docs=True).rows
+        self.assertEquals(rows[0].doc, None)
+        self.assertEquals(rows[1].id, "_design/association")
+
+    def test_snapshot(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        try:
+            server = InMemoryServer(snapshot_path=path)
+            ds = InMemory_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.OBJECTS, server=server)
+            ds.create_datastore()
+            doc_id, _ = ds.create_doc(dict(type_="Foo", name="foo"))
+            ds.close()
+            self.assertTrue(os.path.exists(path))
+
+            server2 = InMemoryServer(snapshot_path=path)
+            ds2 = InMemory_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.OBJECTS, server=server2)
+            self.assertEquals(ds2.read_doc(doc_id)['name'], "foo")
+            rows = ds2.find_by_view("object", "by_type", key=["Foo"], id_only=True, convert_doc=False)
+            self.assertEquals([r[0] for r in rows], [doc_id])
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_paging(self):
+        ds = InMemory_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES, server=InMemoryServer())
+        ds.create_datastore()
+        # Duplicate names, so that pages continue within the rows of one view key
+        doc_ids = [ds.create_doc(dict(type_="Foo", lcstate="DEPLOYED", availability="AVAILABLE", name="foo%s" % (i % 2)))[0]
+                   for i in xrange(5)]
+        all_rows = ds.find_by_view("resource", "by_type", start_key=["Foo"], end_key=["Foo"], convert_doc=False)
+        self.assertEquals(sorted(r[0] for r in all_rows), sorted(doc_ids))
+
+        rows = list(ds.find_by_view_iter("resource", "by_type", start_key=["Foo"], end_key=["Foo"], page_size=2, convert_doc=False))
+        self.assertEquals(rows, all_rows)
+        rows = list(ds.find_by_view_iter("resource", "by_type", start_key=["Foo"], end_key=["Foo"], page_size=2, limit=3, convert_doc=False))
+        self.assertEquals(rows, all_rows[:3])
+
+        rows, page_token = ds.find_by_view_page("resource", "by_type", start_key=["Foo"], end_key=["Foo"], page_size=3, convert_doc=False)
+        self.assertEquals(rows, all_rows[:3])
+        rows, page_token = ds.find_by_view_page("resource", "by_type", start_key=["Foo"], end_key=["Foo"], page_size=3,
+                                                page_token=page_token, convert_doc=False)
+        self.assertEquals(rows, all_rows[3:])
+        self.assertIsNone(page_token)
+
+        res_ids, pages, page_token = [], 0, None
+        while pages == 0 or page_token:
+            page_ids, page_assocs, page_token = ds.find_resources_ext(restype="Foo", page_size=2, page_token=page_token)
+            res_ids.extend(page_ids)
+            pages += 1
+        self.assertEquals(res_ids, [r[0] for r in all_rows])
+        self.assertEquals(pages, 3)
+
+        # Results without page_size are unchanged
+        res_ids, res_assocs = ds.find_resources_ext(restype="Foo")
+        self.assertEquals(len(res_ids), 5)
+
+        self.assertRaises(BadRequest, decode_page_token, base64.urlsafe_b64encode(json.dumps("x")))
+
+    @patch('pyon.datastore.datastore.CFG')
+    def test_server_type(self, mock_cfg):
+        mock_cfg.get_safe.return_value = DataStore.DS_SERVER_INMEMORY
+        ds = DatastoreManager.get_datastore_instance("objects", DataStore.DS_PROFILE.OBJECTS)
+        self.assertIsInstance(ds, InMemory_DataStore)
+        mock_cfg.get_safe.assert_called_once_with('server.type', DataStore.DS_SERVER_COUCHDB)
+
+        mock_cfg.get_safe.return_value = "unknown"
+        self.assertRaises(BadRequest, DatastoreManager.get_datastore_instance, "objects")
@@ -5,6 +5,11 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+import copy
+import time
+
+from ooi.timer import Accumulator
+
 from pyon.core import bootstrap
 from pyon.core.bootstrap import CFG
 from pyon.core.exception import Inconsistent, BadRequest
@@ -15,6 +20,141 @@ from pyon.util.log import log
 from pyon.util.containers import get_ion_ts
 from interface.objects import DirEntry
 
+stats = Accumulator(persist=True)
+
+
+class DirectoryCache(object):
+    """
+    Cache of the DirEntries of one org's directory, shared by all Directory instances of a container.
+    Indexes entries by path (including known absent paths) and the child keys of loaded parent paths,
+    so that lookups below a loaded parent are answered without datastore access, whether the entry
+    exists or not. Entries expire after ttl seconds; directory change events invalidate them earlier.
+    Entries are copied on the way in and out, so callers cannot modify cached state.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}          # path -> (DirEntry or None, expiry time)
+        self._children = {}         # parent path -> (set of child keys, expiry time)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        """
+        Returns a tuple (found, DirEntry or None). found is False if the cache cannot tell.
+        """
+        now = time.time()
+        cached = self._entries.get(path, None)
+        if cached is not None:
+            if cached[1] > now:
+                return self._hit(copy.deepcopy(cached[0]))
+            del self._entries[path]
+
+        parent, key = path.rsplit("/", 1)
+        children = self._children.get(parent or "/", None)
+        if children is not None and children[1] > now and key not in children[0]:
+            return self._hit(None)
+
+        self.misses += 1
+        stats.add_value('directory.cache.miss', 1)
+        return False, None
+
+    def _hit(self, entry):
+        self.hits += 1
+        stats.add_value('directory.cache.hit', 1)
+        return True, entry
+
+    def put(self, path, entry):
+        """
+        Caches the DirEntry for the given path, or its absence if entry is None.
+        """
+        self._entries[path] = (copy.deepcopy(entry), time.time() + self.ttl)
+
+        parent, key = path.rsplit("/", 1)
+        children = self._children.get(parent or "/", None)
+        if children is not None:
+            if entry is None:
+                children[0].discard(key)
+            else:
+                children[0].add(key)
+
+    def get_children(self, parent):
+        """
+        Returns the list of child DirEntries of parent ordered by key, or None if not completely cached.
+        """
+        now = time.time()
+        children = self._children.get(parent, None)
+        if children is None or children[1] <= now:
+            self.misses += 1
+            stats.add_value('directory.cache.miss', 1)
+            return None
+
+        entries = []
+        for key in sorted(children[0]):
+            cached = self._entries.get(parent + key if parent == "/" else parent + "/" + key, None)
+            if cached is None or cached[1] <= now or cached[0] is None:
+                self.misses += 1
+                stats.add_value('directory.cache.miss', 1)
+                return None
+            entries.append(cached[0])
+
+        self.hits += 1
+        stats.add_value('directory.cache.hit', 1)
+        return copy.deepcopy(entries)
+
+    def put_children(self, parent, entries, descendants=False):
+        """
+        Caches the given DirEntries as the complete list of children of parent.
+        With descendants, entries are all entries below parent, and the child lists of all of them are cached.
+        """
+        expiry = time.time() + self.ttl
+        listings = {parent: set()}
+        for entry in entries:
+            path = entry.parent + entry.key if entry.parent == "/" else entry.parent + "/" + entry.key
+            self._entries[path] = (copy.deepcopy(entry), expiry)
+            listings.setdefault(entry.parent, set()).add(entry.key)
+            if descendants:
+                listings.setdefault(path, set())
+
+        for listing_parent, keys in listings.iteritems():
+            self._children[listing_parent] = (keys, expiry)
+
+    def invalidate(self, path=None):
+        """
+        Removes the entry for path, and the child list of its parent. Clears the cache if path is None.
+        """
+        self.invalidations += 1
+        stats.add_value('directory.cache.invalidation', 1)
+        if path is None:
+            self._entries.clear()
+            self._children.clear()
+            return
+
+        self._entries.pop(path, None)
+        self._children.pop(path, None)
+        parent = path.rsplit("/", 1)[0] or "/"
+        self._children.pop(parent, None)
+
+    def get_stats(self):
+        return dict(size=len(self._entries), parents=len(self._children), ttl=self.ttl,
+                    hits=self.hits, misses=self.misses, invalidations=self.invalidations)
+
+
+# Directory caches of the container by (directory datastore name, org name)
+_directory_caches = {}
+
+def get_directory_cache(datastore_name, orgname):
+    """
+    Returns the container-wide cache for the given directory, or None if caching is disabled.
+    """
+    if not CFG.get_safe('container.directory.cache.enabled', False):
+        return None
+    cache_key = (datastore_name, orgname)
+    if cache_key not in _directory_caches:
+        _directory_caches[cache_key] = DirectoryCache(ttl=CFG.get_safe('container.directory.cache.ttl', 60))
+    return _directory_caches[cache_key]
+
 
 class Directory(object):
     """
@@ -39,6 +179,9 @@ class Directory(object):
         self.event_pub = None
         self.event_sub = None
 
+        # Container-wide read cache, write-through; kept current across containers by change events
+        self._cache = get_directory_cache(getattr(self.dir_store, 'datastore_name', None), self.orgname)
+
 
     def start(self):
         # Create directory root entry (for current org) if not existing
@@ -56,6 +199,9 @@ class Directory(object):
             self.event_sub = EventSubscriber(event_type="ContainerConfigModifiedEvent",
                                              origin="Directory",
                                              callback=self.receive_directory_change_event)
+            if self._cache is not None:
+                # Changes from other containers invalidate the cache
+                self.event_sub.start()
 
     def stop(self):
         self.close()
@@ -65,7 +211,10 @@ class Directory(object):
         Close directory and all resources including datastore and event listener.
         """
         if self.event_sub:
-            self.event_sub.deactivate()
+            if self._cache is not None:
+                self.event_sub.stop()
+            else:
+                self.event_sub.deactivate()
         self.dir_store.close()
 
     def _get_path(self, parent, key):
@@ -106,6 +255,12 @@ class Directory(object):
         if path is None:
             raise BadRequest("Illegal arguments")
         orgname = orgname or self.orgname
+        use_cache = self._cache is not None and orgname == self.orgname
+        if use_cache:
+            found, direntry = self._cache.get(path)
+            if found:
+                return direntry
+
         parent, key = path.rsplit("/", 1)
         parent = parent or "/"
         find_key = [orgname, key, parent]
@@ -114,11 +269,74 @@ class Directory(object):
         match = [doc for docid, index, doc in view_res]
         if len(match) > 1:
             log.warn("More than one directory entry found for key %s" % path)
-            recent_match = self._cleanup_outdated_entries(match, "path=%s" % path)
-            return recent_match
+            direntry = self._cleanup_outdated_entries(match, "path=%s" % path)
         elif match:
-            return match[0]
-        return None
+            direntry = match[0]
+        else:
+            direntry = None
+
+        if use_cache:
+            self._cache.put(path, direntry)
+        return direntry
+
+    def _cache_put(self, direntry, res=None):
+        """
+        Writes a created or updated DirEntry through to the cache, with the id and revision from
+        the datastore result tuple. Announces the change to other containers.
+        """
+        path = self._get_path(direntry.parent, direntry.key)
+        if self._cache is not None:
+            if res:
+                direntry._id, direntry._rev = res[-2:]
+                self._cache.put(path, direntry)
+            else:
+                self._cache.invalidate(path)
+        self._publish_change(path)
+
+    def _cache_invalidate(self, path=None):
+        if self._cache is not None:
+            self._cache.invalidate(path)
+        self._publish_change(path)
+
+    def _publish_change(self, path=None):
+        """
+        Publishes a directory change event for the given path (None meaning many paths), so that
+        directory caches in other containers get invalidated.
+        """
+        self._publish_changes([path])
+
+    def _publish_changes(self, paths):
+        """
+        Publishes one directory change event for each of the given paths in one batch. The events carry
+        the container id as actor_id, so that this container does not invalidate its own cache.
+        Published with or without a local cache, since other containers may cache the paths.
+        """
+        if self.event_pub is None or not paths:
+            return
+        container_id = getattr(self.container, 'id', None)
+        event_kwargs = dict(actor_id=container_id) if container_id else {}
+        try:
+            events = [bootstrap.IonObject("ContainerConfigModifiedEvent", origin="Directory", sub_type=path or "",
+                                          **event_kwargs) for path in paths]
+            self.event_pub.publish_events(events)
+        except Exception:
+            log.warn("Could not publish directory change events for %s", paths, exc_info=True)
+
+    def load_cache(self, parent):
+        """
+        Loads all entries below parent (not the root) into the cache with one datastore access.
+        Afterwards, any lookup below parent is answered from the cache, until invalidated or expired.
+        """
+        if parent == "/":
+            raise BadRequest("Cannot load entire directory into cache")
+        if self._cache is not None:
+            self.find_child_entries(parent, direct_only=False)
+
+    def get_cache_stats(self):
+        """
+        Returns a dict with the directory cache stats, or None if caching is disabled.
+        """
+        return self._cache.get_stats() if self._cache is not None else None
 
     def _cleanup_outdated_entries(self, dir_entries, common="key"):
         """
@@ -185,7 +403,8 @@ class Directory(object):
                     direntry = self._create_dir_entry(parent=pp, key=pk)
                     pe_list.append(direntry)
                     if create:
-                        self.dir_store.create(direntry, create_unique_directory_id())
+                        res = self.dir_store.create(direntry, create_unique_directory_id())
+                        self._cache_put(direntry, res)
         except Exception as ex:
             log.warn("_ensure_parents_exist(): Error creating directory parents", exc_info=True)
         return pe_list
@@ -217,11 +436,21 @@ class Directory(object):
             direntry.attributes = kwargs
             direntry.ts_updated = cur_time
             # TODO: This may fail because of concurrent update
-            self.dir_store.update(direntry)
+            try:
+                res = self.dir_store.update(direntry)
+            except Exception:
+                self._cache_invalidate(dn)
+                raise
+            self._cache_put(direntry, res)
         else:
             direntry = self._create_dir_entry(parent, key, attributes=kwargs, ts=cur_time)
             self._ensure_parents_exist([direntry])
-            self.dir_store.create(direntry, create_unique_directory_id())
+            try:
+                res = self.dir_store.create(direntry, create_unique_directory_id())
+            except Exception:
+                self._cache_invalidate(dn)
+                raise
+            self._cache_put(direntry, res)
 
         return entry_old
 
@@ -249,7 +478,19 @@ class Directory(object):
         pe_list = self._ensure_parents_exist(de_list, create=False)
         de_list.extend(pe_list)
         deid_list = [create_unique_directory_id() for i in xrange(len(de_list))]
-        self.dir_store.create_mult(de_list, deid_list)
+        res_list = self.dir_store.create_mult(de_list, deid_list)
+
+        if self._cache is not None:
+            paths = []
+            for direntry, (success, deid, rev) in zip(de_list, res_list):
+                path = self._get_path(direntry.parent, direntry.key)
+                if success:
+                    direntry._id, direntry._rev = deid, rev
+                    self._cache.put(path, direntry)
+                else:
+                    self._cache.invalidate(path)
+                paths.append(path)
+            self._publish_changes(paths)
 
     def unregister(self, parent, key=None, return_entry=False):
         """
@@ -261,7 +502,14 @@ class Directory(object):
 
         direntry = self._read_by_path(path)
         if direntry:
-            self.dir_store.delete(direntry)
+            try:
+                self.dir_store.delete(direntry)
+            except Exception:
+                self._cache_invalidate(path)
+                raise
+            if self._cache is not None:
+                self._cache.put(path, None)
+            self._publish_change(path)
 
         if direntry and not return_entry:
             return direntry.attributes
@@ -285,6 +533,12 @@ class Directory(object):
         """
         if not type(parent) is str or not parent.startswith("/"):
             raise BadRequest("Illegal argument parent: %s" % parent)
+        use_cache = self._cache is not None and not kwargs
+        if use_cache and direct_only:
+            match = self._cache.get_children(parent)
+            if match is not None:
+                return match
+
         if direct_only:
             start_key = [self.orgname, parent, 0]
             end_key = [self.orgname, parent]
@@ -298,6 +552,8 @@ class Directory(object):
                 start_key=start_key, end_key=end_key, id_only=True, convert_doc=True, **kwargs)
 
         match = [doc for docid, indexkey, doc in res]
+        if use_cache and (direct_only or parent != "/"):
+            self._cache.put_children(parent, match, descendants=not direct_only)
         return match
 
     def find_by_key(self, key=None, parent='/', **kwargs):
@@ -359,5 +615,10 @@ class Directory(object):
 
     def receive_directory_change_event(self, event_msg, headers):
         # @TODO add support to fold updated config into container config
-        pass
+        if self._cache is not None:
+            # Our own changes are already in the cache
+            container_id = getattr(self.container, 'id', None)
+            if container_id and getattr(event_msg, 'actor_id', None) == container_id:
+                return
+            self._cache.invalidate(getattr(event_msg, 'sub_type', None) or None)
 
@@ -7,6 +7,7 @@ __license__ = 'Apache 2.0'
 
 from pyon.net.endpoint import Publisher, Subscriber, EndpointUnit, process_interceptors, RPCRequestEndpointUnit, BaseEndpoint, RPCClient, RPCResponseEndpointUnit, RPCServer, PublisherEndpointUnit, SubscriberEndpointUnit
 from pyon.ion.event import BaseEventSubscriberMixin
+from pyon.core.interceptor.interceptor import InterceptorStacks
 from pyon.util.log import log
 from pyon.core.exception import Timeout as IonTimeout
 from gevent.timeout import Timeout
@@ -50,7 +51,11 @@ class ProcessEndpointUnitMixin(EndpointUnit):
         This is a request, so the order should be Message, Process
         """
         inv_one = EndpointUnit._intercept_msg_in(self, inv)
-        inv_two = process_interceptors(self.interceptors["process_incoming"] if "process_incoming" in self.interceptors else [], inv_one)
+        interceptors = self.interceptors
+        if isinstance(interceptors, InterceptorStacks):
+            inv_two = interceptors.get_pipeline("process_incoming")(inv_one)
+        else:
+            inv_two = process_interceptors(interceptors["process_incoming"] if "process_incoming" in interceptors else [], inv_one)
         return inv_two
 
     def _intercept_msg_out(self, inv):
@@ -59,7 +64,11 @@ class ProcessEndpointUnitMixin(EndpointUnit):
 
         This is request, so the order should be Process, Message
         """
-        inv_one = process_interceptors(self.interceptors["process_outgoing"] if "process_outgoing" in self.interceptors else [], inv)
+        interceptors = self.interceptors
+        if isinstance(interceptors, InterceptorStacks):
+            inv_one = interceptors.get_pipeline("process_outgoing")(inv)
+        else:
+            inv_one = process_interceptors(interceptors["process_outgoing"] if "process_outgoing" in interceptors else [], inv)
         inv_two = EndpointUnit._intercept_msg_out(self, inv_one)
 
         return inv_two
@@ -252,7 +261,7 @@ class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpoi
 
         # Persistent process state handling
         if hasattr(self._process, "_proc_state"):
-            if self._process._proc_state_changed:
+            if self._process._proc_state_changed and self._process._is_state_flush_due():
                 log.debug("Process %s state changed. State=%s", self._process.id, self._process._proc_state)
                 self._process._flush_state()
         return res
@@ -260,10 +269,16 @@ class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpoi
     def _get_process_saturation(self):
         """
         Gets the process' saturation, as an integer percentage (process time / total time).
+        For processes with concurrent dispatch, process time is weighted by worker pool occupancy,
+        and the saturation is at least the current pool occupancy.
         """
-        total, _, proc, interval, interval_run = self._process._process.time_stats  # we want the ION proc's stats
+        ionproc = self._process._process
+        total, _, proc, interval, interval_run = ionproc.time_stats  # we want the ION proc's stats
         #return str(int(proc / float(total) * 100))  # Total
-        return str(int(interval_run / float(interval) * 100))  # Percentage in current (partial) and prior interval
+        saturation = int(interval_run / float(interval) * 100)  # Percentage in current (partial) and prior interval
+        if ionproc.max_concurrency > 1:
+            saturation = max(saturation, ionproc.pool_occupancy)
+        return str(saturation)
 
 class ProcessRPCServer(RPCServer):
     endpoint_unit_type = ProcessRPCResponseEndpointUnit
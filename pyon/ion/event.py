@@ -15,6 +15,7 @@ from pyon.core.exception import BadRequest, IonException, StreamException
 from pyon.datastore.datastore import DataStore
 from pyon.ion.identifier import create_unique_event_id
 from pyon.net.endpoint import Publisher, Subscriber
+from pyon.net.transport import NameTrio
 from pyon.util.async import spawn
 from pyon.util.containers import get_ion_ts_millis, is_valid_ts
 from pyon.util.log import log
@@ -82,12 +83,74 @@ class EventPublisher(Publisher):
         @retval event_object    the event object which was published
         """
         assert event_object
+        return self.publish_events([event_object])[0]
 
-        topic = self._topic(event_object)
-        to_name = (self._send_name.exchange, topic)
-        log.trace("Publishing %s event message %s:%s -> %s", event_object.type_, event_object.origin_type, event_object.origin, to_name)
+    def publish_events(self, event_list, persist=False):
+        """
+        Publishes a list of event objects. All events are validated before any is published,
+        so a BadRequest for one event publishes none. Routing keys are computed once per
+        event type and origin, and all events are sent over one channel.
+        @param event_list       list of event objects to be published
+        @param persist          if True, stores the events in the event repository in one bulk call
+        @retval event_list      the event objects which were published
+        """
+        if type(event_list) is not list:
+            raise BadRequest("event_list must be type list, not %s" % type(event_list))
+        if not event_list:
+            return event_list
 
+        # Check all events before changing any, so a BadRequest leaves the caller's events untouched
         current_time = get_ion_ts_millis()
+        for event_object in event_list:
+            self._validate_event(event_object, current_time)
+        for event_object in event_list:
+            self._prepare_event(event_object, current_time)
+
+        extends = {}        # event type -> base types
+        topics = {}         # (event type, sub_type, origin_type, origin) -> routing key
+        to_names = []
+        for event_object in event_list:
+            event_type = event_object._get_type()
+            if not event_object.base_types:
+                if event_type not in extends:
+                    extends[event_type] = event_object._get_extends()
+                event_object.base_types = extends[event_type]
+
+            topic_key = (event_type, event_object.sub_type, event_object.origin_type, event_object.origin)
+            if topic_key not in topics:
+                topics[topic_key] = NameTrio(self._send_name.exchange, self._topic(event_object))
+            to_names.append(topics[topic_key])
+
+            #Generate a unique ID for this event
+            event_object._id = create_unique_event_id()
+
+        ep = self.create_endpoint(to_names[0])
+        try:
+            for event_object, to_name in zip(event_list, to_names):
+                log.trace("Publishing %s event message %s:%s -> %s", event_object.type_, event_object.origin_type, event_object.origin, to_name)
+                try:
+                    ep.channel.connect(to_name)
+                    ep.send(event_object)
+                except Exception as ex:
+                    log.exception("Failed to publish event (%s): '%s'" % (ex.message, event_object))
+                    raise
+        finally:
+            ep.close()
+
+        if persist:
+            if self.event_repo:
+                self.event_repo.put_events(event_list)
+            else:
+                log.warn("Cannot persist %s events: no event repository", len(event_list))
+
+        return event_list
+
+    def _validate_event(self, event_object, current_time):
+        """
+        Checks an event object before publishing, without modifying it.
+        Raises BadRequest for invalid timestamps or an existing _id.
+        """
+        assert event_object
 
         #Ensure valid created timestamp if supplied
         if event_object.ts_created:
@@ -103,7 +166,15 @@ class EventPublisher(Publisher):
             if int(event_object.ts_created) < (current_time - VALID_EVENT_TIME_PERIOD) :
                 raise BadRequest("This ts_created value is too old:'%s'" % (event_object.ts_created))
 
-        else:
+        #Ensure the event object has a unique id
+        if '_id' in event_object:
+            raise BadRequest("The event object cannot contain a _id field '%s'" % (event_object))
+
+    def _prepare_event(self, event_object, current_time):
+        """
+        Sets the ts_created of a validated event object if missing, and validates its fields.
+        """
+        if not event_object.ts_created:
             event_object.ts_created = str(current_time)
 
         #Validate this object - ideally the validator should pass on problems, but for now just log
@@ -114,22 +185,6 @@ class EventPublisher(Publisher):
             log.exception(e)
 
 
-        #Ensure the event object has a unique id
-        if '_id' in event_object:
-            raise BadRequest("The event object cannot contain a _id field '%s'" % (event_object))
-
-        #Generate a unique ID for this event
-        event_object._id = create_unique_event_id()
-
-        try:
-            self.publish(event_object, to_name=to_name)
-        except Exception as ex:
-            log.exception("Failed to publish event (%s): '%s'" % (ex.message, event_object))
-            raise
-
-        return event_object
-
-
     def publish_event(self, origin=None, event_type=None, **kwargs):
         """
         Publishes an event of given type for the given origin. Event_type defaults to an
@@ -8,12 +8,14 @@ from pyon.core.thread import PyonThreadManager, PyonThread, ThreadManager, PyonT
 from pyon.ion.service import BaseService
 from gevent.event import Event, waitall, AsyncResult
 from gevent.queue import Queue
+from gevent.pool import Pool
 from gevent import greenlet, Timeout
 from pyon.util.async import spawn
 from pyon.core.exception import IonException, ContainerError
 from pyon.core.exception import Timeout as IonTimeout
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.core.bootstrap import CFG
+import fnmatch
 import threading
 import traceback
 
@@ -32,12 +34,42 @@ class OperationInterruptedException(BaseException):
 class IonProcessError(StandardError):
     pass
 
+def concurrent_operation(func):
+    """
+    Decorator marking a service operation as safe to run concurrently with other concurrent
+    operations of the same process. Only has an effect if the process has max_concurrency > 1.
+    """
+    func._concurrent_op = True
+    return func
+
+class CallQueue(Queue):
+    """
+    The control queue of an IonProcessThread.
+
+    Keeps the set of queued AsyncResults so a pending call can be found in constant time.
+    """
+    def _init(self, maxsize):
+        Queue._init(self, maxsize)
+        self.pending = set()
+
+    def _put(self, item):
+        Queue._put(self, item)
+        if isinstance(item, tuple):
+            self.pending.add(item[1])
+
+    def _get(self):
+        item = Queue._get(self)
+        if isinstance(item, tuple):
+            self.pending.discard(item[1])
+        return item
+
 class IonProcessThread(PyonThread):
     """
     Form the base of an ION process.
     """
 
-    def __init__(self, target=None, listeners=None, name=None, service=None, cleanup_method=None, heartbeat_secs=10, **kwargs):
+    def __init__(self, target=None, listeners=None, name=None, service=None, cleanup_method=None, heartbeat_secs=10,
+                 max_concurrency=1, concurrent_ops=None, **kwargs):
         """
         Constructs an ION process.
 
@@ -53,6 +85,12 @@ class IonProcessThread(PyonThread):
         @param  cleanup_method  An optional callable to run when the process is stopping. Runs after all other
                                 notify_stop calls have run. Should take one param, this instance.
         @param  heartbeat_secs  Number of seconds to wait in between heartbeats.
+        @param  max_concurrency Max number of calls processed at the same time. With the default of 1, all calls
+                                are processed one after the other in the control greenlet.
+        @param  concurrent_ops  A list of operation names (fnmatch patterns, e.g. "read_*") that may be processed
+                                concurrently if max_concurrency > 1, in addition to operations decorated with
+                                concurrent_operation. All other calls are serial: they wait for running calls to
+                                finish and no call starts before they are done.
         """
         self._startup_listeners = listeners or []
         self.listeners          = []
@@ -64,11 +102,18 @@ class IonProcessThread(PyonThread):
         self.thread_manager     = ThreadManager(failure_notify_callback=self._child_failed) # bubbles up to main thread manager
         self._dead_children     = []        # save any dead children for forensics
         self._ctrl_thread       = None
-        self._ctrl_queue        = Queue()
+        self._ctrl_queue        = CallQueue()
         self._ready_control     = Event()
         self._errors            = []
         self._ctrl_current      = None      # set to the AR generated by _routing_call when in the context of a call
 
+        # concurrent dispatch
+        self.max_concurrency    = max(int(max_concurrency or 1), 1)
+        self._concurrent_ops    = list(concurrent_ops or [])
+        self._concurrent_cache  = {}        # operation name -> bool, matches of _concurrent_ops
+        self._worker_pool       = Pool(size=self.max_concurrency) if self.max_concurrency > 1 else None
+        self._workers_active    = {}        # AR -> (worker greenlet, start time ms), for calls running in the worker pool
+
         # processing vs idle time (ms)
         self._start_time        = None
         self._proc_time         = 0   # busy time since start
@@ -82,6 +127,7 @@ class IonProcessThread(PyonThread):
         self._heartbeat_time    = None              # timestamp of heart beat last matching the current op
         self._heartbeat_op      = None              # last operation (by AR)
         self._heartbeat_count   = 0                 # number of times this operation has been seen consecutively
+        self._heartbeat_workers = {}                # AR -> (stacktrace, timestamp, count) as above, for worker pool calls
 
         PyonThread.__init__(self, target=target, **kwargs)
 
@@ -110,19 +156,8 @@ class IonProcessThread(PyonThread):
             st = traceback.extract_stack(self._ctrl_thread.proc.gr_frame)
 
             if self._ctrl_current == self._heartbeat_op:
-
-                if st == self._heartbeat_stack:
-                    self._heartbeat_count += 1  # we've seen this before! increment count
-
-                    # we've been in this for the last X ticks, or it's been X seconds, fail this part of the heartbeat
-                    if self._heartbeat_count > CFG.get_safe('cc.timeout.heartbeat_proc_count_threshold', 30) or \
-                       get_ion_ts_millis() - int(self._heartbeat_time) >= CFG.get_safe('cc.timeout.heartbeat_proc_time_threshold', 30) * 1000:
-                        heartbeat_ok = False
-                else:
-                    # it's made some progress
-                    self._heartbeat_count = 1
-                    self._heartbeat_stack = st
-                    self._heartbeat_time  = get_ion_ts()
+                heartbeat_ok, (self._heartbeat_stack, self._heartbeat_time, self._heartbeat_count) = \
+                    self._heartbeat_progress(st, (self._heartbeat_stack, self._heartbeat_time, self._heartbeat_count))
             else:
                 self._heartbeat_op      = self._ctrl_current
                 self._heartbeat_count   = 1
@@ -133,8 +168,44 @@ class IonProcessThread(PyonThread):
             self._heartbeat_op      = None
             self._heartbeat_count   = 0
 
+        # same for calls running in the worker pool
+        heartbeat_workers = {}
+        for ar, (worker, start_time) in self._workers_active.items():
+            if worker.gr_frame is None:
+                continue
+            st = traceback.extract_stack(worker.gr_frame)
+
+            if ar in self._heartbeat_workers:
+                worker_ok, heartbeat_workers[ar] = self._heartbeat_progress(st, self._heartbeat_workers[ar])
+                heartbeat_ok = heartbeat_ok and worker_ok
+            else:
+                heartbeat_workers[ar] = (st, get_ion_ts(), 1)
+        self._heartbeat_workers = heartbeat_workers
+
         return (listeners_ok, ctrl_thread_ok, heartbeat_ok)
 
+    def _heartbeat_progress(self, st, prior):
+        """
+        Compares the stacktrace of an operation seen in the prior heartbeat to its current one.
+
+        @param  prior   (stacktrace, timestamp, count) of the operation from the prior heartbeat.
+        @return 2-tuple of (heartbeat ok, new (stacktrace, timestamp, count)).
+        """
+        heartbeat_stack, heartbeat_time, heartbeat_count = prior
+
+        if st != heartbeat_stack:
+            # it's made some progress
+            return True, (st, get_ion_ts(), 1)
+
+        heartbeat_count += 1  # we've seen this before! increment count
+
+        # we've been in this for the last X ticks, or it's been X seconds, fail this part of the heartbeat
+        if heartbeat_count > CFG.get_safe('cc.timeout.heartbeat_proc_count_threshold', 30) or \
+           get_ion_ts_millis() - int(heartbeat_time) >= CFG.get_safe('cc.timeout.heartbeat_proc_time_threshold', 30) * 1000:
+            return False, (heartbeat_stack, heartbeat_time, heartbeat_count)
+
+        return True, (heartbeat_stack, heartbeat_time, heartbeat_count)
+
     @property
     def time_stats(self):
         """
@@ -143,7 +214,7 @@ class IonProcessThread(PyonThread):
         """
         now = get_ion_ts_millis()
         running_time = now - self._start_time
-        idle_time = running_time - self._proc_time
+        idle_time = int(running_time - self._proc_time)
 
         cur_interval = now / STAT_INTERVAL_LENGTH
         now_since_prior = now - (cur_interval - 1) * STAT_INTERVAL_LENGTH
@@ -155,7 +226,17 @@ class IonProcessThread(PyonThread):
         else:
             proc_time_since_prior = 0
 
-        return (running_time, idle_time, self._proc_time, now_since_prior, proc_time_since_prior)
+        return (running_time, idle_time, int(self._proc_time), now_since_prior, int(proc_time_since_prior))
+
+    @property
+    def pool_occupancy(self):
+        """
+        Returns the percentage (int) of the worker pool currently processing calls.
+        """
+        if self._worker_pool is None:
+            return 100 if self._ctrl_current is not None else 0
+
+        return len(self._workers_active) * 100 / self.max_concurrency
 
     def _child_failed(self, child):
         """
@@ -245,6 +326,12 @@ class IonProcessThread(PyonThread):
                 else:
                     stack_out = "N/A"
 
+                now = get_ion_ts_millis()
+                for ar, (st, _, _) in self._heartbeat_workers.iteritems():
+                    if ar in self._workers_active:
+                        stack_out += "\nWorker running for %s ms:\n%s" % (now - self._workers_active[ar][1],
+                                                                         "".join(traceback.format_list(st)))
+
                 #raise PyonHeartbeatError("Heartbeat failed: %s, stacktrace:\n%s" % (hbst, stack_out))
                 log.warn("Heartbeat failed: %s, stacktrace:\n%s", hbst, stack_out)
 
@@ -279,11 +366,7 @@ class IonProcessThread(PyonThread):
         """
         Returns true if the call (keyed by the AsyncResult returned by _routing_call) is still pending.
         """
-        for _, qar, _, _, _, _ in self._ctrl_queue.queue:
-            if qar == ar:
-                return True
-
-        return False
+        return ar in self._ctrl_queue.pending
 
     def _cancel_pending_call(self, ar):
         """
@@ -310,7 +393,29 @@ class IonProcessThread(PyonThread):
         The pending call is keyed by the AsyncResult returned by _routing_call.
         """
         if not self._cancel_pending_call(ar) and not ar.ready():
-            self._interrupt_control_thread()
+            worker, _ = self._workers_active.get(ar, (None, None))
+            if worker is not None:
+                worker.kill(exception=OperationInterruptedException, block=False)
+            else:
+                self._interrupt_control_thread()
+
+    def _is_concurrent_call(self, call):
+        """
+        Returns True if the given call may run in the worker pool, concurrent to other such calls.
+        """
+        if getattr(call, '_concurrent_op', False):
+            return True
+
+        op_name = getattr(call, '__name__', None)
+        if op_name is None or not self._concurrent_ops:
+            return False
+
+        concurrent = self._concurrent_cache.get(op_name, None)
+        if concurrent is None:
+            concurrent = any(fnmatch.fnmatchcase(op_name, pattern) for pattern in self._concurrent_ops)
+            self._concurrent_cache[op_name] = concurrent
+
+        return concurrent
 
     def _control_flow(self):
         """
@@ -325,6 +430,10 @@ class IonProcessThread(PyonThread):
         then calls from within this greenlet.  Any exception raised is caught and re-raised
         in the greenlet that originally scheduled the call.  If successful, the AsyncResult
         created at scheduling time is set with the result of the call.
+
+        If max_concurrency > 1, concurrent calls (see _is_concurrent_call) are handed to a worker pool
+        instead, blocking here while the pool is full. Serial calls first wait for all running workers
+        to complete.
         """
         if self.name:
             svc_name = "unnamed-service"
@@ -338,7 +447,6 @@ class IonProcessThread(PyonThread):
             calling_gl, ar, call, callargs, callkwargs, context = calltuple
             log.debug("control_flow making call: %s %s %s (has context: %s)", call, callargs, callkwargs, context is not None)
 
-            res = None
             start_proc_time = get_ion_ts_millis()
             self._record_proc_time(start_proc_time)
 
@@ -358,43 +466,93 @@ class IonProcessThread(PyonThread):
                 log.info("control_flow: attempting to process message that has been cancelled, ignore")
                 continue
 
-            try:
-                with self.service.push_context(context):
-                    with self.service.container.context.push_context(context):
-                        self._ctrl_current = ar
-                        res = call(*callargs, **callkwargs)
-            except OperationInterruptedException:
-                # endpoint layer takes care of response as it's the one that caused this
-                log.debug("Operation interrupted")
-                pass
-            except Exception as e:
-                # raise the exception in the calling greenlet, and don't
-                # wait for it to die - it's likely not going to do so.
-
-                # try decorating the args of the exception with the true traceback
-                # this should be reported by ThreadManager._child_failed
-                exc = PyonThreadTraceback("IonProcessThread _control_flow caught an exception (call: %s, *args %s, **kwargs %s, context %s)\nTrue traceback captured by IonProcessThread' _control_flow:\n\n%s" % (call, callargs, callkwargs, context, traceback.format_exc()))
-                e.args = e.args + (exc,)
-
-                # HACK HACK HACK
-                # we know that we only handle TypeError and IonException derived things, so only forward those if appropriate
-                if isinstance(e, (TypeError, IonException)):
-                    calling_gl.kill(exception=e, block=False)
-                else:
-                    # otherwise, swallow/record/report and hopefully we can continue on our way
-                    self._errors.append((call, callargs, callkwargs, context, e, exc))
+            if self._worker_pool is not None:
+                # waiting for workers counts as processing this call, so heartbeats see a stuck pool
+                self._ctrl_current = ar
+                try:
+                    if self._is_concurrent_call(call):
+                        self._worker_pool.spawn(self._worker_call, calltuple)     # blocks while pool is full
+                        continue
+
+                    # serial call: no other call may be running
+                    self._worker_pool.join()
+                except OperationInterruptedException:
+                    log.debug("Operation interrupted while waiting for workers")
+                    continue
+                finally:
+                    self._ctrl_current = None
 
-                    log.warn(exc)
-                    log.warn("Attempting to continue...")
+                start_proc_time = get_ion_ts_millis()
+                self._record_proc_time(start_proc_time)
 
-                    # have to raise something friendlier on the client side
-                    calling_gl.kill(exception=ContainerError(str(exc)), block=False)
+            self._ctrl_current = ar
+            try:
+                self._execute_call(calltuple, start_proc_time, self.max_concurrency)
             finally:
-                self._compute_proc_stats(start_proc_time)
-
                 self._ctrl_current = None
 
-            ar.set(res)
+        if self._worker_pool is not None:
+            self._worker_pool.join()
+
+    def _worker_call(self, calltuple):
+        """
+        Runs a concurrent call in a greenlet of the worker pool.
+        """
+        ar = calltuple[1]
+        if ar.ready():
+            log.info("control_flow: attempting to process message that has been cancelled, ignore")
+            return
+
+        start_proc_time = get_ion_ts_millis()
+        self._workers_active[ar] = (greenlet.getcurrent(), start_proc_time)
+        try:
+            self._record_proc_time(start_proc_time)
+            self._execute_call(calltuple, start_proc_time, 1)
+        finally:
+            self._workers_active.pop(ar, None)
+
+    def _execute_call(self, calltuple, start_proc_time, slots):
+        """
+        Makes a call from the control queue and sets its AsyncResult, or raises any error in the calling greenlet.
+
+        @param  slots       Number of worker slots the call occupies, used to weight the processing time.
+        """
+        calling_gl, ar, call, callargs, callkwargs, context = calltuple
+        res = None
+        try:
+            with self.service.push_context(context):
+                with self.service.container.context.push_context(context):
+                    res = call(*callargs, **callkwargs)
+        except OperationInterruptedException:
+            # endpoint layer takes care of response as it's the one that caused this
+            log.debug("Operation interrupted")
+            pass
+        except Exception as e:
+            # raise the exception in the calling greenlet, and don't
+            # wait for it to die - it's likely not going to do so.
+
+            # try decorating the args of the exception with the true traceback
+            # this should be reported by ThreadManager._child_failed
+            exc = PyonThreadTraceback("IonProcessThread _control_flow caught an exception (call: %s, *args %s, **kwargs %s, context %s)\nTrue traceback captured by IonProcessThread' _control_flow:\n\n%s" % (call, callargs, callkwargs, context, traceback.format_exc()))
+            e.args = e.args + (exc,)
+
+            # HACK HACK HACK
+            # we know that we only handle TypeError and IonException derived things, so only forward those if appropriate
+            if isinstance(e, (TypeError, IonException)):
+                calling_gl.kill(exception=e, block=False)
+            else:
+                # otherwise, swallow/record/report and hopefully we can continue on our way
+                self._errors.append((call, callargs, callkwargs, context, e, exc))
+
+                log.warn(exc)
+                log.warn("Attempting to continue...")
+
+                # have to raise something friendlier on the client side
+                calling_gl.kill(exception=ContainerError(str(exc)), block=False)
+        finally:
+            self._compute_proc_stats(start_proc_time, slots)
+
+        ar.set(res)
 
     def _record_proc_time(self, cur_time):
         """Keep the _proc_time of the prior and prior-prior intervals for stats computation"""
@@ -413,10 +571,13 @@ class IonProcessThread(PyonThread):
             self._proc_time_prior2 = self._proc_time
             self._proc_time_prior = self._proc_time
 
-    def _compute_proc_stats(self, start_proc_time):
+    def _compute_proc_stats(self, start_proc_time, slots=1):
         cur_time = get_ion_ts_millis()
         self._record_proc_time(cur_time)
         proc_time = cur_time - start_proc_time
+        if slots != self.max_concurrency:
+            # busy time is the worker pool occupancy over time
+            proc_time = proc_time * slots / float(self.max_concurrency)
         self._proc_time += proc_time
 
     def start_listeners(self):
@@ -8,9 +8,13 @@ __license__ = 'Apache 2.0'
 import inspect
 import types
 import time
+from contextlib import contextmanager
+
+from gevent import Timeout
+from gevent.pool import Pool
 
 from pyon.core.registry import getextends, issubtype, is_ion_object, isenum
-from pyon.core.bootstrap import IonObject
+from pyon.core.bootstrap import IonObject, CFG
 from pyon.core.exception import BadRequest, NotFound, Inconsistent, Unauthorized
 from pyon.util.config import Config
 from pyon.util.containers import DotDict, named_any, get_ion_ts
@@ -397,6 +401,13 @@ class ExtendedResourceContainer(object):
         # Keeps a context used during evaluation of the resource container fields
         self.ctx = None
 
+        # Method decorated fields can be computed concurrently in a bounded greenlet pool, with a
+        # deadline per field and for all fields of an object (seconds). Timed out fields are left unset.
+        self.concurrent = CFG.get_safe('container.extended_resources.concurrent', False)
+        self.pool_size = CFG.get_safe('container.extended_resources.pool_size', 8)
+        self.field_timeout = CFG.get_safe('container.extended_resources.field_timeout', 10.0)
+        self.overall_timeout = CFG.get_safe('container.extended_resources.overall_timeout', 30.0)
+
     def create_extended_resource_container_list(self, extended_resource_type, resource_id_list,
                                                 computed_resource_type=None,
                                                 ext_associations=None, ext_exclude=None, **kwargs):
@@ -407,10 +418,11 @@ class ExtendedResourceContainer(object):
             raise Inconsistent("The parameter resource_id_list is not a list of resource_ids")
 
         ret = list()
-        for res_id in resource_id_list:
-            ext_res = self.create_extended_resource_container(extended_resource_type, res_id, computed_resource_type,
-                ext_associations, ext_exclude )
-            ret.append(ext_res)
+        with self._read_memo():
+            for res_id in resource_id_list:
+                ext_res = self.create_extended_resource_container(extended_resource_type, res_id, computed_resource_type,
+                    ext_associations, ext_exclude )
+                ret.append(ext_res)
 
         return ret
 
@@ -419,6 +431,22 @@ class ExtendedResourceContainer(object):
         """
         Returns an extended resource container for a given resource_id.
         """
+        with self._read_memo():
+            return self._create_extended_resource_container(extended_resource_type, resource_id,
+                computed_resource_type=computed_resource_type, ext_associations=ext_associations,
+                ext_exclude=ext_exclude, **kwargs)
+
+    @contextmanager
+    def _read_memo(self):
+        # Resources are read repeatedly while filling a container; memoize reads if the registry is local
+        if hasattr(type(self._rr), 'request_memo'):
+            with self._rr.request_memo():
+                yield
+        else:
+            yield
+
+    def _create_extended_resource_container(self, extended_resource_type, resource_id, computed_resource_type=None,
+                                            ext_associations=None, ext_exclude=None, **kwargs):
         overall_start_time = time.time()
         self.ctx = None  # Clear the context in case this instance gets reused
 
@@ -468,6 +496,9 @@ class ExtendedResourceContainer(object):
         # Fill additional associations
         self.set_extended_associations(res_container, ext_associations, ext_exclude)
 
+        # Report concurrently computed fields, so a timed out field can be told from a None value
+        self.set_field_timing_info(res_container)
+
         res_container.ts_created = get_ion_ts()
 
         overall_stop_time = time.time()
@@ -527,6 +558,7 @@ class ExtendedResourceContainer(object):
         resource_needs = set()   # Resources to read by id based on needs
         assoc_needs = set()      # Compound associations to follow
         final_target_types = {}  # Keeps track of what resource type filter is desired
+        method_calls = [] if self.concurrent else None  # Method decorated fields to compute concurrently
 
         for field in obj._schema:
 
@@ -543,6 +575,10 @@ class ExtendedResourceContainer(object):
                     deco_value = obj.get_decorator_value(field, decorator)
                     method_name = deco_value if deco_value else 'get_' + field
 
+                    if method_calls is not None:
+                        method_calls.append((field, method_name))
+                        continue
+
                     ret_val = self.execute_method_with_resource(resource._id, method_name, **kwargs)
                     if ret_val is not None:
                         setattr(obj, field, ret_val)
@@ -607,6 +643,9 @@ class ExtendedResourceContainer(object):
 
                 log.debug("Time to process field %s(%s) %f secs", field, decorator, field_stop_time - field_start_time)
 
+        if method_calls:
+            self._execute_methods_concurrently(obj, resource, method_calls, **kwargs)
+
         # field_needs contains a list of what's needed to load in next step (different cases)
         if not field_needs:
             return
@@ -671,6 +710,79 @@ class ExtendedResourceContainer(object):
                     else:
                         setattr(obj, field, None)
 
+    def _execute_methods_concurrently(self, obj, resource, method_calls, **kwargs):
+        """
+        Executes the methods for the given list of (field, method name) in a bounded greenlet pool
+        and sets the field values of obj. Calls exceeding the field timeout or still running at the
+        overall timeout leave their field unset (partial result). Per field execution times and
+        timed out fields are kept in the context as field_times and timed_out_fields, keyed by
+        (object type, field) since the container and its computed attributes share field names.
+        """
+        if self.ctx is None:
+            self.ctx = dict(by_subject={}, by_object={})
+        field_times = self.ctx.setdefault('field_times', {})
+        timed_out_fields = self.ctx.setdefault('timed_out_fields', [])
+
+        # The calling process context (e.g. actor headers) is greenlet local and needs to be passed on
+        get_context = getattr(self.service_provider, 'get_context', None)
+        proc_ctx = get_context() if callable(get_context) else None
+
+        def execute_field(field, method_name):
+            key = (obj.type_, field)
+            start_time = time.time()
+            timeout = Timeout(self.field_timeout)
+            timeout.start()
+            try:
+                with self._service_context(proc_ctx):
+                    return self.execute_method_with_resource(resource._id, method_name, **kwargs)
+            except Timeout as t:
+                if t is not timeout:
+                    raise
+                timed_out_fields.append(key)
+                log.warn("Extended resource field %s of resource %s timed out", field, resource._id)
+            finally:
+                timeout.cancel()
+                field_times[key] = time.time() - start_time
+
+        pool = Pool(self.pool_size)
+        calls = []
+        with Timeout(self.overall_timeout, False):
+            for field, method_name in method_calls:
+                calls.append((field, pool.spawn(execute_field, field, method_name)))
+            pool.join()
+        pool.kill(block=False)
+
+        for field, method_name in method_calls[len(calls):]:
+            timed_out_fields.append((obj.type_, field))
+        for field, gl in calls:
+            if not gl.ready():
+                timed_out_fields.append((obj.type_, field))
+            elif gl.successful() and gl.value is not None:
+                setattr(obj, field, gl.value)
+        if timed_out_fields:
+            log.warn("Extended resource %s fields not computed in time: %s", resource._id, timed_out_fields)
+
+    def set_field_timing_info(self, res_container):
+        """
+        Adds the execution times (secs) of concurrently computed fields and the fields that timed out
+        to the container's ext_associations, as _field_times and _timed_out_fields. Fields are named
+        "<object type>.<field>".
+        """
+        if not self.ctx or not self.ctx.get('field_times', None):
+            return
+
+        res_container.ext_associations['_field_times'] = dict(('%s.%s' % key, field_time)
+                                                              for key, field_time in self.ctx['field_times'].iteritems())
+        res_container.ext_associations['_timed_out_fields'] = ['%s.%s' % key for key in self.ctx['timed_out_fields']]
+
+    @contextmanager
+    def _service_context(self, proc_ctx):
+        if isinstance(proc_ctx, dict):
+            with self.service_provider.push_context(proc_ctx):
+                yield
+        else:
+            yield
+
     def set_extended_associations(self, res_container, ext_associations, ext_exclude):
         """
         Iterates over the dict of extended field names and associations dynamically passed in.
@@ -7,12 +7,20 @@ __license__ = 'Apache 2.0'
 
 
 import base64
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ooi.timer import Accumulator
 
 from pyon.core import bootstrap
+from pyon.core.bootstrap import CFG
 from pyon.core.exception import BadRequest, NotFound, Inconsistent
-from pyon.core.object import IonObjectBase
+from pyon.core.object import IonObjectBase, IonObjectDeserializer
 from pyon.datastore.datastore import DataStore
-from pyon.ion.event import EventPublisher
+from pyon.ion.event import EventPublisher, EventSubscriber
 from pyon.ion.identifier import create_unique_resource_id
 from pyon.ion.resource import LCS, LCE, PRED, RT, AS, OT, get_restype_lcsm, is_resource, ExtendedResourceContainer, lcstate, lcsplit
 from pyon.util.containers import get_ion_ts
@@ -20,6 +28,68 @@ from pyon.util.log import log
 
 from interface.objects import Attachment, AttachmentType, ResourceModificationType
 
+stats = Accumulator(persist=True)
+
+
+class ResourceCache(object):
+    """
+    Cache of resource documents by id, each entry versioned by the document _rev.
+    Entries are evicted least recently used beyond max_size and expire after ttl seconds (0 for no expiry).
+    Documents are kept in persisted form and must not be handed out; readers decode a copy.
+    """
+
+    def __init__(self, max_size=1000, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # Resource id -> (rev, doc, time cached)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, res_id, rev_id=None):
+        """
+        Returns the cached document for res_id (with the given revision, if any) or None.
+        """
+        entry = self._entries.pop(res_id, None)
+        if entry is not None:
+            rev, doc, ts = entry
+            if self.ttl and time.time() - ts > self.ttl:
+                entry = None
+            else:
+                # Reinsert as most recently used
+                self._entries[res_id] = entry
+                if rev_id and rev_id != rev:
+                    entry = None
+
+        if entry is None:
+            self.misses += 1
+            stats.add_value('resregistry.cache.hit', 0)
+            return None
+
+        self.hits += 1
+        stats.add_value('resregistry.cache.hit', 1)
+        return entry[1]
+
+    def put(self, doc):
+        res_id = doc['_id']
+        self._entries.pop(res_id, None)
+        self._entries[res_id] = (doc['_rev'], doc, time.time())
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, res_id):
+        self._entries.pop(res_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        reads = self.hits + self.misses
+        return dict(size=len(self._entries), hits=self.hits, misses=self.misses,
+                    hit_ratio=float(self.hits) / reads if reads else 0.0)
+
 
 class ResourceRegistry(object):
     """
@@ -39,10 +109,27 @@ class ResourceRegistry(object):
 
         self.event_pub = EventPublisher()
 
+        # Read-through resource cache, invalidated by resource events. Disabled unless configured
+        self.cache = None
+        self._cache_sub = None
+        if CFG.get_safe('container.resource_registry.cache.enabled', False):
+            self.cache = ResourceCache(max_size=CFG.get_safe('container.resource_registry.cache.size', 1000),
+                                       ttl=CFG.get_safe('container.resource_registry.cache.ttl', 30.0))
+
+        # Greenlet local memo of resource reads, see request_memo
+        self._memo_local = threading.local()
+        self._io_deserializer = IonObjectDeserializer(obj_registry=bootstrap.get_obj_registry())
+
     def start(self):
-        pass
+        if self.cache is not None:
+            # Resource changes in other containers invalidate cached entries
+            self._cache_sub = EventSubscriber(event_type="ResourceEvent", callback=self._on_resource_event, auto_delete=True)
+            self._cache_sub.start()
 
     def stop(self):
+        if self._cache_sub:
+            self._cache_sub.stop()
+            self._cache_sub = None
         self.close()
 
     def close(self):
@@ -117,12 +204,88 @@ class ResourceRegistry(object):
         if not object_id:
             raise BadRequest("The object_id parameter is an empty string")
 
-        return self.rr_store.read(object_id, rev_id)
+        memo = getattr(self._memo_local, 'memo', None)
+        if self.cache is None and memo is None:
+            return self.rr_store.read(object_id, rev_id)
+
+        if not isinstance(object_id, str):
+            raise BadRequest("Object id param is not string")
+        doc = None
+        if memo is not None and object_id in memo:
+            doc = memo[object_id]
+            if rev_id and rev_id != doc['_rev']:
+                doc = None
+        if doc is None and self.cache is not None:
+            doc = self.cache.get(object_id, rev_id)
+        if doc is None:
+            doc = self.rr_store.read_doc(object_id, rev_id)
+            if self.cache is not None and not rev_id:
+                self.cache.put(doc)
+        if memo is not None and not rev_id:
+            memo[object_id] = doc
+        return self._deserialize_doc(doc)
 
     def read_mult(self, object_ids=None):
         if object_ids is None:
             raise BadRequest("The object_ids parameter is empty")
-        return self.rr_store.read_mult(object_ids)
+
+        memo = getattr(self._memo_local, 'memo', None)
+        if self.cache is None and memo is None:
+            return self.rr_store.read_mult(object_ids)
+
+        docs = {}
+        for obj_id in object_ids:
+            doc = memo.get(obj_id, None) if memo is not None else None
+            if doc is None and self.cache is not None:
+                doc = self.cache.get(obj_id)
+            if doc is not None:
+                docs[obj_id] = doc
+        missing_ids = [obj_id for obj_id in object_ids if obj_id not in docs]
+        if missing_ids:
+            for doc in self.rr_store.read_doc_mult(missing_ids):
+                docs[doc['_id']] = doc
+                if self.cache is not None:
+                    self.cache.put(doc)
+        if memo is not None:
+            memo.update(docs)
+        return [self._deserialize_doc(docs[obj_id]) for obj_id in object_ids]
+
+    def _deserialize_doc(self, doc):
+        # Cached and memoized docs are shared; decoding works in place and the resulting
+        # object keeps the doc's lists and dicts, so decode a private copy
+        return self._io_deserializer.deserialize(copy.deepcopy(doc))
+
+    @contextmanager
+    def request_memo(self):
+        """
+        Memoizes resource reads in the current greenlet for the duration of the with block,
+        such as one RPC request, so that repeated reads of a resource go to the datastore once.
+        Changes made through this registry are seen; nested blocks share the outermost memo.
+        """
+        if getattr(self._memo_local, 'memo', None) is not None:
+            yield
+            return
+        self._memo_local.memo = {}
+        try:
+            yield
+        finally:
+            self._memo_local.memo = None
+
+    def _invalidate(self, object_id):
+        if self.cache is not None:
+            self.cache.invalidate(object_id)
+        memo = getattr(self._memo_local, 'memo', None)
+        if memo is not None:
+            memo.pop(object_id, None)
+
+    def _on_resource_event(self, event, headers):
+        self._invalidate(event.origin)
+
+    def get_cache_stats(self):
+        """
+        Returns the resource cache statistics (size, hits, misses, hit_ratio), or None if the cache is disabled
+        """
+        return self.cache.get_stats() if self.cache is not None else None
 
     def update(self, object):
         if object is None:
@@ -145,7 +308,10 @@ class ResourceRegistry(object):
                                      sub_type="UPDATE",
                                      mod_type=ResourceModificationType.UPDATE)
 
-        return self.rr_store.update(object)
+        try:
+            return self.rr_store.update(object)
+        finally:
+            self._invalidate(object._id)
 
     def delete(self, object_id='', del_associations=False):
         res_obj = self.read(object_id)
@@ -158,6 +324,7 @@ class ResourceRegistry(object):
         res_obj.lcstate = LCS.RETIRED
         self.rr_store.update(res_obj)
         res = self.rr_store.delete(object_id, del_associations=del_associations)
+        self._invalidate(object_id)
 
         if self.container.has_capability(self.container.CCAP.EVENT_PUBLISHER):
             self.event_pub.publish_event(event_type="ResourceModifiedEvent",
@@ -189,6 +356,7 @@ class ResourceRegistry(object):
         res_obj.ts_updated = get_ion_ts()
 
         updres = self.rr_store.update(res_obj)
+        self._invalidate(resource_id)
         log.debug("retire(res_id=%s). Change %s_%s to %s_%s", resource_id,
                   old_state, old_availability, res_obj.lcstate, res_obj.availability)
 
@@ -197,6 +365,8 @@ class ResourceRegistry(object):
             assoc.retired = True
         if assocs:
             self.rr_store.update_mult(assocs)
+            for assoc in assocs:
+                self._invalidate(assoc._id)
             log.debug("retire(res_id=%s). Retired %s associations", resource_id, len(assocs))
 
         if self.container.has_capability(self.container.CCAP.EVENT_PUBLISHER):
@@ -233,6 +403,7 @@ class ResourceRegistry(object):
 
         res_obj.ts_updated = get_ion_ts()
         self.rr_store.update(res_obj)
+        self._invalidate(resource_id)
         log.debug("execute_lifecycle_transition(res_id=%s, event=%s). Change %s_%s to %s_%s", resource_id, transition_event,
                   old_state, old_availability, res_obj.lcstate, res_obj.availability)
 
@@ -288,6 +459,7 @@ class ResourceRegistry(object):
         res_obj.ts_updated = get_ion_ts()
 
         updres = self.rr_store.update(res_obj)
+        self._invalidate(resource_id)
         log.debug("set_lifecycle_state(res_id=%s, target=%s). Change %s_%s to %s_%s", resource_id, old_target,
                   old_state, old_availability, res_obj.lcstate, res_obj.availability)
 
@@ -362,7 +534,9 @@ class ResourceRegistry(object):
         return attachment
 
     def delete_attachment(self, attachment_id=''):
-        return self.rr_store.delete(attachment_id, del_associations=True)
+        res = self.rr_store.delete(attachment_id, del_associations=True)
+        self._invalidate(attachment_id)
+        return res
 
     def find_attachments(self, resource_id='', keyword=None,
                          limit=0, descending=False, include_content=False, id_only=True):
@@ -385,7 +559,12 @@ class ResourceRegistry(object):
         return self.rr_store.create_association(subject, predicate, object, assoc_type)
 
     def delete_association(self, association=''):
-        return self.rr_store.delete_association(association)
+        res = self.rr_store.delete_association(association)
+        if isinstance(association, IonObjectBase):
+            self._invalidate(association._id)
+        elif isinstance(association, str):
+            self._invalidate(association)
+        return res
 
     def find(self, **kwargs):
         raise NotImplementedError("Do not use find. Use a specific find operation instead.")
@@ -451,12 +630,13 @@ class ResourceRegistry(object):
     def find_resources_ext(self, restype="", lcstate="", name="",
                            keyword=None, nested_type=None,
                            attr_name=None, attr_value=None, alt_id="", alt_id_ns="",
-                           limit=None, skip=None, descending=None, id_only=False):
+                           limit=None, skip=None, descending=None, id_only=False,
+                           page_size=None, page_token=None):
         return self.rr_store.find_resources_ext(restype=restype, lcstate=lcstate, name=name,
             keyword=keyword, nested_type=nested_type,
             attr_name=attr_name, attr_value=attr_value, alt_id=alt_id, alt_id_ns=alt_id_ns,
             limit=limit, skip=skip, descending=descending,
-            id_only=id_only)
+            id_only=id_only, page_size=page_size, page_token=page_token)
 
 
     def get_resource_extension(self, resource_id='', resource_extension='', computed_resource_type=None, ext_associations=None, ext_exclude=None, **kwargs ):
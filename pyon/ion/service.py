@@ -5,6 +5,8 @@
 __author__ = 'Adam R. Smith, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+import os
+import yaml
 from zope.interface import implementedBy
 
 from pyon.core.exception import BadRequest, ServerError
@@ -101,6 +103,11 @@ class BaseService(LocalContextMixin):
         """Framework hook to quit"""
         self.running = False
 
+        # Close the channels of this process' stream publishers, see pyon.ion.stream
+        publisher_cache = getattr(self, '_stream_publisher_cache', None)
+        if publisher_cache is not None:
+            publisher_cache.close()
+
     def on_quit(self):
         """
         Method called just before service termination.
@@ -152,6 +159,11 @@ class BaseService(LocalContextMixin):
 
 # -----------------------------------------------------------------------------------------------
 # Service management infrastructure
+
+# Index of generated service interface modules, written by generate_interfaces.
+# Maps service name to a dict with module, base, client, simple_client, dependencies
+SERVICE_MANIFEST_FILE = "interface/services/manifest.yml"
+
 class IonServiceDefinition(object):
     """
     Provides a walkable structure for ION service metadata and object definitions.
@@ -200,22 +212,40 @@ class IonServiceOperation(object):
 
 
 class IonServiceRegistry(object):
+    """
+    Registry of service definitions. Either all service interface modules are imported
+    (load_service_mods, build_service_map), or a service manifest is loaded
+    (load_service_manifest) and each service module is imported when the service is
+    first referenced.
+    """
     def __init__(self):
-        self.services = {}
+        self._services = {}
         self.services_by_name = {}
         self.classes_loaded = False
         self.operations = None
 
+        # Lazy loading from service manifest: service name -> manifest entry
+        self.service_index = {}
+        self._all_loaded = True
+
+    @property
+    def services(self):
+        """
+        Returns the dict of all service definitions, loading all indexed service modules if needed.
+        """
+        self.load_all_services()
+        return self._services
+
     def add_servicedef_entry(self, name, key, value, append=False):
         if not name:
             #log.warning("No name for key=%s, value=%s" % (key, value))
             return
 
-        if not name in self.services:
+        if not name in self._services:
             svc_def = IonServiceDefinition(name)
-            self.services[name] = svc_def
+            self._services[name] = svc_def
         else:
-            svc_def = self.services[name]
+            svc_def = self._services[name]
 
         oldvalue = getattr(svc_def, key, None)
         if oldvalue is not None:
@@ -253,19 +283,75 @@ class IonServiceRegistry(object):
         for cls in BaseService.__subclasses__():
             assert hasattr(cls, 'name'), 'Service class must define name value. Service class in error: %s' % cls
             if cls.name:
-                self.services_by_name[cls.name] = cls
-                self.add_servicedef_entry(cls.name, "base", cls)
-                interfaces = list(implementedBy(cls))
-                if interfaces:
-                    self.add_servicedef_entry(cls.name, "interface", interfaces[0])
-                if cls.__name__.startswith("Base"):
-                    try:
-                        client = "%s.%sProcessClient" % (cls.__module__, cls.__name__[4:])
-                        self.add_servicedef_entry(cls.name, "client", named_any(client))
-                        sclient = "%s.%sClient" % (cls.__module__, cls.__name__[4:])
-                        self.add_servicedef_entry(cls.name, "simple_client", named_any(sclient))
-                    except Exception, ex:
-                        log.warning("Cannot find client for service %s" % (cls.name))
+                self._add_service_base(cls)
+
+    def _add_service_base(self, cls):
+        self.services_by_name[cls.name] = cls
+        self.add_servicedef_entry(cls.name, "base", cls)
+        interfaces = list(implementedBy(cls))
+        if interfaces:
+            self.add_servicedef_entry(cls.name, "interface", interfaces[0])
+        if cls.__name__.startswith("Base"):
+            try:
+                client = "%s.%sProcessClient" % (cls.__module__, cls.__name__[4:])
+                self.add_servicedef_entry(cls.name, "client", named_any(client))
+                sclient = "%s.%sClient" % (cls.__module__, cls.__name__[4:])
+                self.add_servicedef_entry(cls.name, "simple_client", named_any(sclient))
+            except Exception, ex:
+                log.warning("Cannot find client for service %s" % (cls.name))
+
+    def load_service_manifest(self, path=SERVICE_MANIFEST_FILE):
+        """
+        Loads the index of service interface modules written by generate_interfaces.
+        Service modules are then imported when a service is first referenced.
+        @retval True if the manifest was loaded, False if not available
+        """
+        if not os.path.exists(path):
+            log.debug("No service manifest at %s", path)
+            return False
+        try:
+            with open(path, "r") as f:
+                service_index = yaml.load(f)
+        except Exception as ex:
+            log.warning("Cannot load service manifest %s: %s" % (path, ex))
+            return False
+        if not isinstance(service_index, dict):
+            log.warning("Invalid service manifest %s" % path)
+            return False
+
+        self.service_index = dict(service_index)
+        self._all_loaded = False
+        log.debug("Loaded service manifest with %s services", len(self.service_index))
+        return True
+
+    def load_service(self, name):
+        """
+        Imports the interface module for the given service name from the service manifest
+        and adds its definition to the registry, if not yet loaded.
+        @retval True if the service definition is available
+        """
+        if name in self.services_by_name:
+            return True
+        entry = self.service_index.get(name, None)
+        if not entry:
+            return name in self._services
+        try:
+            cls = named_any("%s.%s" % (entry['module'], entry['base']))
+        except Exception, ex:
+            log.warning("Import module '%s' failed: %s" % (entry['module'], ex))
+            return False
+        self._add_service_base(cls)
+        return True
+
+    def load_all_services(self):
+        """
+        Imports all service interface modules from the service manifest not yet loaded.
+        """
+        if self._all_loaded:
+            return
+        for name in self.service_index:
+            self.load_service(name)
+        self._all_loaded = True
 
     def discover_service_classes(self):
         """
@@ -285,8 +371,9 @@ class IonServiceRegistry(object):
         """
         Returns the service base class with interface for the given service name or None.
         """
-        if name in self.services:
-            return getattr(self.services[name], 'base', None)
+        self.load_service(name)
+        if name in self._services:
+            return getattr(self._services[name], 'base', None)
         else:
             return None
 
@@ -294,8 +381,9 @@ class IonServiceRegistry(object):
         """
         Returns the service definition for the given service name or None.
         """
-        if name in self.services:
-            return self.services[name]
+        self.load_service(name)
+        if name in self._services:
+            return self._services[name]
         else:
             return None
 
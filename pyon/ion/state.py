@@ -5,6 +5,8 @@
 __author__ = 'Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+import time
+
 from pyon.core import bootstrap
 from pyon.core.exception import NotFound, BadRequest, Conflict
 from pyon.datastore.datastore import DataStore
@@ -13,6 +15,17 @@ from pyon.util.log import log
 
 from interface.objects import ProcessState
 
+# Process state update modes: the whole state document is written on flush, or only changed keys
+STATE_MODE_FULL = "full"
+STATE_MODE_DELTA = "delta"
+
+# In delta mode, the process state document holds the list of persisted keys under this key,
+# and each key's value is kept in its own document (versioned by its revision)
+DELTA_KEYS = "__delta_keys__"
+
+# Number of attempts to resolve update conflicts in delta mode
+DELTA_RETRIES = 3
+
 
 class StateRepository(object):
     """
@@ -77,22 +90,168 @@ class StateRepository(object):
             state_obj._rev = rev
         return state_obj
 
-    def get_state(self, key):
+    def put_state_delta(self, key, changes, deleted=None, revs=None):
+        """
+        Persist only the changed keys of a private process state, using the given key
+        (typically a process id). Each state key is stored in its own document, so unchanged
+        keys are not rewritten. Update conflicts are resolved per state key (last writer wins
+        for that key only), not by rewriting the whole state.
+        A state previously persisted with put_state is converted on the first delta update.
+        The same locking WARNING as for put_state applies.
+        @param changes  dict of changed state keys and their new values
+        @param deleted  optional list of state keys removed from the state
+        @param revs     optional dict of state key to document revision from prior calls (see get_state),
+                        updated in place. Saves reads and conflicts.
+        @retval the dict of revisions
+        """
+        log.debug("Store persistent state delta for key=%s, changed=%s, deleted=%s", key, len(changes), len(deleted or []))
+        if not isinstance(changes, dict):
+            raise BadRequest("changes must be type dict, not %s" % type(changes))
+        revs = revs if revs is not None else {}
+        deleted = set(deleted or [])
+
+        if DELTA_KEYS not in revs:
+            # First delta update: find the persisted keys, convert a whole state document
+            try:
+                state_obj = self.state_store.read(key)
+                revs[DELTA_KEYS] = state_obj._rev
+                if DELTA_KEYS not in state_obj.state:
+                    old_state = dict(state_obj.state)
+                    old_state.update(changes)
+                    changes = old_state
+            except NotFound:
+                pass
+        new_keys = [k for k in changes if k not in revs]
+
+        ts = get_ion_ts()
+        pending = dict((k, v) for k, v in changes.iteritems() if k not in deleted)
+        for attempt in xrange(DELTA_RETRIES):
+            if not pending:
+                break
+            docs = []
+            for state_key, value in pending.iteritems():
+                doc = dict(_id=self._delta_doc_id(key, state_key), key=key, state_key=state_key, value=value, ts=ts)
+                if revs.get(state_key, None):
+                    doc['_rev'] = revs[state_key]
+                docs.append(doc)
+
+            res = self.state_store.create_doc_mult(docs, allow_ids=True)
+            conflicts = []
+            for doc, (success, doc_id, rev) in zip(docs, res):
+                if success:
+                    revs[doc['state_key']] = rev
+                    del pending[doc['state_key']]
+                else:
+                    conflicts.append(doc['state_key'])
+            if conflicts:
+                log.info("Process %s state update conflict for keys %s - retry.", key, conflicts)
+                self._read_delta_revs(key, conflicts, revs)
+        if pending:
+            raise Conflict("Process %s state update failed for keys %s" % (key, pending.keys()))
+
+        if deleted:
+            unknown = [k for k in deleted if not revs.get(k, None)]
+            if unknown:
+                self._read_delta_revs(key, unknown, revs)
+            docs = [dict(_id=self._delta_doc_id(key, k), _rev=revs[k], _deleted=True) for k in deleted if revs.get(k, None)]
+            if docs:
+                self.state_store.create_doc_mult(docs, allow_ids=True)
+            for state_key in deleted:
+                revs.pop(state_key, None)
+
+        if new_keys or deleted or DELTA_KEYS not in revs:
+            self._update_delta_keys(key, set(new_keys), deleted, revs)
+
+        return revs
+
+    def get_state(self, key, revs=None):
         """
         Returns the state vector for given key (typically a process id).
         The state vector is a previously persisted object (e.g. a dict).
         In case no state was found, NotFound is raised.
+        @param revs     optional dict, filled with the revisions of a state persisted by put_state_delta
         @retval a tuple with state vector and ProcessState object
         """
         log.debug("Retrieving persistent state for key=%s", key)
         state_obj = self.state_store.read(key)
+        if DELTA_KEYS in state_obj.state:
+            state_keys = state_obj.state[DELTA_KEYS]
+            state = {}
+            if revs is not None:
+                revs[DELTA_KEYS] = state_obj._rev
+            for doc in self._read_delta_docs(key, state_keys):
+                state[doc['state_key']] = doc['value']
+                if revs is not None:
+                    revs[doc['state_key']] = doc['_rev']
+            state_obj.state = state
         return state_obj.state, state_obj
 
+    def _delta_doc_id(self, key, state_key):
+        return "%s:%s" % (key, state_key)
+
+    def _read_delta_docs(self, key, state_keys):
+        """
+        Returns the existing documents for given state keys.
+        """
+        doc_ids = [self._delta_doc_id(key, state_key) for state_key in state_keys]
+        try:
+            return self.state_store.read_doc_mult(doc_ids)
+        except NotFound:
+            # Some keys were removed concurrently - read individually
+            docs = []
+            for doc_id in doc_ids:
+                try:
+                    docs.append(self.state_store.read_doc(doc_id))
+                except NotFound:
+                    pass
+            return docs
+
+    def _read_delta_revs(self, key, state_keys, revs):
+        for state_key in state_keys:
+            revs.pop(state_key, None)
+        for doc in self._read_delta_docs(key, state_keys):
+            revs[doc['state_key']] = doc['_rev']
+
+    def _update_delta_keys(self, key, added, deleted, revs):
+        """
+        Updates the list of persisted state keys in the process state document.
+        Conflicts are resolved by merging the added and deleted keys into the current list.
+        """
+        for attempt in xrange(DELTA_RETRIES):
+            try:
+                if revs.get(DELTA_KEYS, None):
+                    state_obj = self.state_store.read(key)
+                    state_keys = set(state_obj.state.get(DELTA_KEYS, []))
+                    state_keys = (state_keys | added) - deleted
+                    state_obj.state = {DELTA_KEYS: sorted(state_keys)}
+                    state_obj.ts = get_ion_ts()
+                    id, rev = self.state_store.update(state_obj)
+                else:
+                    state_obj = ProcessState(state={DELTA_KEYS: sorted(added - deleted)}, ts=get_ion_ts())
+                    id, rev = self.state_store.create(state_obj, object_id=key)
+                revs[DELTA_KEYS] = rev
+                return
+            except (Conflict, BadRequest) as ex:
+                # BadRequest on create if the document was created concurrently
+                log.info("Process %s state keys update conflict - retry.", key)
+                try:
+                    revs[DELTA_KEYS] = self.state_store.read(key)._rev
+                except NotFound:
+                    revs.pop(DELTA_KEYS, None)
+        raise Conflict("Process %s state keys update failed" % key)
+
 
 class StatefulProcessMixin(object):
     """
     Mixin class for stateful processes.
     Need to avoid __init__
+
+    The container flushes a changed state after a process operation, according to the flush
+    policy in the process configuration:
+    - process.state.flush_changes: flush once this many changes were made (0: not used)
+    - process.state.flush_interval: flush once this many seconds passed since the last flush (0: not used)
+    If neither is set, the state is flushed after each operation that changed it.
+    With process.state.update_mode "delta", only the changed keys are persisted.
     """
     def _set_state(self, key, value):
         """
@@ -107,6 +266,8 @@ class StatefulProcessMixin(object):
         if old_state != value:
             self._proc_state[key] = value
             self._proc_state_changed = True
+            self._get_dirty_keys().add(key)
+            self._proc_state_change_count = getattr(self, "_proc_state_change_count", 0) + 1
             log.debug("Process state updated. pid=%s, key=%s, value=%s", self.id, key, value)
 
     def _get_state(self, key, default=None):
@@ -137,6 +298,57 @@ class StatefulProcessMixin(object):
         if not hasattr(self, "_proc_state"):
             self._proc_state = {}
         self._proc_state_changed = True
+        self._proc_state_dirty_all = True
+        self._proc_state_change_count = getattr(self, "_proc_state_change_count", 0) + 1
+
+    def _get_dirty_keys(self):
+        if getattr(self, "_proc_state_dirty", None) is None:
+            self._proc_state_dirty = set()
+        return self._proc_state_dirty
+
+    def _get_state_changes(self, persisted_keys=()):
+        """
+        Returns a tuple of a dict with the state keys changed since the last flush and their
+        values, and a list of the state keys removed. If the whole state vector was marked
+        as changed, all keys are returned as changed and the given persisted keys that are
+        no longer in the state vector as removed.
+        """
+        state = self._get_state_vector()
+        if getattr(self, "_proc_state_dirty_all", False):
+            changes = dict(state)
+            deleted = [k for k in persisted_keys if k not in state]
+        else:
+            dirty = self._get_dirty_keys()
+            changes = dict((k, state[k]) for k in dirty if k in state)
+            deleted = [k for k in dirty if k not in state]
+        return changes, deleted
+
+    def _reset_state_changes(self):
+        """
+        Clears change tracking after the state was flushed or loaded.
+        """
+        self._proc_state_changed = False
+        self._proc_state_dirty = set()
+        self._proc_state_dirty_all = False
+        self._proc_state_change_count = 0
+        self._proc_state_flush_time = time.time()
+
+    def _is_state_flush_due(self):
+        """
+        Returns True if the state has changed and should be flushed now according to the
+        process's flush policy.
+        """
+        if not getattr(self, "_proc_state_changed", False):
+            return False
+        flush_changes = getattr(self, "_proc_state_flush_changes", 0)
+        flush_interval = getattr(self, "_proc_state_flush_interval", 0)
+        if not flush_changes and not flush_interval:
+            return True
+        if flush_changes and getattr(self, "_proc_state_change_count", 0) >= flush_changes:
+            return True
+        if flush_interval and time.time() - getattr(self, "_proc_state_flush_time", 0) >= flush_interval:
+            return True
+        return False
 
     def _flush_state(self):
         """
@@ -9,7 +9,8 @@
 import gevent
 
 from pyon.core.exception import BadRequest
-from pyon.net.endpoint import Publisher, Subscriber
+from pyon.net.channel import ChannelClosedError
+from pyon.net.endpoint import Publisher, Subscriber, PublisherEndpointCache
 from pyon.util.arg_check import validate_is_instance
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceProcessClient
 from pyon.util.log import log
@@ -17,6 +18,47 @@ from pyon.ion.service import BaseService
 from interface.objects import StreamRoute
 
 
+class StreamPublisherCache(object):
+    '''
+    Exchange points by name and publisher endpoints by route (see PublisherEndpointCache) used by the
+    stream publishers of a process, so that publishing to many streams reuses exchange points and channels.
+    '''
+
+    def __init__(self, container, max_size=None, idle_timeout=None):
+        self.container = container
+        self.endpoints = PublisherEndpointCache(max_size=max_size, idle_timeout=idle_timeout)
+        self._xps = {}
+
+    def get_xp(self, exchange_point):
+        '''
+        Returns the exchange point of the given name, creating it once.
+        '''
+        xp = self._xps.get(exchange_point, None)
+        if xp is None:
+            xp = self._xps[exchange_point] = self.container.ex_manager.create_xp(exchange_point)
+        return xp
+
+    def get_xp_route(self, stream_route):
+        '''
+        Returns the route to publish on for a StreamRoute.
+        '''
+        return self.get_xp(stream_route.exchange_point).create_route(stream_route.routing_key)
+
+    def close(self):
+        self.endpoints.close()
+        self._xps.clear()
+
+
+def get_stream_publisher_cache(process):
+    '''
+    Returns the StreamPublisherCache shared by the stream publishers of a process, closed when the process quits.
+    '''
+    cache = getattr(process, '_stream_publisher_cache', None)
+    if cache is None:
+        cache = process._stream_publisher_cache = StreamPublisherCache(process.container)
+    return cache
+
+
 class StreamPublisher(Publisher):
     '''
     Stream Publisher maintains the "stream" concept and properly encapsulates outgoing messages in the streaming
@@ -33,8 +75,9 @@ class StreamPublisher(Publisher):
         @param exchange_point The name of the exchange point, to be used in lieu of stream_route or stream_id
         @param routing_key    The routing key to be used in lieu of stream_route or stream_id
         '''
-        super(StreamPublisher, self).__init__()
         validate_is_instance(process, BaseService, 'No valid process provided.')
+        self._publisher_cache = get_stream_publisher_cache(process)
+        super(StreamPublisher, self).__init__(endpoint_cache=self._publisher_cache.endpoints)
         #--------------------------------------------------------------------------------
         # The important part of publishing is the stream_route and there are three ways
         # to the stream route
@@ -63,7 +106,7 @@ class StreamPublisher(Publisher):
         validate_is_instance(self.stream_route, StreamRoute, 'No valid stream route provided to publisher.')
 
         self.container = process.container
-        self.xp = self.container.ex_manager.create_xp(self.stream_route.exchange_point)
+        self.xp = self._publisher_cache.get_xp(self.stream_route.exchange_point)
         self.xp_route = self.xp.create_route(self.stream_route.routing_key)
 
     def publish(self, msg, stream_id='', stream_route=None):
@@ -71,15 +114,12 @@ class StreamPublisher(Publisher):
         Encapsulates and publishes a message; the message is sent to either the specified
         stream/route or the stream/route specified at instantiation
         '''
-        xp = self.xp
         xp_route = self.xp_route
-        log.trace('Exchange: %s', xp.exchange)
         if stream_route:
-            xp = self.container.ex_manager.create_xp(stream_route.exchange_point)
-            xp_route = xp.create_route(stream_route.routing_key)
+            xp_route = self._publisher_cache.get_xp_route(stream_route)
         else:
             stream_route = self.stream_route
-        log.trace('Publishing (%s,%s)', xp.exchange, stream_route.routing_key)
+        log.trace('Publishing (%s,%s)', stream_route.exchange_point, stream_route.routing_key)
         super(StreamPublisher,self).publish(msg, to_name=xp_route, headers={'exchange_point':stream_route.exchange_point, 'stream':stream_id or self.stream_id})
 
 
@@ -96,19 +136,32 @@ class StreamSubscriber(Subscriber):
     Ex:
       def receive(msg, route, stream_id):
           pass
+
+    With a batch_size above 1 (by default the process' batch_size, see StreamProcess), messages are
+    received in batches of up to batch_size, waiting at most batch_wait seconds, and passed at once to
+    the batch callback as a list of (message, stream_route, stream_id). A batch is acked with one
+    multiple-ack after the batch callback returns.
     '''
-    def __init__(self, process, exchange_name, callback=None):
+    def __init__(self, process, exchange_name, callback=None, batch_callback=None, batch_size=None, batch_wait=None):
         '''
         Creates a new StreamSubscriber which will listen on the specified queue (exchange_name).
-        @param process       The Ion Process to attach to.
-        @param exchange_name The subscribing queue name.
-        @param callback      The callback to execute upon receipt of a packet.
+        @param process        The Ion Process to attach to.
+        @param exchange_name  The subscribing queue name.
+        @param callback       The callback to execute upon receipt of a packet.
+        @param batch_callback The callback to execute upon receipt of a batch of packets.
+        @param batch_size     The maximum number of packets in a batch; 0 or 1 disables batching.
+        @param batch_wait     The maximum time in seconds to wait for a batch to fill.
         '''
         validate_is_instance(process, BaseService, 'No valid process was provided.')
         self.container = process.container
         self.xn = self.container.ex_manager.create_xn_queue(exchange_name)
         self.started = False
         self.callback = callback or process.call_process
+        self.batch_callback = batch_callback
+        if batch_callback is None and callback is None:
+            self.batch_callback = getattr(process, 'call_process_batch', None)
+        self.batch_size = batch_size if batch_size is not None else getattr(process, 'batch_size', 0)
+        self.batch_wait = batch_wait if batch_wait is not None else getattr(process, 'batch_wait', 0.05)
         super(StreamSubscriber, self).__init__(from_name=self.xn, callback=self.preprocess)
 
     def preprocess(self, msg, headers):
@@ -120,12 +173,38 @@ class StreamSubscriber(Subscriber):
         route = StreamRoute(headers['exchange_point'], headers['routing_key'])
         self.callback(msg, route, headers['stream'])
 
+    def listen_batch(self, binding=None):
+        '''
+        Consumes messages in batches until the subscriber is closed, see the class docstring.
+        '''
+        self.prepare_listener(binding=binding)
+
+        # notify any listeners of our readiness
+        self._ready_event.set()
+
+        while True:
+            mos = []
+            try:
+                mos = self.get_up_to_n_msgs(self.batch_size, self.batch_wait)
+                batch = [(mo.body, StreamRoute(mo.headers['exchange_point'], mo.headers['routing_key']), mo.headers['stream'])
+                         for mo in mos if mo.error is None]
+                if batch:
+                    self.batch_callback(batch)
+
+            except ChannelClosedError:
+                break
+            finally:
+                self.ack_msgs(mos)
+
     def start(self):
         '''
         Begins consuming on the queue.
         '''
         self.started = True
-        self.greenlet = gevent.spawn(self.listen)
+        if self.batch_size > 1 and self.batch_callback:
+            self.greenlet = gevent.spawn(self.listen_batch)
+        else:
+            self.greenlet = gevent.spawn(self.listen)
         self.greenlet._glname = "StreamSubscriber"
 
     def stop(self):
@@ -154,13 +233,14 @@ class StandaloneStreamPublisher(Publisher):
         @param stream_id    The stream identifier
         @param stream_route The StreamRoute to publish on.
         '''
-        super(StandaloneStreamPublisher, self).__init__()
         from pyon.container.cc import Container
+        self._publisher_cache = StreamPublisherCache(Container.instance)
+        super(StandaloneStreamPublisher, self).__init__(endpoint_cache=self._publisher_cache.endpoints)
         self.stream_id = stream_id
         validate_is_instance(stream_route, StreamRoute, 'stream route is not valid')
         self.stream_route = stream_route
 
-        self.xp = Container.instance.ex_manager.create_xp(stream_route.exchange_point)
+        self.xp = self._publisher_cache.get_xp(stream_route.exchange_point)
         self.xp_route = self.xp.create_route(stream_route.routing_key)
 
 
@@ -172,16 +252,20 @@ class StandaloneStreamPublisher(Publisher):
         @param stream_id    Stream Identifier
         @param stream_route Stream Route
         '''
-        from pyon.container.cc import Container
         stream_id = stream_id or self.stream_id
-        xp = self.xp
         xp_route = self.xp_route
         if stream_route:
-            xp = Container.instance.ex_manager.create_xp(stream_route.exchange_point)
-            xp_route = xp.create_route(stream_route.routing_key)
+            xp_route = self._publisher_cache.get_xp_route(stream_route)
         stream_route = stream_route or self.stream_route
         super(StandaloneStreamPublisher, self).publish(msg, to_name=xp_route, headers={'exchange_point': stream_route.exchange_point, 'stream': stream_id or self.stream_id})
 
+    def close(self):
+        '''
+        Closes the publishing channels of this publisher.
+        '''
+        super(StandaloneStreamPublisher, self).close()
+        self._publisher_cache.close()
+
 
 class StandaloneStreamSubscriber(Subscriber):
     '''
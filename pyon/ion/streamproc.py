@@ -13,14 +13,33 @@ class StreamProcess(BaseService):
 
     process_type = "stream_process"
 
+    # Opt-in microbatching: with a batch_size above 1, subscribers created with this process deliver
+    # up to batch_size messages at once to process_batch, waiting at most batch_wait seconds for them.
+    batch_size = 0
+    batch_wait = 0.05
+
     def call_process(self, message, stream_route, stream_id):
         '''
         Handles preprocessing of packet and process work
         '''
         self.process(message)
 
+    def call_process_batch(self, batch):
+        '''
+        Handles preprocessing of a batch of packets, a list of (message, stream_route, stream_id), and process work
+        '''
+        self.process_batch([message for message, stream_route, stream_id in batch])
+
     def process(self, message):
         """
         Process a message as arriving based on a subscription.
         """
         pass
+
+    def process_batch(self, messages):
+        """
+        Process a list of messages as arriving based on a subscription, in order.
+        Override to process the messages together, e.g. in vectorized form.
+        """
+        for message in messages:
+            self.process(message)
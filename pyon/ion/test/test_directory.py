@@ -3,10 +3,12 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
-from pyon.ion.directory import Directory
+from pyon.ion.directory import Directory, DirectoryCache, _directory_caches
 from pyon.util.unit_test import IonUnitTestCase
 from nose.plugins.attrib import attr
 from pyon.datastore.datastore import DatastoreManager
+from mock import Mock, patch
+from interface.objects import DirEntry
 
 
 @attr('UNIT',group='datastore')
@@ -105,3 +107,130 @@ class TestDirectory(IonUnitTestCase):
         self.assertEquals(len(res_list), 1)
 
         directory.stop()
+
+
+@attr('UNIT',group='datastore')
+class TestDirectoryCache(IonUnitTestCase):
+
+    def _make_entry(self, parent, key, **kwargs):
+        return DirEntry(org="ION", parent=parent, key=key, attributes=kwargs, ts_created="1", ts_updated="1")
+
+    def test_cache(self):
+        cache = DirectoryCache(ttl=60)
+        self.assertEquals(cache.get("/Config/a"), (False, None))
+
+        cache.put("/Config/a", self._make_entry("/Config", "a", x=1))
+        found, de = cache.get("/Config/a")
+        self.assertTrue(found)
+        self.assertEquals(de.attributes, {"x": 1})
+
+        # returned entries are copies
+        de.attributes["x"] = 2
+        self.assertEquals(cache.get("/Config/a")[1].attributes, {"x": 1})
+
+        # a loaded child list answers for absent entries
+        self.assertEquals(cache.get("/Config/b"), (False, None))
+        cache.put_children("/Config", [self._make_entry("/Config", "a"), self._make_entry("/Config", "b")])
+        self.assertEquals(cache.get("/Config/c"), (True, None))
+        self.assertEquals([de.key for de in cache.get_children("/Config")], ["a", "b"])
+
+        cache.put("/Config/c", self._make_entry("/Config", "c"))
+        self.assertEquals([de.key for de in cache.get_children("/Config")], ["a", "b", "c"])
+        cache.put("/Config/b", None)
+        self.assertEquals([de.key for de in cache.get_children("/Config")], ["a", "c"])
+
+        cache.invalidate("/Config/a")
+        self.assertEquals(cache.get("/Config/a"), (False, None))
+        self.assertIsNone(cache.get_children("/Config"))
+
+        cache.invalidate()
+        self.assertEquals(cache.get("/Config/c"), (False, None))
+
+        stats = cache.get_stats()
+        self.assertEquals(stats['size'], 0)
+        self.assertEquals(stats['invalidations'], 2)
+
+    def test_cache_ttl(self):
+        cache = DirectoryCache(ttl=-1)
+        cache.put("/Config/a", self._make_entry("/Config", "a"))
+        cache.put_children("/Config", [])
+        self.assertEquals(cache.get("/Config/a"), (False, None))
+        self.assertIsNone(cache.get_children("/Config"))
+
+    def test_directory_cached(self):
+        self.patch_cfg('pyon.ion.directory.CFG', {'container': {'directory': {'cache': {'enabled': True, 'ttl': 60}}}})
+        self.addCleanup(_directory_caches.clear)
+
+        dsm = Mock()
+        ds = dsm.get_datastore.return_value
+        ds.datastore_name = "test_directory_cached"
+        directory = Directory(orgname="ION", datastore_manager=dsm, container=Mock())
+
+        de_a = self._make_entry("/Config", "a", x=1)
+        ds.find_by_view.return_value = [("id1", None, de_a)]
+        self.assertEquals(directory.lookup("/Config/a"), {"x": 1})
+        self.assertEquals(directory.lookup("/Config/a"), {"x": 1})
+        self.assertEquals(ds.find_by_view.call_count, 1)
+
+        # writes go through the cache
+        ds.update.return_value = ("id1", "2")
+        self.assertEquals(directory.register("/Config", "a", x=2), {"x": 1})
+        self.assertEquals(directory.lookup("/Config/a"), {"x": 2})
+        self.assertEquals(ds.find_by_view.call_count, 1)
+
+        directory.unregister("/Config", "a")
+        self.assertIsNone(directory.lookup("/Config/a"))
+        self.assertEquals(ds.find_by_view.call_count, 1)
+
+        # change events invalidate, except our own
+        directory.receive_directory_change_event(Mock(sub_type="/Config/a", actor_id=directory.container.id), {})
+        directory.lookup("/Config/a")
+        self.assertEquals(ds.find_by_view.call_count, 1)
+
+        directory.receive_directory_change_event(Mock(sub_type="/Config/a"), {})
+        directory.lookup("/Config/a")
+        self.assertEquals(ds.find_by_view.call_count, 2)
+
+        # prefix load
+        ds.find_by_view.return_value = [("id1", None, de_a), ("id2", None, self._make_entry("/Config", "b", y=1))]
+        directory.load_cache("/Config")
+        self.assertEquals(ds.find_by_view.call_count, 3)
+        self.assertEquals(directory.lookup("/Config/b"), {"y": 1})
+        self.assertIsNone(directory.lookup("/Config/c"))
+        self.assertEquals(len(directory.find_child_entries("/Config")), 2)
+        self.assertEquals(ds.find_by_view.call_count, 3)
+
+        self.assertGreater(directory.get_cache_stats()['hits'], 0)
+
+        # bulk registers announce each path, not a change of everything
+        directory.event_pub = Mock()
+        ds.create_mult.return_value = [(True, "id3", "1"), (True, "id4", "1")]
+        directory._ensure_parents_exist = Mock(return_value=[])
+        directory.register_mult([("/Config", "c", {}), ("/Config", "d", {})])
+        events = directory.event_pub.publish_events.call_args[0][0]
+        self.assertEquals([ev.sub_type for ev in events], ["/Config/c", "/Config/d"])
+        self.assertEquals(directory.lookup("/Config/c"), {})
+        self.assertEquals(ds.find_by_view.call_count, 3)
+
+    def test_directory_uncached_publishes_changes(self):
+        self.patch_cfg('pyon.ion.directory.CFG', {'container': {'directory': {'cache': {'enabled': False}}}})
+
+        dsm = Mock()
+        ds = dsm.get_datastore.return_value
+        ds.datastore_name = "test_directory_uncached"
+        with patch('pyon.ion.directory.bootstrap.container_instance', None):
+            directory = Directory(orgname="ION", datastore_manager=dsm)
+        self.assertIsNone(directory._cache)
+        self.assertIsNone(directory.container)
+
+        # other containers may cache the path, without a container id as origin
+        directory.event_pub = Mock()
+        ds.find_by_view.return_value = []
+        ds.create.return_value = ("id1", "1")
+        directory._ensure_parents_exist = Mock(return_value=[])
+        directory.register("/Config", "a", x=1)
+        events = directory.event_pub.publish_events.call_args[0][0]
+        self.assertEquals([ev.sub_type for ev in events], ["/Config/a"])
+        self.assertFalse(events[0].actor_id)
+
+        directory.receive_directory_change_event(Mock(sub_type="/Config/a"), {})
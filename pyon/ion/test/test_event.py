@@ -21,6 +21,8 @@ from pyon.util.log import log
 from pyon.util.containers import get_ion_ts, DotDict
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import IonUnitTestCase
+from pyon.net.channel import PublisherChannel
+from pyon.net.messaging import NodeB
 
 from interface.objects import Event, ResourceLifecycleEvent
 
@@ -39,6 +41,54 @@ class TestEvents(IonUnitTestCase):
 
         self.assertEquals(ev._chan.queue_auto_delete, sentinel.auto_delete)
 
+    def test_publish_events(self):
+        mocknode = Mock(spec=NodeB)
+        mocknode.interceptors = {}
+        mockch = Mock(spec=PublisherChannel)
+        mocknode.channel.return_value = mockch
+
+        pub = EventPublisher(event_type="ResourceEvent", node=mocknode)
+        pub.event_repo = Mock()
+
+        events = [ResourceLifecycleEvent(origin="res1"), ResourceLifecycleEvent(origin="res2"),
+                  ResourceLifecycleEvent(origin="res1", sub_type="DEPLOYED")]
+        self.assertIs(pub.publish_events(events, persist=True), events)
+
+        # one channel for the whole batch, one send per event
+        self.assertEquals(mocknode.channel.call_count, 1)
+        self.assertEquals(mockch.send.call_count, 3)
+        self.assertEquals(mockch.close.call_count, 1)
+        pub.event_repo.put_events.assert_called_once_with(events)
+
+        topics = [c[0][0].binding for c in mockch.connect.call_args_list[1:]]
+        self.assertEquals(topics[0], pub._topic(events[0]))
+        self.assertTrue(topics[0].endswith(".res1"))
+        self.assertTrue(topics[1].endswith(".res2"))
+        self.assertIn(".DEPLOYED.", topics[2])
+
+        self.assertEquals(len(set(ev._id for ev in events)), 3)
+        self.assertTrue(all(ev.ts_created for ev in events))
+        self.assertIn("ResourceEvent", events[0].base_types)
+
+        # bulk validation: nothing is published if one event is invalid
+        mockch.reset_mock()
+        events = [ResourceLifecycleEvent(origin="res1"), ResourceLifecycleEvent(origin="res2", ts_created="2423")]
+        self.assertRaises(BadRequest, pub.publish_events, events)
+        self.assertEquals(mockch.send.call_count, 0)
+        self.assertNotIn("_id", events[0])
+        self.assertFalse(events[0].ts_created)
+
+        self.assertRaises(BadRequest, pub.publish_events, "notalist")
+        self.assertEquals(pub.publish_events([]), [])
+
+    def test_publish_event_object(self):
+        pub = EventPublisher(event_type="ResourceEvent", node=Mock())
+        pub.publish_events = Mock(return_value=[sentinel.event])
+
+        event_obj = ResourceLifecycleEvent(origin="res1")
+        self.assertEquals(pub.publish_event_object(event_obj), sentinel.event)
+        pub.publish_events.assert_called_once_with([event_obj])
+
 @attr('INT',group='event')
 class TestEventsInt(IonIntegrationTestCase):
 
@@ -3,7 +3,7 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
-from pyon.ion.process import IonProcessThread
+from pyon.ion.process import IonProcessThread, concurrent_operation
 from pyon.ion.endpoint import ProcessRPCServer
 from gevent.event import AsyncResult, Event
 from gevent.coros import Semaphore
@@ -351,6 +351,99 @@ class ProcessTest(PyonTestCase):
         ar2 = p._routing_call(futurear2.set, MagicMock(), sentinel.val2)
         ar2.get(timeout=2)
 
+    def test_has_pending_call_after_stop(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc)
+
+        ar = p._routing_call(sentinel.call, MagicMock())
+        p._ctrl_queue.put(StopIteration)
+
+        self.assertTrue(p.has_pending_call(ar))
+        self.assertEquals(p._ctrl_queue.pending, set([ar]))
+
+    def test_is_concurrent_call(self):
+        p = IonProcessThread(name=sentinel.name, listeners=[], max_concurrency=2, concurrent_ops=['read_*', 'find_resources'])
+
+        def read_thing(): pass
+        def find_resources(): pass
+        def update_thing(): pass
+
+        @concurrent_operation
+        def marked_op(): pass
+
+        self.assertTrue(p._is_concurrent_call(read_thing))
+        self.assertTrue(p._is_concurrent_call(find_resources))
+        self.assertTrue(p._is_concurrent_call(marked_op))
+        self.assertFalse(p._is_concurrent_call(update_thing))
+        self.assertFalse(p._is_concurrent_call(sentinel.call))
+        self.assertEquals(p._concurrent_cache, {'read_thing': True, 'find_resources': True, 'update_thing': False})
+
+    def test__control_flow_concurrent(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2, concurrent_ops=['read_*'])
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        order = []
+        releaseev = Event()
+
+        def read_thing(name, startedar):
+            order.append(name)
+            startedar.set(True)
+            releaseev.wait()
+            return name
+
+        def update_thing():
+            order.append('update')
+            return 'update'
+
+        started1, started2, started3 = AsyncResult(), AsyncResult(), AsyncResult()
+        ar1 = p._routing_call(read_thing, MagicMock(), 'read1', started1)
+        ar2 = p._routing_call(read_thing, MagicMock(), 'read2', started2)
+        ar3 = p._routing_call(read_thing, MagicMock(), 'read3', started3)
+        ar4 = p._routing_call(update_thing, MagicMock())
+
+        # both reads run in parallel, the third waits for a free worker
+        started1.get(timeout=2)
+        started2.get(timeout=2)
+        self.assertFalse(started3.ready())
+        self.assertEquals(p.pool_occupancy, 100)
+        self.assertEquals(len(p._workers_active), 2)
+
+        releaseev.set()
+        self.assertEquals(ar4.get(timeout=2), 'update')
+
+        # the serial call waited for all reads before it
+        self.assertEquals(order, ['read1', 'read2', 'read3', 'update'])
+        self.assertEquals([ar1.get(), ar2.get(), ar3.get()], ['read1', 'read2', 'read3'])
+        self.assertEquals(p.pool_occupancy, 0)
+
+    def test_cancel_or_abort_call_concurrent(self):
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2, concurrent_ops=['read_*'])
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        def read_spin(inev, outar):
+            outar.set(True)
+            inev.wait()
+
+        waitar = AsyncResult()
+        ar = p._routing_call(read_spin, MagicMock(), Event(), waitar)
+        waitar.get(timeout=2)
+
+        # aborts the worker, not the control thread
+        p.cancel_or_abort_call(ar)
+
+        futurear = AsyncResult()
+        ar2 = p._routing_call(futurear.set, MagicMock(), sentinel.val)
+        ar2.get(timeout=2)
+        self.assertEquals(futurear.get(), sentinel.val)
+        self.assertIsNone(ar.get(timeout=2))        # interrupted, no result
+        self.assertEquals(p._workers_active, {})
+
     def test_heartbeat_no_listeners(self):
         svc = self._make_service()
         p = IonProcessThread(name=sentinel.name, listeners=[], service=svc)
@@ -533,6 +626,46 @@ class ProcessTest(PyonTestCase):
 
         self.assertEquals((True, True, False), hb)
 
+    def test_heartbeat_concurrent_op_over_limit(self):
+        self.patch_cfg('pyon.ion.process.CFG', {'cc':{'timeout':{'heartbeat_proc_count_threshold':2}}})
+
+        svc = self._make_service()
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc, max_concurrency=2, concurrent_ops=['read_*'])
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        p._ctrl_thread.ev_exit.set()            # prevent heartbeat loop in proc's target
+
+        def read_op(evout, evin):
+            evout.set(True)
+            evin.wait()
+
+        listenoutev = AsyncResult()
+        listeninev = Event()
+
+        self.addCleanup(listeninev.set)     # allow graceful termination
+        self.addCleanup(p.stop)
+
+        ar = p._routing_call(read_op, None, listenoutev, listeninev)
+
+        listenoutev.wait(timeout=5)         # wait for a worker to run our op
+
+        hb = p.heartbeat()
+        self.assertEquals((True, True, True), hb)
+        self.assertIsNone(p._heartbeat_op)          # the control thread is idle
+        self.assertIn(ar, p._heartbeat_workers)
+        self.assertIn("evin.wait", str(p._heartbeat_workers[ar][0]))
+
+        # make sure it's over the threshold
+        for x in xrange(2):
+            hb = p.heartbeat()
+
+        self.assertEquals((True, True, False), hb)
+
+        listeninev.set()
+        ar.get(timeout=2)
+        p.heartbeat()
+        self.assertEquals(p._heartbeat_workers, {})
+
 class FakeService(BaseService):
     """
     Class to use for testing below.
@@ -4,6 +4,7 @@ __author__ = 'Michael Meisinger, Stephen Henrie'
 
 from unittest import SkipTest
 
+import gevent
 from mock import Mock
 from unittest import SkipTest
 from nose.plugins.attrib import attr
@@ -225,6 +226,60 @@ class TestResources(IonUnitTestCase):
         '''
         return IonObject(RT.SystemResource, name=resource_name)
 
+    def get_slow_value(self, my_resource_id):
+        '''
+        Method used for testing
+        '''
+        gevent.sleep(2)
+        return 'slow'
+
+    def test_execute_methods_concurrently(self):
+        self.container = Mock()
+        extended_resource_handler = ExtendedResourceContainer(self, Mock())
+        extended_resource_handler.pool_size = 2
+        extended_resource_handler.field_timeout = 0.2
+
+        resource = Mock()
+        resource._id = '123'
+        obj = Mock()
+        obj.type_ = 'TestExtendedResource'
+        method_calls = [('field1', 'get_resource_object'), ('field2', 'get_slow_value'), ('field3', 'get_resource_object')]
+        extended_resource_handler._execute_methods_concurrently(obj, resource, method_calls, resource_name='Other_Resource')
+
+        # Partial result: the slow field is left unset
+        self.assertEquals(obj.field1.name, 'Other_Resource')
+        self.assertEquals(obj.field3.name, 'Other_Resource')
+        self.assertNotEquals(obj.field2, 'slow')
+        self.assertEquals(extended_resource_handler.ctx['timed_out_fields'], [('TestExtendedResource', 'field2')])
+        self.assertGreaterEqual(extended_resource_handler.ctx['field_times'][('TestExtendedResource', 'field2')], 0.2)
+
+        # Computed attributes may have the same field names
+        computed = Mock()
+        computed.type_ = 'TestComputedAttributes'
+        extended_resource_handler._execute_methods_concurrently(computed, resource, method_calls[:1])
+        self.assertEquals(set(extended_resource_handler.ctx['field_times']),
+                          set([('TestExtendedResource', 'field1'), ('TestExtendedResource', 'field2'),
+                               ('TestExtendedResource', 'field3'), ('TestComputedAttributes', 'field1')]))
+
+        # The timing info goes on the returned container
+        res_container = Mock()
+        res_container.ext_associations = {}
+        extended_resource_handler.set_field_timing_info(res_container)
+        self.assertEquals(res_container.ext_associations['_timed_out_fields'], ['TestExtendedResource.field2'])
+        self.assertEquals(set(res_container.ext_associations['_field_times']),
+                          set(['TestExtendedResource.field1', 'TestExtendedResource.field2',
+                               'TestExtendedResource.field3', 'TestComputedAttributes.field1']))
+
+        # Fields not done at the overall deadline are left unset as well
+        extended_resource_handler.ctx = None
+        extended_resource_handler.field_timeout = 5
+        extended_resource_handler.overall_timeout = 0.2
+        obj = Mock()
+        obj.type_ = 'TestExtendedResource'
+        extended_resource_handler._execute_methods_concurrently(obj, resource, method_calls)
+        self.assertEquals(obj.field1.name, 'TestSystem_Resource')
+        self.assertEquals(extended_resource_handler.ctx['timed_out_fields'], [('TestExtendedResource', 'field2')])
+
     @attr('SCHEMA')
     def test_get_object_schema(self):
 
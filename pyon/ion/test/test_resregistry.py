@@ -2,17 +2,48 @@
 
 __author__ = 'Michael Meisinger'
 
+import time
 import uuid
 
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import NotFound, Inconsistent, BadRequest
 from pyon.ion.resource import PRED, RT, LCS, AS, LCE, lcstate
+from pyon.ion.resregistry import ResourceCache
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
 
 from interface.objects import Attachment, AttachmentType
 
 
+@attr('UNIT', group='resource')
+class TestResourceCache(PyonTestCase):
+
+    def test_cache(self):
+        cache = ResourceCache(max_size=2, ttl=0)
+        self.assertIsNone(cache.get("r1"))
+        cache.put(dict(_id="r1", _rev="1", name="one"))
+        cache.put(dict(_id="r2", _rev="1", name="two"))
+        self.assertEquals(cache.get("r1")['name'], "one")
+        self.assertEquals(cache.get("r1", "1")['name'], "one")
+        self.assertIsNone(cache.get("r1", "2"))
+
+        # Least recently used entry is evicted
+        cache.put(dict(_id="r3", _rev="1", name="three"))
+        self.assertEquals(len(cache), 2)
+        self.assertIsNone(cache.get("r2"))
+
+        cache.invalidate("r1")
+        self.assertIsNone(cache.get("r1"))
+        self.assertEquals(cache.get_stats(), dict(size=1, hits=2, misses=4, hit_ratio=2.0 / 6))
+
+        cache = ResourceCache(ttl=0.01)
+        cache.put(dict(_id="r1", _rev="1"))
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("r1"))
+        self.assertEquals(len(cache), 0)
+
+
 @attr('INT', group='resource')
 class TestResourceRegistry(IonIntegrationTestCase):
 
@@ -321,3 +352,51 @@ class TestResourceRegistry(IonIntegrationTestCase):
         inst_obj1 = self.rr.read(iid)
         self.assertEquals(inst_obj1.lcstate, LCS.DEPLOYED)
         self.assertEquals(inst_obj1.availability, AS.AVAILABLE)
+
+    def test_read_cache(self):
+        self.rr.cache = ResourceCache()
+        try:
+            res_obj = IonObject(RT.InstrumentDevice, name='instrument')
+            rid, _ = self.rr.create(res_obj)
+
+            read_obj = self.rr.read(rid)
+            read_obj.name = 'changed'
+            self.assertEquals(self.rr.read(rid).name, 'instrument')
+            self.assertEquals(self.rr.cache.hits, 1)
+
+            # Changes to list and dict fields of a read object must not leak into the cache
+            read_obj.alt_ids.append('alt')
+            read_obj.addl['k'] = 'v'
+            cached_obj = self.rr.read(rid)
+            self.assertEquals(cached_obj.alt_ids, [])
+            self.assertEquals(cached_obj.addl, {})
+            self.assertEquals(self.rr.read_mult([rid])[0].alt_ids, [])
+
+            self.rr.update(read_obj)
+            self.assertEquals(self.rr.read(rid).name, 'changed')
+            self.rr.execute_lifecycle_transition(rid, LCE.PLAN)
+            read_objs = self.rr.read_mult([rid])
+            self.assertEquals(read_objs[0].lcstate, LCS.PLANNED)
+        finally:
+            self.rr.cache = None
+
+    def test_request_memo(self):
+        res_obj = IonObject(RT.InstrumentDevice, name='instrument')
+        rid, _ = self.rr.create(res_obj)
+
+        with self.rr.request_memo():
+            read_obj = self.rr.read(rid)
+            with self.rr.request_memo():
+                self.assertEquals(self.rr.read_mult([rid])[0].name, 'instrument')
+            self.assertIn(rid, self.rr._memo_local.memo)
+
+            read_obj.alt_ids.append('alt')
+            read_obj.addl['k'] = 'v'
+            memo_obj = self.rr.read(rid)
+            self.assertEquals(memo_obj.alt_ids, [])
+            self.assertEquals(memo_obj.addl, {})
+
+            read_obj.name = 'changed'
+            self.rr.update(read_obj)
+            self.assertEquals(self.rr.read(rid).name, 'changed')
+        self.assertIsNone(self.rr._memo_local.memo)
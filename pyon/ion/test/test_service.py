@@ -3,9 +3,15 @@
 __author__ = 'Adam R. Smith'
 __license__ = 'Apache 2.0'
 
+import os
+import tempfile
+import yaml
+from nose.plugins.attrib import attr
+
 import pyon
-from pyon.ion.service import BaseService
+from pyon.ion.service import BaseService, IonServiceRegistry
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 
 class TestService(BaseService):
     name = 'test-service'
@@ -15,3 +21,37 @@ class ServiceTest(IonIntegrationTestCase):
         # TODO: Make an equivalent of R1's ServiceProcess
         srv = TestService()
         #srv.serve_forever()
+
+
+@attr('UNIT')
+class TestIonServiceRegistry(PyonTestCase):
+    def _write_manifest(self, content):
+        fd, path = tempfile.mkstemp(suffix=".yml")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_lazy_load(self):
+        path = self._write_manifest(yaml.dump({
+            'test-service': {'module': 'pyon.ion.test.test_service', 'base': 'TestService', 'dependencies': []},
+            'missing-service': {'module': 'pyon.ion.test.no_such_module', 'base': 'BaseMissing', 'dependencies': []}}))
+
+        reg = IonServiceRegistry()
+        self.assertFalse(reg.load_service_manifest(path + ".notfound"))
+        self.assertTrue(reg.load_service_manifest(path))
+        self.assertEquals(reg._services, {})
+
+        self.assertEquals(reg.get_service_base('test-service'), TestService)
+        self.assertEquals(reg.get_service_by_name('test-service').base, TestService)
+        self.assertEquals(reg.services_by_name.keys(), ['test-service'])
+        self.assertIsNone(reg.get_service_by_name('unknown-service'))
+        self.assertIsNone(reg.get_service_base('missing-service'))
+
+        # Full access loads all indexed services
+        self.assertEquals(reg.services.keys(), ['test-service'])
+
+    def test_invalid_manifest(self):
+        reg = IonServiceRegistry()
+        self.assertFalse(reg.load_service_manifest(self._write_manifest("- not a dict")))
+        self.assertEquals(reg.service_index, {})
@@ -9,7 +9,7 @@ import uuid
 import gevent
 
 from pyon.datastore.datastore import DatastoreManager
-from pyon.ion.state import StateRepository, StatefulProcessMixin
+from pyon.ion.state import StateRepository, StatefulProcessMixin, DELTA_KEYS
 from pyon.ion.process import StandaloneProcess
 from pyon.public import Inconsistent
 from pyon.util.containers import get_ion_ts
@@ -55,6 +55,84 @@ class TestState(IonUnitTestCase):
         state7 = {'key':'value7', 'key2': {}}
         state_repo.put_state("id1", state7, state_obj=state_obj4)
 
+    def test_state_delta(self):
+        dsm = DatastoreManager()
+        state_repo = StateRepository(dsm)
+        state_repo.start()
+
+        # Existing whole state is converted on first delta update
+        state_repo.put_state("id2", {'key': 'value1', 'key2': 'value2'})
+        revs = state_repo.put_state_delta("id2", {'key': 'value3'})
+        self.assertIn(DELTA_KEYS, revs)
+        self.assertEquals(set(revs), set([DELTA_KEYS, 'key', 'key2']))
+
+        state, state_obj = state_repo.get_state("id2")
+        self.assertEquals(state, {'key': 'value3', 'key2': 'value2'})
+
+        # Only changed keys are written, the key list only when keys are added
+        key2_rev, keys_rev = revs['key2'], revs[DELTA_KEYS]
+        state_repo.put_state_delta("id2", {'key': 'value4'}, revs=revs)
+        self.assertEquals(revs['key2'], key2_rev)
+        self.assertEquals(revs[DELTA_KEYS], keys_rev)
+
+        state_repo.put_state_delta("id2", {'key3': [1, 2]}, deleted=['key2'], revs=revs)
+        self.assertNotIn('key2', revs)
+        revs1 = {}
+        state, state_obj = state_repo.get_state("id2", revs=revs1)
+        self.assertEquals(state, {'key': 'value4', 'key3': [1, 2]})
+        self.assertEquals(revs1, revs)
+
+        # Conflicts are resolved per key: a stale revision only affects the key written
+        stale_revs = dict(revs)
+        state_repo.put_state_delta("id2", {'key': 'value5'}, revs=revs)
+        state_repo.put_state_delta("id2", {'key': 'value6'}, revs=stale_revs)
+        state, _ = state_repo.get_state("id2")
+        self.assertEquals(state, {'key': 'value6', 'key3': [1, 2]})
+
+        # New state
+        state_repo.put_state_delta("id3", {'key': 'value1'})
+        state, _ = state_repo.get_state("id3")
+        self.assertEquals(state, {'key': 'value1'})
+
+    def test_state_changes(self):
+        proc = StatefulProcessMixin()
+        proc.id = "proc1"
+        self.assertFalse(proc._is_state_flush_due())
+
+        proc._set_state("key1", "value1")
+        proc._set_state("key2", "value2")
+        proc._set_state("key2", "value2")
+        self.assertTrue(proc._is_state_flush_due())
+        self.assertEquals(proc._get_state_changes(), ({"key1": "value1", "key2": "value2"}, []))
+
+        proc._reset_state_changes()
+        self.assertFalse(proc._is_state_flush_due())
+        proc._set_state("key1", "value3")
+        self.assertEquals(proc._get_state_changes(), ({"key1": "value3"}, []))
+
+        # Direct changes to the state vector
+        state_vector = proc._get_state_vector()
+        del state_vector["key2"]
+        proc._mark_changed()
+        self.assertEquals(proc._get_state_changes(persisted_keys=["key1", "key2"]), ({"key1": "value3"}, ["key2"]))
+
+        # Flush policy: every N changes
+        proc._reset_state_changes()
+        proc._proc_state_flush_changes = 2
+        proc._set_state("key1", "value4")
+        self.assertFalse(proc._is_state_flush_due())
+        proc._set_state("key1", "value5")
+        self.assertTrue(proc._is_state_flush_due())
+
+        # Flush policy: every T seconds
+        proc._reset_state_changes()
+        proc._proc_state_flush_changes = 0
+        proc._proc_state_flush_interval = 60
+        proc._set_state("key1", "value6")
+        self.assertFalse(proc._is_state_flush_due())
+        proc._proc_state_flush_time -= 61
+        self.assertTrue(proc._is_state_flush_due())
+
 
 @attr('INT', group='state')
 class TestStatefulProcess(IonIntegrationTestCase):
@@ -54,4 +54,33 @@ class StreamPubsubTest(IonIntegrationTestCase):
 
         self.assertTrue(self.verified.wait(2))
 
+    def test_stream_pub_sub_batch(self):
+        self.verified = Event()
+        self.route = StreamRoute(exchange_point='xp_test', routing_key='route')
+        self.batches = []
+        def verify_batch(batch):
+            for message, route, stream in batch:
+                self.assertEquals(route, self.route)
+            self.batches.append([message for message, route, stream in batch])
+            if sum(len(b) for b in self.batches) == 10:
+                self.verified.set()
+
+        sub_proc = SimpleProcess()
+        sub_proc.container = self.container
+
+        sub1 = StreamSubscriber(process=sub_proc, exchange_name='sub1', batch_callback=verify_batch, batch_size=4, batch_wait=0.2)
+        sub1.start()
+        self.queue_cleanup.append('sub1')
+
+        pub_proc = SimpleProcess()
+        pub_proc.container = self.container
+        pub1 = StreamPublisher(process=pub_proc,stream_route=self.route)
+        sub1.xn.bind(self.route.routing_key,pub1.xp)
+
+        for i in xrange(10):
+            pub1.publish(i)
 
+        self.assertTrue(self.verified.wait(5))
+        self.assertEquals(sum(self.batches, []), range(10))
+        self.assertTrue(all(len(batch) <= 4 for batch in self.batches))
+        self.assertLess(len(self.batches), 10)
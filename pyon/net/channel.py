@@ -45,10 +45,64 @@ from contextlib import contextmanager
 from gevent.event import AsyncResult, Event
 from pyon.net.transport import AMQPTransport, NameTrio
 from pyon.util.fsm import FSM
+from pyon.core.bootstrap import CFG
+import gevent
 import sys
 import os
+import time
 import traceback
 
+from ooi.timer import Accumulator
+stats = Accumulator(persist=True)
+
+# Channel lock diagnostics levels:
+# - off:   no bookkeeping at all
+# - cheap: records the holding greenlet and acquisition time (contention counts, hold times)
+# - full:  additionally captures the stack of the lock holder for the INTERLEAVE DETECTED warning
+LOCK_DIAG_OFF = 'off'
+LOCK_DIAG_CHEAP = 'cheap'
+LOCK_DIAG_FULL = 'full'
+LOCK_DIAG_LEVELS = (LOCK_DIAG_OFF, LOCK_DIAG_CHEAP, LOCK_DIAG_FULL)
+
+_lock_diagnostics = None        # Current level, lazily initialized from config
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+lock_contentions = 0            # Number of acquisitions of a lock held by another greenlet
+lock_interleaves = 0            # Number of re-entrant acquisitions by the holding greenlet
+lock_max_hold = 0.0             # Maximum hold time of a channel lock in seconds
+
+
+def get_lock_diagnostics():
+    """
+    Returns the current channel lock diagnostics level.
+    """
+    global _lock_diagnostics
+    if _lock_diagnostics is None:
+        set_lock_diagnostics(CFG.get_safe('container.messaging.channel.lock_diagnostics', LOCK_DIAG_CHEAP))
+    return _lock_diagnostics
+
+def set_lock_diagnostics(level=None):
+    """
+    Sets the channel lock diagnostics level. None resets to the configured level.
+    Takes effect for the next lock acquisition on all channels.
+    """
+    global _lock_diagnostics
+    if level is None:
+        level = CFG.get_safe('container.messaging.channel.lock_diagnostics', LOCK_DIAG_CHEAP)
+    if level not in LOCK_DIAG_LEVELS:
+        raise ValueError("Unknown lock diagnostics level: %s" % level)
+    _lock_diagnostics = level
+
+def get_lock_stats():
+    return dict(contentions=lock_contentions, interleaves=lock_interleaves, max_hold=lock_max_hold)
+
+def clear_lock_stats():
+    global lock_contentions, lock_interleaves, lock_max_hold
+    lock_contentions = 0
+    lock_interleaves = 0
+    lock_max_hold = 0.0
+
 class ChannelError(StandardError):
     """
     Exception raised for error using Channel Socket Interface.
@@ -70,6 +124,9 @@ class BaseChannel(object):
     _closed_error_callback      = None      # callback which triggers when the underlying transport closes with error
     _exchange                   = None      # exchange (too AMQP specific)
     _close_event                = None      # used for giving notice a close was processed
+    _lock_owner                 = None      # id of greenlet holding the lock (lock diagnostics)
+    _lock_time                  = None      # monotonic time the lock was acquired (lock diagnostics)
+    _lock_trace                 = None      # stack that acquired the lock (full lock diagnostics only)
 
     # exchange related settings @TODO: these should likely come from config instead
     _exchange_type              = 'topic'
@@ -161,21 +218,51 @@ class BaseChannel(object):
         if not self._lock:
             raise ChannelError("No lock available")
 
+        level = _lock_diagnostics or get_lock_diagnostics()
+        if level == LOCK_DIAG_OFF:
+            with self._lock:
+                # we could wait and wait, and it gets closed, and unless we check again, we'd never know!
+                if not self._transport:
+                    raise ChannelError("No transport attached")
+                yield
+            return
+
+        global lock_contentions, lock_interleaves, lock_max_hold
+        owner = id(gevent.getcurrent())
+
         # is lock already acquired? spit out a notice
         if self._lock._is_owned():
-            log.warn("INTERLEAVE DETECTED:\n\nCURRENT STACK:\n%s\n\nSTACK THAT LOCKED: %s\n",
-                    "".join(traceback.format_stack()), "".join(self._lock_trace))
+            lock_interleaves += 1
+            stats.add_value('channel.lock.interleave', 1)
+            if level == LOCK_DIAG_FULL:
+                log.warn("INTERLEAVE DETECTED:\n\nCURRENT STACK:\n%s\n\nSTACK THAT LOCKED: %s\n",
+                        "".join(traceback.format_stack()), "".join(self._lock_trace or []))
+            else:
+                log.warn("INTERLEAVE DETECTED: greenlet %s re-acquired channel lock held for %.3fs",
+                         owner, _monotonic() - (self._lock_time or _monotonic()))
+        elif self._lock_owner is not None:
+            lock_contentions += 1
+            stats.add_value('channel.lock.contention', 1)
 
         with self._lock:
             # we could wait and wait, and it gets closed, and unless we check again, we'd never know!
             if not self._transport:
                 raise ChannelError("No transport attached")
 
-            self._lock_trace = traceback.format_stack()
+            # save outer state so re-entrant acquisitions restore it on exit
+            prev_owner, prev_time, prev_trace = self._lock_owner, self._lock_time, self._lock_trace
+            self._lock_owner = owner
+            self._lock_time = _monotonic()
+            if level == LOCK_DIAG_FULL:
+                self._lock_trace = traceback.format_stack()
             try:
                 yield
             finally:
-                self._lock_trace = None
+                held = _monotonic() - self._lock_time
+                if held > lock_max_hold:
+                    lock_max_hold = held
+                stats.add_value('channel.lock.hold', held)
+                self._lock_owner, self._lock_time, self._lock_trace = prev_owner, prev_time, prev_trace
 
     def _declare_exchange(self, exchange):
         """
@@ -331,6 +418,7 @@ class SendChannel(BaseChannel):
     A channel that can only send.
     """
     _send_name = None           # name that this channel is sending to - tuple (exchange, routing_key)
+    _confirms  = False          # publisher confirms enabled
 
     def connect(self, name):
         """
@@ -344,7 +432,44 @@ class SendChannel(BaseChannel):
 
     def send(self, data, headers=None):
         #log.debug("SendChannel.send")
-        self._send(self._send_name, data, headers=headers)
+        return self._send(self._send_name, data, headers=headers)
+
+    def enable_confirms(self, max_in_flight=100):
+        """
+        Turns on publisher confirms for this channel.
+
+        The broker confirms every message sent afterwards, see send_async. Sending blocks while
+        max_in_flight messages are unconfirmed.
+        """
+        with self._ensure_transport():
+            self._transport.confirm_select_impl(max_in_flight=max_in_flight)
+        self._confirms = True
+
+    def send_async(self, data, headers=None):
+        """
+        Sends a message like send, and returns an AsyncResult for its completion.
+
+        With publisher confirms enabled, the result is set when the broker has confirmed the message
+        and raises a TransportError if it was rejected. Otherwise it is set once the message was
+        handed to the transport.
+        """
+        ar = self.send(data, headers=headers)
+        if ar is None:
+            ar = AsyncResult()
+            ar.set(True)
+        return ar
+
+    def wait_for_confirms(self, timeout=None):
+        """
+        Blocks until the broker has confirmed all messages sent so far on this channel.
+        No-op if publisher confirms are not enabled.
+        """
+        if not self._confirms:
+            return
+        if not self._transport:
+            raise ChannelError("No transport attached")
+
+        self._transport.wait_for_confirms_impl(timeout=timeout)
 
     def _send(self, name, data, headers=None):
         #log.debug("SendChannel._send\n\tname: %s\n\tdata: %s\n\theaders: %s", name, "-", headers)
@@ -364,13 +489,13 @@ class SendChannel(BaseChannel):
             durable_msg = self._send_name.queue_durable
 
         with self._ensure_transport():
-            self._transport.publish_impl(exchange=exchange,
-                                         routing_key=routing_key,
-                                         body=data,
-                                         properties=headers,
-                                         immediate=False,
-                                         mandatory=False,
-                                         durable_msg=durable_msg)
+            return self._transport.publish_impl(exchange=exchange,
+                                                routing_key=routing_key,
+                                                body=data,
+                                                properties=headers,
+                                                immediate=False,
+                                                mandatory=False,
+                                                durable_msg=durable_msg)
 
 class RecvChannel(BaseChannel):
     """
@@ -378,7 +503,9 @@ class RecvChannel(BaseChannel):
     """
     # data for this receive channel
     _recv_queue     = None
+    _ack_coalescing = False
     _consumer_tag   = None
+    _prefetch_count = None      # last prefetch count set through this channel (qos)
     _recv_name      = None      # name this receiving channel is receiving on - tuple (exchange, queue)
     _recv_binding   = None      # binding this queue is listening on (set via _bind)
 
@@ -676,11 +803,17 @@ class RecvChannel(BaseChannel):
             queue = ".".join([self._recv_name.exchange, queue])
             #log.debug('Auto-prepending exchange to queue name for anti-clobbering: %s', queue)
 
+        # only pass exclusive down when requested, not every transport knows about it
+        kwargs = {}
+        if self._queue_exclusive:
+            kwargs['exclusive'] = True
+
         #log.debug("RecvChannel._declare_queue: %s", queue)
         with self._ensure_transport():
             queue_name = self._transport.declare_queue_impl(queue=queue or '',
                                                             auto_delete=self.queue_auto_delete,
-                                                            durable=self.queue_durable)
+                                                            durable=self.queue_durable,
+                                                            **kwargs)
 
         # save the new recv_name if our queue name differs (anon queue via '', or exchange prefixing)
         if queue_name != self._recv_name.queue:
@@ -714,14 +847,45 @@ class RecvChannel(BaseChannel):
         # put body, headers, delivery tag (for acking) in the recv queue
         self._recv_queue.put((body, header_frame.headers, delivery_tag))
 
-    def ack(self, delivery_tag):
+    def ack(self, delivery_tag, multiple=False):
         """
         Acks a message using the delivery tag.
+        With multiple, acks all messages received on this channel up to and including it.
         Should be called by the EP layer.
         """
         #log.debug("RecvChannel.ack: %s", delivery_tag)
         with self._ensure_transport():
-            self._transport.ack_impl(delivery_tag)
+            if multiple:
+                self._transport.ack_impl(delivery_tag, multiple=True)
+            else:
+                self._transport.ack_impl(delivery_tag)
+
+    def coalesce_acks(self, max_count=100, max_interval=0.05):
+        """
+        Turns on coalescing of acks on this channel's transport: acks are sent as one multiple-ack
+        after max_count acks or max_interval seconds. Must be called before consuming starts.
+        """
+        with self._ensure_transport():
+            # delayed flushes take the channel lock, and fail once the transport is gone
+            self._transport.coalesce_acks_impl(max_count=max_count, max_interval=max_interval, lock=self._ensure_transport)
+        self._ack_coalescing = True
+
+    def flush_acks(self):
+        """
+        Sends any coalesced acks now.
+        """
+        if self._ack_coalescing:
+            with self._ensure_transport():
+                self._transport.flush_acks_impl()
+
+    def set_prefetch(self, prefetch_count):
+        """
+        Sets the number of unacked messages the broker delivers to this channel (qos), if changed.
+        """
+        if prefetch_count != self._prefetch_count:
+            with self._ensure_transport():
+                self._transport.qos_impl(prefetch_count=prefetch_count)
+            self._prefetch_count = prefetch_count
 
     def reject(self, delivery_tag, requeue=False):
         """
@@ -763,7 +927,7 @@ class PublisherChannel(SendChannel):
         """
         assert self._send_name and self._send_name.exchange
         self._declare_exchange(self._send_name.exchange)
-        SendChannel.send(self, data, headers=headers)
+        return SendChannel.send(self, data, headers=headers)
 
 class BidirClientChannel(SendChannel, RecvChannel):
     """
@@ -787,7 +951,37 @@ class BidirClientChannel(SendChannel, RecvChannel):
         if not 'reply-to' in headers:
             headers['reply-to'] = "%s,%s" % (self._recv_name.exchange, self._recv_name.queue)
 
-        SendChannel._send(self, name, data, headers=headers)
+        return SendChannel._send(self, name, data, headers=headers)
+
+class ReplyChannel(RecvChannel):
+    """
+    Receiving channel backing a Node's shared RPC reply queue (see pyon.net.messaging.ReplyMultiplexer).
+
+    The queue is anonymous, exclusive to the connection and consumed without acks, so a reply costs a
+    single delivery. It can be bound into any number of exchanges, always using its own queue name as
+    the binding, since that is what the reply-to header of a request points at.
+    """
+    _queue_auto_delete  = True
+    _queue_exclusive    = True
+    _consumer_exclusive = True
+    _consumer_no_ack    = True
+
+    def bind_exchange(self, exchange, durable=False, auto_delete=True):
+        """
+        Declares an additional exchange and binds this channel's queue into it.
+
+        setup_listener must have been called first.
+        """
+        assert self._recv_name and self._recv_name.queue
+
+        with self._ensure_transport():
+            self._transport.declare_exchange_impl(exchange,
+                                                  exchange_type=self._exchange_type,
+                                                  durable=durable,
+                                                  auto_delete=auto_delete)
+            self._transport.bind_impl(exchange=exchange,
+                                      queue=self._recv_name.queue,
+                                      binding=self._recv_name.queue)
 
 class ListenChannel(RecvChannel):
     """
@@ -809,6 +1003,7 @@ class ListenChannel(RecvChannel):
         def __init__(self, name=None, binding=None, parent_channel=None, **kwargs):
             RecvChannel.__init__(self, name=name, binding=binding, **kwargs)
             self._delivery_tags = set()
+            self._recv_order = []           # delivery tags in order received
             self._parent_channel = parent_channel
 
         def close_impl(self):
@@ -823,6 +1018,7 @@ class ListenChannel(RecvChannel):
             """
             msg = RecvChannel.recv(self, timeout=timeout)
             self._delivery_tags.add(msg[2])
+            self._recv_order.append(msg[2])
             return msg
 
         def _checkin(self, delivery_tag):
@@ -843,12 +1039,19 @@ class ListenChannel(RecvChannel):
             if len(self._delivery_tags) == 0:
                 self._parent_channel.exit_accept()
 
-        def ack(self, delivery_tag):
+        def ack(self, delivery_tag, multiple=False):
             """
             Acks a message - broker discards.
+            With multiple, acks all messages received up to and including it.
             """
-            RecvChannel.ack(self, delivery_tag)
-            self._checkin(delivery_tag)
+            RecvChannel.ack(self, delivery_tag, multiple=multiple)
+            if multiple and delivery_tag in self._recv_order:
+                idx = self._recv_order.index(delivery_tag)
+                for dtag in self._recv_order[:idx + 1]:
+                    if dtag in self._delivery_tags:
+                        self._checkin(dtag)
+            else:
+                self._checkin(delivery_tag)
 
         def reject(self, delivery_tag, requeue=False):
             """
@@ -908,12 +1111,17 @@ class ListenChannel(RecvChannel):
 
         assert self._fsm.current_state in [self.S_ACTIVE, self.S_CLOSED], "Channel must be in active/closed state to accept, currently %s (forget to ack messages?)" % str(self._fsm.current_state)
 
+        # send held back acks before waiting, the broker may not deliver more until then (qos)
+        if self._ack_coalescing and self._transport is not None:
+            self.flush_acks()
+
         was_consuming = self._consuming
 
         if not self._should_discard and not was_consuming:
             # tune QOS to get exactly n messages
             if not (self.queue_auto_delete and self._transport is not None and isinstance(self._transport, AMQPTransport)):
                 self._transport.qos_impl(prefetch_count=n)
+                self._prefetch_count = n
 
             # start consuming
             self.start_consume()
@@ -11,13 +11,14 @@ import inspect
 import traceback
 import sys
 from types import MethodType
+from collections import OrderedDict
 import threading
 
 from pyon.core import bootstrap, exception
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.core.exception import ExceptionFactory, IonException, BadRequest
 from pyon.net.channel import ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel
-from pyon.core.interceptor.interceptor import Invocation, process_interceptors
+from pyon.core.interceptor.interceptor import Invocation, InterceptorStacks, process_interceptors
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.util.log import log
 from pyon.net.transport import NameTrio, BaseTransport
@@ -117,7 +118,10 @@ class EndpointUnit(object):
         @param inv      An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(self.interceptors["message_incoming"] if "message_incoming" in self.interceptors else [], inv)
+        interceptors = self.interceptors
+        if isinstance(interceptors, InterceptorStacks):
+            return interceptors.get_pipeline("message_incoming")(inv)
+        inv_prime = process_interceptors(interceptors["message_incoming"] if "message_incoming" in interceptors else [], inv)
         return inv_prime
 
     def message_received(self, msg, headers):
@@ -178,7 +182,10 @@ class EndpointUnit(object):
         @param  inv     An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(self.interceptors["message_outgoing"] if "message_outgoing" in self.interceptors else [], inv)
+        interceptors = self.interceptors
+        if isinstance(interceptors, InterceptorStacks):
+            return interceptors.get_pipeline("message_outgoing")(inv)
+        inv_prime = process_interceptors(interceptors["message_outgoing"] if "message_outgoing" in interceptors else [], inv)
         return inv_prime
 
     def close(self):
@@ -402,13 +409,17 @@ class ListeningBaseEndpoint(BaseEndpoint):
                 log.info("MessageObject.make_body raised an error: \n%s", traceback.format_exc(ex))
                 self.error = ex
 
-        def ack(self):
+        def ack(self, multiple=False):
             """
             Passthrough to underlying channel's ack.
+            With multiple, also acks all messages received before this one on the same channel.
 
             Must call this if using get_one_msg/get_n_msgs.
             """
-            self.ackmethod(self.delivery_tag)
+            if multiple:
+                self.ackmethod(self.delivery_tag, multiple=True)
+            else:
+                self.ackmethod(self.delivery_tag)
 
         def reject(self, requeue=False):
             """
@@ -518,6 +529,12 @@ class ListeningBaseEndpoint(BaseEndpoint):
         self._ensure_node()
         self._chan = self._create_channel()
 
+        # optional high throughput mode: acks are coalesced into multiple-acks
+        ack_batch_size = CFG.get_safe('container.messaging.endpoint.ack_batch_size', 0)
+        if ack_batch_size and ack_batch_size > 1:
+            ack_batch_interval = CFG.get_safe('container.messaging.endpoint.ack_batch_interval', 50)
+            self._chan.coalesce_acks(max_count=ack_batch_size, max_interval=ack_batch_interval / 1000.0)
+
         # @TODO this does not feel right
         if isinstance(self._recv_name, BaseTransport):
             self._recv_name.setup_listener(binding, self._setup_listener)
@@ -587,7 +604,7 @@ class ListeningBaseEndpoint(BaseEndpoint):
 
     def get_n_msgs(self, num, timeout=None):
         """
-        Receives num messages.
+        Receives num messages. Use ack_msgs to ack them all at once.
 
         INBOUND INTERCEPTORS ARE PROCESSED HERE. If the Interceptor stack throws an IonException,
         the response will be sent immediatly and the MessageObject returned to you will not have
@@ -600,6 +617,47 @@ class ListeningBaseEndpoint(BaseEndpoint):
         """
         return self._get_n_msgs(num, timeout=timeout)
 
+    def get_up_to_n_msgs(self, num, max_wait, timeout=None):
+        """
+        Receives a batch of 1 to num messages: blocks until a message is available, or the optional
+        timeout is reached, then waits at most max_wait seconds for more messages, up to num in total.
+        Use ack_msgs to ack them all at once. Raises the channel's prefetch count to num, so that the
+        broker can deliver a whole batch before it is acked.
+
+        INBOUND INTERCEPTORS ARE PROCESSED HERE, see get_n_msgs.
+
+        @raises ChannelClosedError  If the channel has been closed.
+        @raises Timeout             If no messages available when timeout is reached.
+        @returns                    A list of MessageObjects.
+        """
+        assert self._chan, "get_up_to_n_msgs: needs the endpoint to have been initialized"
+
+        # the broker holds back messages beyond the prefetch count until earlier ones are acked
+        self._chan.set_prefetch(num)
+        self._chan.flush_acks()
+
+        recv_queue = self._chan._recv_queue
+        if recv_queue.qsize() == 0:
+            with recv_queue.await_n(n=1) as ar:
+                ar.get(timeout=timeout)
+
+        if num > 1 and max_wait and recv_queue.qsize() < num:
+            try:
+                with recv_queue.await_n(n=num) as ar:
+                    ar.get(timeout=max_wait)
+            except Timeout:
+                pass
+
+        return self._get_n_msgs(min(num, recv_queue.qsize()) or 1, timeout=timeout)
+
+    def ack_msgs(self, msgs):
+        """
+        Acks all MessageObjects returned by a single get_n_msgs/get_all_msgs call
+        with one multiple-ack of the last message.
+        """
+        if msgs:
+            msgs[-1].ack(multiple=True)
+
     def get_all_msgs(self, timeout=None):
         """
         Receives all available messages on the queue.
@@ -644,18 +702,137 @@ class ListeningBaseEndpoint(BaseEndpoint):
 class PublisherEndpointUnit(EndpointUnit):
     pass
 
+class PublisherEndpointCache(object):
+    """
+    Connected publisher endpoint units by destination (exchange, queue), so that publishing to many
+    destinations does not open and close a channel per message. Can be shared by several Publishers,
+    e.g. all publishers of a process.
+
+    Holds at most max_size endpoints, evicting the least recently used one beyond that. Endpoints
+    idle for longer than idle_timeout seconds are evicted on the next access to the cache.
+
+    An endpoint returned by get_endpoint is in use until handed back with release. Evicted endpoints
+    still in use are closed when their last user releases them. Once closed, the cache refuses to
+    hand out endpoints.
+    """
+    def __init__(self, max_size=None, idle_timeout=None):
+        self.max_size = max_size if max_size is not None else CFG.get_safe('container.messaging.endpoint.publisher_cache_size', 20)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else CFG.get_safe('container.messaging.endpoint.publisher_cache_idle_timeout', 60)
+        # (exchange, queue) -> [endpoint unit, last use time], least recently used first
+        self._endpoints = OrderedDict()
+        self._users = {}            # endpoint unit -> number of get_endpoint calls not yet released
+        self._evicted = set()       # endpoint units no longer cached, to close when released
+        self._closed = False
+
+    def get_endpoint(self, to_name, create_func):
+        """
+        Returns the endpoint unit for to_name, calling create_func(to_name) to create it if not cached.
+        The caller must call release when done sending.
+
+        @raises EndpointError   If the cache has been closed.
+        """
+        if self._closed:
+            raise EndpointError("Publisher endpoint cache is closed")
+
+        key = (to_name.exchange, to_name.queue)
+        now = time.time()
+        self._evict_idle(now)
+
+        entry = self._endpoints.pop(key, None)
+        if entry is None:
+            ep = create_func(to_name)
+            if self._closed:
+                self._close_endpoint(ep)
+                raise EndpointError("Publisher endpoint cache is closed")
+
+            # Another greenlet may have cached an endpoint for this destination meanwhile
+            entry = self._endpoints.pop(key, None)
+            if entry is not None:
+                self._close_endpoint(ep)
+            else:
+                entry = [ep, now]
+            while len(self._endpoints) >= max(self.max_size, 1):
+                self._evict(self._endpoints.popitem(last=False)[1][0])
+
+        entry[1] = now
+        self._endpoints[key] = entry
+        ep = entry[0]
+        self._users[ep] = self._users.get(ep, 0) + 1
+        return ep
+
+    def release(self, to_name, ep, failed=False):
+        """
+        Hands back an endpoint unit returned by get_endpoint. If sending on it failed, it is removed
+        from the cache (unless already replaced there) and closed once no one else uses it.
+        """
+        users = self._users.pop(ep, 1) - 1
+        if users > 0:
+            self._users[ep] = users
+
+        if failed:
+            key = (to_name.exchange, to_name.queue)
+            entry = self._endpoints.get(key, None)
+            if entry is not None and entry[0] is ep:
+                del self._endpoints[key]
+                self._evicted.add(ep)
+
+        if users <= 0 and ep in self._evicted:
+            self._evicted.discard(ep)
+            self._close_endpoint(ep)
+
+    def _evict_idle(self, now):
+        expiry = now - self.idle_timeout
+        while self._endpoints:
+            key, (ep, last_use) = next(self._endpoints.iteritems())
+            if last_use >= expiry:
+                break
+            del self._endpoints[key]
+            self._evict(ep)
+
+    def _evict(self, ep):
+        if ep in self._users:
+            self._evicted.add(ep)
+        else:
+            self._close_endpoint(ep)
+
+    def _close_endpoint(self, ep):
+        try:
+            ep.close()
+        except Exception:
+            log.exception("Error closing cached publisher endpoint")
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def close(self):
+        """
+        Closes all cached endpoints, those in use once released, and refuses further get_endpoint calls.
+        """
+        self._closed = True
+        while self._endpoints:
+            self._evict(self._endpoints.popitem(last=False)[1][0])
+
 class Publisher(SendingBaseEndpoint):
     """
     Simple publisher sends out broadcast messages.
+
+    With an endpoint_cache (a PublisherEndpointCache), endpoints for publishing to a to_name are
+    kept open in the cache instead of being created and closed for each message.
     """
 
     endpoint_unit_type = PublisherEndpointUnit
     channel_type = PublisherChannel
 
-    def __init__(self, **kwargs):
+    def __init__(self, endpoint_cache=None, **kwargs):
         self._pub_ep = None
+        self._endpoint_cache = endpoint_cache
         SendingBaseEndpoint.__init__(self, **kwargs)
 
+    def _create_connected_endpoint(self, to_name):
+        ep = self.create_endpoint(to_name)
+        ep.channel.connect(to_name)
+        return ep
+
     def publish(self, msg, to_name=None, headers=None):
         if to_name is not None:
             if not isinstance(to_name, NameTrio):
@@ -676,9 +853,17 @@ class Publisher(SendingBaseEndpoint):
                 self._pub_ep.channel.connect(self._send_name)
 
             ep = self._pub_ep
+        elif self._endpoint_cache is not None:
+            ep = self._endpoint_cache.get_endpoint(to_name, self._create_connected_endpoint)
+            try:
+                ep.send(msg, headers)
+            except Exception:
+                self._endpoint_cache.release(to_name, ep, failed=True)
+                raise
+            self._endpoint_cache.release(to_name, ep)
+            return
         else:
-            ep = self.create_endpoint(to_name)
-            ep.channel.connect(to_name)
+            ep = self._create_connected_endpoint(to_name)
 
         ep.send(msg, headers)
         if ep != self._pub_ep:
@@ -802,6 +987,14 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
         # we have a timeout, update reply-by header
         headers['reply-by'] = str(int(headers['ts']) + int(timeout * 1000))
+
+        # use the node's shared reply queue if we can, otherwise fall back to an anon queue per request
+        mux = self._get_reply_mux()
+        if mux is not None and 'conv-id' in headers:
+            with mux.expect(headers['conv-id']) as ar:
+                if ar is not None:
+                    return self._send_via_reply_mux(mux, ar, msg, headers, timeout)
+
         self.channel.setup_listener(NameTrio(self.channel._send_name.exchange)) # anon queue
         # call base send, and get back the headers it ended up building and sending
         # we extract the conv-id so we can tell the listener what is valid.
@@ -813,6 +1006,37 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
             raise exception.Timeout('Request timed out (%d sec) waiting for response from %s, conv %s' % (timeout, str(self.channel._send_name), sent_headers['conv-id']))
         return result_data, result_headers
 
+    def _send_via_reply_mux(self, mux, ar, msg, headers, timeout):
+        """
+        Sends a request with the node's shared reply queue as reply-to and waits for the multiplexer
+        to hand us the matching reply.
+
+        @param  ar      The AsyncResult obtained by registering our conv-id with the multiplexer.
+        """
+        headers['reply-to'] = mux.get_reply_to(self.channel._send_name)
+        BidirectionalEndpointUnit._send(self, msg, headers=headers)
+
+        try:
+            rmsg, rheaders = ar.get(timeout=timeout)
+        except Timeout:
+            raise exception.Timeout('Request timed out (%d sec) waiting for response from %s, conv %s' % (timeout, str(self.channel._send_name), headers['conv-id']))
+
+        return self.intercept_in(rmsg, rheaders)
+
+    def _get_reply_mux(self):
+        """
+        Returns the node's ReplyMultiplexer if enabled by config (container.messaging.endpoint.rpc_reply_mux)
+        and available, otherwise None.
+        """
+        if not CFG.get_safe('container.messaging.endpoint.rpc_reply_mux', False):
+            return None
+
+        node = self._endpoint.node if self._endpoint is not None else None
+        if node is None or not hasattr(node, 'get_reply_mux'):
+            return None
+
+        return node.get_reply_mux()
+
     def _build_header(self, raw_msg, raw_headers):
         """
         Sets headers common to Request-Response patterns, non-ion-specific.
@@ -12,16 +12,163 @@ from pika import channel as pikachannel
 from pika.exceptions import NoFreeChannels
 
 from pyon.core.bootstrap import CFG, get_sys_name
+from pyon.core.interceptor.interceptor import InterceptorStacks
 from pyon.net import channel
 from pyon.util.async import blocking_cb
 from pyon.util.containers import for_name
 from pyon.util.log import log
 from pyon.util.pool import IDPool
-from pyon.net.transport import LocalTransport, LocalRouter, AMQPTransport, ComposableTransport
+from pyon.net.transport import LocalTransport, LocalRouter, AMQPTransport, ComposableTransport, NameTrio, DeclarationRegistry
 
 from collections import defaultdict
+from contextlib import contextmanager
 import traceback
 
+
+class ReplyMultiplexer(object):
+    """
+    A shared, long-lived reply queue for all RPC requests made through one Node.
+
+    Without this, every request declares, binds and consumes its own anonymous queue and tears it
+    down again afterwards. Instead, a requester registers the conv-id it expects a reply for, sends
+    its request with this multiplexer's reply-to address, and waits on the AsyncResult it was handed.
+    A single greenlet consumes the reply queue and sets the AsyncResult matching each reply's conv-id.
+    """
+
+    def __init__(self, node):
+        self._node = node
+        self._chan = None
+        self._gl_recv = None
+        self._lock = coros.RLock()
+        self._waiters = {}              # conv-id -> AsyncResult
+        self._bound_exchanges = set()   # exchanges our queue has been bound into
+
+        self.active = False
+
+    def start(self):
+        """
+        Creates the reply channel/queue and starts routing replies.
+        """
+        self._chan = self._node.channel(channel.ReplyChannel)
+        self._chan.set_closed_error_callback(self._on_channel_error)
+        self._chan.setup_listener(NameTrio(get_sys_name()))
+        self._bound_exchanges.add(get_sys_name())
+        self._chan.start_consume()
+
+        self._gl_recv = gevent.spawn(self._run_recv)
+        self._gl_recv._glname = "pyon.net RPC reply multiplexer"
+
+        self.active = True
+        log.debug("ReplyMultiplexer started on queue %s", self._chan._recv_name.queue)
+
+    def stop(self):
+        """
+        Closes the reply channel. Any requests still waiting on a reply get a ChannelClosedError.
+        """
+        self.active = False
+        self._fail_waiters(channel.ChannelClosedError("RPC reply queue closed"))
+
+        try:
+            if self._chan is not None:
+                chan, self._chan = self._chan, None
+                chan.close()
+        finally:
+            if self._gl_recv is not None:
+                self._gl_recv.join(timeout=5)
+                self._gl_recv.kill()
+                self._gl_recv = None
+
+    def get_reply_to(self, send_name):
+        """
+        Returns the value of the reply-to header a request sent to send_name should carry.
+
+        Our queue is bound into send_name's exchange the first time it is seen, with the same exchange
+        declare properties a per-request reply channel would have used.
+        """
+        exchange = send_name.exchange
+        if exchange not in self._bound_exchanges:
+            with self._lock:
+                if exchange not in self._bound_exchanges:
+                    self._chan.bind_exchange(exchange,
+                                             durable=getattr(send_name, 'exchange_durable', False),
+                                             auto_delete=getattr(send_name, 'exchange_auto_delete', True))
+                    self._bound_exchanges.add(exchange)
+
+        return "%s,%s" % (exchange, self._chan._recv_name.queue)
+
+    def register(self, conv_id):
+        """
+        Registers interest in the reply to conv_id.
+
+        @returns    An AsyncResult that is set to a (body, headers) tuple when the reply arrives, or None
+                    if another request is already waiting on the same conv-id.
+        """
+        with self._lock:
+            if conv_id in self._waiters:
+                return None
+
+            ar = event.AsyncResult()
+            self._waiters[conv_id] = ar
+            return ar
+
+    def unregister(self, conv_id):
+        """
+        Removes interest in conv_id, whether its reply arrived or not.
+        """
+        self._waiters.pop(conv_id, None)
+
+    @contextmanager
+    def expect(self, conv_id):
+        """
+        Context manager form of register/unregister. Yields None if conv_id is already in use.
+        """
+        ar = self.register(conv_id)
+        try:
+            yield ar
+        finally:
+            if ar is not None:
+                self.unregister(conv_id)
+
+    def _run_recv(self):
+        """
+        Consumes the reply queue and hands replies to the waiting requests.
+        """
+        chan = self._chan
+        while True:
+            try:
+                body, headers, _ = chan.recv()
+            except channel.ChannelClosedError:
+                break
+
+            conv_id = headers.get('conv-id', None)
+            ar = self._waiters.pop(conv_id, None)
+            if ar is None:
+                log.warn("Discarding unknown message, likely from a previous timed out request (conv-id: %s, seq: %s, perf: %s)", conv_id, headers.get('conv-seq', 'no conv seq'), headers.get('performative', 'None'))
+                continue
+
+            ar.set((body, headers))
+
+    def _on_channel_error(self, ch, code, text):
+        """
+        Closed error callback for our channel: the Node stops this multiplexer and creates a new one on next use.
+        """
+        log.warn("ReplyMultiplexer channel closed with error (%s): %s", code, text)
+        self.active = False
+        self._fail_waiters(channel.ChannelClosedError("RPC reply queue closed with error (%s): %s" % (code, text)))
+
+        # nothing more arrives on this channel, don't leave the consumer waiting on it
+        if self._gl_recv is not None:
+            self._gl_recv.kill(block=False)
+
+    def _fail_waiters(self, ex):
+        with self._lock:
+            waiters = self._waiters.values()
+            self._waiters.clear()
+
+        for ar in waiters:
+            ar.set_exception(ex)
+
+
 class BaseNode(object):
     """
     """
@@ -33,6 +180,7 @@ class BaseNode(object):
         self._lock = coros.RLock()
 
         self.interceptors = {}  # endpoint interceptors
+        self._reply_mux = None  # shared RPC reply queue, created on first use
 
     def on_connection_open(self, client):
         """
@@ -68,6 +216,32 @@ class BaseNode(object):
         log.debug("In Node.stop_node")
         self.running = False
 
+    def get_reply_mux(self):
+        """
+        Returns this Node's ReplyMultiplexer, creating and starting it if needed.
+
+        A multiplexer whose channel failed is stopped and replaced by a new one.
+        """
+        with self._lock:
+            if self._reply_mux is None or not self._reply_mux.active:
+                self._stop_reply_mux()
+                mux = ReplyMultiplexer(self)
+                mux.start()
+                self._reply_mux = mux
+
+            return self._reply_mux
+
+    def _stop_reply_mux(self):
+        """
+        Stops the ReplyMultiplexer if one was created.
+        """
+        if self._reply_mux is not None:
+            try:
+                self._reply_mux.stop()
+            except Exception:
+                log.exception("Error stopping RPC reply multiplexer, ignoring")
+            self._reply_mux = None
+
     def channel(self, ch_type):
         """
         Create a channel on current node.
@@ -127,7 +301,7 @@ class BaseNode(object):
 
                 interceptors[type_and_direction].append(classinst)
 
-        self.interceptors = dict(interceptors)
+        self.interceptors = InterceptorStacks(interceptors)
 
 class NodeB(BaseNode):
     """
@@ -148,6 +322,16 @@ class NodeB(BaseNode):
 
         BaseNode.__init__(self)
 
+        # exchanges/queues/bindings declared on this connection, to skip redundant declares
+        self.declarations = None
+        if CFG.get_safe('container.messaging.declaration_cache.enabled', True):
+            self.declarations = DeclarationRegistry(cache_auto_delete=CFG.get_safe('container.messaging.declaration_cache.auto_delete', False))
+
+    def on_connection_close(self, *a):
+        BaseNode.on_connection_close(self, *a)
+        if self.declarations is not None:
+            self.declarations.clear()
+
     def stop_node(self):
         """
         Closes the connection to the broker, cleans up resources held by this node.
@@ -155,7 +339,8 @@ class NodeB(BaseNode):
         log.debug("NodeB.stop_node (running: %s)", self.running)
 
         if self.running:
-            # clean up pooling before we shut connection
+            # clean up shared reply queue and pooling before we shut connection
+            self._stop_reply_mux()
             self._destroy_pool()
             self.client.close()
 
@@ -181,7 +366,7 @@ class NodeB(BaseNode):
                 Container.instance.fail_fast("AMQCHAN IS NONE, messaging has failed", True)
             raise StandardError("AMQCHAN IS NONE THIS SHOULD NEVER HAPPEN, chan number requested: %s" % ch_number)
 
-        transport = AMQPTransport(amq_chan)
+        transport = AMQPTransport(amq_chan, declarations=self.declarations)
 
         # by default, everything should have a prefetch count of 1 (configurable)
         # this can be overridden by the channel get_n related methods
@@ -402,6 +587,7 @@ class LocalNode(BaseNode):
 
     def stop_node(self):
         if self.running:
+            self._stop_reply_mux()
             if self._own_router:
                 self._local_router.stop()
         self.running = False
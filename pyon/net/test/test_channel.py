@@ -4,6 +4,7 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
 from pyon.util.unit_test import PyonTestCase
+from pyon.net import channel
 from pyon.net.channel import BaseChannel, SendChannel, RecvChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, ChannelError, ChannelShutdownMessage, ListenChannel, PublisherChannel
 from nose.plugins.attrib import attr
 from pyon.net.transport import NameTrio, BaseTransport, AMQPTransport
@@ -121,6 +122,66 @@ class TestBaseChannel(PyonTestCase):
             with ch._ensure_transport():
                 pass
 
+    def test__ensure_transport_lock_diagnostics(self):
+        self.addCleanup(channel.set_lock_diagnostics, None)
+        channel.clear_lock_stats()
+        ch = BaseChannel()
+        ch.on_channel_open(Mock())
+
+        channel.set_lock_diagnostics(channel.LOCK_DIAG_OFF)
+        with ch._ensure_transport():
+            self.assertIsNone(ch._lock_owner)
+            self.assertIsNone(ch._lock_trace)
+
+        channel.set_lock_diagnostics(channel.LOCK_DIAG_CHEAP)
+        with ch._ensure_transport():
+            self.assertIsNotNone(ch._lock_owner)
+            self.assertIsNotNone(ch._lock_time)
+            self.assertIsNone(ch._lock_trace)
+            with ch._ensure_transport():
+                pass
+            # re-entrant acquisition restores the outer state
+            self.assertIsNotNone(ch._lock_owner)
+        self.assertIsNone(ch._lock_owner)
+        self.assertIsNone(ch._lock_time)
+        self.assertEquals(channel.get_lock_stats()['interleaves'], 1)
+        self.assertEquals(channel.get_lock_stats()['contentions'], 0)
+
+        channel.set_lock_diagnostics(channel.LOCK_DIAG_FULL)
+        with ch._ensure_transport():
+            self.assertIsInstance(ch._lock_trace, list)
+        self.assertIsNone(ch._lock_trace)
+
+        self.assertRaises(ValueError, channel.set_lock_diagnostics, 'verbose')
+
+    def test__ensure_transport_lock_contention(self):
+        self.addCleanup(channel.set_lock_diagnostics, None)
+        channel.set_lock_diagnostics(channel.LOCK_DIAG_CHEAP)
+        channel.clear_lock_stats()
+        ch = BaseChannel()
+        ch.on_channel_open(Mock())
+
+        ev = Event()
+        def hold():
+            with ch._ensure_transport():
+                ev.wait(timeout=5)
+
+        def wait():
+            with ch._ensure_transport():
+                pass
+
+        gl = spawn(hold)
+        gl.join(timeout=0.1)     # let it take the lock
+        waiter = spawn(wait)
+        waiter.join(timeout=0.1)
+        self.assertFalse(waiter.ready())
+        ev.set()
+        gl.join(timeout=5)
+        waiter.join(timeout=5)
+
+        self.assertEquals(channel.get_lock_stats()['contentions'], 1)
+        self.assertGreater(channel.get_lock_stats()['max_hold'], 0)
+
 @attr('UNIT')
 class TestSendChannel(PyonTestCase):
     def setUp(self):
@@ -171,6 +232,35 @@ class TestSendChannel(PyonTestCase):
         self.assertIn('custom', props)
         self.assertEquals(props['custom'], 'val')
 
+    def test_send_async(self):
+        transport = Mock()
+        transport.channel_number = sentinel.channel_number
+        transport.publish_impl.return_value = None
+        self.ch.on_channel_open(transport)
+        self.ch.connect(NameTrio('xp', 'key'))
+
+        # no confirms: result is ready once handed to the transport
+        ar = self.ch.send_async('data')
+        self.assertTrue(ar.ready())
+        self.assertTrue(ar.get())
+
+        self.ch.enable_confirms(max_in_flight=10)
+        transport.confirm_select_impl.assert_called_once_with(max_in_flight=10)
+
+        # confirms: the transport's result is passed through
+        transport.publish_impl.return_value = sentinel.async_result
+        self.assertEquals(self.ch.send_async('data'), sentinel.async_result)
+
+        self.ch.wait_for_confirms(timeout=5)
+        transport.wait_for_confirms_impl.assert_called_once_with(timeout=5)
+
+    def test_wait_for_confirms_not_enabled(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+
+        self.ch.wait_for_confirms()
+        self.assertFalse(transport.wait_for_confirms_impl.called)
+
 @attr('UNIT')
 class TestRecvChannel(PyonTestCase):
     def setUp(self):
@@ -526,6 +616,30 @@ class TestRecvChannel(PyonTestCase):
 
         transport.ack_impl.assert_called_once_with(sentinel.delivery_tag)
 
+    def test_ack_multiple(self):
+        transport = Mock()
+        transport.channel_number = sentinel.channel_number
+        self.ch.on_channel_open(transport)
+
+        self.ch.ack(sentinel.delivery_tag, multiple=True)
+
+        transport.ack_impl.assert_called_once_with(sentinel.delivery_tag, multiple=True)
+
+    def test_coalesce_acks(self):
+        transport = Mock()
+        transport.channel_number = sentinel.channel_number
+        self.ch.on_channel_open(transport)
+
+        # not coalescing, nothing to flush
+        self.ch.flush_acks()
+        self.assertFalse(transport.flush_acks_impl.called)
+
+        self.ch.coalesce_acks(max_count=10, max_interval=0.1)
+        transport.coalesce_acks_impl.assert_called_once_with(max_count=10, max_interval=0.1, lock=self.ch._ensure_transport)
+
+        self.ch.flush_acks()
+        transport.flush_acks_impl.assert_called_once_with()
+
     def test_reject(self):
         transport = Mock()
         transport.channel_number = sentinel.channel_number
@@ -566,6 +680,17 @@ class TestRecvChannel(PyonTestCase):
 
         self.ch._transport.get_stats_impl.assert_called_once_with(queue=sentinel.queue)
 
+    def test_set_prefetch(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+
+        self.ch.set_prefetch(10)
+        self.ch.set_prefetch(10)
+        transport.qos_impl.assert_called_once_with(prefetch_count=10)
+
+        self.ch.set_prefetch(1)
+        self.assertEquals(transport.qos_impl.call_count, 2)
+
     def test_purge(self):
         transport = Mock()
         self.ch.on_channel_open(transport)
@@ -750,6 +875,41 @@ class TestListenChannel(PyonTestCase):
         newch.close()
         self.assertEquals(transport.close.call_count, 0)
 
+    def test_AcceptedListenChannel_ack_multiple(self):
+        transport = Mock()
+        parent = Mock()
+        newch = ListenChannel.AcceptedListenChannel(parent_channel=parent)
+        newch.attach_transport(transport)
+
+        for dtag in ['tag1', 'tag2', 'tag3']:
+            newch._recv_queue.put((sentinel.body, {}, dtag))
+            newch.recv()
+
+        # acks the first two, third still outstanding
+        newch.ack('tag2', multiple=True)
+        transport.ack_impl.assert_called_once_with('tag2', multiple=True)
+        self.assertEquals(newch._delivery_tags, set(['tag3']))
+        self.assertFalse(parent.exit_accept.called)
+
+        newch.ack('tag3')
+        parent.exit_accept.assert_called_once_with()
+
+    def test_accept_flushes_coalesced_acks(self):
+        rmock = Mock()
+        rmock.return_value = sentinel.msg
+        transport = Mock()
+
+        self.ch.recv = rmock
+        self.ch._recv_queue.await_n = MagicMock()
+        self.ch._create_accepted_channel = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._fsm.current_state = self.ch.S_ACTIVE
+        self.ch._consuming = True
+        self.ch._ack_coalescing = True
+
+        self.ch.accept()
+        transport.flush_acks_impl.assert_called_once_with()
+
 @attr('UNIT')
 class TestSubscriberChannel(PyonTestCase):
 
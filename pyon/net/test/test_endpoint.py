@@ -8,7 +8,7 @@ from zope.interface.declarations import implements
 from zope.interface.interface import Interface
 from pyon.core import exception
 from pyon.net.channel import BaseChannel, SendChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, RecvChannel, ListenChannel
-from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint
+from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint, PublisherEndpointCache
 from gevent import event, spawn
 from pyon.net.messaging import NodeB
 from pyon.ion.service import BaseService
@@ -344,6 +344,32 @@ class TestListeningBaseEndpoint(PyonTestCase):
 
         ep._chan.get_stats.assert_called_once_with()
 
+    def test_get_up_to_n_msgs(self):
+        ep = ListeningBaseEndpoint()
+        ep._chan = Mock(spec=ListenChannel)
+        ep._chan._recv_queue = Mock()
+        ep._chan._recv_queue.qsize.return_value = 4
+        ep._get_n_msgs = Mock(return_value=sentinel.msgs)
+
+        # prefetch window already full, no waiting for more
+        self.assertEquals(ep.get_up_to_n_msgs(4, 10), sentinel.msgs)
+
+        ep._chan.set_prefetch.assert_called_once_with(4)
+        ep._chan.flush_acks.assert_called_once_with()
+        self.assertFalse(ep._chan._recv_queue.await_n.called)
+        ep._get_n_msgs.assert_called_once_with(4, timeout=None)
+
+    def test_ack_msgs(self):
+        ep = ListeningBaseEndpoint()
+        ackmock = Mock()
+        msgs = [ListeningBaseEndpoint.MessageObject((sentinel.body, {}, dtag), ackmock, Mock(), Mock()) for dtag in (1, 2, 3)]
+
+        ep.ack_msgs([])
+        self.assertFalse(ackmock.called)
+
+        ep.ack_msgs(msgs)
+        ackmock.assert_called_once_with(3, multiple=True)
+
 @attr('INT', group='COI')
 class TestListeningBaseEndpointInt(IonIntegrationTestCase):
     def setUp(self):
@@ -427,6 +453,74 @@ class TestPublisher(PyonTestCase):
         self._pub.close()
         self._pub._pub_ep.close.assert_called_once_with()
 
+    def test_publish_with_endpoint_cache(self):
+        cache = PublisherEndpointCache(max_size=2, idle_timeout=60)
+        pub = Publisher(node=self._node, endpoint_cache=cache)
+
+        pub.publish(sentinel.msg, to_name=NameTrio('xp', 'a'))
+        pub.publish(sentinel.msg, to_name=NameTrio('xp', 'a'))
+        self.assertEquals(self._node.channel.call_count, 1)
+        self.assertEquals(self._ch.send.call_count, 2)
+        self.assertEquals(self._ch.close.call_count, 0)
+
+        # Least recently used endpoints are closed beyond max_size
+        pub.publish(sentinel.msg, to_name=NameTrio('xp', 'b'))
+        pub.publish(sentinel.msg, to_name=NameTrio('xp', 'c'))
+        self.assertEquals(self._node.channel.call_count, 3)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(self._ch.close.call_count, 1)
+
+        # Idle endpoints are closed on next access
+        cache.idle_timeout = -1
+        pub.publish(sentinel.msg, to_name=NameTrio('xp', 'c'))
+        self.assertEquals(len(cache), 1)
+        self.assertEquals(self._ch.close.call_count, 3)
+
+        cache.close()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(self._ch.close.call_count, 4)
+
+        # A closed cache hands out no more endpoints
+        self.assertRaises(EndpointError, pub.publish, sentinel.msg, to_name=NameTrio('xp', 'a'))
+        self.assertEquals(self._node.channel.call_count, 4)
+
+    def test_endpoint_cache_in_use(self):
+        cache = PublisherEndpointCache(max_size=1, idle_timeout=60)
+        create_func = Mock(side_effect=lambda to_name: Mock())
+        name_a, name_b = NameTrio('xp', 'a'), NameTrio('xp', 'b')
+
+        # Endpoints evicted while in use are closed when released
+        ep_a = cache.get_endpoint(name_a, create_func)
+        ep_b = cache.get_endpoint(name_b, create_func)
+        self.assertFalse(ep_a.close.called)
+        cache.release(name_a, ep_a)
+        ep_a.close.assert_called_once_with()
+        cache.release(name_b, ep_b)
+        self.assertFalse(ep_b.close.called)
+
+        # A failed endpoint is removed once, without closing the one replacing it
+        ep_b1 = cache.get_endpoint(name_b, create_func)
+        ep_b2 = cache.get_endpoint(name_b, create_func)
+        self.assertIs(ep_b1, ep_b)
+        self.assertIs(ep_b2, ep_b)
+        cache.release(name_b, ep_b, failed=True)
+        self.assertFalse(ep_b.close.called)
+        ep_new = cache.get_endpoint(name_b, create_func)
+        self.assertIsNot(ep_new, ep_b)
+        cache.release(name_b, ep_b, failed=True)
+        ep_b.close.assert_called_once_with()
+        cache.release(name_b, ep_new)
+        self.assertFalse(ep_new.close.called)
+        self.assertEquals(len(cache), 1)
+
+        # Closing the cache closes endpoints in use once released
+        ep_new = cache.get_endpoint(name_b, create_func)
+        cache.close()
+        self.assertFalse(ep_new.close.called)
+        cache.release(name_b, ep_new)
+        ep_new.close.assert_called_once_with()
+        self.assertRaises(EndpointError, cache.get_endpoint, name_b, create_func)
+
 
 class RecvMockMixin(object):
     """
@@ -516,6 +610,32 @@ class TestRequestResponse(PyonTestCase, RecvMockMixin):
 
         self.assertRaises(exception.Timeout, e._send, sentinel.msg, MagicMock(), timeout=1)
 
+    def test_endpoint_send_with_reply_mux(self):
+        self.patch_cfg('pyon.net.endpoint.CFG', container=dict(messaging=dict(endpoint=dict(rpc_reply_mux=True))))
+
+        ar = event.AsyncResult()
+        ar.set(("muxmsg", {'conv-id':sentinel.conv_id}))
+        mux = MagicMock()
+        mux.expect.return_value.__enter__.return_value = ar
+        mux.expect.return_value.__exit__.return_value = False
+        mux.get_reply_to.return_value = sentinel.reply_to
+        self._node.get_reply_mux.return_value = mux
+
+        ep = RequestResponseClient(node=self._node, to_name="rr")
+        ep._interceptors = {}
+        e = RequestEndpointUnit(endpoint=ep, interceptors={})
+        ch = self._setup_mock_channel()
+        e.attach_channel(ch)
+
+        retval, heads = e._send("msg", {'ts':'1', 'conv-id':sentinel.conv_id})
+        self.assertEquals(retval, "muxmsg")
+
+        # no per-request queue was set up or consumed on
+        self.assertFalse(ch.setup_listener.called)
+        self.assertFalse(ch.recv.called)
+        mux.expect.assert_called_once_with(sentinel.conv_id)
+        mux.get_reply_to.assert_called_once_with(ch._send_name)
+
     def test_rr_client(self):
         rr = RequestResponseClient(node=self._node, to_name="rr")
         rr.node.channel.return_value = self._setup_mock_channel()
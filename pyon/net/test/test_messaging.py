@@ -3,8 +3,9 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
-from pyon.net.messaging import NodeB, ioloop, make_node, PyonSelectConnection
-from pyon.net.channel import BaseChannel, BidirClientChannel, RecvChannel
+from pyon.net.messaging import NodeB, ioloop, make_node, PyonSelectConnection, ReplyMultiplexer
+from pyon.net.channel import BaseChannel, BidirClientChannel, RecvChannel, ReplyChannel, ChannelClosedError
+from pyon.net.transport import NameTrio
 from pyon.util.unit_test import PyonTestCase
 from mock import Mock, sentinel, patch
 from nose.plugins.attrib import attr
@@ -13,6 +14,7 @@ from pyon.core import bootstrap
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.async import spawn
 from gevent import event, queue
+import gevent
 import time
 from pyon.util.containers import DotDict
 from pika.exceptions import NoFreeChannels
@@ -244,6 +246,122 @@ class TestNodeB(PyonTestCase):
         self.assertRaises(StandardError, self._node._new_transport)
         containermock.fail_fast.assert_called_once_with("AMQCHAN IS NONE, messaging has failed", True)
 
+    def test_get_reply_mux(self):
+        with patch('pyon.net.messaging.ReplyMultiplexer') as rmmock:
+            mux = self._node.get_reply_mux()
+            self.assertEquals(mux, rmmock.return_value)
+            mux.start.assert_called_once_with()
+
+            # second call gets the same one while it is active
+            self.assertEquals(self._node.get_reply_mux(), mux)
+            self.assertEquals(rmmock.call_count, 1)
+
+            # an inactive (failed) one gets stopped and replaced
+            mux.active = False
+            self._node.get_reply_mux()
+            self.assertEquals(rmmock.call_count, 2)
+            mux.stop.assert_called_once_with()
+
+    def test_stop_node_stops_reply_mux(self):
+        self._node.client = Mock()
+        self._node._destroy_pool = Mock()
+        self._node.running = True
+        muxmock = Mock()
+        self._node._reply_mux = muxmock
+
+        self._node.stop_node()
+
+        muxmock.stop.assert_called_once_with()
+        self.assertIsNone(self._node._reply_mux)
+
+@attr('UNIT')
+class TestReplyMultiplexer(PyonTestCase):
+    def setUp(self):
+        self._node = Mock(spec=NodeB)
+        self._chan = Mock(spec=ReplyChannel)
+        self._chan._recv_name = NameTrio(sentinel.exchange, 'amq.gen-reply')
+        self._node.channel.return_value = self._chan
+        self._mux = ReplyMultiplexer(self._node)
+
+    def _deliver(self, *msgs):
+        vals = list(msgs)
+        def _ret(*args, **kwargs):
+            if len(vals):
+                return vals.pop(0)
+            raise ChannelClosedError()
+        self._chan.recv.side_effect = _ret
+
+    @patch('pyon.net.messaging.get_sys_name', Mock(return_value=sentinel.sysname))
+    def test_start(self):
+        self._deliver()
+        self._mux.start()
+
+        self._node.channel.assert_called_once_with(ReplyChannel)
+        self.assertTrue(self._chan.setup_listener.called)
+        self._chan.start_consume.assert_called_once_with()
+        self.assertTrue(self._mux.active)
+
+        self._mux._gl_recv.join(timeout=5)
+
+    def test_register_duplicate(self):
+        ar = self._mux.register(sentinel.conv_id)
+        self.assertIsNotNone(ar)
+        self.assertIsNone(self._mux.register(sentinel.conv_id))
+
+        self._mux.unregister(sentinel.conv_id)
+        self.assertIsNotNone(self._mux.register(sentinel.conv_id))
+
+    def test_routes_by_conv_id(self):
+        ar1 = self._mux.register('conv-1')
+        ar2 = self._mux.register('conv-2')
+
+        self._deliver((sentinel.body2, {'conv-id':'conv-2'}, 1),
+                      (sentinel.unknown, {'conv-id':'conv-old'}, 2),
+                      (sentinel.body1, {'conv-id':'conv-1'}, 3))
+        self._mux._chan = self._chan
+        self._mux._run_recv()
+
+        self.assertEquals(ar1.get(timeout=1), (sentinel.body1, {'conv-id':'conv-1'}))
+        self.assertEquals(ar2.get(timeout=1), (sentinel.body2, {'conv-id':'conv-2'}))
+        self.assertEquals(self._mux._waiters, {})
+
+    def test_get_reply_to_binds_once(self):
+        self._mux._chan = self._chan
+        send_name = NameTrio('other_xp', 'svc')
+
+        self.assertEquals(self._mux.get_reply_to(send_name), 'other_xp,amq.gen-reply')
+        self.assertEquals(self._mux.get_reply_to(send_name), 'other_xp,amq.gen-reply')
+
+        self._chan.bind_exchange.assert_called_once_with('other_xp', durable=False, auto_delete=True)
+
+    def test_stop_fails_waiters(self):
+        self._mux._chan = self._chan
+        ar = self._mux.register(sentinel.conv_id)
+
+        self._mux.stop()
+
+        self.assertRaises(ChannelClosedError, ar.get, timeout=1)
+        self._chan.close.assert_called_once_with()
+        self.assertFalse(self._mux.active)
+
+    @patch('pyon.net.messaging.get_sys_name', Mock(return_value=sentinel.sysname))
+    def test_channel_error_stops_consumer(self):
+        self._chan.recv.side_effect = lambda *args, **kwargs: gevent.sleep(10)
+        self._mux.start()
+        ar = self._mux.register(sentinel.conv_id)
+
+        self._mux._on_channel_error(self._chan, 404, "NOT_FOUND")
+
+        self.assertRaises(ChannelClosedError, ar.get, timeout=1)
+        self.assertFalse(self._mux.active)
+        self._mux._gl_recv.join(timeout=1)
+        self.assertTrue(self._mux._gl_recv.dead)
+
+        # the node then closes the failed channel
+        self._mux.stop()
+        self._chan.close.assert_called_once_with()
+        self.assertIsNone(self._mux._gl_recv)
+
 @attr('UNIT')
 class TestMessaging(PyonTestCase):
     def test_ioloop(self):
@@ -5,14 +5,19 @@ __license__ = 'Apache 2.0'
 
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
-from pyon.net.transport import NameTrio, BaseTransport, AMQPTransport, TransportError, TopicTrie, LocalRouter, ComposableTransport, LocalTransport
+from pyon.net.transport import NameTrio, BaseTransport, AMQPTransport, TransportError, TopicTrie, LocalRouter, ComposableTransport, LocalTransport, AckCoalescer, DeclarationRegistry
 from pyon.core.bootstrap import get_sys_name
 from pika import BasicProperties
 
 from nose.plugins.attrib import attr
 from mock import Mock, MagicMock, sentinel, patch, call, ANY
 from gevent.event import Event
+from gevent.timeout import Timeout
+from pika import spec
+import gevent
+from contextlib import contextmanager
 import time
+import sys
 
 @attr('UNIT')
 class TestTransport(PyonTestCase):
@@ -34,6 +39,10 @@ class TestTransport(PyonTestCase):
         self.assertRaises(NotImplementedError, bt.purge_impl, sentinel.queue)
         self.assertRaises(NotImplementedError, bt.qos_impl)
         self.assertRaises(NotImplementedError, bt.publish_impl, sentinel.exchange, sentinel.rkey, sentinel.body, sentinel.props)
+        self.assertRaises(NotImplementedError, bt.coalesce_acks_impl)
+        self.assertRaises(NotImplementedError, bt.flush_acks_impl)
+        self.assertRaises(NotImplementedError, bt.confirm_select_impl)
+        self.assertRaises(NotImplementedError, bt.wait_for_confirms_impl)
         self.assertRaises(NotImplementedError, bt.close)
         with self.assertRaises(NotImplementedError):
             cn = bt.channel_number
@@ -64,7 +73,11 @@ class TestComposableTransport(PyonTestCase):
                                         'stop_consume_impl'    : right.stop_consume_impl,
                                         'get_stats_impl'       : right.get_stats_impl,
                                         'qos_impl'             : right.qos_impl,
-                                        'publish_impl'         : right.publish_impl, })
+                                        'publish_impl'         : right.publish_impl,
+                                        'coalesce_acks_impl'   : right.coalesce_acks_impl,
+                                        'flush_acks_impl'      : right.flush_acks_impl,
+                                        'confirm_select_impl'  : right.confirm_select_impl,
+                                        'wait_for_confirms_impl': right.wait_for_confirms_impl, })
 
     def test_overlay(self):
         left = Mock()
@@ -147,6 +160,23 @@ class TestComposableTransport(PyonTestCase):
         self.assertEquals(left.qos_impl.call_count, 0)
         self.assertEquals(left.publish_impl.call_count, 0)
 
+    def test_ack_multiple(self):
+        left = Mock()
+        right = Mock()
+        ct = ComposableTransport(left, right, *ComposableTransport.common_methods)
+
+        ct.ack_impl(sentinel.dtag, multiple=True)
+        ct.coalesce_acks_impl(max_count=5, max_interval=1)
+        ct.flush_acks_impl()
+        ct.confirm_select_impl(max_in_flight=5)
+        ct.wait_for_confirms_impl(timeout=1)
+
+        right.ack_impl.assert_called_once_with(sentinel.dtag, multiple=True)
+        right.coalesce_acks_impl.assert_called_once_with(max_count=5, max_interval=1, lock=None)
+        right.flush_acks_impl.assert_called_once_with()
+        right.confirm_select_impl.assert_called_once_with(max_in_flight=5)
+        right.wait_for_confirms_impl.assert_called_once_with(timeout=1)
+
     def test_close(self):
         left = Mock()
         right = Mock()
@@ -438,6 +468,62 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
 
         self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag)
 
+    def test_ack_impl_multiple(self):
+        self.tp.ack_impl(sentinel.dtag, multiple=True)
+
+        self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag, multiple=True)
+
+    def test_coalesce_acks_impl(self):
+        self.tp.coalesce_acks_impl(max_count=2, max_interval=10)
+        self.tp.start_consume_impl(sentinel.callback, sentinel.queue)
+
+        # deliveries go through the coalescer
+        cb = self.tp._client.basic_consume.call_args[0][0]
+        cb(sentinel.chan, Mock(delivery_tag=1), sentinel.header, sentinel.body)
+        cb(sentinel.chan, Mock(delivery_tag=2), sentinel.header, sentinel.body)
+        cb(sentinel.chan, Mock(delivery_tag=3), sentinel.header, sentinel.body)
+
+        self.tp.ack_impl(1)
+        self.assertEquals(self.tp._client.basic_ack.call_count, 0)
+        self.tp.ack_impl(2)
+        self.tp._client.basic_ack.assert_called_once_with(2, multiple=True)
+
+        self.tp.ack_impl(3)
+        self.tp.flush_acks_impl()
+        self.tp._client.basic_ack.assert_called_with(3)
+
+    def test_confirm_select_impl(self):
+        self.tp.confirm_select_impl(max_in_flight=2)
+        self.tp._client.confirm_delivery.assert_called_once_with(callback=self.tp._on_confirm)
+
+        ar1 = self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+        ar2 = self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+        self.assertFalse(ar1.ready())
+
+        # window is full, next publish blocks until confirmed
+        gl = gevent.spawn(self.tp.publish_impl, sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+        gevent.sleep(0)
+        self.assertEquals(self.tp._client.basic_publish.call_count, 2)
+
+        self.tp._on_confirm(Mock(method=spec.Basic.Ack(delivery_tag=2, multiple=True)))
+        self.assertEquals(ar1.get(timeout=1), 1)
+        self.assertEquals(ar2.get(timeout=1), 2)
+
+        ar3 = gl.get(timeout=1)
+        self.assertEquals(self.tp._client.basic_publish.call_count, 3)
+
+        self.tp._on_confirm(Mock(method=spec.Basic.Nack(delivery_tag=3)))
+        self.assertRaises(TransportError, ar3.get, timeout=1)
+        self.tp.wait_for_confirms_impl(timeout=1)
+
+    def test_confirms_failed_on_close(self):
+        self.tp.confirm_select_impl()
+        ar = self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+
+        self.tp._on_underlying_close(404, "NOT_FOUND")
+        self.assertRaises(TransportError, ar.get, timeout=1)
+        self.assertEquals(len(self.tp._unconfirmed), 0)
+
     def test_reject_impl(self):
         self.tp.reject_impl(sentinel.dtag)
 
@@ -530,6 +616,221 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
                                                               immediate=False,
                                                               mandatory=False)
 
+    def test_declarations(self):
+        self.tp._declarations = DeclarationRegistry()
+
+        # declared once only
+        self.tp.declare_exchange_impl(sentinel.exchange, auto_delete=False)
+        self.tp.declare_exchange_impl(sentinel.exchange, auto_delete=False)
+        self.assertEquals(self.tp._sync_call.call_count, 1)
+
+        # different params, auto delete exchanges are declared every time
+        self.tp.declare_exchange_impl(sentinel.exchange, durable=True, auto_delete=False)
+        self.tp.declare_exchange_impl(sentinel.exchange3)
+        self.tp.declare_exchange_impl(sentinel.exchange3)
+        self.assertEquals(self.tp._sync_call.call_count, 4)
+
+        # unless turned on
+        self.tp._declarations.cache_auto_delete = True
+        self.tp.declare_exchange_impl(sentinel.exchange2)
+        self.tp.declare_exchange_impl(sentinel.exchange2)
+        self.assertEquals(self.tp._sync_call.call_count, 5)
+
+        self.tp._sync_call.reset_mock()
+        self.assertEquals(self.tp.declare_queue_impl(sentinel.queue, auto_delete=False), self.tp._sync_call.return_value.method.queue)
+        self.assertEquals(self.tp.declare_queue_impl(sentinel.queue, auto_delete=False), self.tp._sync_call.return_value.method.queue)
+        self.tp.bind_impl(sentinel.exchange, sentinel.queue, sentinel.binding)
+        self.tp.bind_impl(sentinel.exchange, sentinel.queue, sentinel.binding)
+        self.assertEquals(self.tp._sync_call.call_count, 2)
+
+        # deleting through the transport forgets
+        self.tp.delete_queue_impl(sentinel.queue)
+        self.tp.declare_queue_impl(sentinel.queue, auto_delete=False)
+        self.tp.bind_impl(sentinel.exchange, sentinel.queue, sentinel.binding)
+        self.tp.delete_exchange_impl(sentinel.exchange)
+        self.tp.declare_exchange_impl(sentinel.exchange, auto_delete=False)
+        self.assertEquals(self.tp._sync_call.call_count, 7)
+
+        # a normal channel close forgets the auto delete exchanges declared on it
+        self.tp._on_underlying_close(200, "")
+        self.tp._sync_call.reset_mock()
+        self.tp.declare_exchange_impl(sentinel.exchange, auto_delete=False)
+        self.tp.declare_exchange_impl(sentinel.exchange2)
+        self.assertEquals(self.tp._sync_call.call_count, 1)
+
+        # channel errors forget everything
+        self.tp._on_underlying_close(404, "NOT_FOUND")
+        self.tp._sync_call.reset_mock()
+        self.tp.declare_exchange_impl(sentinel.exchange, auto_delete=False)
+        self.assertEquals(self.tp._sync_call.call_count, 1)
+
+    def test_declarations_auto_delete_exchange_deleted_on_broker(self):
+        self.tp._declarations = DeclarationRegistry()
+
+        self.tp.declare_exchange_impl(sentinel.exchange)
+        self.tp.declare_queue_impl(sentinel.queue, auto_delete=False)
+        self.tp.bind_impl(sentinel.exchange, sentinel.queue, sentinel.binding)
+
+        # another connection unbinds the last binding, the broker deletes the exchange without
+        # anything seen here, so the next publisher must declare it again
+        self.tp._sync_call.reset_mock()
+        self.tp.declare_exchange_impl(sentinel.exchange)
+        self.assertEquals(self.tp._sync_call.call_count, 1)
+        self.assertEquals(self.tp._sync_call.call_args[0][0], self.tp._client.exchange_declare)
+
+@attr('UNIT')
+class TestDeclarationRegistry(PyonTestCase):
+
+    def test_exchanges(self):
+        reg = DeclarationRegistry()
+        reg.add_exchange('ex', ('topic', False, True))
+        self.assertFalse(reg.has_exchange('ex', ('topic', False, True)))
+
+        reg = DeclarationRegistry(cache_auto_delete=True)
+        reg.add_exchange('ex', ('topic', False, True))
+        self.assertTrue(reg.has_exchange('ex', ('topic', False, True)))
+        self.assertFalse(reg.has_exchange('ex', ('topic', True, True)))
+        self.assertEquals(reg.skipped, 1)
+
+        # auto delete exchange goes with its last binding
+        reg.add_queue('q', (False, False, False), 'q')
+        reg.add_binding('ex', 'q', 'b1')
+        reg.add_binding('ex', 'q', 'b2')
+        reg.remove_binding('ex', 'q', 'b1')
+        self.assertTrue(reg.has_exchange('ex', ('topic', False, True)))
+        reg.remove_queue('q')
+        self.assertFalse(reg.has_exchange('ex', ('topic', False, True)))
+
+        # auto delete exchanges go with the channel that declared them
+        reg.add_exchange('ex', ('topic', False, True), owner=sentinel.tp1)
+        reg.add_exchange('ex2', ('topic', False, True), owner=sentinel.tp2)
+        reg.add_exchange('ex3', ('topic', False, False), owner=sentinel.tp1)
+        reg.remove_owner(sentinel.tp1)
+        self.assertFalse(reg.has_exchange('ex', ('topic', False, True)))
+        self.assertTrue(reg.has_exchange('ex2', ('topic', False, True)))
+        self.assertTrue(reg.has_exchange('ex3', ('topic', False, False)))
+
+    def test_queues_and_bindings(self):
+        reg = DeclarationRegistry()
+        reg.add_queue('', (False, False, False), 'amq.gen-1')
+        reg.add_queue('q1', (False, True, False), 'q1')
+        reg.add_queue('q2', (True, False, False), 'q2')
+        self.assertIsNone(reg.get_queue('', (False, False, False)))
+        self.assertIsNone(reg.get_queue('q1', (False, True, False)))
+        self.assertIsNone(reg.get_queue('q2', (False, False, False)))
+        self.assertEquals(reg.get_queue('q2', (True, False, False)), 'q2')
+
+        # only bindings to known queues
+        reg.add_binding('ex', 'q1', 'b')
+        reg.add_binding('ex', 'q2', 'b')
+        self.assertFalse(reg.has_binding('ex', 'q1', 'b'))
+        self.assertTrue(reg.has_binding('ex', 'q2', 'b'))
+
+        reg.remove_exchange('ex')
+        self.assertFalse(reg.has_binding('ex', 'q2', 'b'))
+
+        reg.clear()
+        self.assertIsNone(reg.get_queue('q2', (True, False, False)))
+
+@attr('UNIT')
+class TestAckCoalescer(PyonTestCase):
+    def setUp(self):
+        self.ack_func = Mock()
+        self.ac = AckCoalescer(self.ack_func, max_count=3, max_interval=10)
+        self.addCleanup(self.ac.close)
+
+        cb = self.ac.wrap_callback(Mock())
+        for dtag in xrange(1, 7):
+            cb(sentinel.chan, Mock(delivery_tag=dtag), sentinel.header, sentinel.body)
+
+    def test_ack_in_order(self):
+        self.ac.ack(1)
+        self.ac.ack(2)
+        self.assertEquals(self.ack_func.call_count, 0)
+        self.ac.ack(3)
+        self.ack_func.assert_called_once_with(3, True)
+        self.assertEquals(self.ac.pending, 0)
+
+    def test_ack_out_of_order(self):
+        self.ac.ack(2)
+        self.ac.ack(3)
+        self.ac.ack(4)
+        self.assertEquals(self.ack_func.call_count, 0)   # 1 still outstanding
+        self.assertEquals(self.ac.pending, 3)
+
+        self.ac.ack(1)
+        self.ack_func.assert_called_once_with(4, True)
+
+    def test_reject_does_not_block(self):
+        self.ac.ack(1)
+        self.ac.reject(2)
+        self.ac.ack(3)
+        self.ac.flush()
+        self.ack_func.assert_called_once_with(3, True)
+
+        # a rejected message is never the tag of a multiple-ack
+        self.ack_func.reset_mock()
+        self.ac.ack(4)
+        self.ac.reject(5)
+        self.ac.flush()
+        self.ack_func.assert_called_once_with(4, False)
+
+    def test_ack_multiple(self):
+        self.ac.ack(2)
+        self.ac.ack(4, multiple=True)
+        self.ack_func.assert_called_once_with(4, True)
+        self.assertEquals(self.ac.pending, 0)
+
+    def test_ack_untracked(self):
+        self.ac.ack(sentinel.dtag)
+        self.ack_func.assert_called_once_with(sentinel.dtag, False)
+
+    def test_flush_after_interval(self):
+        self.ac.max_interval = 0.01
+        self.ac.ack(1)
+        gevent.sleep(0.05)
+        self.ack_func.assert_called_once_with(1, False)
+
+    def test_close(self):
+        self.ac.ack(1)
+        self.ac.ack(2)
+        self.ac.close()
+        self.ack_func.assert_called_once_with(2, True)
+
+    def test_flush_after_interval_holds_lock(self):
+        held = []
+        @contextmanager
+        def lock():
+            held.append(True)
+            yield
+            held.append(False)
+        self.ac.lock = lock
+        self.ac.max_interval = 0.01
+        states = []
+        self.ack_func.side_effect = lambda *args: states.append(list(held))
+        self.ac.ack(1)
+        gevent.sleep(0.05)
+        self.ack_func.assert_called_once_with(1, False)
+        self.assertEquals(states, [[True]])
+        self.assertEquals(held, [True, False])
+
+    def test_cancel(self):
+        self.ac.max_interval = 0.01
+        self.ac.ack(1)
+        self.ac.cancel()
+        gevent.sleep(0.05)
+        self.assertEquals(self.ack_func.call_count, 0)
+        self.assertEquals(self.ac.pending, 0)
+
+    def test_no_delayed_flush_after_close(self):
+        self.ac.max_interval = 0.01
+        self.ac.ack(1)
+        self.ac.ack(2)
+        self.ac.close()
+        self.ack_func.reset_mock()
+        gevent.sleep(0.05)
+        self.assertEquals(self.ack_func.call_count, 0)
+
 @attr('UNIT')
 class TestNameTrio(PyonTestCase):
     def test_init(self):
@@ -603,6 +904,34 @@ class TestTopicTrie(PyonTestCase):
         self.assertEquals({sentinel.wild},
                           set(self.tt.get_all_matches('a.b.b.b.b.b.b')))
 
+    def test_hash_matches_zero_tokens(self):
+        self.tt.add_topic_tree('a.#', sentinel.wild)
+        self.tt.add_topic_tree('a.#.c', sentinel.middle_wild)
+        self.tt.add_topic_tree('#', sentinel.all)
+        self.tt.add_topic_tree('#.#.c', sentinel.double_wild)
+
+        self.assertEquals({sentinel.wild, sentinel.all}, self.tt.get_all_matches('a'))
+        self.assertEquals({sentinel.wild, sentinel.middle_wild, sentinel.all, sentinel.double_wild}, self.tt.get_all_matches('a.c'))
+        self.assertEquals({sentinel.all, sentinel.double_wild}, self.tt.get_all_matches('c'))
+        self.assertEquals({sentinel.all}, self.tt.get_all_matches('b.c.d'))
+
+    def test_remove_topic_tree_prunes_nodes(self):
+        self.tt.add_topic_tree('a.b.c', sentinel.p1)
+        self.tt.add_topic_tree('a.b', sentinel.p2)
+        self.tt.add_topic_tree('a.*.c', sentinel.p3)
+
+        self.tt.remove_topic_tree('a.b.c', sentinel.p1)
+        self.assertNotIn('c', self.tt.root.children['a'].children['b'].children)
+        self.assertEquals({sentinel.p2}, self.tt.get_all_matches('a.b'))
+
+        self.tt.remove_topic_tree('a.b', sentinel.p2)
+        self.tt.remove_topic_tree('a.*.c', sentinel.p3)
+        self.assertEquals(self.tt.root.children, {})
+
+        # removing an unknown tree does not create nodes
+        self.tt.remove_topic_tree('x.y', sentinel.p1)
+        self.assertEquals(self.tt.root.children, {})
+
 @attr('UNIT')
 class TestLocalRouter(PyonTestCase):
 
@@ -752,6 +1081,43 @@ class TestLocalRouter(PyonTestCase):
         self.assertEquals(self.lr._queues['ein'].qsize(), 2)
 
 
+    def test_routing_table(self):
+        self.lr.declare_exchange('known')
+        self.lr.declare_queue('q1')
+        self.lr.bind('known', 'q1', 'a.*')
+
+        self.lr.publish('known', 'a.b', 'body', 'props')
+        self.assertEquals(self.lr._routing_table['known'], {'a.b': ('q1',)})
+
+        # cached route is used as long as the bindings do not change
+        self.lr._exchanges['known'] = Mock()
+        self.lr.publish('known', 'a.b', 'body', 'props')
+        self.assertEquals(self.lr._exchanges['known'].get_all_matches.call_count, 0)
+        self.assertEquals(self.lr._queues['q1'].qsize(), 2)
+
+        # bind invalidates the exchange's routes
+        self.lr._exchanges['known'] = TopicTrie()
+        self.lr.declare_queue('q2')
+        self.lr.bind('known', 'q2', 'a.b')
+        self.assertNotIn('known', self.lr._routing_table)
+
+        self.lr.publish('known', 'a.b', 'body', 'props')
+        self.assertEquals(self.lr._queues['q1'].qsize(), 2)
+        self.assertEquals(self.lr._queues['q2'].qsize(), 1)
+
+        # as does deleting a queue
+        self.lr.delete_queue('q2')
+        self.assertNotIn('known', self.lr._routing_table)
+
+    def test_routing_table_size(self):
+        self.lr.ROUTING_TABLE_SIZE = 2
+        self.lr.declare_exchange('known')
+
+        for rkey in ['a', 'b', 'c']:
+            self.lr.publish('known', rkey, 'body', 'props')
+
+        self.assertEquals(self.lr._routing_table['known'], {'c': ()})
+
     def test__connect_addr(self):
         self.assertEquals(self.lr._connect_addr, "inproc://%s" % get_sys_name())
 
@@ -896,6 +1262,15 @@ class TestLocalRouter(PyonTestCase):
         self.lr.ack(sentinel.dtag)
         self.assertEquals(len(self.lr._unacked), 0)
 
+    def test_ack_multiple(self):
+        self.lr._unacked["zctag-1-0"] = ("zctag-1", None, None)
+        self.lr._unacked["zctag-1-1"] = ("zctag-1", None, None)
+        self.lr._unacked["zctag-1-2"] = ("zctag-1", None, None)
+        self.lr._unacked["zctag-2-0"] = ("zctag-2", None, None)
+
+        self.lr.ack("zctag-1-1", multiple=True)
+        self.assertEquals(sorted(self.lr._unacked.keys()), ["zctag-1-2", "zctag-2-0"])
+
     def test_reject(self):
         self.lr._unacked[sentinel.dtag] = (None, None, None)
 
@@ -941,6 +1316,54 @@ class TestLocalRouter(PyonTestCase):
 
         self.assertEquals(self.lr._queues[sentinel.queue].qsize(), 0)
 
+@attr('UNIT')
+class TestLocalTransportWithRouter(PyonTestCase):
+    def setUp(self):
+        self.lr = LocalRouter(get_sys_name())
+        self.lr.start()
+        self.addCleanup(self.lr.stop)
+
+        self.lt = LocalTransport(self.lr, 1)
+        self.lt.declare_exchange_impl('ex')
+        self.lt.declare_queue_impl('q')
+        self.lt.bind_impl('ex', 'q', 'q')
+
+    def test_coalesced_acks(self):
+        self.lt.coalesce_acks_impl(max_count=3, max_interval=10)
+        self.addCleanup(self.lt.close)
+
+        dtags = []
+        ev = Event()
+        def cb(chan, method_frame, header_frame, body):
+            dtags.append(method_frame.delivery_tag)
+            if len(dtags) == 5:
+                ev.set()
+        ctag = self.lt.start_consume_impl(cb, 'q')
+        self.addCleanup(self.lt.stop_consume_impl, ctag)
+
+        for x in xrange(5):
+            self.lt.publish_impl('ex', 'q', 'body', {})
+        ev.wait(timeout=5)
+        self.assertEquals(len(self.lr._unacked), 5)
+
+        self.lt.ack_impl(dtags[1])
+        self.lt.ack_impl(dtags[0])
+        self.assertEquals(len(self.lr._unacked), 5)
+        self.lt.ack_impl(dtags[2])
+        self.assertEquals(len(self.lr._unacked), 2)      # one multiple-ack for the first three
+
+        self.lt.ack_impl(dtags[3])
+        self.lt.flush_acks_impl()
+        self.assertEquals(self.lr._unacked.keys(), [dtags[4]])
+
+    def test_confirms(self):
+        self.assertIsNone(self.lt.publish_impl('ex', 'q', 'body', {}))
+
+        self.lt.confirm_select_impl()
+        ar = self.lt.publish_impl('ex', 'q', 'body', {})
+        self.assertTrue(ar.get(timeout=1))
+        self.assertEquals(self.lr.get_stats('q'), (2, 0))
+
 @attr('UNIT')
 class TestLocalTransport(PyonTestCase):
     def setUp(self):
@@ -1005,5 +1428,34 @@ class TestLocalTransport(PyonTestCase):
         # no body in LocalTransport method
         pass
 
+@attr('PFM')
+class TestLocalRouterSpeed(PyonTestCase):
 
+    def setUp(self):
+        self.lr = LocalRouter(get_sys_name())
+        self.lr.start()
+        self.addCleanup(self.lr.stop)
 
+    def test_route_speed(self):
+        print >>sys.stderr, ""
+
+        self.lr.declare_exchange('ex')
+        self.lr.declare_queue('sink')
+        numbinds = 0
+        numkeys = 100
+
+        for count in (0, 10, 100, 1000, 10000):
+            # add unrelated bindings so the trie grows, keep the matching set constant
+            for i in xrange(numbinds, count):
+                self.lr.bind('ex', 'sink', 'event.%s.*.#' % i)
+            numbinds = count
+            self.lr.bind('ex', 'sink', 'event.#.target')
+
+            nummsgs = 20000
+            start_time = time.time()
+            for i in xrange(nummsgs):
+                self.lr.publish('ex', 'event.type%s.origin.target' % (i % numkeys), 'body', {})
+            diff = time.time() - start_time
+
+            self.lr.purge('sink')
+            print >>sys.stderr, "Messages per second with %s bindings: %.0f" % (count, nummsgs / diff)
@@ -14,22 +14,254 @@ from pyon.util.log import log
 from pyon.util.containers import DotDict
 from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
-from gevent import coros, sleep
+from gevent import coros, sleep, spawn_later
 from gevent.timeout import Timeout
 from gevent.pool import Pool
 from contextlib import contextmanager
 import os
-from pika import BasicProperties
+from pika import BasicProperties, spec
 from pyon.util.async import spawn
 from pyon.util.pool import IDPool
 from uuid import uuid4
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 
 
 class TransportError(StandardError):
     pass
 
 
+class AckCoalescer(object):
+    """
+    Coalesces acks of consumed messages into multiple-acks.
+
+    Deliveries are recorded in order as they arrive. Acks are held back and sent as a single
+    multiple-ack for the latest delivery up to which all deliveries have been acked or rejected,
+    once max_count acks are pending or max_interval seconds after an ack, whichever comes first.
+
+    Must be set up before consuming starts, as earlier deliveries would be covered by multiple-acks
+    without being known.
+    """
+    def __init__(self, ack_func, max_count=100, max_interval=0.05, lock=None):
+        """
+        @param  ack_func        Callable taking a delivery tag and a multiple flag, sending the actual ack.
+        @param  max_count       Number of pending acks that trigger a flush.
+        @param  max_interval    Max number of seconds an ack is held back.
+        @param  lock            Optional callable returning a context manager (e.g. the channel lock) that the
+                                delayed flush holds while acking. It may raise if the channel is gone.
+        """
+        self._ack_func = ack_func
+        self.max_count = max_count
+        self.max_interval = max_interval
+        self.lock = lock
+        self._closed = False
+
+        self._delivered = deque()       # unflushed delivery tags in delivery order
+        self._settled = {}              # delivery tag -> True if acked, False if rejected
+        self._pending = 0               # number of acks not sent yet
+        self._gl_flush = None
+
+    def wrap_callback(self, callback):
+        """
+        Returns a consumer callback recording deliveries before passing them on to callback.
+        """
+        def on_deliver(chan, method_frame, header_frame, body):
+            self._delivered.append(method_frame.delivery_tag)
+            return callback(chan, method_frame, header_frame, body)
+        return on_deliver
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def ack(self, delivery_tag, multiple=False):
+        if self._closed or delivery_tag not in self._delivered:
+            # not (or no longer) tracked, pass through
+            self._ack_func(delivery_tag, multiple)
+            return
+
+        if multiple:
+            for dtag in self._delivered:
+                if dtag not in self._settled:
+                    self._settled[dtag] = True
+                    self._pending += 1
+                if dtag == delivery_tag:
+                    break
+            self.flush()
+            return
+
+        self._settled[delivery_tag] = True
+        self._pending += 1
+
+        if self._pending >= self.max_count:
+            self.flush()
+        elif self._gl_flush is None:
+            self._gl_flush = spawn_later(self.max_interval, self._flush_later)
+
+    def reject(self, delivery_tag):
+        """
+        Records a message as rejected, so that it does not block coalescing of later acks.
+        The reject itself is up to the caller.
+        """
+        if delivery_tag in self._delivered:
+            self._settled[delivery_tag] = False
+
+    def flush(self):
+        """
+        Sends a multiple-ack for all acks that can be sent now.
+        """
+        last_ack = None
+        num_acks = 0
+        while self._delivered and self._delivered[0] in self._settled:
+            dtag = self._delivered.popleft()
+            if self._settled.pop(dtag):
+                last_ack = dtag
+                num_acks += 1
+
+        self._pending -= num_acks
+        if last_ack is not None:
+            self._ack_func(last_ack, num_acks > 1)
+
+    def _flush_later(self):
+        self._gl_flush = None
+        if self._closed:
+            return
+        try:
+            if self.lock is None:
+                self.flush()
+                return
+            with self.lock():
+                # the channel may have closed while we waited for the lock
+                if not self._closed:
+                    self.flush()
+        except Exception:
+            log.exception("Error flushing coalesced acks")
+
+    def close(self):
+        """
+        Flushes remaining acks and stops the flush timer.
+        """
+        self._cancel_flush()
+        self.flush()
+        self._closed = True
+
+    def cancel(self):
+        """
+        Drops all pending acks and stops the flush timer, for a channel that closed on its own.
+        The broker redelivers the unacked messages.
+        """
+        self._cancel_flush()
+        self._closed = True
+        self._delivered.clear()
+        self._settled.clear()
+        self._pending = 0
+
+    def _cancel_flush(self):
+        if self._gl_flush is not None:
+            self._gl_flush.kill(block=False)
+            self._gl_flush = None
+
+class DeclarationRegistry(object):
+    """
+    Remembers the exchanges, queues and bindings declared on a broker connection, so that redeclaring
+    them with the same parameters can be skipped.
+
+    Shared by all transports of a connection. Entries are removed when deleted through the connection,
+    and all entries are dropped when a channel closes with an error (e.g. an entity was deleted on the
+    broker) or the connection closes.
+
+    The broker deletes auto-delete entities on its own, so auto-delete queues and bindings to queues
+    not declared here are never remembered. Auto-delete exchanges are only remembered if
+    cache_auto_delete is on, and forgotten once the last binding known here is removed or the
+    channel they were declared on closes. The broker also deletes them when a binding from another
+    connection goes, which is not seen here, so only turn it on where that can't happen.
+    """
+    def __init__(self, cache_auto_delete=False):
+        self.cache_auto_delete = cache_auto_delete
+        self._exchanges = {}            # exchange -> declare params
+        self._auto_delete_owners = {}   # auto-delete exchange -> owner (transport) that declared it
+        self._queues = {}               # queue -> (declare params, declared queue name)
+        self._bindings = set()          # (exchange, queue, binding)
+        self.skipped = 0                # number of declares skipped
+
+    def has_exchange(self, exchange, params):
+        if self._exchanges.get(exchange, None) == params:
+            self.skipped += 1
+            return True
+        return False
+
+    def add_exchange(self, exchange, params, owner=None):
+        """
+        @param  params  Tuple of (exchange_type, durable, auto_delete)
+        @param  owner   The transport declaring the exchange, see remove_owner.
+        """
+        if not params[2]:
+            self._exchanges[exchange] = params
+            self._auto_delete_owners.pop(exchange, None)
+        elif self.cache_auto_delete:
+            self._exchanges[exchange] = params
+            self._auto_delete_owners[exchange] = owner
+
+    def remove_exchange(self, exchange):
+        self._exchanges.pop(exchange, None)
+        self._auto_delete_owners.pop(exchange, None)
+        self._bindings = set(b for b in self._bindings if b[0] != exchange)
+
+    def get_queue(self, queue, params):
+        """
+        Returns the declared name of queue if it was declared with params, None otherwise.
+        """
+        declared = self._queues.get(queue, None)
+        if declared is not None and declared[0] == params:
+            self.skipped += 1
+            return declared[1]
+        return None
+
+    def add_queue(self, queue, params, declared_name):
+        """
+        @param  params  Tuple of (durable, auto_delete, exclusive)
+        """
+        if queue and not params[1]:     # server named queues can't be redeclared
+            self._queues[queue] = (params, declared_name)
+
+    def remove_queue(self, queue):
+        self._queues.pop(queue, None)
+        for binding in [b for b in self._bindings if b[1] == queue]:
+            self.remove_binding(*binding)
+
+    def has_binding(self, exchange, queue, binding):
+        if (exchange, queue, binding) in self._bindings:
+            self.skipped += 1
+            return True
+        return False
+
+    def add_binding(self, exchange, queue, binding):
+        if queue in self._queues:
+            self._bindings.add((exchange, queue, binding))
+
+    def remove_binding(self, exchange, queue, binding):
+        self._bindings.discard((exchange, queue, binding))
+
+        # the broker deletes an auto-delete exchange with its last binding
+        params = self._exchanges.get(exchange, None)
+        if params is not None and params[2] and not any(b[0] == exchange for b in self._bindings):
+            del self._exchanges[exchange]
+            self._auto_delete_owners.pop(exchange, None)
+
+    def remove_owner(self, owner):
+        """
+        Forgets the auto-delete exchanges declared by owner, called when its channel closes.
+        """
+        for exchange in [ex for ex, o in self._auto_delete_owners.iteritems() if o is owner]:
+            del self._auto_delete_owners[exchange]
+            self._exchanges.pop(exchange, None)
+
+    def clear(self):
+        self._exchanges.clear()
+        self._auto_delete_owners.clear()
+        self._queues.clear()
+        self._bindings.clear()
+
+
 class BaseTransport(object):
     def declare_exchange_impl(self, exchange, **kwargs):
         raise NotImplementedError()
@@ -49,7 +281,19 @@ class BaseTransport(object):
     def unbind_impl(self, exchange, queue, binding):
         raise NotImplementedError()
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
+        raise NotImplementedError()
+
+    def coalesce_acks_impl(self, max_count=100, max_interval=0.05, lock=None):
+        raise NotImplementedError()
+
+    def flush_acks_impl(self):
+        raise NotImplementedError()
+
+    def confirm_select_impl(self, max_in_flight=100):
+        raise NotImplementedError()
+
+    def wait_for_confirms_impl(self, timeout=None):
         raise NotImplementedError()
 
     def reject_impl(self, delivery_tag, requeue=False):
@@ -104,6 +348,8 @@ class ComposableTransport(BaseTransport):
         - qos_impl
         - get_stats_impl
         - publish_impl      (solely for publish rates, not needed for identity in protocol)
+        - coalesce_acks_impl, flush_acks_impl, confirm_select_impl, wait_for_confirms_impl
+                            (belong with ack_impl/publish_impl)
     """
     common_methods = ['ack_impl',
                       'reject_impl',
@@ -111,7 +357,11 @@ class ComposableTransport(BaseTransport):
                       'stop_consume_impl',
                       'qos_impl',
                       'get_stats_impl',
-                      'publish_impl']
+                      'publish_impl',
+                      'coalesce_acks_impl',
+                      'flush_acks_impl',
+                      'confirm_select_impl',
+                      'wait_for_confirms_impl']
 
     def __init__(self, left, right, *methods):
         self._transports = [left]
@@ -132,7 +382,11 @@ class ComposableTransport(BaseTransport):
                           'get_stats_impl'       : left.get_stats_impl,
                           'purge_impl'           : left.purge_impl,
                           'qos_impl'             : left.qos_impl,
-                          'publish_impl'         : left.publish_impl, }
+                          'publish_impl'         : left.publish_impl,
+                          'coalesce_acks_impl'   : left.coalesce_acks_impl,
+                          'flush_acks_impl'      : left.flush_acks_impl,
+                          'confirm_select_impl'  : left.confirm_select_impl,
+                          'wait_for_confirms_impl': left.wait_for_confirms_impl, }
 
         if right is not None:
             self.overlay(right, *methods)
@@ -170,10 +424,28 @@ class ComposableTransport(BaseTransport):
         m = self._methods['unbind_impl']
         return m(exchange, queue, binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         m = self._methods['ack_impl']
+        if multiple:
+            return m(delivery_tag, multiple=True)
         return m(delivery_tag)
 
+    def coalesce_acks_impl(self, max_count=100, max_interval=0.05, lock=None):
+        m = self._methods['coalesce_acks_impl']
+        return m(max_count=max_count, max_interval=max_interval, lock=lock)
+
+    def flush_acks_impl(self):
+        m = self._methods['flush_acks_impl']
+        return m()
+
+    def confirm_select_impl(self, max_in_flight=100):
+        m = self._methods['confirm_select_impl']
+        return m(max_in_flight=max_in_flight)
+
+    def wait_for_confirms_impl(self, timeout=None):
+        m = self._methods['wait_for_confirms_impl']
+        return m(timeout=timeout)
+
     def reject_impl(self, delivery_tag, requeue=False):
         m = self._methods['reject_impl']
         return m(delivery_tag, requeue=requeue)
@@ -230,17 +502,27 @@ class AMQPTransport(BaseTransport):
     A transport adapter around a Pika channel.
     """
 
-    def __init__(self, amq_chan):
+    def __init__(self, amq_chan, declarations=None):
         """
         Creates an AMQPTransport, bound to an underlying Pika channel.
+
+        @param  declarations    Optional DeclarationRegistry of the connection, to skip redundant declares.
         """
         #log.info("AMQPTransport(%d)", amq_chan.channel_number)
         self._client = amq_chan
+        self._declarations = declarations
         self._client.add_on_close_callback(self._on_underlying_close)
 
         self._close_callbacks = []
         self.lock = False
 
+        self._ack_coalescer = None      # AckCoalescer, if acks are coalesced
+
+        # publisher confirms, if enabled
+        self._unconfirmed = None        # publish seq no -> AsyncResult, in publish order
+        self._confirm_window = None     # semaphore limiting number of unconfirmed publishes
+        self._publish_seq = 0
+
     def _on_underlying_close(self, code, text):
         logmeth = log.debug
         if not (code == 0 or code == 200):
@@ -262,6 +544,21 @@ class AMQPTransport(BaseTransport):
         #stro = pprint.pformat(callbacks._callbacks)
         #log.error(str(stro))
 
+        # coalesced acks are lost with the channel, the broker redelivers these messages
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.cancel()
+            self._ack_coalescer = None
+
+        # an error may mean an entity we know as declared is gone (e.g. NOT_FOUND), forget all
+        if self._declarations is not None:
+            if not (code == 0 or code == 200):
+                self._declarations.clear()
+            else:
+                self._declarations.remove_owner(self)
+
+        if self._unconfirmed:
+            self._fail_unconfirmed(TransportError("Channel closed before publish was confirmed (%s: %s)" % (code, text)))
+
         for cb in self._close_callbacks:
             cb(self, code, text)
 
@@ -278,6 +575,9 @@ class AMQPTransport(BaseTransport):
         if self.lock:
             return
 
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.close()
+
         self._client.close()
 
     @property
@@ -333,6 +633,10 @@ class AMQPTransport(BaseTransport):
         return tuple(ret_vals)
 
     def declare_exchange_impl(self, exchange, exchange_type='topic', durable=False, auto_delete=True):
+        params = (exchange_type, durable, auto_delete)
+        if self._declarations is not None and self._declarations.has_exchange(exchange, params):
+            return
+
         log.debug("AMQPTransport.declare_exchange_impl(%s): %s, T %s, D %s, AD %s", self._client.channel_number, exchange, exchange_type, durable, auto_delete)
         arguments = {}
 
@@ -347,54 +651,118 @@ class AMQPTransport(BaseTransport):
                                              auto_delete=auto_delete,
                                              arguments=arguments)
 
+        if self._declarations is not None:
+            self._declarations.add_exchange(exchange, params, owner=self)
+
     def delete_exchange_impl(self, exchange, **kwargs):
         log.debug("AMQPTransport.delete_exchange_impl(%s): %s", self._client.channel_number, exchange)
+        if self._declarations is not None:
+            self._declarations.remove_exchange(exchange)
         self._sync_call(self._client.exchange_delete, 'callback', exchange=exchange)
 
-    def declare_queue_impl(self, queue, durable=False, auto_delete=True):
-        log.debug("AMQPTransport.declare_queue_impl(%s): %s, D %s, AD %s", self._client.channel_number, queue, durable, auto_delete)
+    def declare_queue_impl(self, queue, durable=False, auto_delete=True, exclusive=False):
+        params = (durable, auto_delete, exclusive)
+        if self._declarations is not None and queue:
+            declared_name = self._declarations.get_queue(queue, params)
+            if declared_name is not None:
+                return declared_name
+
+        log.debug("AMQPTransport.declare_queue_impl(%s): %s, D %s, AD %s, EX %s", self._client.channel_number, queue, durable, auto_delete, exclusive)
         arguments = {}
 
         if os.environ.get('QUEUE_BLAME', None) is not None:
             testid = os.environ['QUEUE_BLAME']
             arguments.update({'created-by': testid})
 
+        extra = {}
+        if exclusive:
+            extra['exclusive'] = True
+
         frame = self._sync_call(self._client.queue_declare, 'callback',
                                 queue=queue or '',
                                 auto_delete=auto_delete,
                                 durable=durable,
-                                arguments=arguments)
+                                arguments=arguments,
+                                **extra)
+
+        if self._declarations is not None:
+            self._declarations.add_queue(queue, params, frame.method.queue)
 
         return frame.method.queue
 
     def delete_queue_impl(self, queue, **kwargs):
         log.debug("AMQPTransport.delete_queue_impl(%s): %s", self._client.channel_number, queue)
+        if self._declarations is not None:
+            self._declarations.remove_queue(queue)
         self._sync_call(self._client.queue_delete, 'callback', queue=queue)
 
     def bind_impl(self, exchange, queue, binding):
+        if self._declarations is not None and self._declarations.has_binding(exchange, queue, binding):
+            return
+
         log.debug("AMQPTransport.bind_impl(%s): EX %s, Q %s, B %s", self._client.channel_number, exchange, queue, binding)
         self._sync_call(self._client.queue_bind, 'callback',
                                         queue=queue,
                                         exchange=exchange,
                                         routing_key=binding)
 
+        if self._declarations is not None:
+            self._declarations.add_binding(exchange, queue, binding)
+
     def unbind_impl(self, exchange, queue, binding):
         log.debug("AMQPTransport.unbind_impl(%s): EX %s, Q %s, B %s", self._client.channel_number, exchange, queue, binding)
+        if self._declarations is not None:
+            self._declarations.remove_binding(exchange, queue, binding)
         self._sync_call(self._client.queue_unbind, 'callback', queue=queue,
                                                      exchange=exchange,
                                                      routing_key=binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         """
-        Acks a message.
+        Acks a message, or with multiple, all unacked messages up to and including it.
+
+        If acks are coalesced, the ack may be sent later as part of a multiple-ack.
         """
-        log.debug("AMQPTransport.ack(%s): %s", self._client.channel_number, delivery_tag)
-        self._client.basic_ack(delivery_tag)
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.ack(delivery_tag, multiple=multiple)
+        else:
+            self._basic_ack(delivery_tag, multiple)
+
+    def _basic_ack(self, delivery_tag, multiple=False):
+        log.debug("AMQPTransport.ack(%s): %s, multiple %s", self._client.channel_number, delivery_tag, multiple)
+        if multiple:
+            self._client.basic_ack(delivery_tag, multiple=True)
+        else:
+            self._client.basic_ack(delivery_tag)
+
+    def coalesce_acks_impl(self, max_count=100, max_interval=0.05, lock=None):
+        """
+        Turns on coalescing of acks into multiple-acks, sent after max_count acks or max_interval
+        seconds. Must be called before consuming starts.
+
+        @param  lock    Optional callable returning the channel lock context, held by delayed flushes.
+        """
+        log.debug("AMQPTransport.coalesce_acks_impl(%s): max_count %s, max_interval %s", self._client.channel_number, max_count, max_interval)
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.max_count = max_count
+            self._ack_coalescer.max_interval = max_interval
+            self._ack_coalescer.lock = lock
+        else:
+            self._ack_coalescer = AckCoalescer(self._basic_ack, max_count=max_count, max_interval=max_interval, lock=lock)
+
+    def flush_acks_impl(self):
+        """
+        Sends any coalesced acks now.
+        """
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.flush()
 
     def reject_impl(self, delivery_tag, requeue=False):
         """
         Rejects a message.
         """
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.reject(delivery_tag)
         self._client.basic_reject(delivery_tag, requeue=requeue)
 
     def start_consume_impl(self, callback, queue, no_ack=False, exclusive=False):
@@ -405,6 +773,8 @@ class AMQPTransport(BaseTransport):
         @return A consumer tag to be used when stop_consume_impl is called.
         """
         log.debug("AMQPTransport.start_consume_impl(%s): %s", self._client.channel_number, queue)
+        if self._ack_coalescer is not None and not no_ack:
+            callback = self._ack_coalescer.wrap_callback(callback)
         consumer_tag = self._client.basic_consume(callback,
                                             queue=queue,
                                             no_ack=no_ack,
@@ -481,6 +851,14 @@ class AMQPTransport(BaseTransport):
         props = BasicProperties(headers=properties,
                                 delivery_mode=delivery_mode)
 
+        ar = None
+        if self._unconfirmed is not None:
+            # blocks while the window of unconfirmed publishes is full
+            self._confirm_window.acquire()
+            self._publish_seq += 1
+            ar = AsyncResult()
+            self._unconfirmed[self._publish_seq] = ar
+
         self._client.basic_publish(exchange=exchange,       # todo
                                    routing_key=routing_key, # todo
                                    body=body,
@@ -488,6 +866,72 @@ class AMQPTransport(BaseTransport):
                                    immediate=immediate,     # todo
                                    mandatory=mandatory)     # todo
 
+        return ar
+
+    def confirm_select_impl(self, max_in_flight=100):
+        """
+        Puts the channel into publisher confirm mode.
+
+        From then on, publish_impl returns an AsyncResult that is set when the broker confirms the
+        message, or raises a TransportError if the broker rejects it or the channel closes first.
+        At most max_in_flight messages can be unconfirmed at a time, publish_impl blocks until then.
+        """
+        log.debug("AMQPTransport.confirm_select_impl(%s): max_in_flight %s", self._client.channel_number, max_in_flight)
+        if self._unconfirmed is not None:
+            return
+
+        self._unconfirmed = OrderedDict()
+        self._confirm_window = coros.Semaphore(max_in_flight)
+        self._publish_seq = 0
+        self._client.confirm_delivery(callback=self._on_confirm)
+
+    def _on_confirm(self, frame):
+        """
+        Callback for Basic.Ack/Basic.Nack frames from the broker in confirm mode.
+        """
+        method = frame.method
+        nack = isinstance(method, spec.Basic.Nack)
+
+        if method.multiple:
+            seqs = []
+            for seq in self._unconfirmed:
+                if seq > method.delivery_tag:
+                    break
+                seqs.append(seq)
+        elif method.delivery_tag in self._unconfirmed:
+            seqs = [method.delivery_tag]
+        else:
+            log.warn("AMQPTransport._on_confirm(%s): unknown delivery tag %s", self._client.channel_number, method.delivery_tag)
+            return
+
+        for seq in seqs:
+            ar = self._unconfirmed.pop(seq)
+            self._confirm_window.release()
+            if nack:
+                ar.set_exception(TransportError("Publish %s was rejected by the broker" % seq))
+            else:
+                ar.set(seq)
+
+    def _fail_unconfirmed(self, exception):
+        while self._unconfirmed:
+            _, ar = self._unconfirmed.popitem(last=False)
+            self._confirm_window.release()
+            ar.set_exception(exception)
+
+    def wait_for_confirms_impl(self, timeout=None):
+        """
+        Blocks until all messages published so far are confirmed.
+
+        @raises TransportError  If the broker rejected any of them.
+        @raises Timeout         If not confirmed within timeout seconds.
+        """
+        if not self._unconfirmed:
+            return
+
+        with Timeout(timeout):
+            for ar in self._unconfirmed.values():
+                ar.get()
+
 
 class NameTrio(object):
     """
@@ -569,44 +1013,6 @@ class TopicTrie(object):
 
             return new_node
 
-        def get_all_matches(self, topics):
-            """
-            Given a list of topic tokens, returns all patterns stored in child nodes/self that match the topic tokens.
-
-            This is a depth-first search pruned by token, with special handling for both wildcard types.
-            """
-            results = []
-
-            if len(topics) == 0:
-                # terminal point, return any pattern we have here
-                return self.patterns
-
-            cur_token = topics[0]
-            rem_tokens = topics[1:]     # will always be a list, even if empty or 1-len
-            #log.debug('get_all_matches(%s): cur_token %s, rem_tokens %s', self.token, cur_token, rem_tokens)
-
-            # child node direct matching
-            if cur_token in self.children:
-                results.extend(self.children[cur_token].get_all_matches(rem_tokens))
-
-            # now '*' wildcard
-            if '*' in self.children:
-                results.extend(self.children['*'].get_all_matches(rem_tokens))
-
-            # '#' means any number of tokens - naive method of descent, we'll feed it nothing to start. Then chop the full
-            # topics all the way down, put the results in a set to remove duplicates, and also any patterns on self.
-            if '#' in self.children:
-                # keep popping off and descend, make a set out of results
-                all_wild_childs = set()
-                for i in xrange(len(topics)):
-                    res = self.children['#'].get_all_matches(topics[i:])
-                    map(all_wild_childs.add, res)
-
-                results.extend(all_wild_childs)
-                results.extend(self.children['#'].patterns)     # any patterns defined in # are legal too
-
-            return results
-
     def __init__(self):
         """
         Creates a dummy root node that all topic trees hang off of.
@@ -615,7 +1021,7 @@ class TopicTrie(object):
 
     def add_topic_tree(self, topic_tree, pattern):
         """
-        Splits a string topic_tree into tokens (by .) and recursively adds them to the trie.
+        Splits a string topic_tree into tokens (by .) and adds them to the trie.
 
         Adds the pattern at the terminal node for later retrieval.
         """
@@ -633,27 +1039,68 @@ class TopicTrie(object):
         """
         Splits a string topic_tree into tokens (by .) and removes the pattern from the terminal node.
 
-        @TODO should remove empty nodes
+        Nodes left without patterns and children are pruned from the trie.
         """
         topics = topic_tree.split(".")
 
         curnode = self.root
+        path = []
 
         for topic in topics:
-            curnode = curnode.get_or_create_child(topic)
+            if topic not in curnode.children:
+                return
+            path.append(curnode)
+            curnode = curnode.children[topic]
 
         if pattern in curnode.patterns:
             curnode.patterns.remove(pattern)
 
+        # prune empty nodes bottom up
+        while path and not curnode.patterns and not curnode.children:
+            parent = path.pop()
+            del parent.children[curnode.token]
+            curnode = parent
+
+    def _add_active(self, active, node):
+        """
+        Adds a node to the set of active nodes, including any '#' children (which can match zero tokens).
+        """
+        active.add(node)
+        while '#' in node.children:
+            node = node.children['#']
+            active.add(node)
+
     def get_all_matches(self, topic_tree):
         """
-        Returns a list of all matches for a given topic tree string.
+        Returns a set of all matches for a given topic tree string.
 
-        Creates a set out of the matching patterns, so multiple binds matching on the same pattern only
-        return once.
+        Walks the trie once, token by token, keeping the set of nodes that match the topic so far
+        (no backtracking). A '#' node stays active for any number of tokens. Multiple binds matching
+        on the same pattern only return once.
         """
-        topics = topic_tree.split(".")
-        return set(self.root.get_all_matches(topics))
+        active = set()
+        self._add_active(active, self.root)
+
+        for topic in topic_tree.split("."):
+            next_active = set()
+            for node in active:
+                if node.token == '#':
+                    next_active.add(node)
+                children = node.children
+                if topic in children:
+                    self._add_active(next_active, children[topic])
+                if '*' in children:
+                    self._add_active(next_active, children['*'])
+
+            if not next_active:
+                return set()
+            active = next_active
+
+        matches = set()
+        for node in active:
+            matches.update(node.patterns)
+
+        return matches
 
 class LocalRouter(object):
     """
@@ -661,8 +1108,16 @@ class LocalRouter(object):
 
     Using LocalTransport, can handle topic-exchange-like communication in ION within the context
     of a single container.
+
+    Messages are routed in the publishing greenlet. Matching queues are looked up in a routing
+    table keyed by exchange and routing key, compiled from the exchange's TopicTrie on first use
+    and invalidated when the bindings of that exchange change. Routing never yields, so it takes
+    no locks; only modifications of exchanges, queues and bindings are serialized.
     """
 
+    # Max number of cached routing keys per exchange before that exchange's routing table is reset
+    ROUTING_TABLE_SIZE = 10000
+
     class ConsumerClosedMessage(object):
         """
         Dummy object used to exit queue get looping greenlets.
@@ -677,7 +1132,8 @@ class LocalRouter(object):
         self._exchanges = {}                            # names -> { subscriber, topictrie(queue name) }
         self._queues = {}                               # names -> gevent queue
         self._bindings_by_queue = defaultdict(list)     # queue name -> [(ex, binding)]
-        self._lock_declarables = coros.RLock()          # exchanges, queues, bindings, routing method
+        self._lock_declarables = coros.RLock()          # exchanges, queues, bindings
+        self._routing_table = {}                        # exchange -> { routing key -> tuple(queue names) }
 
         # consumers
         self._consumers = defaultdict(list)             # queue name -> [ctag, channel._on_deliver]
@@ -691,6 +1147,7 @@ class LocalRouter(object):
 
         self._gl_msgs = None
         self._gl_pool = Pool()
+        self._stop_event = Event()
         self.gl_ioloop = None
 
         self.errors = []
@@ -703,7 +1160,7 @@ class LocalRouter(object):
         """
         Starts all internal greenlets of this router device.
         """
-        self._queue_incoming = Queue()
+        self._stop_event.clear()
         self._gl_msgs = self._gl_pool.spawn(self._run_gl_msgs)
         self._gl_msgs._glname = "pyon.net AMQP msgs"
         self._gl_msgs.link_exception(self._child_failed)
@@ -712,36 +1169,60 @@ class LocalRouter(object):
         self.gl_ioloop._glname = "pyon.net AMQP ioloop"
 
     def stop(self):
+        self._stop_event.set()
         self._gl_msgs.kill()    # @TODO: better
         self._gl_pool.join(timeout=5, raise_error=True)
 
     def _run_gl_msgs(self):
+        """
+        Main greenlet of the router, keeping the pool (and thus the "ioloop") alive until stopped.
+
+        Messages are routed directly in publish.
+        """
         self.ready.set()
-        while True:
-            ex, rkey, body, props = self._queue_incoming.get()
-            try:
-                with self._lock_declarables:
-                    self._route(ex, rkey, body, props)
-            except Exception as e:
-                self.errors.append(e)
-                log.exception("Routing message")
+        self._stop_event.wait()
+
+    def _get_routes(self, exchange, routing_key):
+        """
+        Returns the tuple of queue names bound to the given exchange that match the routing key.
+
+        Results are cached in the routing table until the bindings of the exchange change.
+        """
+        ex_table = self._routing_table.get(exchange, None)
+        if ex_table is None:
+            assert exchange in self._exchanges, "Unknown exchange %s" % exchange
+            ex_table = self._routing_table[exchange] = {}
+        else:
+            queues = ex_table.get(routing_key, None)
+            if queues is not None:
+                return queues
+
+        if len(ex_table) >= self.ROUTING_TABLE_SIZE:
+            ex_table.clear()
+
+        queues = tuple(self._exchanges[exchange].get_all_matches(routing_key))
+        ex_table[routing_key] = queues
+        return queues
+
+    def _invalidate_routes(self, exchange):
+        """
+        Drops the compiled routing table of an exchange. Called whenever its bindings change.
+        """
+        self._routing_table.pop(exchange, None)
 
     def _route(self, exchange, routing_key, body, props):
         """
         Delivers incoming messages into queues based on known routes.
 
-        This entire method runs in a lock (likely pretty slow).
+        Does not yield, so the routing table and queues cannot change while delivering.
         """
-        assert exchange in self._exchanges, "Unknown exchange %s" % exchange
-
-        queues = self._exchanges[exchange].get_all_matches(routing_key)
+        queues = self._get_routes(exchange, routing_key)
         log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(queues))
 
         # deliver to each queue
+        msg = (exchange, routing_key, body, props)
         for q in queues:
-            assert q in self._queues
-            log.debug("deliver -> %s", q)
-            self._queues[q].put((exchange, routing_key, body, props))
+            self._queues[q].put(msg)
 
     def _child_failed(self, gproc):
         """
@@ -763,8 +1244,11 @@ class LocalRouter(object):
         self._gl_pool.join()
 
     def publish(self, exchange, routing_key, body, properties, immediate=False, mandatory=False):
-        self._queue_incoming.put((exchange, routing_key, body, properties))
-        sleep(0.0001)      # really wish switch would work instead of a sleep, seems wrong
+        try:
+            self._route(exchange, routing_key, body, properties)
+        except Exception as e:
+            self.errors.append(e)
+            log.exception("Routing message")
 
     def declare_exchange(self, exchange, **kwargs):
         with self._lock_declarables:
@@ -775,6 +1259,7 @@ class LocalRouter(object):
         with self._lock_declarables:
             if exchange in self._exchanges:
                 del self._exchanges[exchange]
+                self._invalidate_routes(exchange)
 
     def declare_queue(self, queue, **kwargs):
 
@@ -801,6 +1286,7 @@ class LocalRouter(object):
                 for ex, binding in self._bindings_by_queue[queue]:
                     if ex in self._exchanges:
                         self._exchanges[ex].remove_topic_tree(binding, queue)
+                        self._invalidate_routes(ex)
 
                 self._bindings_by_queue.pop(queue)
 
@@ -814,6 +1300,7 @@ class LocalRouter(object):
 
             tt.add_topic_tree(binding, queue)
             self._bindings_by_queue[queue].append((exchange, binding))
+            self._invalidate_routes(exchange)
 
     def unbind(self, exchange, queue, binding):
         with self._lock_declarables:
@@ -821,6 +1308,7 @@ class LocalRouter(object):
             assert queue in self._queues
 
             self._exchanges[exchange].remove_topic_tree(binding, queue)
+            self._invalidate_routes(exchange)
             for i, val in enumerate(self._bindings_by_queue[queue]):
                 ex, b = val
                 if ex == exchange and b == binding:
@@ -913,11 +1401,19 @@ class LocalRouter(object):
         """
         return "%s-%s" % (ctag, cnt)
 
-    def ack(self, delivery_tag):
+    def ack(self, delivery_tag, multiple=False):
         assert delivery_tag in self._unacked
 
         with self._lock_unacked:
-            del self._unacked[delivery_tag]
+            if multiple:
+                # ack all unacked messages of the same consumer delivered up to this one
+                ctag, _, cnt = delivery_tag.rpartition("-")
+                cnt = int(cnt)
+                for dtag, (dctag, _, _) in self._unacked.items():
+                    if dctag == ctag and int(dtag.rpartition("-")[2]) <= cnt:
+                        del self._unacked[dtag]
+            else:
+                del self._unacked[delivery_tag]
 
     def reject(self, delivery_tag, requeue=False):
         assert delivery_tag in self._unacked
@@ -968,6 +1464,9 @@ class LocalTransport(BaseTransport):
 
         self._close_callbacks = []
 
+        self._ack_coalescer = None
+        self._confirms = False
+
     def declare_exchange_impl(self, exchange, **kwargs):
         self._broker.declare_exchange(exchange, **kwargs)
 
@@ -989,19 +1488,59 @@ class LocalTransport(BaseTransport):
     def publish_impl(self, exchange, routing_key, body, properties, immediate=False, mandatory=False, durable_msg=False):
         self._broker.publish(exchange, routing_key, body, properties, immediate=immediate, mandatory=mandatory)
 
+        if self._confirms:
+            # the router has queued the message once publish returns
+            ar = AsyncResult()
+            ar.set(True)
+            return ar
+
+    def confirm_select_impl(self, max_in_flight=100):
+        self._confirms = True
+
+    def wait_for_confirms_impl(self, timeout=None):
+        pass
+
     def start_consume_impl(self, callback, queue, no_ack=False, exclusive=False):
+        if self._ack_coalescer is not None and not no_ack:
+            callback = self._ack_coalescer.wrap_callback(callback)
         return self._broker.start_consume(callback, queue, no_ack=no_ack, exclusive=exclusive)
 
     def stop_consume_impl(self, consumer_tag):
         self._broker.stop_consume(consumer_tag)
 
-    def ack_impl(self, delivery_tag):
-        self._broker.ack(delivery_tag)
+    def ack_impl(self, delivery_tag, multiple=False):
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.ack(delivery_tag, multiple=multiple)
+        else:
+            self._broker_ack(delivery_tag, multiple)
+
+    def _broker_ack(self, delivery_tag, multiple=False):
+        if multiple:
+            self._broker.ack(delivery_tag, multiple=True)
+        else:
+            self._broker.ack(delivery_tag)
+
+    def coalesce_acks_impl(self, max_count=100, max_interval=0.05, lock=None):
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.max_count = max_count
+            self._ack_coalescer.max_interval = max_interval
+            self._ack_coalescer.lock = lock
+        else:
+            self._ack_coalescer = AckCoalescer(self._broker_ack, max_count=max_count, max_interval=max_interval, lock=lock)
+
+    def flush_acks_impl(self):
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.flush()
 
     def reject_impl(self, delivery_tag, requeue=False):
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.reject(delivery_tag)
         self._broker.reject(delivery_tag, requeue=requeue)
 
     def close(self):
+        if self._ack_coalescer is not None:
+            self._ack_coalescer.close()
+
         self._broker.transport_close(self)
         self._active = False
 